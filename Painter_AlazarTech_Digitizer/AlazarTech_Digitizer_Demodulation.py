@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+import numpy as np
+
+# demodulation inputs, channel 1, channel 2 or channel 1 + i * channel 2
+INPUT_CH1 = 1
+INPUT_CH2 = 2
+INPUT_IQ = 3
+
+
+class Demodulator:
+    """Demodulate digitizer records to complex single-shot values.
+
+    Each qubit is demodulated at its own IF frequency and within its own
+    integration window, with the same conventions as the demodulation of the
+    multi-qubit pulse generator. The weights of all qubits are combined into
+    one matrix per channel, so that demodulating a block of records is a
+    matrix product with the raw sample codes.
+
+    Parameters
+    ----------
+    dt : float
+        Time step of the digitizer, in seconds.
+    frequencies : list of float
+        IF frequency of each qubit, in Hz.
+    skip : float or list of float
+        Start of the integration window of each qubit, in seconds.
+    length : float or list of float
+        Length of the integration window of each qubit, in seconds.
+    inputs : int or list of int
+        Input of each qubit, `INPUT_CH1`, `INPUT_CH2` or `INPUT_IQ`.
+
+    """
+
+    def __init__(self, dt, frequencies, skip=0.0, length=1.0E-6,
+                 inputs=INPUT_CH1):
+        self.dt = float(dt)
+        self.frequencies = np.array(frequencies, dtype=float).reshape(-1)
+        self.nQubit = len(self.frequencies)
+        self.skip = np.broadcast_to(skip, self.nQubit).astype(float)
+        self.length = np.broadcast_to(length, self.nQubit).astype(float)
+        self.inputs = np.broadcast_to(inputs, self.nQubit).astype(int)
+
+    def getChannels(self):
+        """Get digitizer channels used by the demodulation.
+
+        Returns
+        -------
+        bool, bool
+            True if channel 1 and channel 2 are needed.
+
+        """
+        return (bool(np.any(self.inputs & INPUT_CH1)),
+                bool(np.any(self.inputs & INPUT_CH2)))
+
+    def getWindow(self, nSample):
+        """Get integration windows of all qubits, in samples.
+
+        Parameters
+        ----------
+        nSample : int
+            Number of samples per record.
+
+        Returns
+        -------
+        n0 : numpy array
+            Index of first demodulated sample of each qubit.
+        length : numpy array
+            Number of demodulated samples of each qubit.
+
+        """
+        n0 = np.round(self.skip / self.dt).astype(int)
+        length = 1 + np.round(self.length / self.dt).astype(int)
+        length = np.clip(np.minimum(length, nSample - n0), 0, None)
+        return n0, length
+
+    def getWeights(self, channel, nSample):
+        """Get demodulation weights of one channel for all qubits.
+
+        Parameters
+        ----------
+        channel : int
+            Digitizer channel, 1 or 2.
+        nSample : int
+            Number of samples per record.
+
+        Returns
+        -------
+        numpy array
+            Complex array with shape (nSample, number of qubits). Qubits not
+            using the channel have zero weights.
+
+        """
+        weights = np.zeros((nSample, self.nQubit), dtype=complex)
+        n0, length = self.getWindow(nSample)
+        for n in range(self.nQubit):
+            if not self.inputs[n] & channel or length[n] <= 1:
+                continue
+            vTime = self.dt * (n0[n] + np.arange(length[n], dtype=float))
+            # trapezoidal integration weights
+            trapz = np.ones(length[n]) / float(length[n] - 1)
+            trapz[[0, -1]] *= 0.5
+            phase = 2 * np.pi * vTime * self.frequencies[n]
+            if self.inputs[n] == INPUT_IQ:
+                # conj((I + iQ) * exp(-i phase)) for real I and Q
+                ref = trapz * np.exp(1j * phase)
+                if channel == INPUT_CH2:
+                    ref = -1j * ref
+            else:
+                ref = 2 * trapz * (np.cos(phase) + 1j * np.sin(phase))
+            weights[n0[n]:n0[n] + length[n], n] = ref
+        return weights
+
+    def getHistograms(self, values, bins=50):
+        """Get IQ histograms of single-shot values.
+
+        Parameters
+        ----------
+        values : complex numpy array
+            Single-shot values with shape (number of records, number of
+            qubits).
+        bins : int
+            Number of bins along each of the I and Q axes.
+
+        Returns
+        -------
+        list of tuple
+            For each qubit, the counts with shape (bins, bins), and the bin
+            edges of the I and Q axes.
+
+        """
+        histograms = []
+        for n in range(values.shape[1]):
+            counts, vEdgeI, vEdgeQ = np.histogram2d(
+                values[:, n].real, values[:, n].imag, bins=bins)
+            histograms.append((counts, vEdgeI, vEdgeQ))
+        return histograms
+
+
+if __name__ == '__main__':
+    pass
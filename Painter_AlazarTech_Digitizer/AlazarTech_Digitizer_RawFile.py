@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""Files with the raw sample codes of all acquired records.
+
+The codes are stored in a binary file, in the order the buffers were
+acquired, with shape (buffer, channel, record in buffer, sample). The layout,
+ranges and other metadata needed to convert the codes to voltages are kept
+in a JSON file next to it, with the same name plus ".json".
+"""
+import json
+import time
+
+import numpy as np
+
+# version of the JSON sidecar format
+RAW_FILE_VERSION = 1
+
+# record order within the file. For interleaved records, trace n consists of
+# records n, n + nRecord, n + 2 * nRecord, ..., as in DMA acquisitions. For
+# consecutive records, trace n consists of records n * nAverage to
+# (n + 1) * nAverage - 1, as in single-record reads.
+LAYOUT_INTERLEAVED = 'interleaved'
+LAYOUT_CONSECUTIVE = 'consecutive'
+
+
+def getSidecarPath(path):
+    """Get path of the JSON file describing a raw record file"""
+    return path + '.json'
+
+
+class RawRecordWriter:
+    """Write raw records to a preallocated, memory-mapped file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the binary file, overwritten if it exists.
+    dtype : numpy dtype
+        Type of the sample codes.
+    channels : list of int
+        Digitizer channels in the file.
+    ranges : list of float
+        Input range of each channel, in volts.
+    bitsPerSample : int
+        Resolution of the sample codes.
+    nBuffer : int
+        Number of buffers.
+    recordsPerBuffer : int
+        Number of records of each channel per buffer.
+    samplesPerRecord : int
+        Number of stored samples per record, including alignment padding.
+    nSample : int
+        Number of requested samples per record.
+    nRecord : int
+        Number of records per trace.
+    nAverage : int
+        Number of averages of each trace.
+    layout : str
+        Order of the records, `LAYOUT_INTERLEAVED` or `LAYOUT_CONSECUTIVE`.
+    metadata : dict, optional
+        Additional information to store, for example the sample rate.
+
+    """
+
+    def __init__(self, path, dtype, channels, ranges, bitsPerSample,
+                 nBuffer, recordsPerBuffer, samplesPerRecord, nSample,
+                 nRecord, nAverage, layout=LAYOUT_INTERLEAVED, metadata=None):
+        self.path = path
+        channels = [int(ch) for ch in channels]
+        shape = (int(nBuffer), len(channels), int(recordsPerBuffer),
+                 int(samplesPerRecord))
+        self.data = np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+        self.info = dict(
+            version=RAW_FILE_VERSION,
+            dtype=np.dtype(dtype).str,
+            shape=list(shape),
+            channels=channels,
+            ranges=[float(r) for r in ranges],
+            bitsPerSample=int(bitsPerSample),
+            nSample=int(nSample),
+            nRecord=int(nRecord),
+            nAverage=int(nAverage),
+            layout=layout,
+            buffersCompleted=0,
+            created=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        if metadata is not None:
+            self.info['metadata'] = dict(metadata)
+        self._writeSidecar()
+
+    def _writeSidecar(self):
+        """Write metadata to the JSON file"""
+        with open(getSidecarPath(self.path), 'w') as f:
+            json.dump(self.info, f, indent=2)
+
+    def getBuffer(self, n):
+        """Get buffer `n` of the file as a flat, writable array"""
+        return self.data[n].reshape(-1)
+
+    def getRecords(self, channel):
+        """Get all records of a channel, for files with a single buffer"""
+        return self.data[0, self.info['channels'].index(channel)]
+
+    def close(self, buffersCompleted):
+        """Flush data to disk and store the number of completed buffers"""
+        if self.data is None:
+            return
+        self.data.flush()
+        self.data = None
+        self.info['buffersCompleted'] = int(buffersCompleted)
+        self._writeSidecar()
+
+
+class RawRecordFile:
+    """Read records and averages from a raw record file.
+
+    The file is memory-mapped, so only the requested records are read from
+    disk, and files larger than the available memory can be processed.
+
+    Parameters
+    ----------
+    path : str
+        Path of the binary file.
+
+    """
+
+    def __init__(self, path):
+        with open(getSidecarPath(path)) as f:
+            self.info = json.load(f)
+        if self.info.get('version', 0) > RAW_FILE_VERSION:
+            raise ValueError('Raw record file "%s" has unsupported version %s.'
+                             % (path, self.info['version']))
+        self.data = np.memmap(path, dtype=np.dtype(self.info['dtype']),
+                              mode='r', shape=tuple(self.info['shape']))
+        (self.nBuffer, nChannel, self.recordsPerBuffer,
+         self.samplesPerRecord) = self.data.shape
+        self.channels = self.info['channels']
+        self.nSample = self.info['nSample']
+        self.nRecord = self.info['nRecord']
+        self.nAverage = self.info['nAverage']
+        # number of valid records, less than allocated if stopped early
+        self.nRecordTotal = min(
+            self.info['buffersCompleted'] * self.recordsPerBuffer,
+            self.nRecord * self.nAverage)
+        # conversion to voltages, as in AlazarTechDigitizer.readTracesDMA
+        bits = float(self.info['bitsPerSample'])
+        self.codeZero = 2 ** (bits - 1) - 0.5
+        codeRange = 2 ** (bits - 1) - 0.5
+        self.scale = [r / codeRange for r in self.info['ranges']]
+
+    def getCodes(self, channel, start=0, stop=None):
+        """Get raw sample codes of a range of records.
+
+        Parameters
+        ----------
+        channel : int
+            Digitizer channel.
+        start, stop : int
+            First record and record after the last one, in acquisition order.
+
+        Returns
+        -------
+        numpy array
+            Codes with shape (number of records, nSample). A read-only view of
+            the file if all records are in the same buffer.
+
+        """
+        stop = self.nRecordTotal if stop is None else min(stop,
+                                                          self.nRecordTotal)
+        start = min(start, stop)
+        c = self.channels.index(channel)
+        if start >= stop:
+            return self.data[0, c, :0, :self.nSample]
+        # records may be spread over several buffers
+        lCodes = []
+        for nBuffer in range(start // self.recordsPerBuffer,
+                             (stop - 1) // self.recordsPerBuffer + 1):
+            n0 = max(start - nBuffer * self.recordsPerBuffer, 0)
+            n1 = min(stop - nBuffer * self.recordsPerBuffer,
+                     self.recordsPerBuffer)
+            lCodes.append(self.data[nBuffer, c, n0:n1, :self.nSample])
+        if len(lCodes) == 1:
+            return lCodes[0]
+        return np.concatenate(lCodes)
+
+    def getRecords(self, channel, start=0, stop=None):
+        """Get records of a channel in volts, see `getCodes`"""
+        c = self.channels.index(channel)
+        codes = self.getCodes(channel, start, stop)
+        return self.scale[c] * (codes - self.codeZero)
+
+    def getAverage(self, channel, chunkSize=64 * 1024 * 1024):
+        """Get averaged traces of a channel, in volts.
+
+        The codes are summed exactly as integers, in chunks of about
+        `chunkSize` bytes, so for DMA acquisitions the result is identical
+        to the averaged traces returned by the acquisition.
+
+        Parameters
+        ----------
+        channel : int
+            Digitizer channel.
+        chunkSize : int
+            Number of bytes read from the file at a time.
+
+        Returns
+        -------
+        numpy array
+            The nRecord averaged traces after each other, as returned by
+            `AlazarTechDigitizer.readTracesDMA`.
+
+        """
+        c = self.channels.index(channel)
+        mSum = np.zeros((self.nRecord, self.nSample), dtype=np.int64)
+        nAverage = self.nRecordTotal // self.nRecord
+        if nAverage == 0:
+            return np.zeros(self.nRecord * self.nSample)
+        bytesPerRecord = self.samplesPerRecord * self.data.dtype.itemsize
+        if self.info['layout'] == LAYOUT_CONSECUTIVE:
+            # sum blocks of averages of one trace at a time
+            nChunk = max(1, chunkSize // bytesPerRecord)
+            for n in range(self.nRecord):
+                for n0 in range(0, nAverage, nChunk):
+                    start = n * self.nAverage + n0
+                    codes = self.getCodes(
+                        channel, start, start + min(nChunk, nAverage - n0))
+                    mSum[n] += codes.sum(axis=0, dtype=np.int64)
+        else:
+            # sum whole averages, nRecord records at a time
+            nChunk = max(1, chunkSize // (bytesPerRecord * self.nRecord))
+            for n0 in range(0, nAverage, nChunk):
+                n1 = min(nAverage, n0 + nChunk)
+                codes = self.getCodes(channel, n0 * self.nRecord,
+                                      n1 * self.nRecord)
+                mSum += codes.reshape((n1 - n0, self.nRecord,
+                                       self.nSample)).sum(axis=0,
+                                                          dtype=np.int64)
+        vData = self.scale[c] * (mSum / nAverage - self.codeZero)
+        return vData.reshape(-1)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,504 @@
+#!/usr/bin/env python
+"""Simulated AlazarTech board, replacing the ATSApi library for testing."""
+import ctypes
+import threading
+import time
+
+import numpy as np
+
+# return codes of ATSApi
+ApiSuccess = 512
+ApiFailed = 513
+ApiBufferNotReady = 573
+ApiWaitTimeout = 579
+ApiBufferOverflow = 582
+
+ERROR_TEXT = {
+    ApiSuccess: 'ApiSuccess',
+    ApiFailed: 'ApiFailed',
+    ApiBufferNotReady: 'ApiBufferNotReady',
+    ApiWaitTimeout: 'ApiWaitTimeout',
+    ApiBufferOverflow: 'ApiBufferOverflow',
+}
+
+# input range codes used by AlazarInputControl, in volts
+INPUT_RANGES = {12: 4.0, 11: 2.0, 10: 1.0, 7: 0.4, 6: 0.2, 5: 0.1, 2: 0.04}
+
+# sample rate codes used by AlazarSetCaptureClock with the internal clock
+SAMPLE_RATES = {
+    0x01: 1E3, 0x02: 2E3, 0x04: 5E3, 0x08: 10E3, 0x0A: 20E3, 0x0C: 50E3,
+    0x0E: 100E3, 0x10: 200E3, 0x12: 500E3, 0x14: 1E6, 0x18: 2E6, 0x1A: 5E6,
+    0x1C: 10E6, 0x1E: 20E6, 0x22: 50E6, 0x24: 100E6, 0x28: 200E6,
+    0x30: 500E6, 0x35: 1E9, 0x37: 1.2E9, 0x3A: 1.5E9, 0x3F: 2E9,
+    0x6A: 2.4E9, 0x75: 3E9, 0x7B: 3.6E9, 0x80: 4E9}
+INTERNAL_CLOCK = 1
+
+# board kinds returned by AlazarGetBoardKind
+BOARD_KINDS = {'9870': 13, '9360': 25, '9373': 29}
+
+# trigger source of a disabled trigger engine
+TRIG_DISABLE = 3
+
+
+def _value(arg):
+    """Convert a ctypes argument to a python value."""
+    return getattr(arg, 'value', arg)
+
+
+def _address(arg):
+    """Get memory address of a ctypes buffer or pointer argument."""
+    if isinstance(arg, ctypes.Array):
+        return ctypes.addressof(arg)
+    return _value(arg)
+
+
+class _ApiFunction:
+    """Callable with a `restype` attribute, like a function in a ctypes DLL"""
+
+    def __init__(self, func):
+        self.func = func
+        self.restype = ctypes.c_int
+
+    def __call__(self, *args):
+        return self.func(*args)
+
+
+class IQBlobSource:
+    """Readout signal with a tone per qubit, for testing demodulation.
+
+    In each record, each qubit is in a random state. The tone of a qubit has
+    the complex amplitude of its state, so that demodulating the record at
+    the qubit frequency gives that amplitude plus noise.
+
+    Parameters
+    ----------
+    dt : float
+        Time step of the digitizer, in seconds.
+    frequencies : list of float
+        IF frequency of each qubit, in Hz.
+    amplitudes : list of list of complex
+        For each qubit, the demodulated amplitude of each state, in volts.
+    noise : float
+        Standard deviation of gaussian noise added to each sample, in volts.
+    iq : bool
+        If True, channel 1 and 2 are the I and Q parts of the signal,
+        otherwise both channels get the real signal.
+    nRecord : int
+        Number of records with different states, repeated after that.
+    seed : int
+        Seed of the random states and noise.
+
+    """
+
+    def __init__(self, dt, frequencies, amplitudes, noise=0.0, iq=False,
+                 nRecord=10000, seed=0):
+        self.dt = float(dt)
+        self.frequencies = np.array(frequencies, dtype=float)
+        self.amplitudes = [np.array(a, dtype=complex) for a in amplitudes]
+        self.noise = float(noise)
+        self.iq = iq
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.states = np.stack([rng.integers(len(a), size=nRecord)
+                                for a in self.amplitudes], axis=1)
+
+    def getStates(self, firstRecord, nRecord):
+        """Get state of each qubit, with shape (nRecord, number of qubits)."""
+        index = np.arange(firstRecord, firstRecord + nRecord)
+        return self.states[index % len(self.states)]
+
+    def getAmplitudes(self, firstRecord, nRecord):
+        """Get demodulated amplitude of each qubit in each record."""
+        states = self.getStates(firstRecord, nRecord)
+        return np.stack([a[states[:, n]]
+                         for n, a in enumerate(self.amplitudes)], axis=1)
+
+    def __call__(self, channel, firstRecord, nRecord, nSample):
+        vTime = self.dt * np.arange(nSample)
+        tones = np.exp(2j * np.pi * vTime[:, np.newaxis] * self.frequencies)
+        # the conjugate gives the amplitude after demodulation
+        signal = np.conj(self.getAmplitudes(firstRecord, nRecord)) @ tones.T
+        signal = signal.imag if (self.iq and channel == 2) else signal.real
+        if self.noise > 0:
+            rng = np.random.default_rng((self.seed, firstRecord, channel))
+            signal += rng.normal(0.0, self.noise, signal.shape)
+        return signal
+
+
+class ScriptedSource:
+    """Input signal repeating a list of patterns, for testing hardware loops.
+
+    Record `n` gets pattern ``(n // repeat) % len(patterns)``. With one
+    pattern per step of a hardware loop and `repeat` of 1, as for the
+    interleaved records of DMA acquisitions, each averaged trace is the
+    pattern of its step. For the consecutive records of single-record
+    acquisitions, `repeat` is the number of averages.
+
+    Parameters
+    ----------
+    patterns : array_like or dict
+        Patterns in volts, with shape (number of patterns, samples). Patterns
+        shorter than the record are padded with zeros. A dict gives
+        separate patterns for each channel, other channels get zeros.
+    repeat : int
+        Number of consecutive records with the same pattern.
+    noise : float
+        Standard deviation of gaussian noise added to each sample, in volts.
+    seed : int
+        Seed of the noise.
+
+    """
+
+    def __init__(self, patterns, repeat=1, noise=0.0, seed=0):
+        if not isinstance(patterns, dict):
+            patterns = {1: patterns, 2: patterns}
+        self.patterns = {channel: np.atleast_2d(np.array(p, dtype=float))
+                         for channel, p in patterns.items()}
+        self.repeat = int(repeat)
+        self.noise = float(noise)
+        self.seed = seed
+
+    def __call__(self, channel, firstRecord, nRecord, nSample):
+        signal = np.zeros((nRecord, nSample))
+        patterns = self.patterns.get(channel)
+        if patterns is not None:
+            index = np.arange(firstRecord, firstRecord + nRecord)
+            index = (index // self.repeat) % len(patterns)
+            n = min(nSample, patterns.shape[1])
+            signal[:, :n] = patterns[index, :n]
+        if self.noise > 0:
+            rng = np.random.default_rng((self.seed, firstRecord, channel))
+            signal += rng.normal(0.0, self.noise, signal.shape)
+        return signal
+
+
+class SimulatedATSApi:
+    """Simulated board with the call surface of the ATSApi library.
+
+    An instance can be passed as `dll` to `AlazarTechDigitizer`. Triggers
+    arrive at a fixed rate from the start of the capture, delayed by the
+    trigger delay. With the trigger engine disabled, as for immediate
+    triggering, the board instead triggers itself after each trigger
+    timeout, and never triggers if the timeout is zero.
+
+    In AutoDMA mode, a buffer is completed once all its records are
+    triggered. A buffer that is not posted when the board starts writing to
+    it causes a buffer overflow, as on the real hardware. In single-record
+    mode, the board is busy until all records are triggered, and records
+    already triggered can be read with AlazarRead. Captures that do not fit
+    in the on-board memory are rejected.
+
+    Parameters
+    ----------
+    triggerRate : float
+        Rate of triggers on the trigger inputs, in Hz.
+    bitsPerSample : int
+        Resolution of the board.
+    memorySize : int
+        On-board memory, in samples per channel.
+    source : callable, optional
+        Function returning the input signal in volts, called as
+        ``source(channel, firstRecord, nRecord, nSample)`` and returning an
+        array of shape ``(nRecord, nSample)``. Defaults to gaussian noise,
+        see also `IQBlobSource` and `ScriptedSource`.
+    nTemplate : int
+        Number of buffers of data created in advance and reused, so that the
+        simulated data transfer takes little time. If 0, data is created for
+        every buffer.
+    model : str, optional
+        Board model reported by AlazarGetBoardKind, for example '9373'.
+        Boards without model are reported as unknown.
+
+    """
+
+    def __init__(self, triggerRate=10E3, bitsPerSample=8, memorySize=2**30,
+                 source=None, nTemplate=4, model=None):
+        self.triggerRate = float(triggerRate)
+        self.bitsPerSample = int(bitsPerSample)
+        self.memorySize = int(memorySize)
+        self.source = self.noise if source is None else source
+        self.nTemplate = int(nTemplate)
+        self.model = model
+        self.dRange = {1: 0.4, 2: 0.4}
+        self.nPreSize = 0
+        self.nPostSize = 0
+        self.nRecordCount = 0
+        self.sampleRate = 1E9
+        self.triggerSource = 0
+        self.triggerDelay = 0
+        self.triggerTimeout = 0.0
+        self.asyncMode = False
+        self._lock = threading.Lock()
+        self._abort = threading.Event()
+        self._templates = {}
+        # codes of the records of single-record captures, with their settings
+        self._records = {}
+        self._recordsKey = None
+        self._resetAsync()
+        # install board functions, with the same names as in ATSApi
+        for name in dir(self):
+            if name.startswith('Alazar'):
+                setattr(self, name, _ApiFunction(getattr(self, name)))
+
+    def _resetAsync(self):
+        """Clear state of AutoDMA acquisition."""
+        self.channels = 0
+        self.samplesPerRecord = 0
+        self.recordsPerBuffer = 0
+        self.recordsPerAcquisition = 0
+        self.tStart = None
+        self.posted = []
+        self.buffersCompleted = 0
+        self.overflow = False
+        self.nOverflow = 0
+
+    def noise(self, channel, firstRecord, nRecord, nSample):
+        """Default input signal, gaussian noise of 5 % of the range."""
+        rng = np.random.default_rng(firstRecord * 2 + channel)
+        return rng.normal(0.0, 0.05 * self.dRange[channel], (nRecord, nSample))
+
+    def _getCodes(self, channel, firstRecord, nRecord, nSample):
+        """Convert input signal of a channel to sample codes."""
+        data = self.source(channel, firstRecord, nRecord, nSample)
+        codeZero = 2 ** (self.bitsPerSample - 1) - 0.5
+        codes = np.rint(codeZero + data * codeZero / self.dRange[channel])
+        dtype = np.uint8 if self.bitsPerSample <= 8 else np.uint16
+        return np.clip(codes, 0, 2 ** self.bitsPerSample - 1).astype(dtype)
+
+    def _getBufferData(self, nBuffer):
+        """Get data of an AutoDMA buffer, channels after each other."""
+        if self.nTemplate > 0:
+            key = (nBuffer % self.nTemplate, self.channels,
+                   self.samplesPerRecord, self.recordsPerBuffer)
+            data = self._templates.get(key)
+            if data is not None:
+                return data
+        firstRecord = nBuffer * self.recordsPerBuffer
+        data = np.concatenate([
+            self._getCodes(channel, firstRecord, self.recordsPerBuffer,
+                           self.samplesPerRecord).ravel()
+            for channel in (1, 2) if self.channels & channel])
+        if self.nTemplate > 0:
+            self._templates[key] = data
+        return data
+
+    def _createRecords(self):
+        """Create data of a single-record capture, reused if unchanged."""
+        nSample = self.nPreSize + self.nPostSize
+        key = (self.nRecordCount, nSample, self.dRange[1], self.dRange[2])
+        if key != self._recordsKey:
+            self._records = {channel: self._getCodes(channel, 0,
+                                                     self.nRecordCount,
+                                                     nSample)
+                             for channel in (1, 2)}
+            self._recordsKey = key
+
+    def AlazarNumOfSystems(self):
+        return 1
+
+    def AlazarGetBoardBySystemID(self, systemId, boardId):
+        if (_value(systemId), _value(boardId)) != (1, 1):
+            return None
+        return 1
+
+    def AlazarErrorToText(self, status):
+        status = _value(status)
+        return ERROR_TEXT.get(status, 'Unknown error %d' % status).encode()
+
+    def AlazarGetBoardKind(self, handle):
+        return BOARD_KINDS.get(self.model, 0)
+
+    def AlazarGetChannelInfo(self, handle, memorySize, bitsPerSample):
+        memorySize._obj.value = self.memorySize
+        bitsPerSample._obj.value = self.bitsPerSample
+        return ApiSuccess
+
+    def AlazarSetLED(self, handle, state):
+        return ApiSuccess
+
+    def AlazarSetCaptureClock(self, handle, source, rate, edge, decimation):
+        (rate, decimation) = (_value(rate), _value(decimation))
+        if _value(source) == INTERNAL_CLOCK:
+            if rate not in SAMPLE_RATES:
+                return ApiFailed
+            self.sampleRate = SAMPLE_RATES[rate]
+        else:
+            # external reference, rate in Hz divided by decimation
+            self.sampleRate = float(rate) / max(decimation, 1)
+        return ApiSuccess
+
+    def AlazarInputControl(self, handle, channel, coupling, inputRange,
+                           impedance):
+        self.dRange[_value(channel)] = INPUT_RANGES[_value(inputRange)]
+        self._templates.clear()
+        return ApiSuccess
+
+    def AlazarSetBWLimit(self, handle, channel, enable):
+        return ApiSuccess
+
+    def AlazarSetTriggerOperation(self, handle, operation, engine1, source1,
+                                  slope1, level1, engine2, source2, slope2,
+                                  level2):
+        # only trigger engine J is used
+        self.triggerSource = _value(source1)
+        return ApiSuccess
+
+    def AlazarSetExternalTrigger(self, handle, coupling, triggerRange):
+        return ApiSuccess
+
+    def AlazarSetTriggerDelay(self, handle, delay):
+        self.triggerDelay = _value(delay)
+        return ApiSuccess
+
+    def AlazarSetTriggerTimeOut(self, handle, ticks):
+        # one tick is 10 us
+        self.triggerTimeout = _value(ticks) * 1E-5
+        return ApiSuccess
+
+    def AlazarSetRecordSize(self, handle, preSize, postSize):
+        self.nPreSize = _value(preSize)
+        self.nPostSize = _value(postSize)
+        return ApiSuccess
+
+    def AlazarSetRecordCount(self, handle, count):
+        self.nRecordCount = _value(count)
+        return ApiSuccess
+
+    def AlazarBeforeAsyncRead(self, handle, channels, transferOffset,
+                              samplesPerRecord, recordsPerBuffer,
+                              recordsPerAcquisition, flags):
+        with self._lock:
+            self._resetAsync()
+            self._abort.clear()
+            self.channels = _value(channels)
+            self.samplesPerRecord = _value(samplesPerRecord)
+            self.recordsPerBuffer = _value(recordsPerBuffer)
+            self.recordsPerAcquisition = _value(recordsPerAcquisition)
+            self.asyncMode = True
+        # create reused data before the capture starts
+        nBufferTotal = -(-self.recordsPerAcquisition // self.recordsPerBuffer)
+        for n in range(min(self.nTemplate, nBufferTotal)):
+            self._getBufferData(n)
+        return ApiSuccess
+
+    def AlazarStartCapture(self, handle):
+        # single-record acquisitions have to fit in the on-board memory
+        nSample = self.nRecordCount * (self.nPreSize + self.nPostSize)
+        if not self.asyncMode and nSample > self.memorySize:
+            return ApiFailed
+        if not self.asyncMode:
+            self._createRecords()
+        self.tStart = time.perf_counter()
+        return ApiSuccess
+
+    def AlazarAbortCapture(self, handle):
+        self.tStart = None
+        return ApiSuccess
+
+    def AlazarBusy(self, handle):
+        if self.tStart is None:
+            return 0
+        nRecord = (self.recordsPerAcquisition if self.asyncMode
+                   else self.nRecordCount)
+        return int(time.perf_counter() < self.getRecordTime(nRecord - 1))
+
+    def AlazarRead(self, handle, channel, buffer, elementSize, record,
+                   transferOffset, transferLength):
+        (channel, record) = (_value(channel), _value(record))
+        if self.asyncMode or not 1 <= record <= self.nRecordCount:
+            return ApiFailed
+        if (self.tStart is None or
+                time.perf_counter() < self.getRecordTime(record - 1)):
+            return ApiBufferNotReady
+        # transfer offset is relative to the trigger
+        nSample = self.nPreSize + self.nPostSize
+        n0 = max(self.nPreSize + _value(transferOffset), 0)
+        n1 = min(n0 + _value(transferLength), nSample)
+        codes = self._records[channel][record - 1, n0:n1]
+        codes = codes.astype(np.uint8 if _value(elementSize) == 1
+                             else np.uint16)
+        ctypes.memmove(_address(buffer), codes.ctypes.data, codes.nbytes)
+        return ApiSuccess
+
+    def AlazarAbortAsyncRead(self, handle):
+        # wake up threads waiting for buffers
+        self._abort.set()
+        with self._lock:
+            self.tStart = None
+            self.posted = []
+            self.asyncMode = False
+        return ApiSuccess
+
+    def AlazarPostAsyncBuffer(self, handle, address, length):
+        with self._lock:
+            self.posted.append(
+                (_value(address), _value(length), time.perf_counter()))
+        return ApiSuccess
+
+    def getTriggerPeriod(self):
+        """Time between triggers, in seconds."""
+        if self.triggerSource == TRIG_DISABLE:
+            # the board triggers itself after each timeout
+            return self.triggerTimeout or float('inf')
+        period = 1.0 / self.triggerRate
+        if self.triggerTimeout > 0:
+            period = min(period, self.triggerTimeout)
+        return period
+
+    def getRecordTime(self, nRecord):
+        """Time when the board completes record number `nRecord`."""
+        return (self.tStart + self.triggerDelay / self.sampleRate +
+                (nRecord + 1) * self.getTriggerPeriod())
+
+    def getBufferTime(self, nBuffer):
+        """Time when the board completes buffer number `nBuffer`."""
+        return self.getRecordTime((nBuffer + 1) * self.recordsPerBuffer - 1)
+
+    def AlazarWaitAsyncBufferComplete(self, handle, address, timeout_ms):
+        address = _value(address)
+        with self._lock:
+            if self.tStart is None:
+                return ApiBufferNotReady
+            if self.overflow:
+                return ApiBufferOverflow
+            if not self.posted or self.posted[0][0] != address:
+                return ApiBufferNotReady
+            nBuffer = self.buffersCompleted
+            (address, length, tPosted) = self.posted[0]
+            # the board starts writing when the previous buffer is complete
+            if nBuffer > 0 and tPosted > self.getBufferTime(nBuffer - 1):
+                self.overflow = True
+                self.nOverflow += 1
+                return ApiBufferOverflow
+            nBufferTotal = -(-self.recordsPerAcquisition //
+                             self.recordsPerBuffer)
+            tDone = (self.getBufferTime(nBuffer)
+                     if nBuffer < nBufferTotal else float('inf'))
+        # wait for triggers, stop early if aborted
+        delay = tDone - time.perf_counter()
+        if delay > timeout_ms / 1000:
+            self._abort.wait(timeout_ms / 1000)
+            return ApiFailed if self._abort.is_set() else ApiWaitTimeout
+        if delay > 0 and self._abort.wait(delay):
+            return ApiFailed
+        # transfer data to buffer
+        data = self._getBufferData(nBuffer)
+        ctypes.memmove(address, data.ctypes.data,
+                       min(length, data.nbytes))
+        with self._lock:
+            self.posted.pop(0)
+            self.buffersCompleted += 1
+        return ApiSuccess
+
+
+if __name__ == '__main__':
+    # measure throughput of the DMA readout against a simulated board
+    from AlazarTech_Digitizer_Wrapper import AlazarTechDigitizer
+    dll = SimulatedATSApi(triggerRate=50E3)
+    digitizer = AlazarTechDigitizer(dll=dll)
+    t0 = time.perf_counter()
+    digitizer.readTracesDMA(True, True, 1024, 1, 100, nAverage=50000,
+                            bufferSize=16)
+    dt = time.perf_counter() - t0
+    print('%d records in %.2f s, %.1f kHz, %d overflows' % (
+        50000, dt, 50000 / dt / 1E3, dll.nOverflow))
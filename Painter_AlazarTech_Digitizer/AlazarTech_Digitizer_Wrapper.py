@@ -1,7 +1,9 @@
-import ctypes, os
-from ctypes import c_int, c_uint8, c_uint16, c_uint32, c_int32, c_float, c_char_p, c_void_p, c_long, byref, windll
+import ctypes, ctypes.util, os, queue, threading
+from ctypes import c_int, c_uint8, c_uint16, c_uint32, c_int32, c_float, c_char_p, c_void_p, c_long, byref
 import numpy as np
 
+from AlazarTech_Digitizer_RawFile import LAYOUT_CONSECUTIVE, RawRecordWriter
+
 # add logger, to allow logging to Labber's instrument log
 import logging
 log = logging.getLogger('LabberDriver')
@@ -11,15 +13,43 @@ import time
 ADMA_NPT = 0x200
 ADMA_EXTERNAL_STARTCAPTURE = 0x1
 
+# board kinds returned by AlazarGetBoardKind, for the supported models
+BOARD_KINDS = {13: '9870', 25: '9360', 29: '9373'}
+
+# features of the supported models
+#   dma: traces are read with AutoDMA, instead of record by record
+#   inputControl: coupling, range and impedance of the inputs can be set
+#   bandwidthLimit: the inputs have a bandwidth limit
+#   refClockRate: with a 10 MHz reference clock, the sample rate is set
+#                 directly, instead of by decimation of 1 GS/s
+#   extTrigRange: range code and maximum level of the external trigger
+FEATURES = {
+    '9870': dict(dma=True, inputControl=True, bandwidthLimit=False,
+                 refClockRate=False, extTrigRange=(0, 5.0)),
+    '9360': dict(dma=True, inputControl=False, bandwidthLimit=False,
+                 refClockRate=True, extTrigRange=(3, 2.5)),
+    '9373': dict(dma=True, inputControl=False, bandwidthLimit=False,
+                 refClockRate=True, extTrigRange=(3, 2.5)),
+}
+
 # match naming convertinos in DLL
 U8 = c_uint8
 U16 = c_uint16
 U32 = c_uint32
 
+# C library, for allocating page-aligned DMA buffers on posix systems
+if os.name == 'posix':
+    libc = ctypes.CDLL(ctypes.util.find_library('c'))
+    libc.valloc.argtypes = [c_long]
+    libc.valloc.restype = c_void_p
+    libc.free.argtypes = [c_void_p]
+    libc.free.restype = None
+
 class DMABuffer:
     """"Buffer for DMA"""
     def __init__(self, c_sample_type, size_bytes):
         self.size_bytes = size_bytes
+        self.c_sample_type = c_sample_type
 
         npSampleType = {
             c_uint8: np.uint8,
@@ -47,12 +77,12 @@ class DMABuffer:
             self.addr = kernel32.VirtualAlloc(
                 0, c_long(size_bytes), MEM_COMMIT, PAGE_READWRITE)
         elif os.name == 'posix':
-            libc.valloc.argtypes = [c_long]
-            libc.valloc.restype = c_void_p
             self.addr = libc.valloc(size_bytes)
         else:
             raise Exception("Unsupported OS")
-
+        if not self.addr:
+            raise MemoryError('Could not allocate DMA buffer of %d bytes.'
+                              % size_bytes)
 
         ctypes_array = (c_sample_type *
                         (size_bytes // bytes_per_sample)).from_address(self.addr)
@@ -82,26 +112,57 @@ class TimeoutError(Error):
 # open dll
 try:
     DLL = ctypes.CDLL('ATSApi')
-except:
+except OSError:
     # if failure, try to open in driver folder
     sPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'atsapi')
-    DLL = ctypes.CDLL(os.path.join(sPath, 'ATSApi'))
+    try:
+        DLL = ctypes.CDLL(os.path.join(sPath, 'ATSApi'))
+    except OSError:
+        # no board library, a simulated backend can still be given to the class
+        DLL = None
+
+
+def getAccumulatorType(dtype, nSum):
+    """Smallest unsigned integer type holding the sum of nSum samples"""
+    maxSum = int(np.iinfo(dtype).max) * int(nSum)
+    for accType in (np.uint16, np.uint32):
+        if maxSum <= np.iinfo(accType).max:
+            return accType
+    return np.uint64
 
 
 class AlazarTechDigitizer():
     """Represent the Alazartech digitizer, redefines the dll functions in python"""
 
-    def __init__(self, systemId=1, boardId=1, timeout=10.0):
-        """The init case defines a session ID, used to identify the instrument"""
+    def __init__(self, systemId=1, boardId=1, timeout=10.0, dll=None,
+                 model=None):
+        """The init case defines a session ID, used to identify the instrument
+
+        The board functions are called in `dll`, which defaults to the ATSApi
+        library but can be any object with the same functions, for example a
+        simulated board from AlazarTech_Digitizer_Simulator.
+
+        The board model is detected from the board, and `model` is only used
+        for boards that are not recognized. The features of the model, see
+        `FEATURES`, are available as `features`.
+        """
+        self.dll = DLL if dll is None else dll
+        if self.dll is None:
+            raise Error('The AlazarTech ATSApi library could not be loaded.')
         # range settings; default value of 400mV for 9373;
         #will be overwritten if model is 9870 and AlazarInputControl called
         self.dRange = {1: 0.4, 2: 0.4}
         self.buffers = []
         self.timeout = timeout
+        # start of the last capture, and trigger period measured from it
+        self.tCaptureStart = None
+        self.triggerPeriod = 0.0
+        # array for the records of single-record reads, reused between reads
+        self.recordBuffer = np.zeros(0, dtype=np.uint8)
         # create a session id
-        func = getattr(DLL, 'AlazarNumOfSystems')
+        func = getattr(self.dll, 'AlazarNumOfSystems')
         func.restype = U32
-        func = getattr(DLL, 'AlazarGetBoardBySystemID')
+        func = getattr(self.dll, 'AlazarGetBoardBySystemID')
         func.restype = c_void_p
         handle = func(U32(systemId), U32(boardId))
         if handle is None:
@@ -109,6 +170,11 @@ class AlazarTechDigitizer():
         self.handle = c_void_p(handle)
         # get mem and bitsize
         (self.memorySize_samples, self.bitsPerSample) = self.AlazarGetChannelInfo()
+        # detect model, unknown boards are treated as the given model
+        self.model = BOARD_KINDS.get(self.AlazarGetBoardKind(), model)
+        if model is not None and self.model != model:
+            log.warning('Board is an ATS%s, not an ATS%s.' % (self.model, model))
+        self.features = FEATURES.get(self.model, FEATURES['9870'])
 
 
     def testLED(self):
@@ -121,7 +187,7 @@ class AlazarTechDigitizer():
     def callFunc(self, sFunc, *args, **kargs):
         """General function caller with restype=status, also checks for errors"""
         # get function from DLL
-        func = getattr(DLL, sFunc)
+        func = getattr(self.dll, sFunc)
         func.restype = c_int
         # call function, raise error if needed
         status = func(*args)
@@ -136,7 +202,7 @@ class AlazarTechDigitizer():
 
     def getError(self, status):
         """Convert the error in status to a string"""
-        func = getattr(DLL, 'AlazarErrorToText')
+        func = getattr(self.dll, 'AlazarErrorToText')
         func.restype = c_char_p
         # const char* AlazarErrorToText(RETURN_CODE retCode)
         errorText = func(c_int(status))
@@ -151,6 +217,13 @@ class AlazarTechDigitizer():
         return (int(memorySize_samples.value), int(bitsPerSample.value))
 
 
+    #U32 AlazarGetBoardKind( HANDLE h);
+    def AlazarGetBoardKind(self):
+        func = getattr(self.dll, 'AlazarGetBoardKind')
+        func.restype = U32
+        return int(func(self.handle))
+
+
     #RETURN_CODE AlazarSetCaptureClock( HANDLE h, U32 Source, U32 Rate, U32 Edge, U32 Decimation);
     def AlazarSetCaptureClock(self, SourceId, SampleRateId, EdgeId=0, Decimation=0):
         self.callFunc('AlazarSetCaptureClock', self.handle,
@@ -216,6 +289,7 @@ class AlazarTechDigitizer():
     #RETURN_CODE AlazarStartCapture( HANDLE h);
     def AlazarStartCapture(self):
         self.callFunc('AlazarStartCapture', self.handle)
+        self.tCaptureStart = time.perf_counter()
 
 
     #RETURN_CODE AlazarAbortCapture( HANDLE h);
@@ -226,12 +300,74 @@ class AlazarTechDigitizer():
     #U32	AlazarBusy( HANDLE h);
     def AlazarBusy(self):
         # get function from DLL
-        func = getattr(DLL, 'AlazarBusy')
+        func = getattr(self.dll, 'AlazarBusy')
         func.restype = U32
         # call function, return result
         return bool(func(self.handle))
 
 
+    def waitCapture(self, nRecord, timeout=None, funcStop=None,
+                    pollInterval=0.001, expectedPollInterval=0.005):
+        """Wait until a single-record capture started by AlazarStartCapture
+        is done.
+
+        Until the expected capture time, which is the number of records
+        times the trigger period measured in previous captures, the board is
+        polled every `expectedPollInterval` seconds, and then every
+        `pollInterval` seconds.
+
+        The measured period includes the wait for the first trigger, so a
+        late trigger would make the next expected time too long. The period
+        can therefore at most double from one capture to the next.
+
+        Parameters
+        ----------
+        nRecord : int
+            Number of records in the capture.
+        timeout : float, optional
+            Maximum time to wait, in seconds. Defaults to the global timeout.
+        funcStop : callable, optional
+            Function returning True if the wait should be stopped.
+        pollInterval : float
+            Time between calls to AlazarBusy after the expected capture
+            time, in seconds.
+        expectedPollInterval : float
+            Time between calls to AlazarBusy before the expected capture
+            time, in seconds.
+
+        Returns
+        -------
+        bool
+            True if the capture is done, False if stopped.
+
+        """
+        timeout = self.timeout if timeout is None else timeout
+        tStart = self.tCaptureStart
+        tEnd = tStart + timeout
+        # keep a margin, since triggers may come faster than last time
+        tExpected = tStart + 0.9 * nRecord * self.triggerPeriod
+        while True:
+            now = time.perf_counter()
+            if funcStop is not None and funcStop():
+                return False
+            if not self.AlazarBusy():
+                break
+            if now >= tEnd:
+                self.AlazarAbortCapture()
+                raise TimeoutError('Acquisition timed out')
+            # poll less often until the expected end
+            delay = (min(tExpected - now, expectedPollInterval)
+                     if now < tExpected else pollInterval)
+            time.sleep(min(delay, max(tEnd - now, 0.0)))
+        # measure trigger period, for the next capture
+        if nRecord > 0:
+            period = (time.perf_counter() - tStart) / nRecord
+            if self.triggerPeriod > 0:
+                period = min(period, 2 * self.triggerPeriod)
+            self.triggerPeriod = period
+        return True
+
+
     # U32	AlazarRead(HANDLE h, U32 Channel, void *buffer, int ElementSize,
     #                 long Record, long TransferOffset, U32 TransferLength);
     def AlazarRead(self, Channel, buffer, ElementSize, Record, TransferOffset, TransferLength):
@@ -266,11 +402,33 @@ class AlazarTechDigitizer():
     def readTracesDMA(self, bGetCh1, bGetCh2, nSamples, nRecord, nBuffer, nAverage=1,
                       bConfig=True, bArm=True, bMeasure=True,
                       funcStop=None, funcProgress=None, timeout=None, bufferSize=512,
-                      firstTimeout=None, maxBuffers=1024):
+                      firstTimeout=None, maxBuffers=1024, queueSize=8,
+                      demodulator=None, histogramBins=None, rawPath=None,
+                      rawMetadata=None, bSumBuffers=False):
         """
         read traces in NPT AutoDMA mode, convert to float, average to single trace
+
+        DMA buffers are waited for and re-posted in a separate thread, while
+        the calling thread averages the data. Up to `queueSize` completed
+        buffers can be waiting for the averaging.
+
+        If a `demodulator` is given, each record is demodulated directly from
+        the DMA buffers instead, and the complex single-shot values are
+        returned as an array with shape (nRecord * nAverage, number of qubits).
+        If `histogramBins` is also given, the IQ histograms of the values of
+        each qubit are returned as well, see `Demodulator.getHistograms`.
+
+        If `rawPath` is given, the raw codes of all records are also written
+        to that file, see AlazarTech_Digitizer_RawFile. The DMA buffers are
+        copied directly into the memory-mapped file, which then replaces the
+        staging arrays. `rawMetadata` is stored with the file.
+
+        The averaged traces are the average of all records. With
+        `bSumBuffers`, they are instead multiplied by the number of DMA
+        buffers, which gives the sum of the averages of each buffer returned
+        by driver versions before 0.4.
         """
-        t0 = time.clock()
+        t0 = time.perf_counter()
         lT = []
 
         # use global timeout if not given
@@ -354,12 +512,8 @@ class AlazarTechDigitizer():
             sample_type = ctypes.c_uint8
             if bytesPerSample > 1:
                 sample_type = ctypes.c_uint16
-            # clear old buffers
-            self.removeBuffersDMA()
-            # create new buffers
-            self.buffers = []
-            for i in range(bufferCount):
-                self.buffers.append(DMABuffer(sample_type, bytesPerBufferMem))
+            self.allocateBuffersDMA(sample_type, bytesPerBufferMem,
+                                    bufferCount)
 
         # arm and start capture, if wanted
         if bArm:
@@ -384,10 +538,15 @@ class AlazarTechDigitizer():
         if not bMeasure:
             return
 
-        lT.append('Post: %.1f ms' % ((time.clock() - t0) * 1000))
+        lT.append('Post: %.1f ms' % ((time.perf_counter() - t0) * 1000))
+        stopEvent = threading.Event()
+        producer = None
+        rawFile = None
         try:
-            lT.append('Start: %.1f ms' % ((time.clock() - t0) * 1000))
+            lT.append('Start: %.1f ms' % ((time.perf_counter() - t0) * 1000))
             buffersCompleted = 0
+            # buffers included in the result, can be one less if stopped
+            buffersProcessed = 0
             bytesTransferred = 0
 
             # initialize data array, which is the size of number of samples
@@ -405,25 +564,74 @@ class AlazarTechDigitizer():
             range1 = self.dRange[1] / codeRange #/ 16.
             range2 = self.dRange[2] / codeRange #/ 16.
             offset = codeZero #16. * codeZero #  #
-
-            timeout_ms = int(firstTimeout * 1000)
+            # integer sum of the codes of all averaged records, converted to
+            # voltages once at the end
+            mSum = np.zeros((channelCount, nPtsOut), dtype=np.int64)
+            nAvDone = 0
+            # sum of one buffer, in the smallest type that cannot overflow
+            accType = getAccumulatorType(self.buffers[0].buffer.dtype,
+                                         nAvPerBuffer)
+            mBufferSum = np.empty((channelCount, nPtsOut), dtype=accType)
+
+            if demodulator is not None:
+                (bNeedCh1, bNeedCh2) = demodulator.getChannels()
+                if (bNeedCh1 and not bGetCh1) or (bNeedCh2 and not bGetCh2):
+                    raise Error('Demodulation needs a channel that is not enabled.')
+                # weights of the active channels, in volts per code, limited
+                # to the samples inside the integration windows
+                lWeight = [self.dRange[ch] / codeRange *
+                           demodulator.getWeights(ch, samplesPerRecordValue)
+                           for ch in (1, 2) if channels & ch]
+                vUsed = np.flatnonzero(np.any([np.any(w != 0, axis=1)
+                                               for w in lWeight], axis=0))
+                (i0, i1) = (vUsed[0], vUsed[-1] + 1) if len(vUsed) else (0, 0)
+                # complex weights as pairs of real weights, for the raw codes
+                lWeight = [np.ascontiguousarray(w[i0:i1]).view(float)
+                           for w in lWeight]
+                vOffset = offset * sum(w.sum(axis=0) for w in lWeight)
+                vShots = np.zeros((recordsPerAcquisition, demodulator.nQubit),
+                                  dtype=complex)
+
+            # completed DMA buffers are copied to staging arrays by a separate
+            # thread, which re-posts them directly, so that the board never
+            # waits for the averaging below
+            nSampleBuffer = bytesPerBuffer // bytesPerSample
+            freeArrays = queue.Queue()
+            # no staging arrays needed if buffers are copied to a raw file
+            nStage = 0 if rawPath else max(1, min(queueSize, buffersPerAcquisition))
+            for n in range(nStage):
+                freeArrays.put(np.empty(nSampleBuffer,
+                                        dtype=self.buffers[0].buffer.dtype))
+            filledArrays = queue.Queue()
+            if rawPath:
+                # file with room for the raw records of all buffers
+                lCh = [ch for ch in (1, 2) if channels & ch]
+                rawFile = RawRecordWriter(
+                    rawPath, self.buffers[0].buffer.dtype, lCh,
+                    [self.dRange[ch] for ch in lCh], self.bitsPerSample,
+                    buffersPerAcquisition, recordsPerBuffer, samplesPerRecord,
+                    samplesPerRecordValue, nRecord, nAverage,
+                    metadata=rawMetadata)
+            producer = threading.Thread(
+                target=self._produceBuffersDMA,
+                args=(buffersPerAcquisition, nSampleBuffer, firstTimeout,
+                      timeout, freeArrays, filledArrays, stopEvent, rawFile),
+                daemon=True)
+            producer.start()
 
             log.info(str(lT))
             lT = []
 
             while (buffersCompleted < buffersPerAcquisition):
-                # Wait for the buffer at the head of the list of available
-                # buffers to be filled by the board.
-                buf = self.buffers[buffersCompleted % len(self.buffers)]
-                self.AlazarWaitAsyncBufferComplete(buf.addr,
-                                                   timeout_ms=timeout_ms)
-                # lT.append('Wait: %.1f ms' % ((time.clock()-t0)*1000))
-
-                # reset timeout time, can be different than first call
-                timeout_ms = int(timeout * 1000)
+                # wait for the next buffer copied by the producer thread
+                buf_truncated = self._getFilledArray(filledArrays, funcStop)
+                if buf_truncated is None:
+                    # stopped from outside
+                    break
+                # lT.append('Wait: %.1f ms' % ((time.perf_counter()-t0)*1000))
 
                 buffersCompleted += 1
-                bytesTransferred += buf.size_bytes
+                bytesTransferred += bytesPerBuffer
 
                 # break if stopped from outside
                 if funcStop is not None and funcStop():
@@ -432,38 +640,27 @@ class AlazarTechDigitizer():
                 if funcProgress is not None:
                     funcProgress(float(buffersCompleted) / float(buffersPerAcquisition))
 
-                # remove extra elements for getting even 256*16 buffer sizes
-                if bytesPerBuffer == bytesPerBufferMem:
-                    buf_truncated = buf.buffer
-                else:
-                    buf_truncated = buf.buffer[:(bytesPerBuffer // bytesPerSample)]
-
                 # reshape, sort and average data
-                if nAverage > 1:
-                    if channels == 1:
-                        # only channel 1 active:
-                        rs = buf_truncated.reshape((nAvPerBuffer, nPtsOut))
-                        vData[0] += range1 * (np.mean(rs, axis=0) - offset)
-                    elif channels == 2:
-                        # only channel 2 active:
-                        rs = buf_truncated.reshape((nAvPerBuffer, nPtsOut))
-                        vData[1] += range2 * (np.mean(rs, axis=0) - offset)
-                    elif channels == 3:
-                        # both channels 1 & 2 active:
-                        rs = buf_truncated.reshape((2, nAvPerBuffer, nPtsOut))
-                        vData[0] += range1 * (np.mean(rs[0, :, :], axis=0) - offset)
-                        vData[1] += range2 * (np.mean(rs[1, :, :], axis=0) - offset)
+                if demodulator is not None:
+                    # demodulate all records of the buffer, one product per channel
+                    rs = buf_truncated.reshape((channelCount, recordsPerBuffer,
+                                                samplesPerRecord))
+                    n1 = buffersCompleted * recordsPerBuffer
+                    vOut = vShots[n1 - recordsPerBuffer:n1].view(float)
+                    for n, mWeight in enumerate(lWeight):
+                        vOut += rs[n, :, i0:i1] @ mWeight
+                    vOut -= vOffset
                 else:
-                    if channels == 1:
-                        vData[0] = range1 * (buf_truncated - offset)
-                    elif channels == 2:
-                        vData[1] = range2 * (buf_truncated - offset)
-                    elif channels == 3:
-                        rs = buf_truncated.reshape((2, nPtsOut))
-                        vData[0] = range1 * (rs[0, :] - offset)
-                        vData[1] = range2 * (rs[1, :] - offset)
-
-                # lT.append('Sort/Avg: %.1f ms' % ((time.clock()-t0)*1000))
+                    # sum raw codes of the records in the buffer, exactly
+                    rs = buf_truncated.reshape((channelCount, nAvPerBuffer,
+                                                nPtsOut))
+                    nUse = min(nAvPerBuffer, nAverage - nAvDone)
+                    np.add.reduce(rs[:, :nUse], axis=1, dtype=accType,
+                                  out=mBufferSum)
+                    mSum += mBufferSum
+                    nAvDone += nUse
+
+                # lT.append('Sort/Avg: %.1f ms' % ((time.perf_counter()-t0)*1000))
                 # log.info(str(lT))
                 # lT = []
                 #
@@ -472,26 +669,42 @@ class AlazarTechDigitizer():
                 # - 0x80 represents a ~0V signal.
                 # - 0xFF represents a positive full scale input signal.
 
-                # Add the buffer to the end of the list of available buffers.
-                self.AlazarPostAsyncBuffer(buf.addr, buf.size_bytes)
+                # give the staging array back to the producer thread
+                if rawFile is None:
+                    freeArrays.put(buf_truncated)
+                buffersProcessed += 1
         finally:
-            # release resources
+            # release resources, aborting also ends a wait in the producer
+            stopEvent.set()
             try:
                 self.AlazarAbortAsyncRead()
             except:
                 pass
-            lT.append('Abort: %.1f ms' % ((time.clock() - t0) * 1000))
-        # normalize
-        # log.info('Average: %.1f ms' % np.mean(lAvTime))
-
-        # why do this?
-        # vData[0] /= buffersPerAcquisition
-        # vData[1] /= buffersPerAcquisition
-
+            if producer is not None:
+                producer.join()
+            if rawFile is not None:
+                rawFile.close(buffersProcessed)
+            lT.append('Abort: %.1f ms' % ((time.perf_counter() - t0) * 1000))
         # # log timing information
-        lT.append('Done: %.1f ms' % ((time.clock() - t0) * 1000))
+        lT.append('Done: %.1f ms' % ((time.perf_counter() - t0) * 1000))
         log.info(str(lT))
 
+        if demodulator is not None:
+            # remove records acquired to fill up the last buffer
+            vShots = vShots[:nRecordTotal]
+            if histogramBins is None:
+                return vShots
+            return (vShots, demodulator.getHistograms(vShots, histogramBins))
+
+        # average and convert to voltages, nothing to do if stopped before
+        # the first buffer
+        if nAvDone > 0:
+            lRange = [range1, range2]
+            for n, ch in enumerate(ch for ch in (1, 2) if channels & ch):
+                vData[ch - 1] = lRange[ch - 1] * (mSum[n] / nAvDone - offset)
+                if bSumBuffers:
+                    vData[ch - 1] *= buffersProcessed
+
         #return data - requested vector length, not restricted to 128 multiple
         # reshape vData[i] to shape of `(nRecord, samplesPerRecord)`, take the
         # first `samplesPerRecordValue` columns and flatten to cast it to 1D vector
@@ -507,6 +720,78 @@ class AlazarTechDigitizer():
         return vData
 
 
+    def _produceBuffersDMA(self, nBuffer, nSampleBuffer, firstTimeout, timeout,
+                           freeArrays, filledArrays, stopEvent, rawFile=None):
+        """Wait for DMA buffers, copy them to free arrays and re-post them.
+
+        Runs in a separate thread. Filled arrays are put in `filledArrays` in
+        the order they were acquired, errors are passed on the same way. With
+        a `rawFile`, buffers are copied to the file instead of free arrays.
+        """
+        try:
+            timeout_ms = int(firstTimeout * 1000)
+            for n in range(nBuffer):
+                # Wait for the buffer at the head of the list of available
+                # buffers to be filled by the board.
+                buf = self.buffers[n % len(self.buffers)]
+                self.AlazarWaitAsyncBufferComplete(buf.addr,
+                                                   timeout_ms=timeout_ms)
+                # reset timeout time, can be different than first call
+                timeout_ms = int(timeout * 1000)
+                # get a free array, only blocks if averaging is too slow
+                data = None if rawFile is None else rawFile.getBuffer(n)
+                while data is None:
+                    if stopEvent.is_set():
+                        return
+                    try:
+                        data = freeArrays.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                # remove extra elements for getting even 256*16 buffer sizes
+                np.copyto(data, buf.buffer[:nSampleBuffer])
+                # Add the buffer to the end of the list of available buffers.
+                self.AlazarPostAsyncBuffer(buf.addr, buf.size_bytes)
+                filledArrays.put(data)
+        except Exception as e:
+            # errors are ignored if the acquisition was stopped on purpose
+            if not stopEvent.is_set():
+                filledArrays.put(e)
+
+
+    def _getFilledArray(self, filledArrays, funcStop=None):
+        """Get next array from producer thread, None if stopped from outside"""
+        while True:
+            try:
+                data = filledArrays.get(timeout=0.1)
+            except queue.Empty:
+                # keep checking for stop while waiting for slow triggers
+                if funcStop is not None and funcStop():
+                    return None
+                continue
+            if isinstance(data, Exception):
+                raise data
+            return data
+
+
+    def allocateBuffersDMA(self, sample_type, size_bytes, count):
+        """Allocate DMA buffers, reusing buffers from earlier acquisitions
+
+        Buffers with the right size and sample type are kept, so that
+        configuring the board again with the same buffer size, as in every
+        step of a hardware loop, does not free and allocate the memory.
+        """
+        lKeep = [buf for buf in self.buffers
+                 if buf.size_bytes == size_bytes and
+                 buf.c_sample_type is sample_type][:count]
+        # release the others before allocating new ones
+        for buf in self.buffers:
+            if not any(buf is keep for keep in lKeep):
+                buf.__exit__()
+        self.buffers = lKeep
+        while len(self.buffers) < count:
+            self.buffers.append(DMABuffer(sample_type, size_bytes))
+
+
     def removeBuffersDMA(self):
         """Clear and remove DMA buffers, to release memory"""
         # make sure buffers release memory
@@ -516,39 +801,84 @@ class AlazarTechDigitizer():
         self.buffers = []
 
 
-    def readTraces(self, Channel):
-        """Read traces, convert to float, average to a single trace"""
-        # define sizes
-        bitsPerSample = 8
-        bytesPerSample = int(np.floor((float(bitsPerSample) + 7.) / 8.0))
-        #TODO: change so buffer alignment is 64!!
+    def openRawFile(self, path, channels, metadata=None):
+        """Create file for the raw records read by readTraces.
+
+        The file must be closed with `close(1)` after reading all channels.
+        """
+        dtype = np.uint8 if self.bitsPerSample <= 8 else np.uint16
+        samplesPerRecord = self.nPreSize + self.nPostSize
+        return RawRecordWriter(path, dtype, channels,
+                               [self.dRange[ch] for ch in channels],
+                               self.bitsPerSample,
+                               1, self.nRecord * self.nAverage,
+                               samplesPerRecord, samplesPerRecord,
+                               self.nRecord, self.nAverage,
+                               layout=LAYOUT_CONSECUTIVE, metadata=metadata)
+
+
+    def readRecords(self, Channel):
+        """Read all records of a channel into one preallocated array
+
+        The records are transferred back to back into an array that is
+        reused by the next call, without converting each record.
+
+        Returns
+        -------
+        numpy array
+            Sample codes with shape (nRecord * nAverage, samples per record),
+            valid until the next call.
+        """
+        dtype = np.uint8 if self.bitsPerSample <= 8 else np.uint16
+        bytesPerSample = np.dtype(dtype).itemsize
         samplesPerRecord = self.nPreSize + self.nPostSize
-        # The buffer must be at least 16 samples larger than the transfer size
-        samplesPerBuffer = samplesPerRecord + 16
-        dataBuffer = (c_uint8 * samplesPerBuffer)()
+        nRecordTotal = self.nRecord * self.nAverage
+        # the buffer must be at least 16 samples larger than the transfer
+        # size, since records are read in order only the last one needs it
+        nSampleTotal = nRecordTotal * samplesPerRecord
+        if (self.recordBuffer.dtype != dtype or
+                self.recordBuffer.size < nSampleTotal + 16):
+            self.recordBuffer = np.zeros(nSampleTotal + 16, dtype=dtype)
+        # look up the function once, the call is repeated for every record
+        func = getattr(self.dll, 'AlazarRead')
+        func.restype = c_int
+        addr = self.recordBuffer.ctypes.data
+        bytesPerRecord = samplesPerRecord * bytesPerSample
+        (channel, elementSize) = (U32(Channel), c_int(bytesPerSample))
+        (offset, length) = (c_long(-self.nPreSize), U32(samplesPerRecord))
+        for n in range(nRecordTotal):
+            status = func(self.handle, channel,
+                          c_void_p(addr + n * bytesPerRecord), elementSize,
+                          c_long(n + 1), offset, length)
+            if status > 512:
+                raise Error(self.getError(status))
+        return self.recordBuffer[:nSampleTotal].reshape((nRecordTotal,
+                                                         samplesPerRecord))
+
+
+    def readTraces(self, Channel, rawFile=None):
+        """Read traces, convert to float, average to a single trace
+
+        If a `rawFile` from `openRawFile` is given, the raw records are also
+        written to the file.
+        """
+        codes = self.readRecords(Channel)
+        if rawFile is not None:
+            rawFile.getRecords(Channel)[:] = codes
+        # sum averages of each record as integers, records after each other
+        samplesPerRecord = codes.shape[1]
+        mSum = codes.reshape((self.nRecord, self.nAverage,
+                              samplesPerRecord)).sum(
+            axis=1, dtype=getAccumulatorType(codes.dtype, self.nAverage))
         # define scale factors
-        codeZero = 2 ** (float(bitsPerSample) - 1) - 0.5
-        codeRange = 2 ** (float(bitsPerSample) - 1) - 0.5
+        codeZero = 2 ** (float(self.bitsPerSample) - 1) - 0.5
+        codeRange = 2 ** (float(self.bitsPerSample) - 1) - 0.5
         voltScale = self.dRange[Channel] / codeRange
-
-        # initialize a scaled float vector to store the data read from digitizer
-        vData = np.zeros(samplesPerRecord * self.nRecord, dtype=float)
-        for n1 in range(self.nRecord):
-            for n2 in range(self.nAverage):
-                self.AlazarRead(Channel, dataBuffer, bytesPerSample,
-                                n2 + self.nAverage * n1 + 1, -self.nPreSize,
-                                samplesPerRecord)
-                # convert and scale to float
-                vBuffer = voltScale * (np.array(dataBuffer[:samplesPerRecord]) - codeZero)
-                # add to output vector (indices corresponding to n1-th record)
-                vData[(n1 * samplesPerRecord):((n1 + 1) * samplesPerRecord)] += vBuffer
-
-        # Perform averaging. The resulting vector `vData` is a 1D vector
-        # containing `self.nRecord` number of traces, each with
-        # `samplesPerRecord` number of samples
-        vData /= float(self.nAverage)
-        return vData
-
+        # The resulting vector `vData` is a 1D vector containing
+        # `self.nRecord` number of traces, each with `samplesPerRecord`
+        # number of samples
+        vData = voltScale * (mSum / float(self.nAverage) - codeZero)
+        return vData.reshape(-1)
 
 
 if __name__ == '__main__':
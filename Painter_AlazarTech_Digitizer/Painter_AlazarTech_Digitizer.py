@@ -1,6 +1,9 @@
 #!/usr/bin/env python
+import os
 
 import AlazarTech_Digitizer_Wrapper as AlazarDig
+from AlazarTech_Digitizer_Demodulation import Demodulator
+from AlazarTech_Digitizer_Simulator import SimulatedATSApi
 import InstrumentDriver
 import numpy as np
 
@@ -18,12 +21,27 @@ class Driver(InstrumentDriver.InstrumentWorker):
         # keep track of sampled traces
         self.lTrace = [np.array([]), np.array([])]
         self.lSignalNames = ['Ch1 - Data', 'Ch2 - Data']
+        # single-shot values, with shape (number of records, number of qubits)
+        self.mShots = np.zeros((0, 0), dtype=complex)
+        self.lDemodNames = (['Voltage, QB%d' % (n + 1) for n in range(9)] +
+                            ['Single-shot, QB%d' % (n + 1) for n in range(9)])
         self.dt = 1.0
-        # open connection
-        boardId = int(self.comCfg.address)
+        # number of the next raw record file
+        self.nRawFile = 0
+        # open connection, address "SIM" opens a simulated board
         timeout = self.dComCfg['Timeout']
-        self.dig = AlazarDig.AlazarTechDigitizer(systemId=1, boardId=boardId,
-                                                 timeout=timeout)
+        model = self.getModel()
+        if str(self.comCfg.address).strip().upper() == 'SIM':
+            bitsPerSample = 12 if model in ('9373', '9360') else 8
+            dll = SimulatedATSApi(bitsPerSample=bitsPerSample, model=model)
+            self.dig = AlazarDig.AlazarTechDigitizer(timeout=timeout, dll=dll,
+                                                     model=model)
+        else:
+            boardId = int(self.comCfg.address)
+            self.dig = AlazarDig.AlazarTechDigitizer(systemId=1,
+                                                     boardId=boardId,
+                                                     timeout=timeout,
+                                                     model=model)
         self.dig.testLED()
 
 
@@ -51,20 +69,26 @@ class Driver(InstrumentDriver.InstrumentWorker):
 
     def performGetValue(self, quant, options={}):
         """Perform the Get Value instrument operation"""
-        # only implmeneted for traces
-        if quant.name in self.lSignalNames:
+        # only implmeneted for traces and demodulated values
+        if quant.name in self.lSignalNames or quant.name in self.lDemodNames:
             # special case for hardware looping
             if self.isHardwareLoop(options):
+                if quant.name in self.lDemodNames:
+                    raise Error('Single-shot demodulation is not supported '
+                                'with hardware looping.')
                 return self.getSignalHardwareLoop(quant, options)
             # check if first call, if so get new traces
             if self.isFirstCall(options):
                 # clear trace buffer
                 self.lTrace = [np.array([]), np.array([])]
+                self.mShots = np.zeros((0, 0), dtype=complex)
                 # read traced to buffer, proceed depending on model
-                if self.getModel() in ('',): # currently all models are reading traces with DMA
+                if not self.dig.features['dma']:
                     self.getTracesNonDMA()
                 else:
                     self.getTracesDMA(hardware_trig=self.isHardwareTrig(options))
+            if quant.name in self.lDemodNames:
+                return self.getDemodulatedValue(quant)
             indx = self.lSignalNames.index(quant.name)
             # return correct data
             value = quant.getTraceDict(self.lTrace[indx], dt=self.dt)
@@ -77,10 +101,11 @@ class Driver(InstrumentDriver.InstrumentWorker):
     def performArm(self, quant_names, options={}):
         """Perform the instrument arm operation"""
         # arming is only implemented for DMA reaoud
-        if self.getModel() in ('',): # currently all models are reading traces with DMA
+        if not self.dig.features['dma']:
             return
         # make sure we are arming for reading traces, if not return
-        signals = [name in self.lSignalNames for name in quant_names]
+        signals = [name in self.lSignalNames or name in self.lDemodNames
+                   for name in quant_names]
         if not np.any(signals):
             return
         # get config
@@ -129,6 +154,7 @@ class Driver(InstrumentDriver.InstrumentWorker):
             nBuffer = int(self.getValue('Records per Buffer'))
             nMemSize = int(self.getValue('Max buffer size'))
             nMaxBuffer = int(self.getValue('Max number of buffers'))
+            bSumBuffers = bool(self.getValue('Sum of buffer averages'))
             # show status before starting acquisition
             self.reportStatus('Digitizer - Waiting for signal')
             # get data
@@ -139,7 +165,8 @@ class Driver(InstrumentDriver.InstrumentWorker):
                            funcProgress=self._callbackProgress,
                            firstTimeout=self.dComCfg['Timeout'] + 180.0,
                            bufferSize=nMemSize,
-                           maxBuffers=nMaxBuffer)
+                           maxBuffers=nMaxBuffer,
+                           bSumBuffers=bSumBuffers)
             # re-shape data and place in trace buffer
             self.lTrace[0] = vCh1.reshape((n_seq, nSample))
             self.lTrace[1] = vCh2.reshape((n_seq, nSample))
@@ -152,6 +179,7 @@ class Driver(InstrumentDriver.InstrumentWorker):
 
     def setConfiguration(self):
         """Set digitizer configuration based on driver settings"""
+        features = self.dig.features
         # clock configuration
         SourceId = int(self.getCmdStringFromValue('Clock source'))
         if self.getValue('Clock source') == 'Internal':
@@ -161,7 +189,8 @@ class Driver(InstrumentDriver.InstrumentWorker):
                      1E6, 2E6, 5E6, 10E6, 20E6, 50E6, 100E6, 200E6, 500E6, 1E9,
                      1.2E9, 1.5E9, 2E9, 2.4E9, 3E9, 3.6E9, 4E9]
             Decimation = 0
-        elif self.getValue('Clock source') == '10 MHz Reference' and self.getModel() in ('9373','9360'):
+        elif (self.getValue('Clock source') == '10 MHz Reference' and
+              features['refClockRate']):
             # 10 MHz ref, for 9373 - decimation is 1
             #for now don't allow DES mode; talk to Simon about best implementation
             lFreq = [1E3, 2E3, 5E3, 10E3, 20E3, 50E3, 100E3, 200E3, 500E3,
@@ -183,7 +212,7 @@ class Driver(InstrumentDriver.InstrumentWorker):
         for n in range(2):
             if self.getValue('Ch%d - Enabled' % (n+1)):
                 # coupling and range
-                if self.getModel() in ('9373', '9360'):
+                if not features['inputControl']:
                     # these options are not available for these models, set to default
                     Coupling = 2
                     InputRange = 7
@@ -195,7 +224,7 @@ class Driver(InstrumentDriver.InstrumentWorker):
                 #set coupling, input range, impedance
                 self.dig.AlazarInputControl(n + 1, Coupling, InputRange, Impedance)
                 # bandwidth limit, currently no model with this option supported
-                if self.getModel() in ('',):
+                if features['bandwidthLimit']:
                     BW = int(self.getValue('Ch%d - Bandwidth limit' % (n + 1)))
                     self.dig.AlazarSetBWLimit(n + 1, BW)
         #
@@ -212,12 +241,8 @@ class Driver(InstrumentDriver.InstrumentWorker):
         elif self.getValue('Trig source') == 'Channel 2':
             maxLevel = vAmp[self.getValueIndex('Ch2 - Range')]
         elif self.getValue('Trig source') == 'External':
-            if self.getModel() in ('9373', '9360'):
-                maxLevel = 2.5
-                ExtTrigRange = 3  # 2V5-50OHM range
-            else:
-                maxLevel = 5.0
-                ExtTrigRange = 0  # 5V-50OHM range
+            # 2V5-50OHM range for 9373/9360, 5V-50OHM range for 9870
+            (ExtTrigRange, maxLevel) = features['extTrigRange']
         elif self.getValue('Trig source') == 'Immediate':
             maxLevel = 5.0
             # set timeout to very short with immediate triggering
@@ -239,7 +264,7 @@ class Driver(InstrumentDriver.InstrumentWorker):
         self.dig.AlazarSetTriggerDelay(Delay)
         self.dig.AlazarSetTriggerTimeOut(time=timeout)
         # config memeory buffers, only possible for cards using DMA read
-        if self.getModel() not in ('9360', '9373', '9870'):
+        if not features['dma']:
             return
         bGetCh1 = bool(self.getValue('Ch1 - Enabled'))
         bGetCh2 = bool(self.getValue('Ch2 - Enabled'))
@@ -270,13 +295,80 @@ class Driver(InstrumentDriver.InstrumentWorker):
         nMaxBuffer = int(self.getValue('Max number of buffers'))
         # in hardware trig mode, there is no noed to re-arm the card
         bArm = not hardware_trig
+        rawPath = self.getRawPath()
+        if self.getValue('Acquisition mode') == 'Single-shot demodulation':
+            # demodulate each record, without returning traces
+            self.mShots = self.dig.readTracesDMA(bGetCh1, bGetCh2,
+                                   nPostSize, nRecord, nBuffer, nAverage,
+                                   bConfig=False, bArm=bArm, bMeasure=True,
+                                   funcStop=self.isStopped,
+                                   bufferSize=nMemSize,
+                                   maxBuffers=nMaxBuffer,
+                                   demodulator=self.getDemodulator(),
+                                   rawPath=rawPath,
+                                   rawMetadata=self.getRawMetadata())
+            return
         # get data
         self.lTrace[0], self.lTrace[1] = self.dig.readTracesDMA(bGetCh1, bGetCh2,
                                          nPostSize, nRecord, nBuffer, nAverage,
                                          bConfig=False, bArm=bArm, bMeasure=True,
                                          funcStop=self.isStopped,
                                          bufferSize=nMemSize,
-                                         maxBuffers=nMaxBuffer)
+                                         maxBuffers=nMaxBuffer,
+                                         rawPath=rawPath,
+                                         rawMetadata=self.getRawMetadata(),
+                                         bSumBuffers=bool(self.getValue(
+                                             'Sum of buffer averages')))
+
+    def getDemodulator(self):
+        """Create demodulator for the qubits in use"""
+        nQubit = self.getValueIndex('Number of qubits') + 1
+        lFreq, lSkip, lLength, lInput = [], [], [], []
+        for n in range(nQubit):
+            lFreq.append(self.getValue('Demodulation frequency #%d' % (n + 1)))
+            lSkip.append(self.getValue('Demodulation skip #%d' % (n + 1)))
+            lLength.append(self.getValue('Demodulation length #%d' % (n + 1)))
+            lInput.append(int(self.getCmdStringFromValue(
+                'Demodulation input #%d' % (n + 1))))
+        return Demodulator(self.dt, lFreq, lSkip, lLength, lInput)
+
+
+    def getDemodulatedValue(self, quant):
+        """Get single-shot or averaged value of a demodulated qubit"""
+        n = int(quant.name.split(', QB')[1]) - 1
+        if n < self.mShots.shape[1]:
+            vShots = self.mShots[:, n]
+        else:
+            # qubit not in use
+            vShots = np.array([], dtype=complex)
+        if quant.name.startswith('Single-shot, QB'):
+            return vShots
+        return np.mean(vShots) if len(vShots) > 0 else 0j
+
+
+    def getRawPath(self):
+        """Get path of the next raw record file, None if not saving records"""
+        if not self.getValue('Save raw records'):
+            return None
+        path = self.getValue('Raw records file')
+        if not path:
+            raise Error('No file given for saving raw records.')
+        # number the files, without overwriting old ones
+        (base, ext) = os.path.splitext(path)
+        while True:
+            rawPath = '%s_%05d%s' % (base, self.nRawFile, ext or '.bin')
+            self.nRawFile += 1
+            if not os.path.exists(rawPath):
+                return rawPath
+
+
+    def getRawMetadata(self):
+        """Get acquisition settings stored with raw record files"""
+        return {'sampleRate': 1 / self.dt,
+                'trigDelay': self.getValue('Trig delay'),
+                'trigSource': self.getValue('Trig source'),
+                'model': self.dig.model}
+
 
     def getTracesNonDMA(self):
         """Resample the data"""
@@ -295,25 +387,29 @@ class Driver(InstrumentDriver.InstrumentWorker):
         self.dig.AlazarSetRecordCount(nRecord, nAverage)
         # start aquisition
         self.dig.AlazarStartCapture()
-        nTry = self.dComCfg['Timeout']/0.05
-        while nTry > 0 and self.dig.AlazarBusy() and not self.isStopped():
-            # sleep for a while to save resources, then try again
-            self.wait(0.050)
-            nTry -= 1
-        # check if timeout occurred
-        if nTry <= 0:
-            self.dig.AlazarAbortCapture()
-            raise Error('Acquisition timed out')
-        # check if user stopped
-        if self.isStopped():
+        # wait for the expected capture time, then poll until done
+        if not self.dig.waitCapture(nRecord * nAverage,
+                                    timeout=self.dComCfg['Timeout'],
+                                    funcStop=self.isStopped):
+            # user stopped
             self.dig.AlazarAbortCapture()
             return
 
         # read data for channels in use
-        if bGetCh1:
-            self.lTrace[0] = self.dig.readTraces(1)
-        if bGetCh2:
-            self.lTrace[1] = self.dig.readTraces(2)
+        rawPath = self.getRawPath()
+        rawFile = None
+        if rawPath:
+            channels = [ch for ch in (1, 2) if (bGetCh1, bGetCh2)[ch - 1]]
+            rawFile = self.dig.openRawFile(rawPath, channels,
+                                           self.getRawMetadata())
+        try:
+            if bGetCh1:
+                self.lTrace[0] = self.dig.readTraces(1, rawFile)
+            if bGetCh2:
+                self.lTrace[1] = self.dig.readTraces(2, rawFile)
+        finally:
+            if rawFile is not None:
+                rawFile.close(1)
 
 
 
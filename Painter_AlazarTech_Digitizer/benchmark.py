@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""Benchmark of the averaging of DMA buffers and of single-record reads.
+
+Compares the CPU time per DMA buffer of the integer accumulation used by
+`readTracesDMA` with the previous float averaging, which converted each
+buffer to float and added its mean to the result. The buffers are created by
+the simulated board, so no hardware is needed::
+
+    python benchmark.py
+    python benchmark.py --records 1000000
+
+Each run also checks that the integer accumulation is bit-identical to the
+exact average, and reports how far the float averaging drifted from it.
+
+With ``--non-dma``, single-record acquisitions on the simulated board are
+timed instead, comparing `waitCapture` and `readTraces` with the previous
+polling of AlazarBusy every 50 ms and conversion of each record. The latency
+is the time from the last trigger until the traces are returned.
+"""
+import argparse
+import ctypes
+import time
+
+import numpy as np
+
+from AlazarTech_Digitizer_Simulator import SimulatedATSApi
+from AlazarTech_Digitizer_Wrapper import AlazarTechDigitizer, getAccumulatorType
+
+# bits per sample, number of channels, records per buffer, samples per record
+WORKLOADS = {
+    '8bit_2ch_128x1024': (8, 2, 128, 1024),
+    '8bit_1ch_1000x4096': (8, 1, 1000, 4096),
+    '12bit_2ch_128x1024': (12, 2, 128, 1024),
+    '12bit_2ch_16x8192': (12, 2, 16, 8192),
+}
+
+# single-record acquisitions: records, averages, samples per record
+NON_DMA_WORKLOADS = {
+    '1x1000x1024': (1, 1000, 1024),
+    '10x100x1024': (10, 100, 1024),
+    '4x50x8192': (4, 50, 8192),
+}
+
+
+def getBuffers(bitsPerSample, nChannel, nRecord, nSample, nBuffer=4):
+    """Get buffers of simulated noise, with shape (channels, records, samples)"""
+    dll = SimulatedATSApi(bitsPerSample=bitsPerSample, nTemplate=nBuffer)
+    channels = 3 if nChannel == 2 else 1
+    dll.AlazarBeforeAsyncRead(1, channels, 0, nSample, nRecord,
+                              nRecord * nBuffer, 0)
+    return [dll._getBufferData(n).reshape((nChannel, nRecord, nSample))
+            for n in range(nBuffer)]
+
+
+def averageFloat(buffers, nBuffer, scale, offset):
+    """Previous averaging, float mean of each buffer added to result"""
+    vData = np.zeros(buffers[0].shape[::2])
+    for n in range(nBuffer):
+        rs = buffers[n % len(buffers)]
+        for ch in range(rs.shape[0]):
+            vData[ch] += scale * (np.mean(rs[ch], axis=0) - offset)
+    # normalize to number of buffers, to get the average
+    return vData / nBuffer
+
+
+def averageInteger(buffers, nBuffer, scale, offset):
+    """Integer sum of the codes, converted to voltages at the end"""
+    (nChannel, nRecord, nSample) = buffers[0].shape
+    mSum = np.zeros((nChannel, nSample), dtype=np.int64)
+    mBufferSum = np.empty((nChannel, nSample),
+                          dtype=getAccumulatorType(buffers[0].dtype, nRecord))
+    for n in range(nBuffer):
+        np.add.reduce(buffers[n % len(buffers)], axis=1,
+                      dtype=mBufferSum.dtype, out=mBufferSum)
+        mSum += mBufferSum
+    return scale * (mSum / (nBuffer * nRecord) - offset)
+
+
+def averageExact(buffers, nBuffer, scale, offset):
+    """Reference average, from the exact sum of all buffers"""
+    nRecord = buffers[0].shape[1]
+    # each buffer is used a whole number of times
+    counts = [len(range(n, nBuffer, len(buffers))) for n in range(len(buffers))]
+    mSum = sum(int(count) * buf.sum(axis=1, dtype=np.int64)
+               for count, buf in zip(counts, buffers))
+    return scale * (mSum / (nBuffer * nRecord) - offset)
+
+
+def runWorkload(name, nRecordTotal, repeat):
+    """Time both averaging methods, return CPU time per buffer and errors"""
+    (bitsPerSample, nChannel, nRecord, nSample) = WORKLOADS[name]
+    buffers = getBuffers(bitsPerSample, nChannel, nRecord, nSample)
+    nBuffer = max(1, nRecordTotal // nRecord)
+    codeZero = 2 ** (float(bitsPerSample) - 1) - 0.5
+    scale = 0.4 / codeZero
+    result = {}
+    for method in (averageFloat, averageInteger):
+        lTime = []
+        for n in range(repeat):
+            t0 = time.process_time()
+            vData = method(buffers, nBuffer, scale, codeZero)
+            lTime.append(time.process_time() - t0)
+        result[method.__name__] = (min(lTime) / nBuffer, vData)
+    vExact = averageExact(buffers, nBuffer, scale, codeZero)
+    return (nBuffer,
+            result['averageFloat'][0], result['averageInteger'][0],
+            np.max(np.abs(result['averageFloat'][1] - vExact)),
+            np.array_equal(result['averageInteger'][1], vExact))
+
+
+def readTracesPrevious(dig, channel):
+    """Previous single-record read, each record converted and added"""
+    samplesPerRecord = dig.nPreSize + dig.nPostSize
+    dataBuffer = (ctypes.c_uint8 * (samplesPerRecord + 16))()
+    codeZero = 2 ** (float(dig.bitsPerSample) - 1) - 0.5
+    voltScale = dig.dRange[channel] / codeZero
+    vData = np.zeros(samplesPerRecord * dig.nRecord, dtype=float)
+    for n1 in range(dig.nRecord):
+        for n2 in range(dig.nAverage):
+            dig.AlazarRead(channel, dataBuffer, 1,
+                           n2 + dig.nAverage * n1 + 1, -dig.nPreSize,
+                           samplesPerRecord)
+            codes = np.frombuffer(dataBuffer, dtype=np.uint8,
+                                  count=samplesPerRecord)
+            vData[(n1 * samplesPerRecord):((n1 + 1) * samplesPerRecord)] += \
+                voltScale * (codes - codeZero)
+    return vData / float(dig.nAverage)
+
+
+def acquirePrevious(dig, nRecordTotal):
+    """Previous single-record acquisition, polling every 50 ms"""
+    dig.AlazarStartCapture()
+    nTry = dig.timeout / 0.05
+    while nTry > 0 and dig.AlazarBusy():
+        time.sleep(0.050)
+        nTry -= 1
+    tRead = time.perf_counter()
+    return tRead, [readTracesPrevious(dig, ch) for ch in (1, 2)]
+
+
+def acquire(dig, nRecordTotal):
+    """Single-record acquisition with waitCapture and bulk reads"""
+    dig.AlazarStartCapture()
+    dig.waitCapture(nRecordTotal)
+    tRead = time.perf_counter()
+    return tRead, [dig.readTraces(ch) for ch in (1, 2)]
+
+
+def runNonDMA(name, triggerRate, repeat):
+    """Time single-record acquisitions, return latency and read throughput"""
+    (nRecord, nAverage, nSample) = NON_DMA_WORKLOADS[name]
+    dll = SimulatedATSApi(triggerRate=triggerRate)
+    dig = AlazarTechDigitizer(dll=dll)
+    dig.AlazarSetRecordSize(0, nSample)
+    dig.AlazarSetRecordCount(nRecord, nAverage)
+    nRecordTotal = nRecord * nAverage
+    result = {}
+    for method in (acquirePrevious, acquire):
+        lWait, lLatency, lRate = [], [], []
+        # first acquisition measures the trigger period
+        for n in range(repeat + 1):
+            tRead, vData = method(dig, nRecordTotal)
+            tDone = time.perf_counter()
+            tTrig = dll.getRecordTime(nRecordTotal - 1)
+            lWait.append(tRead - tTrig)
+            lLatency.append(tDone - tTrig)
+            lRate.append(2 * nRecordTotal / (tDone - tRead))
+        result[method.__name__] = (np.median(lWait[1:]),
+                                   np.median(lLatency[1:]),
+                                   np.median(lRate[1:]), vData)
+    (vPrevious, vNew) = (result['acquirePrevious'][3], result['acquire'][3])
+    same = all(np.allclose(a, b, rtol=0, atol=1E-12)
+               for a, b in zip(vPrevious, vNew))
+    return (nRecordTotal, result['acquirePrevious'][:3],
+            result['acquire'][:3], same)
+
+
+def mainNonDMA(args):
+    """Run benchmark of single-record acquisitions, return exit code."""
+    bSame = True
+    print('%-12s %8s %17s %17s %19s %5s' % (
+        'workload', 'records', 'wait [ms]', 'latency [ms]',
+        'read [rec/s]', 'same'))
+    print('%-12s %8s %8s %8s %8s %8s %9s %9s' % (
+        '', '', 'old', 'new', 'old', 'new', 'old', 'new'))
+    names = [name for name in args.workload or NON_DMA_WORKLOADS
+             if name in NON_DMA_WORKLOADS]
+    for name in names:
+        (nRecordTotal, old, new, same) = runNonDMA(
+            name, args.trigger_rate, args.repeat)
+        bSame = bSame and same
+        print('%-12s %8d %8.2f %8.2f %8.2f %8.2f %9.0f %9.0f %5s' % (
+            name, nRecordTotal, old[0] * 1E3, new[0] * 1E3, old[1] * 1E3,
+            new[1] * 1E3, old[2], new[2], same))
+    return 0 if bSame else 1
+
+
+def main(argv=None):
+    """Run benchmark from the command line, return exit code."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the averaging of Alazar DMA buffers.')
+    parser.add_argument('-w', '--workload', action='append',
+                        choices=list(WORKLOADS) + list(NON_DMA_WORKLOADS),
+                        help='workload to run, can be repeated '
+                             '(default: all)')
+    parser.add_argument('-n', '--records', type=int, default=100000,
+                        help='number of averaged records per workload '
+                             '(default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of timed runs per workload '
+                             '(default: %(default)s)')
+    parser.add_argument('--non-dma', action='store_true',
+                        help='time single-record acquisitions instead')
+    parser.add_argument('-t', '--trigger-rate', type=float, default=10E3,
+                        help='trigger rate of single-record acquisitions, '
+                             'in Hz (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.non_dma:
+        return mainNonDMA(args)
+    bExact = True
+    print('%-20s %8s %12s %12s %8s %12s %6s' % (
+        'workload', 'buffers', 'float [us]', 'int [us]', 'speedup',
+        'float drift', 'exact'))
+    for name in [name for name in args.workload or WORKLOADS
+                 if name in WORKLOADS]:
+        (nBuffer, tFloat, tInt, drift, exact) = runWorkload(
+            name, args.records, args.repeat)
+        bExact = bExact and exact
+        print('%-20s %8d %12.1f %12.1f %7.2fx %12.3g %6s' % (
+            name, nBuffer, tFloat * 1E6, tInt * 1E6, tFloat / tInt, drift,
+            exact))
+    return 0 if bExact else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
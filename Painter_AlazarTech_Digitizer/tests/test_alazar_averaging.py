@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from AlazarTech_Digitizer_Simulator import ScriptedSource, SimulatedATSApi
+from AlazarTech_Digitizer_Wrapper import (AlazarTechDigitizer,
+                                          getAccumulatorType)
+
+# input beyond the 400 mV range, clipped to the highest and lowest code
+FULL_SCALE = ScriptedSource({1: [[1.0] * 128], 2: [[-1.0] * 128]})
+
+
+def get_digitizer(bitsPerSample=8, source=FULL_SCALE):
+    dll = SimulatedATSApi(triggerRate=1E7, bitsPerSample=bitsPerSample,
+                          source=source)
+    return AlazarTechDigitizer(dll=dll, timeout=5.0)
+
+
+def assert_full_scale(dig, vData, factor=1):
+    """Check that channel 1 is at the highest code, channel 2 at the lowest"""
+    codeZero = 2 ** (float(dig.bitsPerSample) - 1) - 0.5
+    scale = 0.4 / codeZero
+    # exact average of the codes, without rounding errors
+    assert np.all(vData[0] == factor * (scale * codeZero))
+    assert np.all(vData[1] == factor * (scale * -codeZero))
+
+
+@pytest.mark.parametrize('dtype,nSum,accType', [
+    (np.uint8, 1, np.uint16), (np.uint8, 257, np.uint16),
+    (np.uint8, 258, np.uint32), (np.uint8, 16843009, np.uint32),
+    (np.uint8, 16843010, np.uint64), (np.uint16, 1, np.uint16),
+    (np.uint16, 2, np.uint32), (np.uint16, 65537, np.uint32),
+    (np.uint16, 65538, np.uint64)])
+def test_accumulator_type(dtype, nSum, accType):
+    assert getAccumulatorType(dtype, nSum) is accType
+    # largest sum of nSum samples fits
+    assert int(np.iinfo(dtype).max) * nSum <= np.iinfo(accType).max
+
+
+@pytest.mark.parametrize('bitsPerSample', [8, 12])
+@pytest.mark.parametrize('nBuffer', [1, 2, 256, 257, 258])
+def test_full_scale_buffer_sum(bitsPerSample, nBuffer):
+    # records per buffer at the limits of the accumulator of a buffer
+    dig = get_digitizer(bitsPerSample)
+    vData = dig.readTracesDMA(True, True, 128, 1, nBuffer, 5 * nBuffer + 3)
+    assert_full_scale(dig, vData)
+
+
+def test_full_scale_beyond_uint32():
+    # sum of the 12-bit codes of all records is larger than 2**32
+    dig = get_digitizer(12)
+    nAverage = 1100000
+    assert 4095 * nAverage > 2**32
+    vData = dig.readTracesDMA(True, True, 128, 1, 4096, nAverage)
+    assert_full_scale(dig, vData)
+    # same with the previous scaling, times the number of buffers
+    vData = dig.readTracesDMA(True, True, 128, 1, 4096, nAverage,
+                              bSumBuffers=True)
+    assert_full_scale(dig, vData, factor=269)
+
+
+def test_maximum_acquisition():
+    # the record count of the board is a U32, so the int64 sum of an
+    # acquisition with the largest record count and codes cannot overflow,
+    # and is converted to float exactly
+    nMax = 2**32 - 1
+    maxSum = int(np.iinfo(np.uint16).max) * nMax
+    assert maxSum < np.iinfo(np.int64).max
+    assert maxSum < 2**53
+    assert float(np.int64(maxSum)) == maxSum
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from AlazarTech_Digitizer_Demodulation import (INPUT_CH1, INPUT_CH2, INPUT_IQ,
+                                               Demodulator)
+from AlazarTech_Digitizer_Simulator import IQBlobSource, SimulatedATSApi
+from AlazarTech_Digitizer_Wrapper import AlazarTechDigitizer
+
+DT = 1E-9
+FREQUENCIES = [50E6, 120E6, -80E6]
+# demodulated amplitude of each state of each qubit, in volts
+AMPLITUDES = [[0.1, -0.1 + 0.05j], [0.05j, 0.08, -0.04 - 0.04j],
+              [0.06, -0.06]]
+NOISE = 0.01
+
+
+def get_digitizer(source):
+    dll = SimulatedATSApi(triggerRate=1E6, bitsPerSample=12, source=source,
+                          nTemplate=0)
+    dig = AlazarTechDigitizer(dll=dll, timeout=5.0)
+    for channel in (1, 2):
+        # 400 mV range
+        dig.AlazarInputControl(channel, 2, 7, 2)
+    dig.AlazarSetTriggerOperation(0, 0, 1, 1, 128)
+    return dig
+
+
+def get_source(iq=False, nRecord=2000):
+    return IQBlobSource(DT, FREQUENCIES, AMPLITUDES, noise=NOISE, iq=iq,
+                        nRecord=nRecord, seed=1)
+
+
+def classify(vShots, source):
+    """State of each qubit in each record, from the closest blob"""
+    return np.stack([np.argmin(np.abs(vShots[:, n, np.newaxis] -
+                                      source.amplitudes[n]), axis=1)
+                     for n in range(vShots.shape[1])], axis=1)
+
+
+@pytest.mark.parametrize('iq', [False, True])
+def test_blobs(iq):
+    source = get_source(iq)
+    dig = get_digitizer(source)
+    inputs = INPUT_IQ if iq else [INPUT_CH1, INPUT_CH2, INPUT_CH1]
+    demodulator = Demodulator(DT, FREQUENCIES, 0.0, 1E-6, inputs)
+    # records not fitting evenly in the buffers
+    vShots = dig.readTracesDMA(True, True, 1024, 1, 128, 2000,
+                               demodulator=demodulator)
+    assert vShots.shape == (2000, 3)
+    vExpected = source.getAmplitudes(0, 2000)
+    # noise of the trapezoidal integration of 1001 samples
+    sigma = NOISE * np.sqrt(2 / 1000) * (1 if iq else np.sqrt(2))
+    assert np.std(vShots - vExpected) < 1.5 * sigma
+    assert np.max(np.abs(vShots - vExpected)) < 6 * sigma
+    assert np.array_equal(classify(vShots, source), source.getStates(0, 2000))
+
+
+def test_records_and_averages():
+    source = get_source(nRecord=500)
+    dig = get_digitizer(source)
+    demodulator = Demodulator(DT, FREQUENCIES[:2], [0.0, 2E-7],
+                              [8E-7, 5E-7])
+    vShots = dig.readTracesDMA(True, False, 1024, 10, 128, 50,
+                               demodulator=demodulator)
+    # records in the order they were acquired
+    assert vShots.shape == (500, 2)
+    states = source.getStates(0, 500)[:, :2]
+    assert np.array_equal(classify(vShots, source), states)
+
+
+def test_histograms():
+    source = get_source()
+    dig = get_digitizer(source)
+    demodulator = Demodulator(DT, FREQUENCIES, 0.0, 1E-6, INPUT_CH1)
+    (vShots, lHistogram) = dig.readTracesDMA(True, False, 1024, 1, 128, 2000,
+                                             demodulator=demodulator,
+                                             histogramBins=40)
+    assert vShots.shape == (2000, 3)
+    assert len(lHistogram) == 3
+    states = source.getStates(0, 2000)
+    for n, (counts, vEdgeI, vEdgeQ) in enumerate(lHistogram):
+        assert counts.shape == (40, 40)
+        assert counts.sum() == 2000
+        assert np.array_equal(counts, np.histogram2d(
+            vShots[:, n].real, vShots[:, n].imag, bins=40)[0])
+        # counts are close to the blobs, with the population of their state
+        vCenter = ((vEdgeI[:-1] + vEdgeI[1:])[:, np.newaxis] / 2 +
+                   1j * (vEdgeQ[:-1] + vEdgeQ[1:])[np.newaxis, :] / 2)
+        for m, amplitude in enumerate(source.amplitudes[n]):
+            nBlob = counts[np.abs(vCenter - amplitude) < 0.015].sum()
+            assert nBlob == np.sum(states[:, n] == m)
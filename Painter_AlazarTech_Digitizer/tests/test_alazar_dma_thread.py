@@ -0,0 +1,168 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from AlazarTech_Digitizer_Simulator import (ApiFailed, ScriptedSource,
+                                            SimulatedATSApi)
+from AlazarTech_Digitizer_Wrapper import AlazarTechDigitizer, Error
+
+# arguments of readTracesDMA: bGetCh1, bGetCh2, nSamples, nRecord, nBuffer,
+# nAverage, with records not fitting evenly in the buffers
+DMA_CASES = [(True, True, 256, 1, 64, 1000),
+             (True, False, 512, 8, 100, 50),
+             (False, True, 128, 3, 100, 7)]
+
+
+def get_digitizer(triggerRate=1E5, **kwargs):
+    dll = SimulatedATSApi(triggerRate=triggerRate, bitsPerSample=12,
+                          nTemplate=0, **kwargs)
+    return AlazarTechDigitizer(dll=dll, timeout=5.0)
+
+
+def readTracesSynchronous(dig, bGetCh1, bGetCh2, nSamples, nRecord, nBuffer,
+                          nAverage):
+    """DMA acquisition with wait, averaging and re-post in the same thread,
+    as before the producer thread"""
+    dig.readTracesDMA(bGetCh1, bGetCh2, nSamples, nRecord, nBuffer, nAverage,
+                      bMeasure=False)
+    lCh = [ch for ch in (1, 2) if (bGetCh1, bGetCh2)[ch - 1]]
+    recordsPerBuffer = nRecord if nRecord > 1 else nBuffer
+    nBufferTotal = -(-nRecord * nAverage // recordsPerBuffer)
+    recordsPerBuffer = min(recordsPerBuffer, nRecord * nAverage)
+    nAvPerBuffer = recordsPerBuffer // nRecord
+    mSum = np.zeros((len(lCh), nRecord * nSamples), dtype=np.int64)
+    nAvDone = 0
+    for n in range(nBufferTotal):
+        buf = dig.buffers[n % len(dig.buffers)]
+        dig.AlazarWaitAsyncBufferComplete(buf.addr, timeout_ms=5000)
+        rs = buf.buffer[:len(lCh) * recordsPerBuffer * nSamples].reshape(
+            (len(lCh), nAvPerBuffer, nRecord * nSamples))
+        nUse = min(nAvPerBuffer, nAverage - nAvDone)
+        mSum += rs[:, :nUse].sum(axis=1, dtype=np.int64)
+        nAvDone += nUse
+        dig.AlazarPostAsyncBuffer(buf.addr, buf.size_bytes)
+    dig.AlazarAbortAsyncRead()
+    codeZero = 2 ** (float(dig.bitsPerSample) - 1) - 0.5
+    vData = [np.zeros(nRecord * nSamples), np.zeros(nRecord * nSamples)]
+    for n, ch in enumerate(lCh):
+        vData[ch - 1] = (dig.dRange[ch] / codeZero *
+                         (mSum[n] / nAvDone - codeZero))
+    return vData
+
+
+def get_threads():
+    """Threads running now, to check that none are left behind"""
+    return set(threading.enumerate())
+
+
+@pytest.mark.parametrize('queueSize', [1, 2, 8])
+@pytest.mark.parametrize('args', DMA_CASES)
+def test_identical_to_synchronous(args, queueSize):
+    dig = get_digitizer()
+    reference = readTracesSynchronous(dig, *args)
+    threads = get_threads()
+    vData = dig.readTracesDMA(*args[:5], nAverage=args[5],
+                              queueSize=queueSize)
+    assert get_threads() == threads
+    for x, y in zip(vData, reference):
+        assert x.shape == y.shape
+        assert np.array_equal(x, y)
+    assert dig.dll.nOverflow == 0
+
+
+def test_slow_averaging_identical_to_synchronous():
+    # averaging slower than the triggers, the producer waits for free arrays
+    dig = get_digitizer(triggerRate=1E6)
+    args = DMA_CASES[0]
+    reference = readTracesSynchronous(dig, *args)
+    nProgress = [0]
+
+    def slowProgress(progress):
+        nProgress[0] += 1
+        time.sleep(0.002)
+    vData = dig.readTracesDMA(*args[:5], nAverage=args[5], queueSize=2,
+                              funcProgress=slowProgress)
+    assert nProgress[0] == 16
+    for x, y in zip(vData, reference):
+        assert np.array_equal(x, y)
+
+
+@pytest.mark.parametrize('delay', [0.0, 0.05])
+def test_stop_mid_acquisition(delay):
+    # one buffer every 10 ms, or waiting for slow triggers
+    dig = get_digitizer(triggerRate=1E4 if delay == 0 else 10)
+    source = ScriptedSource([[0.1] * 256])
+    dig.dll.source = source
+    stopped = threading.Event()
+    threads = get_threads()
+    # as performStop, set from another thread while waiting
+    timer = threading.Timer(delay, stopped.set)
+    if delay > 0:
+        timer.start()
+
+    def progress(value):
+        if value >= 0.3:
+            stopped.set()
+    t0 = time.perf_counter()
+    vData = dig.readTracesDMA(True, True, 256, 1, 100, 10000,
+                              funcStop=stopped.is_set, funcProgress=progress)
+    # stopped long before the 10000 records or the timeout
+    assert time.perf_counter() - t0 < 0.5
+    if delay > 0:
+        timer.join()
+    assert get_threads() == threads
+    assert not dig.dll.asyncMode
+    # the average of the records acquired until the stop
+    if delay == 0:
+        for x in vData:
+            assert np.allclose(x, 0.1, atol=1E-3)
+    # next acquisition is not affected
+    dig.dll.triggerRate = 1E5
+    args = DMA_CASES[0]
+    reference = readTracesSynchronous(dig, *args)
+    for x, y in zip(dig.readTracesDMA(*args[:5], nAverage=args[5]),
+                    reference):
+        assert np.array_equal(x, y)
+
+
+def test_thread_error_reaches_caller():
+    dig = get_digitizer()
+    wait = dig.dll.AlazarWaitAsyncBufferComplete.func
+    nCall = [0]
+
+    def failingWait(*args):
+        nCall[0] += 1
+        return ApiFailed if nCall[0] == 5 else wait(*args)
+    dig.dll.AlazarWaitAsyncBufferComplete.func = failingWait
+    threads = get_threads()
+    with pytest.raises(Error, match='ApiFailed'):
+        dig.readTracesDMA(True, True, 256, 1, 64, 1000)
+    assert nCall[0] == 5
+    assert get_threads() == threads
+    assert not dig.dll.asyncMode
+
+
+def test_thread_timeout_reaches_caller():
+    # no trigger within the timeout
+    dig = get_digitizer(triggerRate=1)
+    threads = get_threads()
+    t0 = time.perf_counter()
+    with pytest.raises(Error, match='ApiWaitTimeout'):
+        dig.readTracesDMA(True, False, 256, 1, 64, 1000, timeout=0.1)
+    assert time.perf_counter() - t0 < 0.5
+    assert get_threads() == threads
+
+
+def test_caller_error_stops_thread():
+    dig = get_digitizer(triggerRate=1E4)
+    threads = get_threads()
+
+    def failingProgress(value):
+        raise ValueError('progress failed')
+    with pytest.raises(ValueError, match='progress failed'):
+        dig.readTracesDMA(True, True, 256, 1, 64, 10000,
+                          funcProgress=failingProgress)
+    assert get_threads() == threads
+    assert not dig.dll.asyncMode
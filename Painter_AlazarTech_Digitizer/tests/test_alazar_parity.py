@@ -0,0 +1,226 @@
+import ctypes
+import ctypes.util
+import os
+import time
+import types
+
+import numpy as np
+import pytest
+
+import AlazarTech_Digitizer_Wrapper
+from AlazarTech_Digitizer_Simulator import SimulatedATSApi, _ApiFunction, _value
+
+# the two wrappers that were merged, as they were before the merge
+LEGACY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'legacy')
+LEGACY = {'original': 'AlazarTech_Digitizer_Wrapper',
+          'painter': 'Painter_AlazarTech_Digitizer_Wrapper'}
+
+# changes made when loading the legacy modules, so that they load on any
+# platform and Python 3.8+. The board is set as module variable DLL.
+PATCHES = [(', byref, windll', ', byref'),
+           ("ctypes.CDLL('ATSApi')", 'None'),
+           ("ctypes.CDLL(os.path.join(sPath, 'ATSApi'))", 'None'),
+           ('time.clock()', 'time.perf_counter()')]
+
+# public methods of the legacy wrappers, called by the tests below
+CALLED = {'testLED', 'getError', 'AlazarGetChannelInfo',
+          'AlazarSetCaptureClock', 'AlazarInputControl', 'AlazarSetBWLimit',
+          'AlazarSetTriggerOperation', 'AlazarSetExternalTrigger',
+          'AlazarSetTriggerDelay', 'AlazarSetTriggerTimeOut',
+          'AlazarSetRecordSize', 'AlazarSetRecordCount', 'AlazarStartCapture',
+          'AlazarAbortCapture', 'AlazarBusy', 'readTracesDMA',
+          'removeBuffersDMA', 'readTraces'}
+# and public methods called by readTracesDMA and readTraces
+CALLED_INDIRECTLY = {'callFunc', 'AlazarRead', 'AlazarBeforeAsyncRead',
+                     'AlazarAbortAsyncRead', 'AlazarPostAsyncBuffer',
+                     'AlazarWaitAsyncBufferComplete'}
+
+# arguments of readTracesDMA: bGetCh1, bGetCh2, nSamples, nRecord, nBuffer,
+# nAverage
+DMA_CASES = [(True, True, 1000, 1, 100, 400),
+             (True, False, 512, 8, 100, 50),
+             (False, True, 300, 1, 64, 1),
+             (True, True, 256, 4, 100, 1)]
+
+# records read one by one: the original wrapper and the unified one average
+# nAverage records for each of nRecord traces, the Painter copy averages
+# all records to a single trace
+RECORD_COUNT = {'original': (4, 5), 'painter': (20,)}
+RECORD_COUNT_UNIFIED = {'original': (4, 5), 'painter': (1, 20)}
+
+
+def load_legacy(name):
+    """Load a legacy wrapper from its source, with the patches applied"""
+    path = os.path.join(LEGACY_DIR, LEGACY[name] + '.py')
+    with open(path) as f:
+        source = f.read()
+    for old, new in PATCHES:
+        assert old in source
+        source = source.replace(old, new)
+    module = types.ModuleType('legacy_' + LEGACY[name])
+    module.__file__ = path
+    if os.name != 'nt':
+        # the DMA buffers are allocated with libc, which was not defined
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        libc.free.argtypes = [ctypes.c_void_p]
+        module.libc = libc
+    exec(compile(source, path, 'exec'), module.__dict__)
+    return module
+
+
+class RecordingATSApi(SimulatedATSApi):
+    """Simulated board keeping a log of the board calls and their arguments.
+
+    The DMA buffers are numbered in order of use in each acquisition, since
+    their addresses differ between runs.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.log = []
+        self.buffers = {}
+        for name in dir(self):
+            if name.startswith('Alazar'):
+                setattr(self, name, _ApiFunction(
+                    self._record(name, getattr(self, name).func)))
+
+    def _record(self, name, func):
+        def call(*args):
+            values = ['buffer' if isinstance(x, ctypes.Array)
+                      or type(x).__name__ == 'CArgObject' else _value(x)
+                      for x in args]
+            if name == 'AlazarBeforeAsyncRead':
+                self.buffers = {}
+            elif name in ('AlazarPostAsyncBuffer',
+                          'AlazarWaitAsyncBufferComplete'):
+                values[1] = self.buffers.setdefault(values[1],
+                                                    len(self.buffers))
+            elif name == 'AlazarRead':
+                # given as array or as address
+                values[2] = 'buffer'
+            # the board model is only read by the unified wrapper
+            if name != 'AlazarGetBoardKind':
+                # all calls except these take the board handle first
+                if name in ('AlazarNumOfSystems', 'AlazarGetBoardBySystemID',
+                            'AlazarErrorToText'):
+                    self.log.append((name, tuple(values)))
+                else:
+                    self.log.append((name, tuple(values[1:])))
+            return func(*args)
+        return call
+
+
+def run(dig, recordCount):
+    """Call the public methods of a wrapper, return outputs by name"""
+    out = {}
+    out['channelInfo'] = dig.AlazarGetChannelInfo()
+    dig.testLED()
+    dig.AlazarSetCaptureClock(1, 0x35, 0, 0)
+    dig.AlazarInputControl(1, 2, 7, 2)
+    dig.AlazarInputControl(2, 1, 10, 1)
+    out['dRange'] = dict(dig.dRange)
+    dig.AlazarSetBWLimit(1, 0)
+    dig.AlazarSetTriggerOperation(0, 0, 2, 1, 150)
+    dig.AlazarSetExternalTrigger(2, 3)
+    dig.AlazarSetTriggerDelay(10)
+    dig.AlazarSetTriggerTimeOut(0.5)
+    out['error'] = dig.getError(579)
+    out['busy'] = dig.AlazarBusy()
+    out['dma'] = [dig.readTracesDMA(*args[:5], nAverage=args[5])
+                  for args in DMA_CASES]
+    dig.AlazarSetRecordSize(0, 256)
+    dig.AlazarSetRecordCount(*recordCount)
+    dig.AlazarStartCapture()
+    # the legacy wrappers have no waitCapture
+    while dig.AlazarBusy():
+        time.sleep(0.001)
+    out['read'] = [dig.readTraces(1), dig.readTraces(2)]
+    dig.AlazarAbortCapture()
+    dig.removeBuffersDMA()
+    return out
+
+
+@pytest.fixture(scope='module', params=sorted(LEGACY))
+def results(request):
+    """Outputs and board calls of a legacy wrapper and the unified one"""
+    name = request.param
+    module = load_legacy(name)
+    module.DLL = RecordingATSApi(triggerRate=20E3)
+    legacy = run(module.AlazarTechDigitizer(), RECORD_COUNT[name])
+    dll = RecordingATSApi(triggerRate=20E3)
+    unified = run(AlazarTech_Digitizer_Wrapper.AlazarTechDigitizer(dll=dll),
+                  RECORD_COUNT_UNIFIED[name])
+    # same board data, with the previous scaling of averages
+    dig = AlazarTech_Digitizer_Wrapper.AlazarTechDigitizer(
+        dll=SimulatedATSApi(triggerRate=20E3))
+    dig.AlazarInputControl(1, 2, 7, 2)
+    dig.AlazarInputControl(2, 1, 10, 1)
+    unified['dmaSum'] = [dig.readTracesDMA(*args[:5], nAverage=args[5],
+                                           bSumBuffers=True)
+                         for args in DMA_CASES]
+    return (name, legacy, module.DLL.log, unified, dll.log)
+
+
+def get_buffers_per_acquisition(nRecord, nBuffer, nAverage):
+    """Number of DMA buffers of an acquisition, as in readTracesDMA"""
+    recordsPerBuffer = nRecord if nRecord > 1 else nBuffer
+    return int(np.ceil(nRecord * nAverage / recordsPerBuffer))
+
+
+@pytest.mark.parametrize('name', sorted(LEGACY))
+def test_legacy_methods_are_covered(name):
+    module = load_legacy(name)
+    methods = {x for x in vars(module.AlazarTechDigitizer)
+               if not x.startswith('_')}
+    assert methods == CALLED | CALLED_INDIRECTLY
+    for method in methods:
+        assert callable(getattr(AlazarTech_Digitizer_Wrapper.
+                                AlazarTechDigitizer, method))
+
+
+def test_same_board_calls(results):
+    (name, legacy, legacyLog, unified, unifiedLog) = results
+    # the DMA buffers are reused, but are posted in the same order
+    assert unifiedLog == legacyLog
+
+
+def test_same_settings(results):
+    (name, legacy, legacyLog, unified, unifiedLog) = results
+    for key in ('channelInfo', 'dRange', 'error', 'busy'):
+        assert unified[key] == legacy[key], key
+
+
+def test_same_single_record_traces(results):
+    (name, legacy, legacyLog, unified, unifiedLog) = results
+    for vLegacy, vUnified in zip(legacy['read'], unified['read']):
+        assert vUnified.shape == vLegacy.shape
+        assert np.allclose(vUnified, vLegacy, rtol=0, atol=1E-12)
+
+
+def test_dma_traces(results):
+    (name, legacy, legacyLog, unified, unifiedLog) = results
+    for args, lLegacy, lUnified in zip(DMA_CASES, legacy['dma'],
+                                       unified['dma']):
+        if name == 'original' and args[5] > 1:
+            # intentional difference: the original wrapper summed the mean
+            # of each DMA buffer without dividing by the number of buffers,
+            # the unified one averages all records
+            factor = get_buffers_per_acquisition(*args[3:])
+        else:
+            factor = 1
+        for vLegacy, vUnified in zip(lLegacy, lUnified):
+            assert vUnified.shape == vLegacy.shape
+            assert np.allclose(factor * vUnified, vLegacy, rtol=0, atol=1E-12)
+            # disabled channels are zero
+            if factor > 1 and np.any(vLegacy):
+                assert not np.allclose(vUnified, vLegacy, rtol=0, atol=1E-12)
+
+
+def test_dma_traces_sum_of_buffers(results):
+    (name, legacy, legacyLog, unified, unifiedLog) = results
+    if name != 'original':
+        pytest.skip('only the original wrapper summed the buffer averages')
+    for lLegacy, lUnified in zip(legacy['dma'], unified['dmaSum']):
+        for vLegacy, vUnified in zip(lLegacy, lUnified):
+            assert vUnified.shape == vLegacy.shape
+            assert np.allclose(vUnified, vLegacy, rtol=0, atol=1E-12)
@@ -0,0 +1,165 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from AlazarTech_Digitizer_RawFile import (LAYOUT_CONSECUTIVE, RawRecordFile,
+                                          RawRecordWriter, getSidecarPath)
+from AlazarTech_Digitizer_Simulator import SimulatedATSApi
+from AlazarTech_Digitizer_Wrapper import AlazarTechDigitizer
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+DRIVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# acquisition and read-back of a raw file, run with limited memory
+ACQUIRE_SCRIPT = '''
+import json, sys
+import numpy as np
+from AlazarTech_Digitizer_RawFile import RawRecordFile
+from AlazarTech_Digitizer_Simulator import SimulatedATSApi
+from AlazarTech_Digitizer_Wrapper import AlazarTechDigitizer
+(path, nAverage, chunkSize) = (sys.argv[1], int(sys.argv[2]),
+                               int(sys.argv[3]))
+dll = SimulatedATSApi(triggerRate=5E4, bitsPerSample=12)
+dig = AlazarTechDigitizer(dll=dll, timeout=10.0)
+(vCh1, vCh2) = dig.readTracesDMA(True, True, 1024, 1, 256, nAverage,
+                                 bufferSize=16, rawPath=path)
+f = RawRecordFile(path)
+# compare the records with the simulated data, one buffer at a time
+bSame = True
+for n in range(f.nBuffer):
+    vCodes = dll._getBufferData(n).reshape((2, 256, 1024))
+    for c, ch in enumerate((1, 2)):
+        bSame &= np.array_equal(
+            f.getCodes(ch, n * 256, (n + 1) * 256), vCodes[c])
+print(json.dumps({
+    'records': f.nRecordTotal,
+    'same_records': bool(bSame),
+    'same_average': [np.array_equal(f.getAverage(1, chunkSize), vCh1),
+                     np.array_equal(f.getAverage(2, chunkSize), vCh2)]}))
+'''
+
+
+def write_file(path, nBuffer=5, recordsPerBuffer=6, nRecord=3, nSample=100,
+               samplesPerRecord=128, layout='interleaved', completed=None,
+               seed=0):
+    """Write random 12-bit codes, return the codes of the written buffers"""
+    rng = np.random.default_rng(seed)
+    writer = RawRecordWriter(path, np.uint16, [1, 2], [0.4, 0.1], 12,
+                             nBuffer, recordsPerBuffer, samplesPerRecord,
+                             nSample, nRecord,
+                             nBuffer * recordsPerBuffer // nRecord,
+                             layout=layout, metadata={'sampleRate': 1E9})
+    if completed is None:
+        completed = nBuffer
+    codes = rng.integers(0, 4096, size=(completed, 2, recordsPerBuffer,
+                                        samplesPerRecord), dtype=np.uint16)
+    for n in range(completed):
+        # buffers are copied as flat arrays, as from the DMA buffers
+        writer.getBuffer(n)[:] = codes[n].reshape(-1)
+    writer.close(completed)
+    return codes
+
+
+def test_sidecar(tmp_path):
+    path = str(tmp_path / 'raw.bin')
+    write_file(path)
+    with open(getSidecarPath(path)) as f:
+        info = json.load(f)
+    assert info['channels'] == [1, 2]
+    assert info['ranges'] == [0.4, 0.1]
+    assert info['shape'] == [5, 2, 6, 128]
+    assert info['metadata'] == {'sampleRate': 1E9}
+    assert os.path.getsize(path) == 5 * 2 * 6 * 128 * 2
+
+
+@pytest.mark.parametrize('completed', [5, 3])
+def test_interleaved_read_back(tmp_path, completed):
+    path = str(tmp_path / 'raw.bin')
+    codes = write_file(path, completed=completed)
+    f = RawRecordFile(path)
+    assert f.nRecordTotal == completed * 6
+    for c, ch in enumerate((1, 2)):
+        # records in acquisition order, without alignment padding
+        vCodes = codes[:, c, :, :100].reshape((-1, 100))
+        assert np.array_equal(f.getCodes(ch), vCodes)
+        # ranges across buffer boundaries
+        assert np.array_equal(f.getCodes(ch, 4, 13), vCodes[4:13])
+        assert f.getCodes(ch, 10, 10).shape == (0, 100)
+        scale = f.info['ranges'][c] / 2047.5
+        assert np.array_equal(f.getRecords(ch, 2, 8),
+                              scale * (vCodes[2:8] - 2047.5))
+        # average of the records of each trace, in whole averages
+        nAverage = len(vCodes) // 3
+        mSum = vCodes[:3 * nAverage].reshape((nAverage, 3, 100)).sum(
+            axis=0, dtype=np.int64)
+        vAverage = scale * (mSum / nAverage - 2047.5)
+        for chunkSize in (1, 2 * 128 * 3 * 2, 1 << 20):
+            assert np.array_equal(f.getAverage(ch, chunkSize),
+                                  vAverage.reshape(-1))
+
+
+def test_consecutive_read_back(tmp_path):
+    path = str(tmp_path / 'raw.bin')
+    codes = write_file(path, nBuffer=1, recordsPerBuffer=20, nRecord=4,
+                       samplesPerRecord=100, layout=LAYOUT_CONSECUTIVE)
+    f = RawRecordFile(path)
+    for c, ch in enumerate((1, 2)):
+        mSum = codes[0, c].reshape((4, 5, 100)).sum(axis=1, dtype=np.int64)
+        vAverage = f.info['ranges'][c] / 2047.5 * (mSum / 5 - 2047.5)
+        for chunkSize in (1, 600, 1 << 20):
+            assert np.array_equal(f.getAverage(ch, chunkSize),
+                                  vAverage.reshape(-1))
+
+
+def test_single_record_read_back(tmp_path):
+    # records read one by one, as for boards without DMA
+    dll = SimulatedATSApi(triggerRate=1E5, bitsPerSample=12)
+    dig = AlazarTechDigitizer(dll=dll, timeout=5.0)
+    dig.AlazarSetRecordSize(0, 256)
+    dig.AlazarSetRecordCount(3, 20)
+    dig.AlazarStartCapture()
+    assert dig.waitCapture(60)
+    path = str(tmp_path / 'raw.bin')
+    rawFile = dig.openRawFile(path, [1, 2], {'sampleRate': 1E9})
+    lTrace = [dig.readTraces(ch, rawFile) for ch in (1, 2)]
+    rawFile.close(1)
+    f = RawRecordFile(path)
+    for ch, vTrace in zip((1, 2), lTrace):
+        assert np.array_equal(f.getCodes(ch), dig.readRecords(ch))
+        assert np.array_equal(f.getAverage(ch), vTrace)
+
+
+@pytest.mark.skipif(resource is None or not sys.platform.startswith('linux'),
+                    reason='needs a memory limit for the process')
+def test_dma_file_larger_than_memory_limit(tmp_path):
+    # 128 MB of records, with 64 MB of memory for the heap, the DMA buffers
+    # and the staging arrays. The file is memory-mapped, which does not
+    # count to the limit.
+    (nAverage, limit) = (32768, 64 * 2 ** 20)
+    path = str(tmp_path / 'raw.bin')
+
+    def set_limit():
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+
+    env = dict(os.environ, OPENBLAS_NUM_THREADS='1', OMP_NUM_THREADS='1')
+    result = subprocess.run(
+        [sys.executable, '-c', ACQUIRE_SCRIPT, path, str(nAverage),
+         str(8 * 2 ** 20)],
+        cwd=DRIVER_DIR, env=env, preexec_fn=set_limit,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    assert os.path.getsize(path) == nAverage * 2 * 1024 * 2 >= 2 * limit
+    output = json.loads(result.stdout)
+    assert output['records'] == nAverage
+    assert output['same_records']
+    assert output['same_average'] == [True, True]
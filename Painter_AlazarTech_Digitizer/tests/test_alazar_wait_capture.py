@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from AlazarTech_Digitizer_Simulator import SimulatedATSApi
+from AlazarTech_Digitizer_Wrapper import AlazarTechDigitizer, TimeoutError
+
+
+def get_digitizer(triggerRate=1E4):
+    dll = SimulatedATSApi(triggerRate=triggerRate, bitsPerSample=12)
+    dig = AlazarTechDigitizer(dll=dll, timeout=5.0)
+    dig.AlazarSetRecordSize(0, 256)
+    return dig
+
+
+def capture(dig, nRecord, delay=0.0):
+    """Capture records, with the first trigger late by delay, return time"""
+    # the trigger delay is in samples, at 1 GS/s
+    dig.AlazarSetTriggerDelay(int(delay * 1E9))
+    dig.AlazarSetRecordCount(nRecord)
+    dig.AlazarStartCapture()
+    t0 = time.perf_counter()
+    assert dig.waitCapture(nRecord)
+    return time.perf_counter() - t0
+
+
+def test_capture_after_late_trigger():
+    dig = get_digitizer()
+    capture(dig, 10)
+    period = dig.triggerPeriod
+    # the period measured with a late trigger is limited
+    assert capture(dig, 10, delay=0.5) >= 0.5
+    assert dig.triggerPeriod <= 2 * period
+    # done after 1 ms, the board is polled during the expected time
+    assert capture(dig, 10) < 0.05
+
+
+def test_first_capture_after_late_trigger():
+    dig = get_digitizer()
+    # no previous period to limit the measurement
+    capture(dig, 10, delay=0.3)
+    assert dig.triggerPeriod >= 0.03
+    assert capture(dig, 10) < 0.05
+
+
+def test_expected_time():
+    # records take 0.1 s, busy is only polled a few times per record
+    dig = get_digitizer(triggerRate=100)
+    capture(dig, 10)
+    nCall = [0]
+    busy = dig.AlazarBusy
+
+    def countBusy():
+        nCall[0] += 1
+        return busy()
+    dig.AlazarBusy = countBusy
+    assert capture(dig, 10) == pytest.approx(0.1, abs=0.03)
+    assert nCall[0] < 60
+
+
+def test_stop_and_timeout():
+    dig = get_digitizer(triggerRate=10)
+    dig.AlazarSetRecordCount(100)
+    dig.AlazarStartCapture()
+    assert not dig.waitCapture(100, funcStop=lambda: True)
+    dig.AlazarAbortCapture()
+    dig.AlazarStartCapture()
+    t0 = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        dig.waitCapture(100, timeout=0.1)
+    assert time.perf_counter() - t0 < 0.5
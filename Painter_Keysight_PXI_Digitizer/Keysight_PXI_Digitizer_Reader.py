@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""Background reading of digitizer channels, overlapping with averaging."""
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class Error(Exception):
+    pass
+
+
+class BufferPool:
+    """Buffers of the channel readers, kept between acquisitions.
+
+    The buffers are only reallocated when the size of the chunks or traces
+    changes, so repeated acquisitions with the same settings do not allocate
+    any memory for reading and averaging.
+
+    Parameters
+    ----------
+    nRing : int
+        Number of chunk buffers of each channel.
+
+    """
+
+    def __init__(self, nRing=4):
+        self.nRing = nRing
+        self.size = None
+        self.dBuffer = {}
+        # number of channels allocated, for testing
+        self.nAllocation = 0
+
+    def getBuffers(self, channel, nPoints, nTrace, nChunk):
+        """Get the buffers of a channel.
+
+        Parameters
+        ----------
+        channel : int
+            Digitizer channel.
+        nPoints : int
+            Number of points of the largest chunk.
+        nTrace : int
+            Number of points of the averaged records.
+        nChunk : int
+            Number of chunks of the acquisition.
+
+        Returns
+        -------
+        lArray : list of numpy array
+            Ring of int16 chunk buffers, for `ChannelReader`.
+        vSum : numpy array
+            Accumulator of the summed records, for `averageChunks`. None for
+            a single chunk, which needs no accumulator.
+
+        """
+        size = (int(nPoints), int(nTrace), max(1, min(self.nRing, nChunk)))
+        if size != self.size:
+            self.size = size
+            self.dBuffer = {}
+        if channel not in self.dBuffer:
+            self.dBuffer[channel] = (
+                [np.empty(size[0], dtype=np.int16) for n in range(size[2])],
+                np.zeros(size[1], dtype=np.int64) if nChunk > 1 else None)
+            self.nAllocation += 1
+        return self.dBuffer[channel]
+
+
+class ChannelReader(threading.Thread):
+    """Read the data of one digitizer channel in a background thread.
+
+    Chunks are read as soon as they are available into a ring of
+    preallocated buffers, and handed to the consumer with `getChunk`. The
+    consumer gives each buffer back with `releaseChunk` when it is done, so
+    the reader waits if the consumer falls `nRing` chunks behind.
+
+    Parameters
+    ----------
+    funcRead : callable
+        Function reading points into a buffer, called as
+        ``funcRead(buffer, nPoints, timeout_ms)`` with a ctypes array of
+        c_short, and returning the number of points read.
+    lPoints : list of int
+        Number of points of each chunk.
+    timeout : float
+        Time to read all chunks, in seconds.
+    lArray : list of numpy array, optional
+        Ring of int16 buffers, each with room for the largest chunk, for
+        example from `BufferPool`. Allocated if not given.
+    nRing : int
+        Number of chunk buffers, if not given by `lArray`.
+
+    """
+
+    def __init__(self, funcRead, lPoints, timeout, lArray=None, nRing=4):
+        super().__init__(daemon=True)
+        self.funcRead = funcRead
+        self.lPoints = [int(n) for n in lPoints]
+        self.timeout = float(timeout)
+        if lArray is None:
+            nMax = max(self.lPoints, default=0)
+            nRing = max(1, min(nRing, len(self.lPoints)))
+            lArray = [np.empty(nMax, dtype=np.int16) for n in range(nRing)]
+        # the data is read directly into the numpy arrays
+        self.lArray = lArray
+        self.lBuffer = [np.ctypeslib.as_ctypes(data) for data in lArray]
+        self.freeBuffers = queue.Queue()
+        for n in range(len(lArray)):
+            self.freeBuffers.put(n)
+        self.filledBuffers = queue.Queue()
+        self.stopEvent = threading.Event()
+        self.nCurrent = None
+
+    def run(self):
+        tEnd = time.perf_counter() + self.timeout
+        try:
+            for nPoints in self.lPoints:
+                # wait for a free buffer, stop if requested
+                while True:
+                    if self.stopEvent.is_set():
+                        return
+                    try:
+                        n = self.freeBuffers.get(timeout=0.1)
+                        break
+                    except queue.Empty:
+                        pass
+                timeout_ms = max(1, int(1000 * (tEnd - time.perf_counter())))
+                nOut = self.funcRead(self.lBuffer[n], nPoints, timeout_ms)
+                if self.stopEvent.is_set():
+                    return
+                if nOut < nPoints:
+                    raise Error('Timeout while reading digitizer data, got '
+                                '%d of %d points.' % (max(nOut, 0), nPoints))
+                self.filledBuffers.put((n, nPoints))
+        except Exception as e:
+            # pass errors to the consumer
+            self.filledBuffers.put(e)
+
+    def getChunk(self, funcStop=None):
+        """Get the next chunk, in the order they were read.
+
+        Parameters
+        ----------
+        funcStop : callable, optional
+            Function returning True if the wait should be stopped.
+
+        Returns
+        -------
+        numpy array
+            Codes of the chunk, valid until `releaseChunk` is called. None if
+            stopped.
+
+        """
+        while True:
+            if funcStop is not None and funcStop():
+                return None
+            try:
+                item = self.filledBuffers.get(timeout=0.1)
+                break
+            except queue.Empty:
+                pass
+        if isinstance(item, Exception):
+            raise item
+        (self.nCurrent, nPoints) = item
+        return self.lArray[self.nCurrent][:nPoints]
+
+    def releaseChunk(self):
+        """Give the buffer of the last chunk back to the reader"""
+        self.freeBuffers.put(self.nCurrent)
+        self.nCurrent = None
+
+    def stop(self):
+        """Stop reading, after the current read"""
+        self.stopEvent.set()
+
+
+def getChunkCycles(nCycleTotal, nCyclePerCall):
+    """Split cycles into chunks of nCyclePerCall, the last can be smaller"""
+    nCall = int(np.ceil(nCycleTotal / nCyclePerCall))
+    return [min(nCyclePerCall, nCycleTotal - n * nCyclePerCall)
+            for n in range(nCall)]
+
+
+def averageChunks(lReader, lScale, nPts, nSeg, nAv, lCycle, funcStop=None,
+                  lSum=None):
+    """Average the chunks of all channels while they are being read.
+
+    Each chunk is summed as soon as it arrives, with the chunks of the
+    channels taken in turn. The codes are summed as integers, and scaled to
+    volts once at the end.
+
+    Parameters
+    ----------
+    lReader : list of ChannelReader
+        Started readers of the channels.
+    lScale : list of float
+        Volts per code of each channel.
+    nPts, nSeg, nAv : int
+        Number of points per record, records and averages.
+    lCycle : list of int
+        Number of cycles in each chunk, see `getChunkCycles`.
+    funcStop : callable, optional
+        Function returning True if the acquisition should be stopped.
+    lSum : list of numpy array, optional
+        Int64 accumulator of each channel, with nPts * nSeg points, for
+        example from `BufferPool`. Allocated if not given, and not needed
+        for a single chunk.
+
+    Returns
+    -------
+    list of numpy array
+        Averaged records of each channel after each other, in volts. None if
+        stopped.
+
+    """
+    # int32 is exact for the sum of up to 65536 int16 records
+    nMax = max(lCycle, default=0) // nSeg
+    dtype = np.int32 if nMax <= 2 ** 16 else np.int64
+    if len(lCycle) == 1:
+        # single chunk, convert it directly
+        lTrace = []
+        for n, reader in enumerate(lReader):
+            data = reader.getChunk(funcStop)
+            if data is None:
+                return None
+            if nMax > 1:
+                data = np.add.reduce(data.reshape((nMax, nPts * nSeg)),
+                                     axis=0, dtype=dtype)
+            lTrace.append(data * (lScale[n] / nAv))
+            reader.releaseChunk()
+        return lTrace
+    if lSum is None:
+        lSum = [np.empty(nPts * nSeg, dtype=np.int64) for reader in lReader]
+    for vSum in lSum:
+        vSum.fill(0)
+    vChunkSum = np.empty(nPts * nSeg if nMax > 1 else 0, dtype=dtype)
+    for nCycle in lCycle:
+        for n, reader in enumerate(lReader):
+            data = reader.getChunk(funcStop)
+            if data is None:
+                return None
+            # sum records of the chunk, add to total
+            nAvHere = nCycle // nSeg
+            if nAvHere > 1:
+                np.add.reduce(data.reshape((nAvHere, nPts * nSeg)), axis=0,
+                              dtype=dtype, out=vChunkSum)
+                np.add(lSum[n], vChunkSum, out=lSum[n])
+            else:
+                np.add(lSum[n], data, out=lSum[n])
+            reader.releaseChunk()
+    # convert sum to average voltage
+    return [vSum * (scale / nAv) for vSum, scale in zip(lSum, lScale)]
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""Simulated keysightSD1 module, replacing the Keysight SD1 library for testing.
+
+Only the digitizer functions used by the driver are available. Each channel
+acquires its cycles at a fixed trigger rate from the start of the
+acquisition. A DAQread call waits until all requested points are acquired,
+and then takes a configurable read latency more, as for the transfer of the
+data. Settings are class attributes of `SD_AIN`, so they can be changed
+before the driver creates its instance::
+
+    import Keysight_PXI_Digitizer_Simulator as sd1
+    sd1.SD_AIN.triggerRate = 50E3
+    sd1.SD_AIN.readLatency = 0.002
+"""
+import ctypes
+import threading
+import time
+
+import numpy as np
+
+c_short = ctypes.c_short
+
+
+class SD_Error:
+    """Error codes, with the same names as in keysightSD1"""
+    NONE = 0
+    MODULE_NOT_OPENED = -8003
+    INVALID_VALUE = -8020
+
+
+def _address(data):
+    """Get memory address of a ctypes buffer or pointer"""
+    if isinstance(data, ctypes.Array):
+        return ctypes.addressof(data)
+    return getattr(data, 'value', data)
+
+
+class _CoreDLL:
+    """Functions of the SD1 core library called directly by the driver"""
+
+    def __init__(self, module):
+        self.module = module
+
+    def SD_AIN_DAQread(self, handle, nDAQ, data, nPoints, timeOut):
+        return self.module._read(nDAQ, data, nPoints, timeOut)
+
+
+class SD_Object:
+    """Base class of all modules, with the private names of keysightSD1"""
+
+    def __init__(self):
+        self.__handle = 0
+        self.__core_dll = _CoreDLL(self)
+
+    def openWithSlot(self, productName, chassis, slot):
+        self.__handle = 1
+        return self.__handle
+
+    def close(self):
+        self.__handle = 0
+        return SD_Error.NONE
+
+    def getProductNameBySlot(self, chassis, slot):
+        return self.productName
+
+    def getSerialNumberBySlot(self, chassis, slot):
+        return 'SIM%04d' % slot
+
+    def getHardwareVersion(self):
+        return 4
+
+
+class SD_AIN(SD_Object):
+    """Simulated digitizer module.
+
+    Attributes
+    ----------
+    productName : str
+        Product name reported for every slot.
+    triggerRate : float
+        Rate of triggers, in Hz. Each trigger acquires one cycle.
+    readLatency : float
+        Time of every DAQread call after the data is acquired, in seconds.
+    source : callable, optional
+        Function returning the sample codes of a channel, called as
+        ``source(channel, firstCycle, nCycle, nPoint)`` and returning an int16
+        array of shape ``(nCycle, nPoint)``. Defaults to noise repeated every
+        `nTemplate` cycles.
+    nTemplate : int
+        Number of different cycles of the default source.
+
+    """
+
+    productName = 'M3102A'
+    triggerRate = 10E3
+    readLatency = 0.0
+    source = None
+    nTemplate = 64
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._abort = threading.Event()
+        # per channel: points per cycle, number of cycles, start time and
+        # number of points already read
+        self._config = {}
+        self._tStart = {}
+        self._pointsRead = {}
+        self._templates = {}
+        self.nRead = 0
+
+    def _getCodes(self, channel, firstCycle, nCycle, nPoint):
+        """Get codes of a range of cycles"""
+        # source may be set on the class or on the instance
+        source = self.__dict__.get('source', type(self).source)
+        if source is not None:
+            return source(channel, firstCycle, nCycle, nPoint)
+        key = (channel, nPoint)
+        if key not in self._templates:
+            rng = np.random.default_rng(channel)
+            self._templates[key] = rng.integers(
+                -2000, 2000, (self.nTemplate, nPoint), dtype=np.int16)
+        index = np.arange(firstCycle, firstCycle + nCycle) % self.nTemplate
+        return self._templates[key][index]
+
+    def _copyTemplate(self, channel, address, first, nPoints, nPoint):
+        """Copy points of the default source, without temporary arrays"""
+        self._getCodes(channel, 0, 0, nPoint)
+        template = self._templates[(channel, nPoint)].reshape(-1)
+        # the codes repeat every nTemplate cycles
+        n0 = first % template.size
+        while nPoints > 0:
+            nCopy = min(nPoints, template.size - n0)
+            ctypes.memmove(address, template.ctypes.data + 2 * n0, 2 * nCopy)
+            address += 2 * nCopy
+            nPoints -= nCopy
+            n0 = 0
+
+    def getCycleTime(self, channel, nCycle):
+        """Time when `nCycle` cycles of a channel are acquired"""
+        return self._tStart[channel] + nCycle / self.triggerRate
+
+    def DAQconfig(self, nDAQ, pointsPerCycle, nCycles, triggerDelay,
+                  triggerMode):
+        with self._lock:
+            self._config[nDAQ] = (int(pointsPerCycle), int(nCycles))
+            self._tStart.pop(nDAQ, None)
+        return SD_Error.NONE
+
+    def DAQstartMultiple(self, DAQmask):
+        self._abort.clear()
+        tStart = time.perf_counter()
+        with self._lock:
+            for nDAQ in self._config:
+                if DAQmask & (1 << (nDAQ - 1)):
+                    self._tStart[nDAQ] = tStart
+                    self._pointsRead[nDAQ] = 0
+        return SD_Error.NONE
+
+    def DAQstopMultiple(self, DAQmask):
+        # wake up threads waiting for data
+        self._abort.set()
+        with self._lock:
+            for nDAQ in list(self._tStart):
+                if DAQmask & (1 << (nDAQ - 1)):
+                    del self._tStart[nDAQ]
+        return SD_Error.NONE
+
+    def DAQflush(self, nDAQ):
+        with self._lock:
+            self._pointsRead[nDAQ] = 0
+        return SD_Error.NONE
+
+    def _read(self, nDAQ, data, nPoints, timeOut):
+        """Read points of a channel, waiting until they are acquired"""
+        with self._lock:
+            if nDAQ not in self._tStart:
+                return 0
+            (pointsPerCycle, nCycles) = self._config[nDAQ]
+            first = self._pointsRead[nDAQ]
+            nPoints = min(nPoints, pointsPerCycle * nCycles - first)
+            if nPoints <= 0:
+                return 0
+            nCycleDone = -(-(first + nPoints) // pointsPerCycle)
+            tDone = self.getCycleTime(nDAQ, nCycleDone)
+        # wait for triggers and the transfer, stop early if aborted
+        delay = max(tDone - time.perf_counter(), 0) + self.readLatency
+        if delay > timeOut / 1000:
+            self._abort.wait(timeOut / 1000)
+            return 0
+        if delay > 0 and self._abort.wait(delay):
+            return 0
+        # transfer codes of the cycles covering the requested points
+        if self.__dict__.get('source', type(self).source) is None:
+            self._copyTemplate(nDAQ, _address(data), first, nPoints,
+                               pointsPerCycle)
+        else:
+            firstCycle = first // pointsPerCycle
+            codes = self._getCodes(nDAQ, firstCycle, nCycleDone - firstCycle,
+                                   pointsPerCycle).reshape(-1)
+            codes = codes[first - firstCycle * pointsPerCycle:][:nPoints]
+            ctypes.memmove(_address(data), codes.ctypes.data, codes.nbytes)
+        with self._lock:
+            self._pointsRead[nDAQ] = first + nPoints
+            self.nRead += 1
+        return nPoints
+
+    def DAQtriggerExternalConfig(self, nDAQ, externalSource, triggerBehavior,
+                                 sync=0):
+        return SD_Error.NONE
+
+    def DAQdigitalTriggerConfig(self, nDAQ, triggerSource, triggerBehavior):
+        return SD_Error.NONE
+
+    def DAQtriggerConfig(self, nDAQ, digitalTriggerMode, digitalTriggerSource,
+                         analogTriggerMask):
+        return SD_Error.NONE
+
+    def triggerIOconfig(self, direction):
+        return SD_Error.NONE
+
+    def channelTriggerConfig(self, channel, analogTriggerMode, threshold):
+        return SD_Error.NONE
+
+    def channelInputConfig(self, channel, fullScale, impedance, coupling):
+        return SD_Error.NONE
+
+
+if __name__ == '__main__':
+    pass
@@ -3,7 +3,14 @@ import sys
 sys.path.append('C:\Program Files (x86)\Keysight\SD1\Libraries\Python')
 
 from BaseDriver import LabberDriver, Error, IdError
-import keysightSD1
+try:
+    import keysightSD1
+except ImportError:
+    # only the simulated digitizer is available
+    keysightSD1 = None
+import Keysight_PXI_Digitizer_Simulator
+from Keysight_PXI_Digitizer_Reader import (BufferPool, ChannelReader,
+                                           averageChunks, getChunkCycles)
 
 import numpy as np
 
@@ -20,12 +27,21 @@ class Driver(LabberDriver):
         self.timeout_ms = int(1000 * self.dComCfg['Timeout'])
         # get PXI chassis
         self.chassis = int(self.dComCfg.get('PXI chassis', 1))
+        # address "SIM" opens a simulated digitizer
+        if str(self.comCfg.address).strip().upper() == 'SIM':
+            self.sd1 = Keysight_PXI_Digitizer_Simulator
+            self.slot = 0
+        else:
+            if keysightSD1 is None:
+                raise Error('The Keysight SD1 library "keysightSD1" is not '
+                            'installed.')
+            self.sd1 = keysightSD1
+            self.slot = int(self.comCfg.address)
         # create AWG instance
-        self.dig = keysightSD1.SD_AIN()
-        AWGPart = self.dig.getProductNameBySlot(
-            self.chassis, int(self.comCfg.address))
+        self.dig = self.sd1.SD_AIN()
+        AWGPart = self.dig.getProductNameBySlot(self.chassis, self.slot)
         self.log('Serial:', self.dig.getSerialNumberBySlot(
-            self.chassis, int(self.comCfg.address)))
+            self.chassis, self.slot))
         if not isinstance(AWGPart, str):
             raise Error('Unit not available')
         # check that model is supported
@@ -50,7 +66,9 @@ class Driver(LabberDriver):
             self.nCh = 4
         # create list of sampled data
         self.lTrace = [np.array([])] * self.nCh
-        self.dig.openWithSlot(AWGPart, self.chassis, int(self.comCfg.address))
+        # buffers for reading data, kept between calls
+        self.pool = BufferPool()
+        self.dig.openWithSlot(AWGPart, self.chassis, self.slot)
         # get hardware version - changes numbering of channels
         hw_version = self.dig.getHardwareVersion()
         if hw_version >= 4:
@@ -201,34 +219,39 @@ class Driver(LabberDriver):
         nCycleTotal = nSeg*nAv
         # set cycles equal to number of records, else 100
         nCyclePerCall = nSeg if nSeg>1 else 100
-        nCall = int(np.ceil(nCycleTotal/nCyclePerCall))
-        lScale = [(self.getRange(ch)/self.bitRange) for ch in range(self.nCh)]
-        for n in range(nCall):
-            # number of cycles for this call, could be fewer for last call
-            nCycle = min(nCyclePerCall, nCycleTotal-(n*nCyclePerCall))
-            # capture traces one by one
-            for nCh in lCh:
-                # channel number depens on hardware version
-                ch = self.get_hw_ch(nCh)
-                data = self.DAQread(self.dig, ch, nPts*nCycle, int(self.timeout_ms/nCall))
-                # average, if wanted
-                scale = (self.getRange(nCh)/self.bitRange)
-                if nAv > 1 and data.size>0:
-                    nAvHere = nCycle/nSeg
-                    data = data.reshape((int(nAvHere), nPts*nSeg)).mean(0)
-                    # adjust scaling to account for summing averages
-                    scale = lScale[nCh]*(nAvHere/nAv)
-                else:
-                    # use pre-calculated scaling
-                    scale = lScale[nCh]
-                # convert to voltage, add to total average
-                if n==0:
-                    self.lTrace[nCh] = data*scale
-                else:
-                    self.lTrace[nCh] += data*scale
-#                lT.append('N: %d, Tot %.1f ms' % (n, 1000*(time.clock()-t0)))
-#        # log timing info
-#        self.log(': '.join(lT))
+        lCycle = getChunkCycles(nCycleTotal, nCyclePerCall)
+        lScale = [(self.getRange(ch)/self.bitRange) for ch in lCh]
+        # read all channels in the background, average chunks as they arrive
+        lReader, lSum = [], []
+        for nCh in lCh:
+            # channel number depens on hardware version
+            ch = self.get_hw_ch(nCh)
+            funcRead = (lambda data, nPoints, timeOut, ch=ch:
+                        self.DAQreadInto(self.dig, ch, data, nPoints, timeOut))
+            (lArray, vSum) = self.pool.getBuffers(
+                nCh, nPts*lCycle[0], nPts*nSeg, len(lCycle))
+            lReader.append(ChannelReader(funcRead,
+                                         [nPts*nCycle for nCycle in lCycle],
+                                         self.timeout_ms/1000, lArray))
+            lSum.append(vSum)
+        lTrace = None
+        try:
+            for reader in lReader:
+                reader.start()
+            lTrace = averageChunks(lReader, lScale, nPts, nSeg, nAv, lCycle,
+                                   funcStop=self.isStopped, lSum=lSum)
+        finally:
+            if lTrace is None:
+                # stopped or failed, abort pending reads
+                for reader in lReader:
+                    reader.stop()
+                self.dig.DAQstopMultiple(iChMask)
+            for reader in lReader:
+                reader.join()
+        if lTrace is None:
+            return
+        for nCh, trace in zip(lCh, lTrace):
+            self.lTrace[nCh] = trace
 
 
     def getRange(self, ch):
@@ -241,16 +264,24 @@ class Driver(LabberDriver):
         """Read data diretly to numpy array"""
         if dig._SD_Object__handle > 0:
             if nPoints > 0:
-                data = (keysightSD1.c_short * nPoints)()
+                data = (self.sd1.c_short * nPoints)()
                 nPointsOut = dig._SD_Object__core_dll.SD_AIN_DAQread(dig._SD_Object__handle, nDAQ, data, nPoints, timeOut)
                 if nPointsOut > 0:
                     return np.frombuffer(data, dtype=np.int16, count=nPoints)
                 else:
                     return np.array([], dtype=np.int16)
             else:
-                return keysightSD1.SD_Error.INVALID_VALUE
+                return self.sd1.SD_Error.INVALID_VALUE
         else:
-            return keysightSD1.SD_Error.MODULE_NOT_OPENED
+            return self.sd1.SD_Error.MODULE_NOT_OPENED
+
+
+    def DAQreadInto(self, dig, nDAQ, data, nPoints, timeOut):
+        """Read data into a c_short buffer, return number of points read"""
+        if dig._SD_Object__handle <= 0:
+            raise Error('Digitizer is not open.')
+        return dig._SD_Object__core_dll.SD_AIN_DAQread(
+            dig._SD_Object__handle, nDAQ, data, nPoints, timeOut)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Benchmark of reading and averaging digitizer data.
+
+Compares the time and memory allocated per acquisition of `BufferPool` and
+the integer averaging of `averageChunks`, with the previous acquisition,
+which allocated the chunk buffers for every call and scaled the float mean
+of each chunk. The data comes from the simulated digitizer, with triggers
+fast enough that the time is spent reading and averaging::
+
+    python benchmark.py
+    python benchmark.py -w 1x10000x1000 -r 10
+
+The allocated memory is the peak traced by tracemalloc during one call, and
+includes the returned traces. Each run also checks that both methods return
+the same traces.
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+import Keysight_PXI_Digitizer_Simulator as sd1
+from Keysight_PXI_Digitizer_Reader import (BufferPool, ChannelReader,
+                                           averageChunks, getChunkCycles)
+
+# records, averages and points per record, for 4 channels
+WORKLOADS = {
+    '1x10000x1000': (1, 10000, 1000),
+    '100x100x1000': (100, 100, 1000),
+    '10000x1x1000': (10000, 1, 1000),
+}
+CHANNELS = (1, 2, 3, 4)
+
+
+def averagePrevious(lReader, lScale, nPts, nSeg, nAv, lCycle):
+    """Previous averaging, float mean of each chunk scaled and added"""
+    lTrace = [None] * len(lReader)
+    for nCycle in lCycle:
+        for n, reader in enumerate(lReader):
+            data = reader.getChunk()
+            if nAv > 1:
+                nAvHere = nCycle // nSeg
+                value = data.reshape((nAvHere, nPts * nSeg)).mean(0)
+                value *= lScale[n] * (nAvHere / nAv)
+            else:
+                value = data * lScale[n]
+            reader.releaseChunk()
+            if lTrace[n] is None:
+                lTrace[n] = value
+            else:
+                lTrace[n] += value
+    return lTrace
+
+
+def acquire(dig, nPts, nSeg, nAv, pool=None):
+    """Acquire and average all channels, with buffers from pool if given"""
+    for ch in CHANNELS:
+        dig.DAQconfig(ch, nPts, nSeg * nAv, 0, 0)
+    dig.DAQstartMultiple(2 ** len(CHANNELS) - 1)
+    lCycle = getChunkCycles(nSeg * nAv, nSeg if nSeg > 1 else 100)
+    lScale = [(n + 1) / 32767 for n in range(len(CHANNELS))]
+    lReader, lSum = [], []
+    for ch in CHANNELS:
+        funcRead = (lambda data, nPoints, timeOut, ch=ch:
+                    dig._SD_Object__core_dll.SD_AIN_DAQread(
+                        1, ch, data, nPoints, timeOut))
+        lArray = None
+        if pool is not None:
+            (lArray, vSum) = pool.getBuffers(ch, nPts * lCycle[0], nPts * nSeg,
+                                             len(lCycle))
+            lSum.append(vSum)
+        lReader.append(ChannelReader(funcRead, [nPts * n for n in lCycle],
+                                     10.0, lArray))
+    for reader in lReader:
+        reader.start()
+    if pool is None:
+        lTrace = averagePrevious(lReader, lScale, nPts, nSeg, nAv, lCycle)
+    else:
+        lTrace = averageChunks(lReader, lScale, nPts, nSeg, nAv, lCycle,
+                               lSum=lSum)
+    for reader in lReader:
+        reader.join()
+    return lTrace
+
+
+def runWorkload(name, repeat):
+    """Time both methods, return time and allocated memory per call"""
+    (nSeg, nAv, nPts) = WORKLOADS[name]
+    sd1.SD_AIN.triggerRate = 1E12
+    sd1.SD_AIN.readLatency = 0.0
+    dig = sd1.SD_AIN()
+    dig.openWithSlot('M3102A', 1, 0)
+    result = {}
+    for method in ('previous', 'pool'):
+        pool = None if method == 'previous' else BufferPool()
+        # first call fills the pool and the simulated data
+        vData = acquire(dig, nPts, nSeg, nAv, pool)
+        lTime = []
+        for n in range(repeat):
+            t0 = time.perf_counter()
+            acquire(dig, nPts, nSeg, nAv, pool)
+            lTime.append(time.perf_counter() - t0)
+        # memory allocated during a call, including the returned traces
+        tracemalloc.start()
+        acquire(dig, nPts, nSeg, nAv, pool)
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result[method] = (np.median(lTime), peak, vData)
+    same = all(np.allclose(a, b, rtol=0, atol=1E-12)
+               for a, b in zip(result['previous'][2], result['pool'][2]))
+    return (result['previous'][:2], result['pool'][:2], same)
+
+
+def main(argv=None):
+    """Run benchmark from the command line, return exit code."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark reading and averaging of digitizer data.')
+    parser.add_argument('-w', '--workload', action='append',
+                        choices=list(WORKLOADS),
+                        help='workload to run, can be repeated '
+                             '(default: all)')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='number of timed runs per workload '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+    bSame = True
+    print('%-14s %17s %17s %8s %5s' % (
+        'workload', 'time [ms]', 'allocated [MB]', 'speedup', 'same'))
+    print('%-14s %8s %8s %8s %8s' % ('', 'old', 'new', 'old', 'new'))
+    for name in args.workload or WORKLOADS:
+        (old, new, same) = runWorkload(name, args.repeat)
+        bSame = bSame and same
+        print('%-14s %8.1f %8.1f %8.2f %8.2f %7.2fx %5s' % (
+            name, old[0] * 1E3, new[0] * 1E3, old[1] / 2 ** 20,
+            new[1] / 2 ** 20, old[0] / new[0], same))
+    return 0 if bSame else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,137 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import Keysight_PXI_Digitizer_Simulator as sd1
+from benchmark import CHANNELS, acquire
+from Keysight_PXI_Digitizer_Reader import (BufferPool, ChannelReader,
+                                           averageChunks, getChunkCycles)
+
+
+def get_digitizer(source=None):
+    """Simulated digitizer with triggers faster than the reading"""
+    dig = sd1.SD_AIN()
+    dig.openWithSlot('M3102A', 1, 0)
+    dig.triggerRate = 1E12
+    dig.readLatency = 0.0
+    if source is not None:
+        dig.source = source
+    return dig
+
+
+def full_scale(channel, firstCycle, nCycle, nPoint):
+    """Highest and lowest int16 codes, alternating between points"""
+    codes = np.full((nCycle, nPoint), 32767, dtype=np.int16)
+    codes[:, ::2] = -32768
+    if channel % 2 == 0:
+        codes = -1 - codes
+    return codes
+
+
+def get_reference(dig, nPts, nSeg, nAv):
+    """Float average of all records at once, in volts"""
+    return [(n + 1) / 32767 * dig._getCodes(
+        ch, 0, nSeg * nAv, nPts).astype(float).reshape(
+        (nAv, nSeg * nPts)).mean(axis=0) for n, ch in enumerate(CHANNELS)]
+
+
+def test_buffers_kept_for_same_size():
+    pool = BufferPool(nRing=3)
+    (lArray, vSum) = pool.getBuffers(1, 1000, 100, 10)
+    assert len(lArray) == 3
+    assert all(x.dtype == np.int16 and x.shape == (1000,) for x in lArray)
+    assert vSum.dtype == np.int64 and vSum.shape == (100,)
+    # same size, same buffers
+    assert pool.getBuffers(1, 1000, 100, 10) == (lArray, vSum)
+    assert pool.getBuffers(1, 1000, 100, 10)[0][0] is lArray[0]
+    assert pool.getBuffers(1, 1000, 100, 10)[1] is vSum
+    # other channels get their own buffers
+    (lArray2, vSum2) = pool.getBuffers(2, 1000, 100, 10)
+    assert lArray2[0] is not lArray[0] and vSum2 is not vSum
+    assert pool.nAllocation == 2
+
+
+@pytest.mark.parametrize('size', [(2000, 100, 10), (1000, 200, 10),
+                                  (1000, 100, 2)])
+def test_buffers_reallocated_for_other_size(size):
+    pool = BufferPool(nRing=3)
+    (lArray, vSum) = pool.getBuffers(1, 1000, 100, 10)
+    (lArray2, vSum2) = pool.getBuffers(1, *size)
+    assert lArray2[0] is not lArray[0]
+    assert vSum2 is not vSum
+    assert pool.nAllocation == 2
+    # ring no larger than the number of chunks
+    assert len(lArray2) == min(3, size[2])
+
+
+def test_no_accumulator_for_single_chunk():
+    (lArray, vSum) = BufferPool().getBuffers(1, 1000, 1000, 1)
+    assert len(lArray) == 1
+    assert vSum is None
+
+
+def test_buffers_returned_to_reader():
+    dig = get_digitizer()
+    dig.DAQconfig(1, 100, 1000, 0, 0)
+    dig.DAQstartMultiple(1)
+    lCycle = getChunkCycles(1000, 100)
+    (lArray, vSum) = BufferPool().getBuffers(1, 100 * 100, 100, len(lCycle))
+    reader = ChannelReader(
+        lambda data, nPoints, timeOut: dig._SD_Object__core_dll.
+        SD_AIN_DAQread(1, 1, data, nPoints, timeOut),
+        [100 * n for n in lCycle], 5.0, lArray)
+    reader.start()
+    averageChunks([reader], [1.0], 100, 1, 1000, lCycle, lSum=[vSum])
+    reader.join()
+    # every chunk was read into the pool buffers, which are all free again
+    assert reader.lArray is lArray
+    assert reader.freeBuffers.qsize() == len(lArray)
+    assert reader.filledBuffers.empty()
+    assert reader.nCurrent is None
+
+
+@pytest.mark.parametrize('nSeg,nAv,nPts', [(1, 1000, 2000), (50, 100, 4000)])
+def test_no_allocation_after_warm_up(nSeg, nAv, nPts):
+    dig = get_digitizer()
+    pool = BufferPool()
+    reference = acquire(dig, nPts, nSeg, nAv, pool)
+    dBuffer = {ch: (list(lArray), vSum)
+               for ch, (lArray, vSum) in pool.dBuffer.items()}
+    nAllocation = pool.nAllocation
+    assert nAllocation == len(CHANNELS)
+    tracemalloc.start()
+    lTrace = acquire(dig, nPts, nSeg, nAv, pool)
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # the same buffers are used again
+    assert pool.nAllocation == nAllocation
+    for ch, (lArray, vSum) in pool.dBuffer.items():
+        assert all(x is y for x, y in zip(lArray, dBuffer[ch][0]))
+        assert vSum is dBuffer[ch][1]
+    # apart from the returned traces, only the threads and queues allocate
+    # memory, less than a single chunk buffer
+    nTrace = sum(x.nbytes for x in lTrace)
+    assert peak - nTrace < pool.dBuffer[1][0][0].nbytes
+    for x, y in zip(lTrace, reference):
+        assert np.array_equal(x, y)
+
+
+@pytest.mark.parametrize('nSeg,nAv,nPts', [
+    # single chunk, chunks of 100 records beyond the int32 range, and
+    # chunks of one set of records
+    (1, 100, 16), (1, 70000, 16), (4, 2000, 8)])
+def test_full_scale_identical_to_float(nSeg, nAv, nPts):
+    dig = get_digitizer(full_scale)
+    lTrace = acquire(dig, nPts, nSeg, nAv, BufferPool())
+    # same result as the float reference, and as the previous averaging
+    lPrevious = acquire(dig, nPts, nSeg, nAv)
+    for n, (trace, reference) in enumerate(
+            zip(lTrace, get_reference(dig, nPts, nSeg, nAv))):
+        assert trace.dtype == np.float64
+        assert np.allclose(trace, reference, rtol=1E-14, atol=0)
+        assert np.allclose(trace, lPrevious[n], rtol=1E-12, atol=0)
+        # the sum of the extremes is exact
+        codes = full_scale(CHANNELS[n], 0, 1, 2)[0].astype(np.int64)
+        scale = (n + 1) / 32767
+        assert np.array_equal(trace[:2], codes * nAv * (scale / nAv))
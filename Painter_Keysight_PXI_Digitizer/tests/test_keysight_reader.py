@@ -0,0 +1,198 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import Keysight_PXI_Digitizer_Simulator as sd1
+from Keysight_PXI_Digitizer_Reader import (ChannelReader, Error,
+                                           averageChunks, getChunkCycles)
+
+CHANNELS = (1, 2, 3)
+# volts per code of each channel
+SCALE = [0.1 / 32767, 1.0 / 32767, 4.0 / 32767]
+
+
+def get_digitizer(triggerRate=1E9, readLatency=0.0):
+    """Simulated digitizer, with settings of the instance only"""
+    dig = sd1.SD_AIN()
+    dig.openWithSlot('M3102A', 1, 0)
+    dig.triggerRate = triggerRate
+    dig.readLatency = readLatency
+    return dig
+
+
+def acquire(dig, nPts, nSeg, nAv, timeout=5.0, funcStop=None, nRing=4,
+            funcRead=None):
+    """Acquire and average all channels, as in the driver"""
+    for ch in CHANNELS:
+        dig.DAQconfig(ch, nPts, nSeg * nAv, 0, 0)
+    iChMask = 2 ** len(CHANNELS) - 1
+    dig.DAQstartMultiple(iChMask)
+    lCycle = getChunkCycles(nSeg * nAv, nSeg if nSeg > 1 else 100)
+    lReader = []
+    for ch in CHANNELS:
+        read = (lambda data, nPoints, timeOut, ch=ch:
+                dig._SD_Object__core_dll.SD_AIN_DAQread(
+                    1, ch, data, nPoints, timeOut))
+        if funcRead is not None:
+            read = (lambda data, nPoints, timeOut, ch=ch, read=read:
+                    funcRead(ch, read, data, nPoints, timeOut))
+        lReader.append(ChannelReader(read, [nPts * n for n in lCycle],
+                                     timeout, nRing=nRing))
+    lTrace = None
+    try:
+        for reader in lReader:
+            reader.start()
+        lTrace = averageChunks(lReader, SCALE, nPts, nSeg, nAv, lCycle,
+                               funcStop=funcStop)
+    finally:
+        if lTrace is None:
+            # stopped or failed, abort pending reads
+            for reader in lReader:
+                reader.stop()
+            dig.DAQstopMultiple(iChMask)
+        for reader in lReader:
+            reader.join()
+    return lTrace
+
+
+def get_reference(dig, nPts, nSeg, nAv):
+    """Average of all records at once, in volts"""
+    return [SCALE[n] * dig._getCodes(ch, 0, nSeg * nAv, nPts).reshape(
+        (nAv, nSeg * nPts)).mean(axis=0) for n, ch in enumerate(CHANNELS)]
+
+
+def get_threads():
+    """Threads running now, to check that none are left behind"""
+    return set(threading.enumerate())
+
+
+@pytest.mark.parametrize('nRing', [1, 2, 4])
+@pytest.mark.parametrize('nSeg,nAv,nPts', [
+    # single chunk, with and without averaging
+    (1, 1, 1000), (1, 100, 64), (10, 1, 100),
+    # chunks of 100 records, the last one smaller
+    (1, 250, 128), (1, 1000, 100),
+    # chunks of one set of records
+    (4, 50, 256), (100, 3, 10)])
+def test_identical_to_reshape_mean(nSeg, nAv, nPts, nRing):
+    dig = get_digitizer()
+    threads = get_threads()
+    lTrace = acquire(dig, nPts, nSeg, nAv, nRing=nRing)
+    assert get_threads() == threads
+    for trace, reference in zip(lTrace, get_reference(dig, nPts, nSeg, nAv)):
+        assert trace.shape == (nSeg * nPts,)
+        assert np.allclose(trace, reference, rtol=1E-14, atol=0)
+
+
+def test_full_scale_identical_to_reshape_mean():
+    # int16 extremes, summed beyond the int32 range
+    dig = get_digitizer()
+
+    def fullScale(channel, firstCycle, nCycle, nPoint):
+        codes = np.full((nCycle, nPoint), 32767, dtype=np.int16)
+        codes[:, ::2] = -32768
+        return codes
+    dig.source = fullScale
+    (nSeg, nAv, nPts) = (1, 70000, 16)
+    assert 32768 * nAv > 2 ** 31
+    lTrace = acquire(dig, nPts, nSeg, nAv)
+    for trace, reference in zip(lTrace, get_reference(dig, nPts, nSeg, nAv)):
+        assert np.allclose(trace, reference, rtol=1E-14, atol=0)
+        assert trace[0] < 0 < trace[1]
+
+
+def test_slow_averaging():
+    # the readers wait for free buffers while the chunks are averaged
+    dig = get_digitizer()
+    lStop = []
+
+    def slowStop():
+        lStop.append(1)
+        time.sleep(0.001)
+        return False
+    lTrace = acquire(dig, 100, 1, 1000, funcStop=slowStop, nRing=1)
+    assert len(lStop) >= 10 * len(CHANNELS)
+    for trace, reference in zip(lTrace, get_reference(dig, 100, 1, 1000)):
+        assert np.allclose(trace, reference, rtol=1E-14, atol=0)
+
+
+@pytest.mark.parametrize('triggerRate,readLatency', [
+    # data transfer longer than the timeout
+    (1E9, 0.5),
+    # triggers too slow for all records to arrive in time
+    (1E3, 0.0)])
+def test_timeout(triggerRate, readLatency):
+    dig = get_digitizer(triggerRate, readLatency)
+    threads = get_threads()
+    t0 = time.perf_counter()
+    with pytest.raises(Error, match='Timeout while reading'):
+        acquire(dig, 100, 1, 1000, timeout=0.2)
+    # waits for the timeout, not for the data
+    assert 0.15 < time.perf_counter() - t0 < 0.45
+    assert get_threads() == threads
+    # acquisition is stopped
+    assert dig._tStart == {}
+
+
+@pytest.mark.parametrize('delay', [0.0, 0.05])
+def test_stop(delay):
+    # 10 ms per chunk of 100 records
+    dig = get_digitizer(triggerRate=1E4)
+    stopped = threading.Event()
+    threads = get_threads()
+    # as performStop, set from another thread while waiting
+    timer = threading.Timer(delay, stopped.set)
+    timer.start()
+    t0 = time.perf_counter()
+    assert acquire(dig, 100, 1, 10000, funcStop=stopped.is_set) is None
+    # stopped long before the 10000 records or the timeout
+    assert time.perf_counter() - t0 < delay + 0.3
+    timer.join()
+    assert get_threads() == threads
+    assert dig._tStart == {}
+    # next acquisition is not affected
+    dig.triggerRate = 1E9
+    lTrace = acquire(dig, 100, 1, 300)
+    for trace, reference in zip(lTrace, get_reference(dig, 100, 1, 300)):
+        assert np.allclose(trace, reference, rtol=1E-14, atol=0)
+
+
+def test_read_error_stops_all_threads():
+    # one channel fails in the middle, the others keep waiting for data
+    dig = get_digitizer(triggerRate=1E4)
+    nCall = [0]
+
+    def failingRead(ch, read, data, nPoints, timeOut):
+        if ch == 2:
+            nCall[0] += 1
+            if nCall[0] == 3:
+                raise ValueError('read failed')
+        return read(data, nPoints, timeOut)
+    threads = get_threads()
+    t0 = time.perf_counter()
+    with pytest.raises(ValueError, match='read failed'):
+        acquire(dig, 100, 1, 10000, funcRead=failingRead)
+    assert time.perf_counter() - t0 < 0.3
+    assert get_threads() == threads
+    assert dig._tStart == {}
+
+
+def test_reader_stops_while_waiting_for_buffer():
+    # no consumer, the reader waits for a free buffer until stopped
+    dig = get_digitizer()
+    dig.DAQconfig(1, 10, 100, 0, 0)
+    dig.DAQstartMultiple(1)
+    reader = ChannelReader(
+        lambda data, nPoints, timeOut: dig._SD_Object__core_dll.
+        SD_AIN_DAQread(1, 1, data, nPoints, timeOut), [100] * 10, 5.0,
+        nRing=2)
+    reader.start()
+    time.sleep(0.05)
+    assert reader.is_alive()
+    assert reader.filledBuffers.qsize() == 2
+    reader.stop()
+    reader.join(1.0)
+    assert not reader.is_alive()
+    assert dig.nRead == 2
@@ -1,15 +1,12 @@
 #!/usr/bin/env python
-import importlib
-import os
-import sys
-import copy
-
 import numpy as np
 
 from BaseDriver import LabberDriver
+from parallel import WorkerPool
 from sequence_builtin import CPMG, PulseTrain, Rabi, SpinLocking, ZRabi
 from sequence_rb import SingleQubit_RB, TwoQubit_RB
 from sequence import SequenceToWaveforms
+from sequence_loader import SequenceLoader
 
 # dictionary with built-in sequences
 SEQUENCES = {'Rabi': Rabi,
@@ -30,48 +27,72 @@ class Driver(LabberDriver):
         # init variables
         self.sequence = None
         self.sequence_to_waveforms = SequenceToWaveforms()
+        # cache of loaded custom sequence files
+        self.sequence_loader = SequenceLoader()
         self.waveforms = {}
+        # demodulated values for all qubits and the input they came from
+        self.demodulated = None
+        self.demodulated_input = None
+        # worker processes for parallel compilation, started on first use
+        self.worker_pool = None
         # always create a sequence at startup
         name = self.getValue('Sequence')
         self.sendValueToOther('Sequence', name)
 
+    def performClose(self, bError=False, options={}):
+        """Perform the close instrument connection operation."""
+        # stop worker processes
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+            self.worker_pool = None
+
     def performSetValue(self, quant, value, sweepRate=0.0, options={}):
         """Perform the Set Value instrument operation."""
         # only do something here if changing the sequence type
         if quant.name == 'Sequence':
             # create new sequence if sequence type changed
             new_type = SEQUENCES[value]
-
-            if not isinstance(self.sequence, new_type):
-                # create a new sequence object
-                if value == 'Custom':
-                    # for custom python files
-                    path = self.getValue('Custom Python file')
-                    (path, modName) = os.path.split(path)
-                    sys.path.append(path)
-                    modName = modName.split('.py')[0]  # strip suffix
-                    mod = importlib.import_module(modName)
-                    # the custom sequence class has to be named
-                    # 'CustomSequence'
-                    if not isinstance(self.sequence, mod.CustomSequence):
-                        self.sequence = mod.CustomSequence()
-                else:
-                    # standard built-in sequence
-                    self.sequence = new_type()
+            if value == 'Custom':
+                # for custom python files
+                self.updateCustomSequence(
+                    self.getValue('Custom Python file'))
+            elif not isinstance(self.sequence, new_type):
+                # standard built-in sequence
+                self.sequence = new_type()
 
         elif (quant.name == 'Custom Python file' and
               self.getValue('Sequence') == 'Custom'):
             # for custom python files
-            path = self.getValue('Custom Python file')
-            (path, modName) = os.path.split(path)
-            modName = modName.split('.py')[0]  # strip suffix
-            sys.path.append(path)
-            mod = importlib.import_module(modName)
-            # the custom sequence class has to be named 'CustomSequence'
-            if not isinstance(self.sequence, mod.CustomSequence):
-                self.sequence = mod.CustomSequence()
+            self.updateCustomSequence(value)
         return value
 
+    def updateCustomSequence(self, path):
+        """Create new custom sequence object if the file changed.
+
+        The file is only executed again if its content changed. The custom
+        sequence class has to be named 'CustomSequence'.
+
+        Parameters
+        ----------
+        path : str
+            Path to Python file with custom sequence.
+
+        Returns
+        -------
+        bool
+            True if a new sequence object was created.
+
+        """
+        if (self.sequence is not None and
+                not self.sequence_loader.is_updated(path,
+                                                    type(self.sequence))):
+            return False
+        sequence_class = self.sequence_loader.get_sequence_class(path)
+        if type(self.sequence) is sequence_class:
+            return False
+        self.sequence = sequence_class()
+        return True
+
     def performGetValue(self, quant, options={}):
         """Perform the Get Value instrument operation."""
         # ignore if no sequence
@@ -83,83 +104,101 @@ class Driver(LabberDriver):
                 quant.name.startswith('Single-shot, QB')):
             # perform demodulation, check if config is updated
             if self.isConfigUpdated():
-                # update sequence object with current driver configuation
-                config = self.instrCfg.getValuesDict()
-                self.sequence.set_parameters(config)
-                self.sequence_to_waveforms.set_parameters(config)
+                self.applyConfig()
             # get qubit index and waveforms
             n = int(quant.name.split(', QB')[1]) - 1
             demod_iq = self.getValue('Demodulation - IQ')
             if demod_iq:
-                signal_i = self.getValue('Demodulation - Input I')
-                signal_q = self.getValue('Demodulation - Input Q')
+                signal = [self.getValue('Demodulation - Input I'),
+                          self.getValue('Demodulation - Input Q')]
             else:
-                signal = self.getValue('Demodulation - Input')
+                signal = [self.getValue('Demodulation - Input')]
             ref = self.getValue('Demodulation - Reference')
-            # perform demodulation
-            if demod_iq:
+            # demodulate all qubits at once, reuse for the other qubits
+            inputs = signal + [ref]
+            if (self.demodulated is None or
+                    not self.isSameInput(inputs, self.demodulated_input)):
+                readout = self.sequence_to_waveforms.readout
+                if demod_iq:
+                    self.demodulated = readout.demodulate_iq_all(
+                        signal[0], signal[1], ref)
+                else:
+                    self.demodulated = readout.demodulate_all(signal[0], ref)
+                self.demodulated_input = inputs
+            if n < len(self.demodulated):
+                value = self.demodulated[n]
+            elif demod_iq:
+                # qubit not in use, demodulate separately
                 value = self.sequence_to_waveforms.readout.demodulate_iq(
-                    n, signal_i, signal_q, ref)
+                    n, signal[0], signal[1], ref)
             else:
                 value = self.sequence_to_waveforms.readout.demodulate(
-                    n, signal, ref)
+                    n, signal[0], ref)
             # average values if not single-shot
             if not quant.name.startswith('Single-shot, QB'):
                 value = np.mean(value)
 
+        elif quant.name == 'Compile time':
+            # time and profile of the last compilation of the traces
+            value = self.sequence_to_waveforms.profile_time
+        elif quant.name == 'Compile profile':
+            value = self.sequence_to_waveforms.format_profile()
+
         elif quant.isVector():
             # traces, check if waveform needs to be re-calculated
-            if self.isConfigUpdated():
-                # update sequence object with current driver configuation
-                config = self.instrCfg.getValuesDict()
-                self.sequence.set_parameters(config)
-                self.sequence_to_waveforms.set_parameters(config)
+            updated = self.isConfigUpdated()
+            if self.getValue('Sequence') == 'Custom':
+                # reload custom sequence if the file was edited
+                updated = self.updateCustomSequence(
+                    self.getValue('Custom Python file')) or updated
+            if updated:
+                # incremental compilation sets the parameters itself, to
+                # record which settings each compilation stage reads
+                incremental = (
+                    self.getValue('Incremental compilation') and
+                    not self.getValue('Output multiple sequences'))
+                config = self.applyConfig(set_parameters=not incremental)
 
                 # check if calculating multiple sequences, for randomization
                 if config.get('Output multiple sequences', False):
-                    # create multiple randomizations, store in memory
+                    # create multiple randomizations, compile all at once
                     n_call = int(config.get('Number of multiple sequences', 1))
-                    calls = []
-                    for n in range(n_call):
-                        config['Randomize'] += 1
-                        calls.append(
-                            copy.deepcopy(
-                                self.sequence_to_waveforms.get_waveforms(
-                                    self.sequence.get_sequence(config))))
-
-                    # after all calls are done, convert output to matrix form
-                    self.waveforms = dict()
-                    n_qubit = self.sequence.n_qubit
                     # Align RB waveforms to end
                     align_RB_to_end = config.get('Align RB waveforms to end', False)
-                    # start with xy, z and gate waveforms, list of data
-                    for key in ['xy', 'z', 'gate']:
-                        # get size of longest waveform
-                        self.waveforms[key] = []
-                        for n in range(n_qubit):
-                            length = max([len(call[key][n]) for call in calls])
-                            # build matrix
-                            datatype = calls[0][key][n].dtype
-                            data = np.zeros((n_call, length), dtype=datatype)
-                            for m, call in enumerate(calls):
-                                if align_RB_to_end:
-                                    data[m][-len(call[key][n]):] = call[key][n]
-                                else:
-                                    data[m][:len(call[key][n])] = call[key][n]
-                            self.waveforms[key].append(data)
-
-                    # same for readout waveforms
-                    for key in ['readout_trig', 'readout_iq']:
-                        length = max([len(call[key]) for call in calls])
-                        datatype = calls[0][key].dtype
-                        data = np.zeros((n_call, length), dtype=datatype)
-                        for m, call in enumerate(calls):
-                            if align_RB_to_end:
-                                data[m][-len(call[key]):] = call[key]
-                            else:
-                                data[m][:len(call[key])] = call[key]
-                        self.waveforms[key] = data
+                    if config.get('Parallel compilation', False):
+                        # generate and compile in worker processes, which
+                        # are kept until the number of workers changes
+                        n_workers = int(
+                            config.get('Number of worker processes', 0))
+                        pool = WorkerPool(n_workers)
+                        if (self.worker_pool is None or
+                                self.worker_pool.n_workers != pool.n_workers):
+                            if self.worker_pool is not None:
+                                self.worker_pool.close()
+                            self.worker_pool = pool
+                        # custom sequences are loaded from file by workers
+                        if config.get('Sequence') == 'Custom':
+                            sequence_class = config.get('Custom Python file')
+                        else:
+                            sequence_class = type(self.sequence)
+                        self.waveforms = self.worker_pool.get_waveforms(
+                            sequence_class, config, n_call,
+                            align_end=align_RB_to_end)
+                    else:
+                        sequences = []
+                        for n in range(n_call):
+                            config['Randomize'] += 1
+                            sequences.append(
+                                self.sequence.get_sequence(config))
+                        self.waveforms = \
+                            self.sequence_to_waveforms.get_waveforms_batch(
+                                sequences, align_end=align_RB_to_end)
 
+                elif incremental:
+                    # only re-run stages affected by the changed settings
+                    self.waveforms = \
+                        self.sequence_to_waveforms.get_waveforms_incremental(
+                            self.sequence, config)
                 else:
                     # normal operation, calcluate waveforms
                     self.waveforms = self.sequence_to_waveforms.get_waveforms(
@@ -171,6 +210,47 @@ class Driver(LabberDriver):
             value = quant.getValue()
         return value
 
+    def applyConfig(self, set_parameters=True):
+        """Update sequence objects with the current driver configuration.
+
+        The demodulated values are cleared, since the readout settings may
+        have changed.
+
+        Parameters
+        ----------
+        set_parameters : bool
+            If False, the parameters of the sequence objects are not set,
+            for compilation methods that set them (the default is True).
+
+        Returns
+        -------
+        dict
+            Current driver configuration.
+
+        """
+        config = self.instrCfg.getValuesDict()
+        if set_parameters:
+            self.sequence.set_parameters(config)
+            self.sequence_to_waveforms.set_parameters(config)
+        self.demodulated = None
+        self.demodulated_input = None
+        return config
+
+    def isSameInput(self, inputs, old_inputs):
+        """Check if demodulation input traces are unchanged."""
+        if old_inputs is None or len(inputs) != len(old_inputs):
+            return False
+        for trace, old_trace in zip(inputs, old_inputs):
+            if trace is None or old_trace is None:
+                if trace is not old_trace:
+                    return False
+            elif (trace.get('dt') != old_trace.get('dt') or
+                  trace.get('shape') != old_trace.get('shape') or
+                  not (trace['y'] is old_trace['y'] or
+                       np.array_equal(trace['y'], old_trace['y']))):
+                return False
+        return True
+
     def getWaveformFromMemory(self, quant):
         """Return data from already calculated waveforms."""
         # check which data to return
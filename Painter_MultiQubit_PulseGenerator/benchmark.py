@@ -0,0 +1,1120 @@
+#!/usr/bin/env python3
+"""Benchmark and regression check of the sequence compiler.
+
+Compiles a set of representative sequences without Labber, using the default
+values of the driver configuration file as configuration. For each workload,
+the time spent in each compilation stage, the peak memory and a hash of the
+compiled waveforms are recorded. The results can be saved as a JSON baseline,
+and later runs compared to it::
+
+    python benchmark.py --save baseline.json
+    python benchmark.py --baseline baseline.json --tolerance 20
+
+The comparison fails if the waveforms are not bit-for-bit identical, or if a
+stage got slower or used more memory than allowed by the tolerance.
+"""
+import argparse
+import configparser
+import hashlib
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from copy import deepcopy
+
+import numpy as np
+import scipy
+
+from numpy.fft import fft, fftshift, ifft, ifftshift
+from scipy.interpolate import interp1d
+from scipy.linalg import inv
+
+from crosstalk import Crosstalk
+from predistortion import ExponentialPredistortion, Predistortion
+from pulse import Pulse, PulseShape, PulseType
+from readout import Readout
+from sequence import SequenceToWaveforms
+from sequence_builtin import CPMG, Rabi, ZRabi
+from sequence_rb import SingleQubit_RB, TwoQubit_RB
+
+log = logging.getLogger('LabberDriver')
+
+# configuration file of the driver, for default values
+INI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'Painter_MultiQubit_PulseGenerator.ini')
+
+# version of the baseline file format
+BASELINE_VERSION = 1
+
+# allowed increase of stage time and peak memory, in percent
+DEFAULT_TOLERANCE = 20.0
+# differences smaller than these are never considered regressions
+MIN_TIME_DIFFERENCE = 2E-3
+MIN_MEMORY_DIFFERENCE = 1E6
+
+# compilation stages, in the order they are shown
+STAGES = ('sequence', 'seperate_gates', 'add_timings', 'init_waveforms',
+          'virtual_z', 'generate_waveforms', 'crosstalk', 'predistort',
+          'readout_trig', 'microwave_gate', 'filter')
+
+# values of "Number of qubits", for one to nine qubits
+N_QUBIT_NAMES = ('One', 'Two', 'Three', 'Four', 'Five', 'Six', 'Seven',
+                 'Eight', 'Nine')
+
+_RB_1QB = {'Sequence': '1-QB Randomized Benchmarking',
+           'Number of qubits': 'One'}
+_RB_2QB = {'Sequence': '2-QB Randomized Benchmarking',
+           'Number of qubits': 'Two'}
+_RB_1QB_DRAG = dict(_RB_1QB, **{
+    'Number of Cliffords': 1000.0, 'Use DRAG': True,
+    'DRAG scaling #1': 0.2E-9, 'DRAG frequency detuning #1': 2E6})
+# 100 us CPMG on nine qubits, with DRAG and different SSB frequencies
+_CPMG_9QB = {'Sequence': 'CP/CPMG', 'Number of qubits': 'Nine',
+             '# of pi pulses': 100.0, 'Sequence duration': 100E-6,
+             'Use DRAG': True}
+for _n in range(1, 10):
+    _CPMG_9QB['Frequency #%d' % _n] = (40 + 23 * _n) * 1E6
+    _CPMG_9QB['DRAG scaling #%d' % _n] = 0.2E-9
+
+# name: (sequence class, configuration values differing from the defaults)
+WORKLOADS = {
+    'rb_1qb_1': (SingleQubit_RB,
+                 dict(_RB_1QB, **{'Number of Cliffords': 1.0})),
+    'rb_1qb_10': (SingleQubit_RB,
+                  dict(_RB_1QB, **{'Number of Cliffords': 10.0})),
+    'rb_1qb_100': (SingleQubit_RB,
+                   dict(_RB_1QB, **{'Number of Cliffords': 100.0})),
+    'rb_1qb_1000': (SingleQubit_RB,
+                    dict(_RB_1QB, **{'Number of Cliffords': 1000.0})),
+    'rb_2qb_1': (TwoQubit_RB,
+                 dict(_RB_2QB, **{'Number of Cliffords': 1.0})),
+    'rb_2qb_10': (TwoQubit_RB,
+                  dict(_RB_2QB, **{'Number of Cliffords': 10.0})),
+    'rb_2qb_100': (TwoQubit_RB,
+                   dict(_RB_2QB, **{'Number of Cliffords': 100.0})),
+    'rb_2qb_1000': (TwoQubit_RB,
+                    dict(_RB_2QB, **{'Number of Cliffords': 1000.0})),
+    # 1000-gate RB with DRAG pulses, calculated per gate and with the
+    # envelope cache
+    'rb_1qb_1000_drag': (SingleQubit_RB, dict(_RB_1QB_DRAG, **{
+        'Cache pulse envelopes': False})),
+    'rb_1qb_1000_drag_cache': (SingleQubit_RB, dict(_RB_1QB_DRAG, **{
+        'Cache pulse envelopes': True})),
+    'cpmg_500': (CPMG, {'Sequence': 'CP/CPMG', 'Number of qubits': 'One',
+                        '# of pi pulses': 500.0,
+                        'Sequence duration': 100E-6}),
+    # nine-qubit waveforms in double and single precision
+    'cpmg_9qb_100us': (CPMG, dict(_CPMG_9QB, **{
+        'Single-precision waveforms': False})),
+    'cpmg_9qb_100us_single': (CPMG, dict(_CPMG_9QB, **{
+        'Single-precision waveforms': True})),
+    # 200 us T1 on three qubits, with gate and output filters
+    't1_200us': (CPMG, {'Sequence': 'CP/CPMG', 'Number of qubits': 'Three',
+                        '# of pi pulses': -1.0, 'Sequence duration': 200E-6,
+                        'Generate gate': True, 'Filter gate waveforms': True,
+                        'Filter Z waveforms': True}),
+    'readout_9qb': (Rabi, {'Sequence': 'Rabi', 'Number of qubits': 'Nine',
+                           'Readout delay': 1E-6}),
+    'cz_predistort': (TwoQubit_RB, dict(_RB_2QB, **{
+        'Number of Cliffords': 100.0, 'Predistort Z': True,
+        'Predistort Z1 - A1': 0.02, 'Predistort Z1 - tau1': 1E-7,
+        'Predistort Z1 - A2': -0.01, 'Predistort Z1 - tau2': 2E-6,
+        'Predistort Z2 - A1': 0.01, 'Predistort Z2 - tau1': 5E-7,
+        'Filter Z waveforms': True})),
+}
+
+
+def load_default_config(path=INI_PATH):
+    """Get configuration dict with the default values of the driver.
+
+    Parameters
+    ----------
+    path : str
+        Path to the driver configuration file.
+
+    Returns
+    -------
+    dict
+        Configuration, with the same keys and value types as the dict
+        returned by Labber's `getValuesDict`.
+
+    """
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    parser.optionxform = str
+    parser.read(path)
+    config = dict()
+    for name in parser.sections():
+        if name == 'General settings':
+            continue
+        section = parser[name]
+        datatype = section.get('datatype', 'DOUBLE').upper()
+        value = section.get('def_value')
+        if datatype == 'DOUBLE':
+            config[name] = float(value) if value is not None else 0.0
+        elif datatype == 'BOOLEAN':
+            config[name] = (value is not None and
+                            value.strip() in ('1', 'True', 'true'))
+        elif datatype == 'COMBO':
+            config[name] = (value if value is not None else
+                            section.get('combo_def_1'))
+        elif datatype in ('STRING', 'PATH'):
+            config[name] = value if value is not None else ''
+    return config
+
+
+def get_waveform_hash(waveforms):
+    """Get hash of compiled waveforms, including data types and shapes.
+
+    Parameters
+    ----------
+    waveforms : dict
+        Waveforms, as returned by `SequenceToWaveforms.get_waveforms`.
+
+    Returns
+    -------
+    str
+        SHA-1 hex digest of the waveforms.
+
+    """
+    h = hashlib.sha1()
+    for key in ('xy', 'z', 'gate', 'readout_trig', 'readout_iq'):
+        values = waveforms[key]
+        for data in (values if isinstance(values, list) else [values]):
+            data = np.ascontiguousarray(data)
+            h.update(('%s %s %s;' % (key, data.dtype.str,
+                                     data.shape)).encode())
+            h.update(data.tobytes())
+    return h.hexdigest()
+
+
+def compile_workload(name, config=None, timings=None):
+    """Compile one workload with newly created objects.
+
+    Parameters
+    ----------
+    name : str
+        Name of workload in `WORKLOADS`.
+    config : dict
+        Default configuration. If None, it is loaded from the driver
+        configuration file (the default is None).
+    timings : dict
+        If given, the time spent in each stage, from the profile of the
+        compilation, is stored in this dict (the default is None).
+
+    Returns
+    -------
+    dict
+        Compiled waveforms.
+
+    """
+    (sequence_class, values) = WORKLOADS[name]
+    config = dict(load_default_config() if config is None else config)
+    config.update(values)
+    sequence = sequence_class()
+    sequence_to_waveforms = SequenceToWaveforms()
+    # the sequence stage includes setting the parameters
+    t0 = time.perf_counter()
+    sequence.set_parameters(config)
+    sequence_to_waveforms.set_parameters(config)
+    sequences = sequence.get_sequence(config)
+    t = time.perf_counter() - t0
+    waveforms = sequence_to_waveforms.get_waveforms(sequences)
+    if timings is not None:
+        timings['sequence'] = t
+        for stage, profile in sequence_to_waveforms.profile.items():
+            timings[stage] = profile['time']
+    return waveforms
+
+
+def run_workload(name, config=None, repeat=3):
+    """Benchmark one workload.
+
+    Parameters
+    ----------
+    name : str
+        Name of workload in `WORKLOADS`.
+    config : dict
+        Default configuration. If None, it is loaded from the driver
+        configuration file (the default is None).
+    repeat : int
+        Number of timed compilations, the fastest time of each stage is
+        reported (the default is 3).
+
+    Returns
+    -------
+    dict
+        Waveform hash, number of points, fastest total time and stage times
+        in seconds, and peak memory in bytes.
+
+    Raises
+    ------
+    RuntimeError
+        If the compiled waveforms differ between repetitions.
+
+    """
+    if config is None:
+        config = load_default_config()
+    # the first run includes one-time setup, such as loading lookup tables
+    waveforms = compile_workload(name, config)
+    waveform_hash = get_waveform_hash(waveforms)
+    n_pts = len(waveforms['readout_iq'])
+    if len(waveforms['xy']) > 0:
+        n_pts = max(n_pts, len(waveforms['xy'][0]))
+    waveforms = None
+    # peak memory, in a separate run since tracing slows down compilation
+    tracemalloc.start()
+    try:
+        compile_workload(name, config)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    total = None
+    stages = dict()
+    for n in range(max(1, int(repeat))):
+        timings = dict()
+        t0 = time.perf_counter()
+        waveforms = compile_workload(name, config, timings)
+        t = time.perf_counter() - t0
+        if get_waveform_hash(waveforms) != waveform_hash:
+            raise RuntimeError(
+                'Waveforms of workload "%s" differ between runs.' % name)
+        waveforms = None
+        total = t if total is None else min(total, t)
+        for stage, t in timings.items():
+            stages[stage] = min(stages.get(stage, t), t)
+    return dict(hash=waveform_hash, n_pts=n_pts, total=total, stages=stages,
+                peak_memory=peak_memory)
+
+
+def get_environment():
+    """Get versions of the packages the waveform hashes may depend on."""
+    return dict(python=platform.python_version(), numpy=np.__version__,
+                scipy=scipy.__version__, machine=platform.machine())
+
+
+def run_benchmark(names=None, repeat=3):
+    """Benchmark workloads.
+
+    Parameters
+    ----------
+    names : list of str
+        Workloads to run. If None, all workloads are run (the default is
+        None).
+    repeat : int
+        Number of timed compilations of each workload (the default is 3).
+
+    Returns
+    -------
+    dict
+        Benchmark results, in the format of the baseline file.
+
+    """
+    if names is None:
+        names = list(WORKLOADS)
+    config = load_default_config()
+    results = dict(version=BASELINE_VERSION, environment=get_environment(),
+                   workloads=dict())
+    for name in names:
+        result = run_workload(name, config, repeat)
+        results['workloads'][name] = result
+        log.info('Benchmark %s: %.1f ms' % (name, 1E3 * result['total']))
+    return results
+
+
+def compare_results(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compare benchmark results to a baseline.
+
+    Parameters
+    ----------
+    results : dict
+        Results, as returned by `run_benchmark`.
+    baseline : dict
+        Baseline results, in the same format.
+    tolerance : float
+        Allowed increase of stage time and peak memory, in percent
+        (the default is 20).
+
+    Returns
+    -------
+    list of str
+        Description of each regression, empty if there are none.
+
+    """
+    if baseline.get('version') != BASELINE_VERSION:
+        return ['Baseline has unsupported version %s.' %
+                str(baseline.get('version'))]
+    limit = 1.0 + tolerance / 100.0
+    regressions = []
+    for name, result in results['workloads'].items():
+        old = baseline['workloads'].get(name)
+        if old is None:
+            continue
+        if result['hash'] != old['hash']:
+            regressions.append('%s: waveforms differ from baseline' % name)
+        for stage, t in sorted(result['stages'].items()):
+            t_old = old['stages'].get(stage)
+            if (t_old is not None and t > limit * t_old and
+                    t - t_old > MIN_TIME_DIFFERENCE):
+                regressions.append(
+                    '%s: stage %s took %.1f ms, baseline %.1f ms' %
+                    (name, stage, 1E3 * t, 1E3 * t_old))
+        memory, memory_old = result['peak_memory'], old['peak_memory']
+        if (memory > limit * memory_old and
+                memory - memory_old > MIN_MEMORY_DIFFERENCE):
+            regressions.append(
+                '%s: peak memory %.1f MB, baseline %.1f MB' %
+                (name, 1E-6 * memory, 1E-6 * memory_old))
+    return regressions
+
+
+def format_results(results):
+    """Format benchmark results as a table, with stage times below each
+    workload."""
+    lines = ['%-14s %8s %9s %9s  %s' % ('workload', 'n_pts', 'total/ms',
+                                       'peak/MB', 'hash')]
+    for name, result in results['workloads'].items():
+        lines.append('%-14s %8d %9.1f %9.1f  %s' % (
+            name, result['n_pts'], 1E3 * result['total'],
+            1E-6 * result['peak_memory'], result['hash'][:12]))
+        stages = [s for s in STAGES if s in result['stages']]
+        stages += sorted(set(result['stages']) - set(STAGES))
+        line = '   '
+        for s in stages:
+            item = ' %s %.1f' % (s, 1E3 * result['stages'][s])
+            if len(line) + len(item) > 79:
+                lines.append(line)
+                line = '   '
+            line += item
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def calculate_cz_waveform_previous(pulse):
+    """Previous CZ trajectory, with loops and a cumulative integral per point.
+
+    Sets `theta_i`, `theta_f`, `theta_tau` and `t_tau` of the pulse, as
+    `Pulse.calculate_cz_waveform`.
+    """
+    pulse.theta_i = np.arctan(2 * pulse.Coupling / pulse.Offset)
+    pulse.theta_f = np.arctan(2 * pulse.Coupling / pulse.amplitude)
+    Lcoeff = pulse.Lcoeff
+    Lcoeff[0] = (((pulse.theta_f - pulse.theta_i) / 2)
+                 - np.sum(pulse.Lcoeff[range(2, pulse.F_Terms, 2)]))
+    n = np.arange(1, pulse.F_Terms + 1, 1)
+    n_points = 1000
+    tau = np.linspace(0, 1, n_points)
+    pulse.theta_tau = np.zeros(n_points)
+    for i in range(n_points):
+        pulse.theta_tau[i] = (
+            np.sum(Lcoeff * (1 - np.cos(2 * np.pi * n * tau[i]))) +
+            pulse.theta_i)
+    t_tau = np.trapz(np.sin(pulse.theta_tau), x=tau)
+    Width_tau = pulse.width / t_tau
+    tau = np.linspace(0, Width_tau, n_points)
+    pulse.t_tau = np.zeros(n_points)
+    for i in range(n_points):
+        if i > 0:
+            pulse.t_tau[i] = np.trapz(
+                np.sin(pulse.theta_tau[0:i + 1]), x=tau[0:i + 1])
+
+
+def calculate_cz_theta_previous(pulse, t0, t):
+    """Previous CZ angle trajectory with plateau, interpolated per sample"""
+    theta_t = np.ones(len(t)) * pulse.theta_i
+    for i in range(len(t)):
+        if 0 < (t[i] - t0 + pulse.plateau / 2) < pulse.plateau:
+            theta_t[i] = pulse.theta_f
+        elif (0 < (t[i] - t0 + pulse.width / 2 + pulse.plateau / 2) <
+                (pulse.width + pulse.plateau) / 2):
+            theta_t[i] = np.interp(
+                t[i] - t0 + pulse.width / 2 + pulse.plateau / 2,
+                pulse.t_tau, pulse.theta_tau)
+        elif (0 < (t[i] - t0 + pulse.width / 2 + pulse.plateau / 2) <
+                (pulse.width + pulse.plateau)):
+            theta_t[i] = np.interp(
+                t[i] - t0 + pulse.width / 2 - pulse.plateau / 2,
+                pulse.t_tau, pulse.theta_tau)
+    return theta_t
+
+
+def calculate_cz_envelope_previous(pulse, t0, t):
+    """Previous CZ envelope, see `Pulse.calculate_envelope`"""
+    if pulse.plateau == 0:
+        theta_t = np.interp(t - t0 + pulse.width / 2, pulse.t_tau,
+                            pulse.theta_tau)
+    else:
+        theta_t = calculate_cz_theta_previous(pulse, t0, t)
+    theta_t = np.clip(theta_t, pulse.theta_i, None)
+    df = 2 * pulse.Coupling * (
+        1 / np.tan(theta_t) - 1 / np.tan(pulse.theta_i))
+    values = df / pulse.dfdV
+    if pulse.negative_amplitude is True:
+        values = -values
+    values[t < (t0 - pulse.total_duration() / 2)] = 0
+    values[t > (t0 + pulse.total_duration() / 2)] = 0
+    return values
+
+
+def get_cz_pulse(width=500E-9, plateau=0.0, amplitude=50E6,
+                 Lcoeff=(0.3,)):
+    """Get CZ pulse with the given shape, with the trajectory calculated"""
+    pulse = Pulse(shape=PulseShape.CZ, pulse_type=PulseType.Z)
+    pulse.width = width
+    pulse.plateau = plateau
+    pulse.amplitude = amplitude
+    pulse.F_Terms = len(Lcoeff)
+    pulse.Lcoeff = np.array(Lcoeff, dtype=float)
+    pulse.calculate_cz_waveform()
+    return pulse
+
+
+def time_call(func, repeat, number=1):
+    """Get fastest time of a function call, in seconds"""
+    lTime = []
+    for n in range(max(1, int(repeat))):
+        t0 = time.perf_counter()
+        for m in range(number):
+            func()
+        lTime.append((time.perf_counter() - t0) / number)
+    return min(lTime)
+
+
+def run_cz(repeat):
+    """Time CZ trajectory and envelope of 500 ns pulses at 2 GSa/s"""
+    rows = []
+    sample_rate = 2E9
+    pulse = get_cz_pulse(width=500E-9, Lcoeff=(0.3, 0.0, 0.05))
+    reference = get_cz_pulse(width=500E-9, Lcoeff=(0.3, 0.0, 0.05))
+    t_old = time_call(lambda: calculate_cz_waveform_previous(reference),
+                      repeat)
+    t_new = time_call(pulse.calculate_cz_waveform, repeat, 10)
+    rows.append(('cz_waveform', t_old, t_new,
+                 np.max(np.abs(pulse.t_tau - reference.t_tau)) /
+                 pulse.width))
+    for plateau in (0.0, 100E-9):
+        pulse.plateau = reference.plateau = plateau
+        duration = pulse.total_duration()
+        t = np.arange(int(round(duration * sample_rate))) / sample_rate
+        t0 = duration / 2
+        t_old = time_call(
+            lambda: calculate_cz_envelope_previous(reference, t0, t), repeat)
+        t_new = time_call(lambda: pulse.calculate_envelope(t0, t), repeat, 10)
+        difference = np.max(np.abs(
+            pulse.calculate_envelope(t0, t) -
+            calculate_cz_envelope_previous(reference, t0, t)))
+        rows.append(('cz_envelope_plateau_%dns' % round(1E9 * plateau),
+                     t_old, t_new, difference))
+    return rows
+
+
+def predistort_previous(predistortion, waveform):
+    """Previous XY predistortion, with the inverse filter built per call"""
+    predistortion.tvals = np.arange(0, predistortion.dt * len(waveform),
+                                    predistortion.dt)
+    response_I = ifft(ifftshift(predistortion.vFilteredResponse_FFT_I))
+    response_FFT_I_r = fftshift(fft(complex(1, 0) * response_I.real))
+    response_FFT_I_i = fftshift(fft(complex(1, 0) * response_I.imag))
+    response_Q = ifft(ifftshift(predistortion.vFilteredResponse_FFT_Q))
+    response_FFT_Q_r = fftshift(fft(complex(1, 0) * response_Q.real))
+    response_FFT_Q_i = fftshift(fft(complex(1, 0) * response_Q.imag))
+    determinant = response_FFT_I_r * response_FFT_Q_i - \
+        response_FFT_Q_r * response_FFT_I_i
+    Inverse_A = interp1d(predistortion.vResponse_freqs,
+                         response_FFT_Q_i / determinant)
+    Inverse_B = interp1d(predistortion.vResponse_freqs,
+                         -response_FFT_Q_r / determinant)
+    Inverse_C = interp1d(predistortion.vResponse_freqs,
+                         -response_FFT_I_i / determinant)
+    Inverse_D = interp1d(predistortion.vResponse_freqs,
+                         response_FFT_I_r / determinant)
+    fft_vals, fft_signal_r = predistortion.apply_FFT(
+        predistortion.tvals, complex(1, 0) * waveform.real)
+    fft_vals, fft_signal_i = predistortion.apply_FFT(
+        predistortion.tvals, complex(1, 0) * waveform.imag)
+    fft_signal = (fft_signal_r * Inverse_A(fft_vals) + fft_signal_i *
+                  Inverse_B(fft_vals) + 1j *
+                  (fft_signal_r * Inverse_C(fft_vals) +
+                   fft_signal_i * Inverse_D(fft_vals)))
+    corr_signal = ifft(ifftshift(fft_signal))
+    vI = np.array(corr_signal.real, dtype='float64')
+    vQ = np.array(corr_signal.imag, dtype='float64')
+    return vI + 1j * vQ
+
+
+def exponential_predistort_previous(predistortion, waveform):
+    """Previous Z predistortion, with the filter response built per call"""
+    p = predistortion
+    pad_time = 6 * max([p.tau1, p.tau2, p.tau3])
+    padded = np.zeros(len(waveform) + round(pad_time / p.dt))
+    padded[:len(waveform)] = waveform
+    Y = np.fft.rfft(padded, norm='ortho')
+    omega = 2 * np.pi * np.fft.rfftfreq(len(padded), p.dt)
+    H = (1 +
+         (1j * p.A1 * omega * p.tau1) / (1j * omega * p.tau1 + 1) +
+         (1j * p.A2 * omega * p.tau2) / (1j * omega * p.tau2 + 1) +
+         (1j * p.A3 * omega * p.tau3) / (1j * omega * p.tau3 + 1) +
+         (1j * p.A4 * omega * p.tau4) / (1j * omega * p.tau4 + 1))
+    yc = np.fft.irfft(Y / H, norm='ortho')
+    return yc[:len(waveform)]
+
+
+def get_transfer_predistortion(sample_rate, n_freq=4001, seed=0):
+    """Get XY predistortion with a smooth, synthetic mixer response.
+
+    The response is set directly, instead of loading a Labber log file.
+    """
+    predistortion = Predistortion(0)
+    predistortion.dt = 1 / sample_rate
+    rng = np.random.default_rng(seed)
+    # response slightly beyond the Nyquist frequency, for interpolation
+    freqs = np.linspace(-0.51, 0.51, n_freq) * sample_rate
+    x = freqs / sample_rate
+    (a, b) = rng.uniform(-0.2, 0.2, 2)
+    predistortion.vResponse_freqs = freqs
+    predistortion.vFilteredResponse_FFT_I = (1 + a * x ** 2 +
+                                             0.05j * np.sin(3 * x))
+    predistortion.vFilteredResponse_FFT_Q = (0.9 + b * x +
+                                             0.02j * np.cos(5 * x))
+    predistortion._transfer_key = ('synthetic', seed)
+    return predistortion
+
+
+def get_exponential_predistortion(sample_rate):
+    """Get Z predistortion with the poles of the cz_predistort workload"""
+    config = dict(WORKLOADS['cz_predistort'][1])
+    config['Sample rate'] = sample_rate
+    for n in (3, 4):
+        config['Predistort Z1 - A%d' % n] = 0.0
+        config['Predistort Z1 - tau%d' % n] = 0.0
+    predistortion = ExponentialPredistortion(0)
+    predistortion.set_parameters(config)
+    return predistortion
+
+
+def run_predistortion(repeat, n_point=50, n_pts=100000):
+    """Time a 50-point sweep of a non-predistortion parameter.
+
+    The waveform amplitude changes at each point, so the waveforms differ
+    but the predistortion filters stay the same.
+    """
+    sample_rate = 1.2E9
+    t = np.arange(n_pts) / sample_rate
+    envelope = np.exp(-((t - t[-1] / 2) / (0.1 * t[-1])) ** 2)
+    rows = []
+    for (label, predistortion, previous, waveform) in (
+            ('predistort_xy_sweep', get_transfer_predistortion(sample_rate),
+             predistort_previous, envelope * np.exp(2j * np.pi * 1E8 * t)),
+            ('predistort_z_sweep', get_exponential_predistortion(sample_rate),
+             exponential_predistort_previous, envelope)):
+        amplitudes = np.linspace(0.1, 1.0, n_point)
+
+        def sweep_previous():
+            return [previous(predistortion, a * waveform)
+                    for a in amplitudes]
+
+        def sweep():
+            # each sweep starts with an empty cache
+            predistortion._kernels.clear()
+            return [predistortion.predistort(a * waveform)
+                    for a in amplitudes]
+        t_old = time_call(sweep_previous, repeat) / n_point
+        t_new = time_call(sweep, repeat) / n_point
+        difference = max(np.max(np.abs(a - b)) for (a, b) in zip(
+            sweep_previous(), sweep()))
+        rows.append((label, t_old, t_new, difference))
+    return rows
+
+
+def run_window_filter(repeat, n_pts=1000000):
+    """Time direct and FFT convolution of filter windows of 5-2001 taps.
+
+    The direct convolution is the default, the FFT convolution is used for
+    long windows if "FFT filter convolution" is set.
+    """
+    sequence_to_waveforms = SequenceToWaveforms()
+    sequence_to_waveforms.fft_filter = True
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-1, 1, n_pts)
+    rows = []
+    for size in (5, 21, 101, 501, 2001):
+        window = sequence_to_waveforms._get_filter_window(size, 'Kaiser', 14.0)
+        t_old = time_call(lambda: np.convolve(x, window, mode='same'), repeat)
+        t_new = time_call(
+            lambda: sequence_to_waveforms._convolve_window(x, window), repeat)
+        difference = np.max(np.abs(
+            np.convolve(x, window, mode='same') -
+            sequence_to_waveforms._convolve_window(x, window)))
+        rows.append(('window_filter_%d_taps' % size, t_old, t_new,
+                     difference))
+    return rows
+
+
+def add_microwave_gate_previous(sequence_to_waveforms):
+    """Previous microwave gate, with a loop over the gate edges.
+
+    Returns the gate waveforms instead of storing them, see
+    `SequenceToWaveforms._add_microwave_gate`.
+    """
+    self = sequence_to_waveforms
+    gates = []
+    n_wave = self.n_qubit if self.local_xy else 1
+    # go through all waveforms
+    for n, wave in enumerate(self._wave_xy[:n_wave]):
+        if self.uniform_gate:
+            # the uniform gate is all ones
+            gate = np.ones_like(wave)
+            # if creating readout trig, turn off gate during readout
+            if self.readout_trig_generate:
+                gate[-int((self.readout_trig_duration -
+                           self.gate_overlap -
+                           self.gate_delay) * self.sample_rate):] = 0.0
+        else:
+            # non-uniform gate, find non-zero elements
+            gate = np.array(np.abs(wave) > 0.0, dtype=float)
+            # fix gate overlap
+            n_overlap = int(np.round(self.gate_overlap * self.sample_rate))
+            diff_gate = np.diff(gate)
+            indx_up = np.nonzero(diff_gate > 0.0)[0]
+            indx_down = np.nonzero(diff_gate < 0.0)[0]
+            # add extra elements to left and right for overlap
+            for indx in indx_up:
+                gate[max(0, indx - n_overlap):(indx + 1)] = 1.0
+            for indx in indx_down:
+                gate[indx:(indx + n_overlap + 1)] = 1.0
+
+            # fix gaps in gate shorter than min (look for 1>0)
+            diff_gate = np.diff(gate)
+            indx_up = np.nonzero(diff_gate > 0.0)[0]
+            indx_down = np.nonzero(diff_gate < 0.0)[0]
+            # ignore first transition if starting in zero
+            if gate[0] == 0:
+                indx_up = indx_up[1:]
+            n_down_up = min(len(indx_down), len(indx_up))
+            len_down = indx_up[:n_down_up] - indx_down[:n_down_up]
+            # find short gaps
+            short_gaps = np.nonzero(len_down < (self.minimal_gate_time *
+                                                self.sample_rate))[0]
+            for indx in short_gaps:
+                gate[indx_down[indx]:(1 + indx_up[indx])] = 1.0
+
+            # shift gate in time
+            n_shift = int(np.round(self.gate_delay * self.sample_rate))
+            if n_shift < 0:
+                n_shift = abs(n_shift)
+                gate = np.r_[gate[n_shift:], np.zeros((n_shift,))]
+            elif n_shift > 0:
+                gate = np.r_[np.zeros((n_shift,)), gate[:(-n_shift)]]
+        # make sure gate starts/ends in 0
+        gate[0] = 0.0
+        gate[-1] = 0.0
+        gates.append(gate)
+    return gates
+
+
+def run_microwave_gate(repeat):
+    """Time the microwave gate of 1000-Clifford RB and 500-pulse CPMG"""
+    rows = []
+    for name in ('rb_1qb_1000', 'cpmg_500'):
+        (sequence_class, values) = WORKLOADS[name]
+        config = load_default_config()
+        config.update(values)
+        config['Generate gate'] = True
+        sequence = sequence_class()
+        sequence_to_waveforms = SequenceToWaveforms()
+        sequence.set_parameters(config)
+        sequence_to_waveforms.set_parameters(config)
+        sequence_to_waveforms.get_waveforms(sequence.get_sequence(config))
+        t_old = time_call(
+            lambda: add_microwave_gate_previous(sequence_to_waveforms),
+            repeat, number=10)
+        t_new = time_call(sequence_to_waveforms._add_microwave_gate,
+                          repeat, number=10)
+        sequence_to_waveforms._add_microwave_gate()
+        difference = np.max(np.abs(
+            add_microwave_gate_previous(sequence_to_waveforms)[0] -
+            sequence_to_waveforms._wave_gate[0]))
+        rows.append(('microwave_gate_%s' % name, t_old, t_new, difference))
+    return rows
+
+def compensate_crosstalk_previous(crosstalk, waveforms):
+    """Previous crosstalk compensation, with np.matrix and einsum.
+
+    The matrix is inverted in each call, see `Crosstalk.compensate`.
+    """
+    mat_voltage_vs_phi0 = inv(np.matrix(crosstalk.phi0_vs_voltage))
+
+    wavform_length = len(waveforms[0])
+    wavform_num = len(crosstalk.Sequence)
+    wav_array = np.array(np.zeros((wavform_num, wavform_length)))
+    wav_toCorrect = []
+    for index, waveform in enumerate(waveforms):
+        if index + 1 in crosstalk.Sequence:
+            wav_array[index] = waveform
+            wav_toCorrect.append(index)
+
+    # dot product between the matrix and the waveforms at each timestep
+    new_array = np.einsum('ij,jk->ik', mat_voltage_vs_phi0, wav_array)
+
+    waveforms = list(waveforms)
+    for Corr_index, index in zip(wav_toCorrect,
+                                 range(0, len(crosstalk.Sequence))):
+        waveforms[Corr_index] = new_array[index]
+    return waveforms
+
+
+def get_crosstalk(path, n_qubit, seed=0):
+    """Get cross-talk compensation with a random matrix close to identity"""
+    rng = np.random.default_rng(seed)
+    matrix = np.eye(n_qubit) + 0.05 * rng.uniform(-1, 1, (n_qubit, n_qubit))
+    np.savetxt(path, matrix)
+    crosstalk = Crosstalk()
+    crosstalk.set_parameters({
+        'Compensate cross-talk': True, 'Cross-talk (CT) matrix': path,
+        '1-1 QB <--> Crosstalk matrix': True,
+        'Number of qubits': N_QUBIT_NAMES[n_qubit - 1]})
+    return crosstalk
+
+
+def run_crosstalk(repeat, n_qubit=9, n_pts=1000000):
+    """Time crosstalk compensation of nine 1e6-point waveforms"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '_benchmark_crosstalk.txt')
+    try:
+        crosstalk = get_crosstalk(path, n_qubit)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    rng = np.random.default_rng(0)
+    waveforms = list(rng.uniform(-1, 1, (n_qubit, n_pts)))
+    t_old = time_call(
+        lambda: compensate_crosstalk_previous(crosstalk, waveforms), repeat)
+    t_new = time_call(
+        lambda: crosstalk.compensate(list(waveforms)), repeat)
+    difference = max(np.max(np.abs(a - b)) for (a, b) in zip(
+        compensate_crosstalk_previous(crosstalk, waveforms),
+        crosstalk.compensate(list(waveforms))))
+    return [('crosstalk_%dqb_%d' % (n_qubit, n_pts), t_old, t_new,
+             difference)]
+
+def get_waveforms_batch_previous(sequence_to_waveforms, sequences_list,
+                                 align_end=False):
+    """Previous compilation of multiple sequences, as done by the driver.
+
+    Each sequence is compiled with `get_waveforms`, the result is copied and
+    all results are padded into 2D arrays, see
+    `SequenceToWaveforms.get_waveforms_batch`.
+    """
+    calls = [deepcopy(sequence_to_waveforms.get_waveforms(sequences))
+             for sequences in sequences_list]
+
+    def stack(values):
+        data = np.zeros((len(values), max([len(x) for x in values])),
+                        dtype=values[0].dtype)
+        for m, x in enumerate(values):
+            if align_end:
+                data[m][-len(x):] = x
+            else:
+                data[m][:len(x)] = x
+        return data
+
+    waveforms = dict()
+    for key in ('xy', 'z', 'gate'):
+        waveforms[key] = [stack([call[key][n] for call in calls])
+                          for n in range(sequence_to_waveforms.n_qubit)]
+    for key in ('readout_trig', 'readout_iq'):
+        waveforms[key] = stack([call[key] for call in calls])
+    return waveforms
+
+
+def get_randomized_sequences(sequence, config, n_call):
+    """Generate sequences with seeds `Randomize + n + 1`, as the driver"""
+    config = dict(config)
+    randomize = config['Randomize']
+    sequences_list = []
+    for n in range(n_call):
+        config['Randomize'] = randomize + n + 1
+        sequences_list.append(deepcopy(sequence.get_sequence(config)))
+    return sequences_list
+
+
+def run_batch(repeat, n_call=50):
+    """Time compilation of 50 randomizations of 100-Clifford 1-QB RB"""
+    config = load_default_config()
+    config.update(WORKLOADS['rb_1qb_100'][1])
+    sequence = SingleQubit_RB()
+    sequence_to_waveforms = SequenceToWaveforms()
+    sequence.set_parameters(config)
+    sequence_to_waveforms.set_parameters(config)
+
+    # sequences are generated in each call, as in the driver
+    def loop():
+        return get_waveforms_batch_previous(
+            sequence_to_waveforms,
+            get_randomized_sequences(sequence, config, n_call))
+
+    def batch():
+        return sequence_to_waveforms.get_waveforms_batch(
+            get_randomized_sequences(sequence, config, n_call))
+
+    t_old = time_call(loop, repeat)
+    t_new = time_call(batch, repeat)
+    (old, new) = (loop(), batch())
+    difference = max(np.max(np.abs(a - b)) for key in ('xy', 'z', 'gate')
+                     for (a, b) in zip(old[key], new[key]))
+    return [('batch_rb_1qb_100_x%d' % n_call, t_old, t_new, difference)]
+
+
+class DenseSequenceToWaveforms(SequenceToWaveforms):
+    """Previous compiler, processing the full Z waveforms.
+
+    Identity gates are calculated like all other gates, and crosstalk
+    compensation and the Z filter are applied to all waveform points instead
+    of only close to the Z pulses.
+    """
+
+    def _perform_crosstalk_compensation(self):
+        if not self.compensate_crosstalk:
+            return
+        self._wave_z = self._crosstalk.compensate(self._wave_z)
+
+    def _apply_window_filter(self, x, window, segments=None):
+        return super()._apply_window_filter(x, window)
+
+    def _generate_waveforms(self):
+        pulses_cz = set()
+        for step in self.sequences:
+            for qubit, gate in enumerate(step.gates):
+                pulse = self._get_pulse_for_gate(qubit, gate)
+                if pulse is not None and pulse.shape == PulseShape.CZ:
+                    pulses_cz.add(pulse)
+        for pulse in pulses_cz:
+            pulse.calculate_cz_waveform()
+
+        cache = self._envelope_cache if self.cache_envelopes else None
+        for pulse in (self.pulses_1qb_xy + self.pulses_1qb_z +
+                      self.pulses_2qb + self.pulses_readout):
+            pulse.envelope_cache = cache
+
+        for step in self.sequences:
+            for qubit, gate in enumerate(step.gates):
+                pulse = self._get_pulse_for_gate(qubit, gate)
+                if pulse is None:
+                    continue
+                if pulse.pulse_type == PulseType.Z:
+                    waveform = self._wave_z[qubit]
+                    delay = self.wave_z_delays[qubit]
+                elif pulse.pulse_type == PulseType.XY:
+                    waveform = self._wave_xy[qubit]
+                    delay = self.wave_xy_delays[qubit]
+                elif pulse.pulse_type == PulseType.READOUT:
+                    waveform = self.readout_iq
+                    delay = 0
+
+                if (pulse.pulse_type == PulseType.READOUT and not
+                        self.readout_match_main_size):
+                    start = 0.0
+                    middle = self._round(step.t_middle - step.t_start)
+                    end = self._round(step.t_end - step.t_start)
+                else:
+                    start = self._round(step.t_start + delay)
+                    middle = self._round(step.t_middle + delay)
+                    end = self._round(step.t_end + delay)
+
+                indices = np.arange(
+                    max(np.floor(start * self.sample_rate), 0),
+                    min(np.ceil(end * self.sample_rate), len(waveform)),
+                    dtype=int
+                )
+                if len(indices) == 0:
+                    continue
+
+                t = indices / self.sample_rate
+                max_duration = end - start
+                if step.align == 'center':
+                    t0 = middle
+                elif step.align == 'left':
+                    t0 = middle - (max_duration - pulse.total_duration()) / 2
+                elif step.align == 'right':
+                    t0 = middle + (max_duration - pulse.total_duration()) / 2
+                waveform[indices] += gate.get_waveform(pulse, t0, t)
+
+
+def get_crosstalk_config(path, n_qubit, coupling=0.05):
+    """Write cross-talk matrix file, return config values using it"""
+    matrix = np.eye(n_qubit) + coupling * (
+        np.ones((n_qubit, n_qubit)) - np.eye(n_qubit))
+    np.savetxt(path, matrix)
+    return {'Compensate cross-talk': True, 'Cross-talk (CT) matrix': path,
+            '1-1 QB <--> Crosstalk matrix': True}
+
+
+def run_sparse_z(repeat):
+    """Time 200 us T1 and Z Rabi with crosstalk, with full Z processing"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '_benchmark_crosstalk.txt')
+    cases = [
+        ('t1_200us', WORKLOADS['t1_200us'][0], WORKLOADS['t1_200us'][1]),
+        ('z_rabi_200us_crosstalk', ZRabi,
+         dict(get_crosstalk_config(path, 3), **{
+             'Sequence': 'Z Rabi', 'Number of qubits': 'Three',
+             'Readout delay': 200E-6, 'Filter Z waveforms': True}))]
+    rows = []
+    try:
+        for (label, sequence_class, values) in cases:
+            config = load_default_config()
+            config.update(values)
+            sequence = sequence_class()
+            sequence.set_parameters(config)
+            compilers = []
+            for compiler_class in (DenseSequenceToWaveforms,
+                                   SequenceToWaveforms):
+                sequence_to_waveforms = compiler_class()
+                sequence_to_waveforms.set_parameters(config)
+                compilers.append(sequence_to_waveforms)
+
+            def compile_dense():
+                return compilers[0].get_waveforms(
+                    sequence.get_sequence(config))
+
+            def compile_sparse():
+                return compilers[1].get_waveforms(
+                    sequence.get_sequence(config))
+
+            t_old = time_call(compile_dense, repeat)
+            t_new = time_call(compile_sparse, repeat)
+            (old, new) = (deepcopy(compile_dense()), compile_sparse())
+            difference = max(np.max(np.abs(a - b), initial=0.0)
+                             for key in ('xy', 'z', 'gate')
+                             for (a, b) in zip(old[key], new[key]))
+            rows.append((label, t_old, t_new, difference))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return rows
+
+
+def get_readout(n_qubit=9, n_records=1, seed=0):
+    """Get readout with different demodulation frequencies for all qubits"""
+    rng = np.random.default_rng(seed)
+    config = {'Number of qubits': N_QUBIT_NAMES[n_qubit - 1],
+              'Demodulation - Skip': 20E-9, 'Demodulation - Length': 1E-6,
+              'Demodulation - Frequency offset': 0.0,
+              'Use phase reference signal': False,
+              'Readout I/Q ratio': 1.0, 'Readout IQ skew': 0.0,
+              'Demodulation - Number of records': float(n_records)}
+    for n in range(9):
+        config['Readout frequency #%d' % (n + 1)] = rng.uniform(-200E6, 200E6)
+    readout = Readout()
+    readout.set_parameters(config)
+    return readout
+
+
+def get_readout_signal(n_records, n_pts=600, dt=2E-9, seed=0):
+    """Get random readout trace dict, with one row per record"""
+    rng = np.random.default_rng(seed)
+    y = rng.normal(size=(n_records, n_pts))
+    return {'y': y.ravel(), 'dt': dt, 'shape': y.shape}
+
+
+def run_demodulation(repeat, n_qubit=9, n_records=10000):
+    """Time demodulation of 10k records for nine qubits, one by one and all"""
+    readout = get_readout(n_qubit, n_records)
+    signal = get_readout_signal(n_records)
+    signal_q = get_readout_signal(n_records, seed=1)
+    rows = []
+    for (label, previous, new) in (
+            ('demodulate_%dqb_%d' % (n_qubit, n_records),
+             lambda: [readout.demodulate(n, signal)
+                      for n in range(n_qubit)],
+             lambda: readout.demodulate_all(signal)),
+            ('demodulate_iq_%dqb_%d' % (n_qubit, n_records),
+             lambda: [readout.demodulate_iq(n, signal, signal_q)
+                      for n in range(n_qubit)],
+             lambda: readout.demodulate_iq_all(signal, signal_q))):
+        t_old = time_call(previous, repeat)
+        # references are calculated in the first call and then re-used
+        t_new = time_call(new, repeat)
+        difference = np.max(np.abs(np.array(previous()) - new()))
+        rows.append((label, t_old, t_new, difference))
+    return rows
+
+# components timed against their previous implementation
+COMPONENTS = {
+    'batch': run_batch,
+    'crosstalk': run_crosstalk,
+    'cz': run_cz,
+    'demodulation': run_demodulation,
+    'microwave_gate': run_microwave_gate,
+    'predistortion': run_predistortion,
+    'sparse_z': run_sparse_z,
+    'window_filter': run_window_filter,
+}
+
+
+def main_components(names, repeat):
+    """Run benchmark of compiler components, return exit code."""
+    print('%-28s %12s %12s %8s %10s' % (
+        'component', 'old [us]', 'new [us]', 'speedup', 'max diff'))
+    for name in names:
+        for (label, t_old, t_new, difference) in COMPONENTS[name](repeat):
+            print('%-28s %12.1f %12.1f %7.1fx %10.2g' % (
+                label, 1E6 * t_old, 1E6 * t_new, t_old / t_new, difference))
+    return 0
+
+
+def main(argv=None):
+    """Run benchmark from the command line, return exit code."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the sequence compiler and check for '
+                    'regressions against a baseline.')
+    parser.add_argument('-w', '--workload', action='append',
+                        choices=list(WORKLOADS),
+                        help='workload to run, can be repeated '
+                             '(default: all)')
+    parser.add_argument('-b', '--baseline',
+                        help='JSON baseline to compare against')
+    parser.add_argument('-s', '--save', help='save results as JSON baseline')
+    parser.add_argument('-t', '--tolerance', type=float,
+                        default=DEFAULT_TOLERANCE,
+                        help='allowed increase of stage time and peak memory '
+                             'in percent (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of timed runs per workload '
+                             '(default: %(default)s)')
+    parser.add_argument('-c', '--component', action='append',
+                        choices=list(COMPONENTS),
+                        help='time a compiler component against its '
+                             'previous implementation instead, can be '
+                             'repeated')
+    args = parser.parse_args(argv)
+    if args.component:
+        return main_components(args.component, args.repeat)
+
+    results = run_benchmark(args.workload, args.repeat)
+    print(format_results(results))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('environment') != results['environment']:
+        print('Note: baseline was recorded with %s, now %s' %
+              (baseline.get('environment'), results['environment']))
+    regressions = compare_results(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    if regressions:
+        return 1
+    print('No regressions against %s' % args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 from numpy import matmul as mul
 from numpy.linalg import inv as inv
@@ -36,6 +38,13 @@ dict_m1QBGate = {'I': np.matrix('1,0;0,1'),
     'Zp': np.matrix('1,0;0,-1'),
     'Zm': np.matrix('1,0;0,-1')
     }
+# number of two-qubit Cliffords, up to global phase
+N_2QB_CLIFFORDS = 11520
+
+# default path of the two-qubit Clifford table
+CLIFFORD_TABLE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'clifford_table.npy')
+
 dict_m2QBGate = {'SWAP': np.matrix('1,0,0,0; 0,0,1,0; 0,1,0,0; 0,0,0,1'),
     'CZ': np.matrix('1,0,0,0; 0,1,0,0; 0,0,1,0; 0,0,0,-1'),
     'iSWAP': np.matrix('1,0,0,0; 0,0,1j,0; 0,1j,0,0; 0,0,0,1'),
@@ -246,6 +255,209 @@ def generate_2QB_Cliffords(_index):
         m2QBClifford = mul(_mGate, m2QBClifford)
     return (m2QBClifford)
 
+def _pauli_matrix(v):
+    """
+    Get the matrix X^x Z^z of a two-qubit Pauli, where v = (x1, x2, z1, z2)
+    is given as a 4-bit integer with x1 as the least significant bit.
+    """
+    x_1 = dict_mPauli['X'] if (v & 1) else dict_mPauli['I']
+    x_2 = dict_mPauli['X'] if (v & 2) else dict_mPauli['I']
+    z_1 = dict_mPauli['Z'] if (v & 4) else dict_mPauli['I']
+    z_2 = dict_mPauli['Z'] if (v & 8) else dict_mPauli['I']
+    return np.asarray(mul(np.kron(x_1, x_2), np.kron(z_1, z_2)))
+
+
+# two-qubit Pauli matrices X^x Z^z, indexed by the 4-bit vector (x, z)
+list_mPauli_xz = [_pauli_matrix(v) for v in range(16)]
+
+# the generators X1, X2, Z1, Z2 of the Pauli group
+list_generator_xz = [1, 2, 4, 8]
+
+
+def _multiply_paulis(v_1, r_1, v_2, r_2):
+    """
+    Multiply two Paulis i^r X^x Z^z, given as (vector, phase exponent).
+
+    Returns
+    -------
+    (v, r): tuple of int
+        The product, as 4-bit vector and phase exponent modulo 4.
+    """
+    # moving Z^z1 past X^x2 gives a sign for each qubit with z1 = x2 = 1
+    n_swap = bin((v_1 >> 2) & v_2 & 3).count('1')
+    return (v_1 ^ v_2, (r_1 + r_2 + 2 * n_swap) % 4)
+
+
+def clifford_to_tableau(matrix):
+    """
+    Get the action of a two-qubit Clifford on the generators of the Pauli
+    group. The global phase of the matrix is irrelevant.
+
+    Parameters
+    ----------
+    matrix: 4x4 np.matrix or np.ndarray
+        The Clifford unitary.
+
+    Returns
+    -------
+    tableau: tuple
+        Tuple ((v, r), ...) with the images U P U^dagger = i^r X^x Z^z of
+        the generators X1, X2, Z1, Z2.
+    """
+    u = np.asarray(matrix, dtype=complex)
+    tableau = []
+    for v_gen in list_generator_xz:
+        image = u.dot(list_mPauli_xz[v_gen]).dot(u.conj().T)
+        for v in range(16):
+            c = np.trace(list_mPauli_xz[v].conj().T.dot(image)) / 4
+            if np.abs(np.abs(c) - 1) < 1e-6:
+                r = int(np.round(np.angle(c) / (np.pi / 2))) % 4
+                tableau.append((v, r))
+                break
+        else:
+            raise ValueError('The matrix is not a two-qubit Clifford.')
+    return tuple(tableau)
+
+
+def tableau_to_code(tableau):
+    """Encode a Clifford tableau as a 24-bit integer."""
+    code = 0
+    for k, (v, r) in enumerate(tableau):
+        code |= (v | (r << 4)) << (6 * k)
+    return code
+
+
+def code_to_tableau(code):
+    """Decode a Clifford tableau from a 24-bit integer."""
+    return tuple((int((code >> (6 * k)) & 15), int((code >> (6 * k + 4)) & 3))
+                 for k in range(4))
+
+
+def compose_tableaus(tableau_2, tableau_1):
+    """
+    Get the tableau of the Clifford U_2 U_1, i.e. U_1 applied first.
+    """
+    composed = []
+    for (v_1, r_1) in tableau_1:
+        # apply U_2 to each generator in the product X^x Z^z
+        (v, r) = (0, r_1)
+        for k, v_gen in enumerate(list_generator_xz):
+            if v_1 & v_gen:
+                (v, r) = _multiply_paulis(v, r, *tableau_2[k])
+        composed.append((v, r))
+    return tuple(composed)
+
+
+def generate_clifford_table():
+    """
+    Generate the table of the two-qubit Cliffords in the order defined by
+    `sequence_rb.add_twoQ_clifford`.
+
+    Returns
+    -------
+    table: np.ndarray, shape (2, 11520)
+        The first row holds the encoded tableau of each Clifford, the second
+        row the index of its inverse.
+    """
+    codes = np.zeros(N_2QB_CLIFFORDS, dtype=np.int32)
+    for index in range(N_2QB_CLIFFORDS):
+        codes[index] = tableau_to_code(
+            clifford_to_tableau(generate_2QB_Cliffords(index)))
+    if len(np.unique(codes)) != N_2QB_CLIFFORDS:
+        raise ValueError('The two-qubit Cliffords are not unique.')
+    dict_index = {int(code): index for index, code in enumerate(codes)}
+    identity = tableau_to_code(clifford_to_tableau(np.identity(4)))
+    inverse = np.zeros(N_2QB_CLIFFORDS, dtype=np.int32)
+    for index, code in enumerate(codes):
+        # the group is finite, so the inverse is reached by repeated products
+        tableau = code_to_tableau(int(code))
+        (power, power_code) = (tableau, int(code))
+        while True:
+            next_power = compose_tableaus(tableau, power)
+            if tableau_to_code(next_power) == identity:
+                break
+            (power, power_code) = (next_power, tableau_to_code(next_power))
+        inverse[index] = dict_index[power_code]
+    return np.array([codes, inverse])
+
+
+class CliffordTable(object):
+    """
+    Look-up table of the 11520 two-qubit Cliffords, up to global phase.
+
+    Each Clifford is identified by its action on the Pauli group (a
+    symplectic matrix plus phases), which allows composing Cliffords and
+    finding inverses without multiplying matrices or searching the group.
+
+    Parameters
+    ----------
+    file_path: str
+        Path of the table. If the file does not exist, the table is
+        generated and saved (the default is `CLIFFORD_TABLE_PATH`).
+    """
+
+    def __init__(self, file_path=CLIFFORD_TABLE_PATH):
+        if os.path.exists(file_path):
+            table = np.load(file_path)
+        else:
+            table = generate_clifford_table()
+            try:
+                np.save(file_path, table)
+            except OSError:
+                pass
+        self.codes = table[0]
+        self.inverse = table[1]
+        self.tableaus = [code_to_tableau(int(c)) for c in self.codes]
+        self.dict_index = {int(c): n for n, c in enumerate(self.codes)}
+        self.identity = self.index_from_matrix(np.identity(4))
+
+    def index_from_matrix(self, matrix):
+        """
+        Get the index of a two-qubit Clifford, given as unitary matrix.
+
+        Parameters
+        ----------
+        matrix: 4x4 np.matrix or np.ndarray
+            The Clifford unitary.
+
+        Returns
+        -------
+        index: int
+            The index of the Clifford in `sequence_rb.add_twoQ_clifford`.
+        """
+        return self.dict_index[tableau_to_code(clifford_to_tableau(matrix))]
+
+    def compose(self, index_2, index_1):
+        """
+        Get the index of the Clifford index_2 * index_1 (index_1 first).
+        """
+        tableau = compose_tableaus(self.tableaus[index_2],
+                                   self.tableaus[index_1])
+        return self.dict_index[tableau_to_code(tableau)]
+
+    def get_inverse(self, index):
+        """Get the index of the inverse Clifford."""
+        return int(self.inverse[index])
+
+
+_clifford_table = None
+
+
+def get_clifford_table():
+    """
+    Get the two-qubit Clifford table, load it the first time it is used.
+
+    Returns
+    -------
+    table: CliffordTable
+        The Clifford table.
+    """
+    global _clifford_table
+    if _clifford_table is None:
+        _clifford_table = CliffordTable()
+    return _clifford_table
+
+
 def saveData(file_path, data):
 
     """
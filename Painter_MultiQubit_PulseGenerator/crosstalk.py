@@ -1,8 +1,15 @@
 #!/usr/bin/env python3
+# add logger, to allow logging to Labber's instrument log
+import logging
 
 import numpy as np
 from scipy.linalg import inv
 
+log = logging.getLogger('LabberDriver')
+
+# warn if the condition number of the cross-talk matrix exceeds this value
+CONDITION_NUMBER_WARNING = 1E6
+
 
 class Crosstalk(object):
     """This class is used to compensate crosstalk qubit Z control."""
@@ -10,7 +17,11 @@ class Crosstalk(object):
     def __init__(self):
         # define variables
         self.matrix_path = ''
-        # TODO(dan): define variables for matrix, etc
+        self.compensation_matrix = np.zeros((0, 0))
+        self.Sequence = []
+        self.phi0_vs_voltage = np.zeros((0, 0))
+        # inverse of phi0_vs_voltage, updated when the matrix changes
+        self.voltage_vs_phi0 = np.zeros((0, 0))
 
     def set_parameters(self, config={}):
         """Set base parameters using config from from Labber driver.
@@ -31,8 +42,8 @@ class Crosstalk(object):
             path = config.get('Cross-talk (CT) matrix')
             self.import_crosstalk_matrix(path)
 
-        dTranslate = {'One': int(1), 'Two': int(
-            2), 'Three': int(3), 'Four': int(4), 'Five': int(5)}
+        dTranslate = {'One': 1, 'Two': 2, 'Three': 3, 'Four': 4, 'Five': 5,
+                      'Six': 6, 'Seven': 7, 'Eight': 8, 'Nine': 9}
         nQBs = dTranslate[config.get('Number of qubits')]
 
         if config.get('1-1 QB <--> Crosstalk matrix'):
@@ -49,16 +60,39 @@ class Crosstalk(object):
                     else:
                         self.Sequence.append(dTranslate[element])
                     if self.compensation_matrix.shape[0] < dTranslate[element]:
-                        raise 'Element of Cross-talk matrix is too large for '\
-                            'actual matrix size'
+                        raise ValueError('Element of Cross-talk matrix is too '
+                                         'large for actual matrix size')
+
+        # sub-matrix of the selected elements
+        indices = np.array(self.Sequence, dtype=int) - 1
+        phi0_vs_voltage = self.compensation_matrix[np.ix_(indices, indices)]
+        # only invert if matrix or selection changed
+        if not np.array_equal(phi0_vs_voltage, self.phi0_vs_voltage):
+            self.phi0_vs_voltage = phi0_vs_voltage
+            self.voltage_vs_phi0 = self._invert_matrix(phi0_vs_voltage)
+
+    def _invert_matrix(self, matrix):
+        """Invert cross-talk matrix, warn if it is close to singular.
+
+        Parameters
+        ----------
+        matrix : 2D numpy array
+            Cross-talk matrix, flux quanta per volt.
 
-        mat_length = len(self.Sequence)
-        self.phi0_vs_voltage = np.matrix(np.zeros((mat_length, mat_length)))
+        Returns
+        -------
+        2D numpy array
+            Inverse matrix, volt per flux quanta.
 
-        for index_r, element_r in enumerate(self.Sequence):
-            for index_c, element_c in enumerate(self.Sequence):
-                self.phi0_vs_voltage[index_r, index_c] = \
-                    self.compensation_matrix[element_r - 1, element_c - 1]
+        """
+        if matrix.size == 0:
+            return np.zeros_like(matrix)
+        condition = np.linalg.cond(matrix)
+        if not condition < CONDITION_NUMBER_WARNING:
+            log.warning('Cross-talk matrix is close to singular, condition '
+                        'number is %.3g. The compensated waveforms may have '
+                        'large amplitudes.' % condition)
+        return inv(matrix)
 
     def import_crosstalk_matrix(self, path):
         """Import crosstalk matrix data.
@@ -71,16 +105,20 @@ class Crosstalk(object):
         """
         # store new path
         self.matrix_path = path
-        self.compensation_matrix = np.matrix(np.loadtxt(path))
+        self.compensation_matrix = np.atleast_2d(np.loadtxt(path))
         # TODO(dan): load crosstalk data
 
-    def compensate(self, waveforms):
+    def compensate(self, waveforms, segments=None):
         """Compensate crosstalk on Z-control waveforms.
 
         Parameters
         ----------
         waveforms : list on 1D numpy arrays
             Input data to apply crosstalk compensation on
+        segments : list of tuple
+            Sorted, non-overlapping index ranges (start, stop) outside which
+            all waveforms are zero. If None, the compensation is applied to
+            the full waveforms (the default is None).
 
         Returns
         -------
@@ -88,21 +126,27 @@ class Crosstalk(object):
             Waveforms with crosstalk compensation
 
         """
-        mat_voltage_vs_phi0 = inv(self.phi0_vs_voltage)
-
         wavform_length = len(waveforms[0])
         wavform_num = len(self.Sequence)
-        wav_array = np.array(np.zeros((wavform_num, wavform_length)))
+        # keep data type of input waveforms
+        dtype = waveforms[0].dtype
+        mat_voltage_vs_phi0 = np.asarray(self.voltage_vs_phi0, dtype=dtype)
+        if segments is None:
+            segments = [(0, wavform_length)]
+        wav_array = np.zeros((wavform_num, wavform_length), dtype=dtype)
         wav_toCorrect = []
         for index, waveform in enumerate(waveforms):
             if index + 1 in self.Sequence:
-                wav_array[index] = waveform
+                for start, stop in segments:
+                    wav_array[index, start:stop] = waveform[start:stop]
                 wav_toCorrect.append(index)
 
-        # new_array = np.dot(mat_voltage_vs_phi0, wav_array)
-
-        # dot product between the matrix and the waveforms at each timestep
-        new_array = np.einsum('ij,jk->ik', mat_voltage_vs_phi0, wav_array)
+        # matrix product with the waveforms at each timestep, the result is
+        # zero outside the segments
+        new_array = np.zeros_like(wav_array)
+        for start, stop in segments:
+            np.matmul(mat_voltage_vs_phi0, wav_array[:, start:stop],
+                      out=new_array[:, start:stop])
 
         for Corr_index, index in zip(wav_toCorrect,
                                      range(0, len(self.Sequence))):
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# add logger, to allow logging to Labber's instrument log
+import logging
+import multiprocessing
+import os
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from sequence import SequenceToWaveforms
+from sequence_loader import SequenceLoader
+
+log = logging.getLogger('LabberDriver')
+
+# byte alignment of arrays in the shared memory block
+ALIGNMENT = 64
+
+
+def _waveform_layout(n_qubit, n_call, n_pts, n_pts_readout,
+                     dtype_complex=np.complex128, dtype_float=np.float64):
+    """Get layout of batch waveforms in a shared memory block.
+
+    Parameters
+    ----------
+    n_qubit : int
+        Number of qubits.
+    n_call : int
+        Number of sequences in the batch.
+    n_pts : int
+        Number of points in the qubit waveforms.
+    n_pts_readout : int
+        Number of points in the readout waveforms.
+    dtype_complex : numpy dtype
+        Data type of complex waveforms (the default is np.complex128).
+    dtype_float : numpy dtype
+        Data type of real waveforms (the default is np.float64).
+
+    Returns
+    -------
+    list of tuple
+        Tuples (key, shape, dtype string, byte offset) for each waveform.
+    int
+        Total size of the block in bytes.
+
+    """
+    arrays = []
+    for key, dtype in (('xy', dtype_complex), ('z', dtype_float),
+                       ('gate', dtype_float)):
+        arrays += [(key, (n_call, n_pts), dtype)] * n_qubit
+    arrays.append(('readout_trig', (n_call, n_pts_readout), dtype_float))
+    arrays.append(('readout_iq', (n_call, n_pts_readout), dtype_complex))
+    layout = []
+    offset = 0
+    for key, shape, dtype in arrays:
+        layout.append((key, shape, np.dtype(dtype).str, offset))
+        size = shape[0] * shape[1] * np.dtype(dtype).itemsize
+        offset += ALIGNMENT * int(np.ceil(size / ALIGNMENT))
+    return layout, offset
+
+
+def _map_waveforms(buf, layout):
+    """Create waveform dict with numpy arrays backed by a shared buffer.
+
+    Parameters
+    ----------
+    buf : memoryview
+        Buffer of the shared memory block.
+    layout : list of tuple
+        Waveform layout, as returned by `_waveform_layout`.
+
+    Returns
+    -------
+    dict
+        Waveforms, with the same keys as returned by
+        `SequenceToWaveforms.get_waveforms_batch`.
+
+    """
+    waveforms = {'xy': [], 'z': [], 'gate': []}
+    for key, shape, dtype, offset in layout:
+        data = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        if key in waveforms:
+            waveforms[key].append(data)
+        else:
+            waveforms[key] = data
+    return waveforms
+
+
+def _compile_into_shared_memory(sequence_to_waveforms, compiled, indices,
+                                name, layout, align_end):
+    """Compile prepared sequences into a shared memory block."""
+    shm = SharedMemory(name=name)
+    try:
+        waveforms = _map_waveforms(shm.buf, layout)
+        sequence_to_waveforms._compile_batch(
+            compiled, waveforms, indices, align_end=align_end)
+    finally:
+        # release all views of the buffer before closing
+        waveforms = None
+        n_qubit = sequence_to_waveforms.n_qubit
+        sequence_to_waveforms._wave_xy[:n_qubit] = [
+            np.zeros(0, dtype=complex) for n in range(n_qubit)]
+        sequence_to_waveforms._wave_z[:n_qubit] = [
+            np.zeros(0) for n in range(n_qubit)]
+        sequence_to_waveforms._wave_gate[:n_qubit] = [
+            np.zeros(0) for n in range(n_qubit)]
+        sequence_to_waveforms.readout_trig = np.zeros(0)
+        sequence_to_waveforms.readout_iq = np.zeros(0, dtype=complex)
+        shm.close()
+
+
+def _compile_task(conn, loader, sequence_class, config, indices):
+    """Generate and compile a subset of the randomized sequences.
+
+    The worker first reports the waveform sizes of its sequences, then waits
+    for the name and layout of the shared output block, and finally compiles
+    its sequences directly into the rows given by `indices`.
+
+    """
+    if isinstance(sequence_class, str):
+        # custom sequence, not importable by name
+        sequence_class = loader.get_sequence_class(sequence_class)
+    sequence = sequence_class()
+    sequence.set_parameters(config)
+    sequence_to_waveforms = SequenceToWaveforms()
+    sequence_to_waveforms.set_parameters(config)
+    # the seed only depends on the index, not on the worker
+    randomize = config['Randomize']
+    sequences_list = []
+    for n in indices:
+        config['Randomize'] = randomize + n + 1
+        sequences_list.append(sequence.get_sequence(config))
+    compiled = sequence_to_waveforms._prepare_batch(sequences_list)
+    dtypes = [np.dtype(d).str for d in sequence_to_waveforms.get_dtypes()]
+    conn.send(('sizes', sequence_to_waveforms.n_qubit, dtypes,
+               [(c[1], c[2]) for c in compiled]))
+    # wait for shared memory block, not sent if another worker failed
+    msg = conn.recv()
+    if msg[0] != 'compile':
+        return
+    (name, layout, align_end) = msg[1:]
+    _compile_into_shared_memory(sequence_to_waveforms, compiled, indices,
+                                name, layout, align_end)
+    conn.send(('done',))
+
+
+def _worker(conn):
+    """Run compile tasks sent by the pool, until the pool is closed.
+
+    The driver modules are only imported once per worker process. Errors
+    are sent back to the pool and the worker waits for the next task.
+
+    """
+    # custom sequence files are only executed again if they changed
+    loader = SequenceLoader()
+    try:
+        while True:
+            msg = conn.recv()
+            if msg[0] == 'close':
+                break
+            try:
+                _compile_task(conn, loader, *msg[1:])
+            except Exception:
+                conn.send(('error', traceback.format_exc()))
+    except (EOFError, OSError, KeyboardInterrupt):
+        # pool process is gone
+        pass
+    finally:
+        conn.close()
+
+
+def _receive(conn):
+    """Receive message from worker, raise error if the worker exited."""
+    try:
+        return conn.recv()
+    except EOFError:
+        raise RuntimeError('Waveform worker process exited unexpectedly.')
+
+
+class WorkerPool:
+    """Worker processes for generating and compiling randomized sequences.
+
+    The processes are started on first use and kept until the pool is
+    closed, so that later calls do not pay for starting the processes and
+    importing the driver modules again.
+
+    Parameters
+    ----------
+    n_workers : int
+        Number of worker processes. If None or 0, one worker per CPU core is
+        used (the default is None).
+
+    """
+
+    def __init__(self, n_workers=None):
+        if n_workers is None or n_workers < 1:
+            n_workers = os.cpu_count() or 1
+        self.n_workers = int(n_workers)
+        # spawn gives the same behavior on all platforms and lets the
+        # workers share the resource tracker of this process
+        self._ctx = multiprocessing.get_context('spawn')
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        """Start worker processes that are not running."""
+        self._workers = [(process, conn) for (process, conn) in self._workers
+                         if process.is_alive()]
+        while len(self._workers) < self.n_workers:
+            conn, child_conn = self._ctx.Pipe()
+            process = self._ctx.Process(target=_worker, args=(child_conn,),
+                                        daemon=True)
+            process.start()
+            child_conn.close()
+            self._workers.append((process, conn))
+
+    def close(self):
+        """Stop all worker processes."""
+        for process, conn in self._workers:
+            try:
+                conn.send(('close',))
+            except (OSError, ValueError):
+                pass
+        for process, conn in self._workers:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            conn.close()
+        self._workers = []
+
+    def get_waveforms(self, sequence_class, config, n_call, align_end=False):
+        """Generate and compile multiple randomized sequences in parallel.
+
+        Sequence number `n` is generated with `config['Randomize'] + n + 1`
+        as seed, the same as when generating the sequences one by one, so
+        the result does not depend on the number of workers. The waveforms
+        are returned from the workers through shared memory.
+
+        Parameters
+        ----------
+        sequence_class : type or str
+            Sequence class, must be importable by the worker processes, or
+            path to a Python file with a custom sequence.
+        config : dict
+            Configuration dict from the Labber driver. A copy is sent to the
+            workers.
+        n_call : int
+            Number of sequences to generate.
+        align_end : bool
+            If True, align waveforms to the end of each row instead of the
+            start (the default is False).
+
+        Returns
+        -------
+        dict
+            Waveforms, with the same keys and shapes as returned by
+            `SequenceToWaveforms.get_waveforms_batch`.
+
+        Raises
+        ------
+        RuntimeError
+            If a worker failed. The workers are kept for the next call,
+            unless one of them exited.
+
+        """
+        self.start()
+        workers = self._workers[:max(1, min(self.n_workers, n_call))]
+        # picklable config snapshot
+        config = dict(config)
+        shm = None
+        # False while the workers may wait for a message from the pool
+        in_step = False
+        try:
+            for (process, conn), indices in zip(
+                    workers, np.array_split(np.arange(n_call), len(workers))):
+                conn.send(('task', sequence_class, config,
+                           [int(n) for n in indices]))
+
+            # collect sizes from all workers, to keep them in step
+            replies = [_receive(conn) for (process, conn) in workers]
+            errors = [msg[1] for msg in replies if msg[0] == 'error']
+            if errors:
+                for (process, conn), msg in zip(workers, replies):
+                    if msg[0] == 'sizes':
+                        conn.send(('cancel',))
+                in_step = True
+                raise RuntimeError(
+                    'Error in waveform worker process:\n' + errors[0])
+
+            # allocate output
+            n_pts = 0
+            n_pts_readout = 0
+            for (_, n_qubit, dtypes, sizes) in replies:
+                n_pts = max([n_pts] + [s[0] for s in sizes])
+                n_pts_readout = max([n_pts_readout] + [s[1] for s in sizes])
+            layout, size = _waveform_layout(n_qubit, n_call, n_pts,
+                                            n_pts_readout, *dtypes)
+            shm = SharedMemory(create=True, size=max(size, 1))
+            shared = _map_waveforms(shm.buf, layout)
+            for key, values in shared.items():
+                for data in (values if isinstance(values, list) else [values]):
+                    data[:] = 0.0
+
+            # compile in workers, copy result out of shared memory
+            for process, conn in workers:
+                conn.send(('compile', shm.name, layout, align_end))
+            replies = [_receive(conn) for (process, conn) in workers]
+            in_step = True
+            errors = [msg[1] for msg in replies if msg[0] == 'error']
+            if errors:
+                raise RuntimeError(
+                    'Error in waveform worker process:\n' + errors[0])
+            waveforms = dict()
+            for key, values in shared.items():
+                if isinstance(values, list):
+                    waveforms[key] = [np.array(data) for data in values]
+                else:
+                    waveforms[key] = np.array(values)
+            shared = None
+            log.debug('Compiled %d sequences using %d worker processes' %
+                      (n_call, len(workers)))
+            return waveforms
+
+        finally:
+            if not in_step:
+                # stop workers that are out of step, new ones are started
+                # on the next call
+                self.close()
+            if shm is not None:
+                shared = None
+                shm.close()
+                shm.unlink()
+
+
+def get_waveforms_parallel(sequence_class, config, n_call, n_workers=None,
+                           align_end=False):
+    """Generate and compile multiple randomized sequences in parallel.
+
+    The worker processes are started for this call only, use a
+    :obj:`WorkerPool` to keep them between calls. See
+    `WorkerPool.get_waveforms` for the parameters.
+
+    Parameters
+    ----------
+    sequence_class : type or str
+        Sequence class, must be importable by the worker processes, or
+        path to a Python file with a custom sequence.
+    config : dict
+        Configuration dict from the Labber driver.
+    n_call : int
+        Number of sequences to generate.
+    n_workers : int
+        Number of worker processes. If None, one worker per CPU core is
+        used (the default is None).
+    align_end : bool
+        If True, align waveforms to the end of each row instead of the
+        start (the default is False).
+
+    Returns
+    -------
+    dict
+        Waveforms, with the same keys and shapes as returned by
+        `SequenceToWaveforms.get_waveforms_batch`.
+
+    """
+    if n_workers is None or n_workers < 1:
+        n_workers = os.cpu_count() or 1
+    with WorkerPool(max(1, min(int(n_workers), n_call))) as pool:
+        return pool.get_waveforms(sequence_class, config, n_call,
+                                  align_end=align_end)
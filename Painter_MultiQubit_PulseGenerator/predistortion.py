@@ -10,10 +10,50 @@
 # one mixer at a time. A challenge will be finding a good way to add the
 # transfer functions to a common file in a convenient way.
 
+import hashlib
+import os
+from collections import OrderedDict
+
 import numpy as np
 from numpy.fft import fft, fftfreq, fftshift, ifft, ifftshift
 from scipy.interpolate import interp1d
 
+# number of filter kernels kept by each predistortion, one per waveform length
+KERNEL_CACHE_SIZE = 4
+
+
+def _get_kernel(cache, key, calculate):
+    """Get filter kernel from a least-recently-used cache.
+
+    Parameters
+    ----------
+    cache : OrderedDict
+        Cache of read-only kernel arrays.
+    key : tuple
+        Key of the kernel, must contain all parameters the kernel depends on.
+    calculate : callable
+        Function returning a tuple of kernel arrays, called if the key is not
+        in the cache.
+
+    Returns
+    -------
+    tuple of numpy array
+        The kernel arrays.
+
+    """
+    kernel = cache.get(key)
+    if kernel is not None:
+        cache.move_to_end(key)
+        return kernel
+    kernel = calculate()
+    for x in kernel:
+        x.setflags(write=False)
+    cache[key] = kernel
+    # remove least recently used kernels
+    while len(cache) > KERNEL_CACHE_SIZE:
+        cache.popitem(last=False)
+    return kernel
+
 
 class Predistortion(object):
     """This class is used to predistort I/Q waveforms for qubit XY control."""
@@ -23,6 +63,10 @@ class Predistortion(object):
         self.transfer_path = ''
         # keep track of which Labber waveform this predistortion refers to
         self.waveform_number = waveform_number
+        # path, modification time and hash of the loaded transfer function
+        self._transfer_key = None
+        # inverse filters evaluated at the waveform frequencies
+        self._kernels = OrderedDict()
         # TODO(dan): define variables for predistortion algorithm
 
     def set_parameters(self, config={}):
@@ -37,7 +81,8 @@ class Predistortion(object):
         # Labber configuration contains multiple predistortions, get right one
         path = config.get('Transfer function #%d' % (self.waveform_number + 1))
         # only reload tranfser function if file changed
-        if path != self.transfer_path:
+        if (path != self.transfer_path or
+                self._get_mtime(path) != self._get_mtime(self.transfer_path)):
             self.import_transfer_function(path)
 
         self.dt = 1 / config.get('Sample rate')
@@ -53,10 +98,15 @@ class Predistortion(object):
         """
         # store new path
         self.transfer_path = path
+        self._transfer_key = None
+        self._kernels.clear()
 
         # return directly if not in use, look for both '' and '.'
         if self.transfer_path.strip() in ('', '.'):
             return
+        with open(path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        self._transfer_key = (path, self._get_mtime(path), digest)
         import Labber
         f = Labber.LogFile(self.transfer_path)
         self.vResponse_freqs, self.vFilteredResponse_FFT_I = f.getTraceXY(
@@ -65,6 +115,13 @@ class Predistortion(object):
             y_channel=1)
         # TODO(dan): load transfer function data
 
+    def _get_mtime(self, path):
+        """Get modification time of file, or None if not available."""
+        try:
+            return os.path.getmtime(path)
+        except (OSError, TypeError):
+            return None
+
     def predistort(self, waveform):
         """Predistort input waveform.
 
@@ -82,6 +139,41 @@ class Predistortion(object):
         # find timespan of waveform
         self.tvals = np.arange(0, self.dt * len(waveform), self.dt)
 
+        fft_vals, fft_signal_r = self.apply_FFT(
+            self.tvals, complex(1, 0) * waveform.real)
+        fft_vals, fft_signal_i = self.apply_FFT(
+            self.tvals, complex(1, 0) * waveform.imag)
+
+        # the frequencies only depend on waveform length and sample spacing
+        Inverse_A, Inverse_B, Inverse_C, Inverse_D = _get_kernel(
+            self._kernels, (self._transfer_key, len(waveform), self.dt),
+            lambda: self._calculate_inverse_filter(fft_vals))
+
+        # applies the inverse function to the AWG signal
+        fft_signal = (fft_signal_r * Inverse_A + fft_signal_i * Inverse_B +
+                      1j * (fft_signal_r * Inverse_C +
+                            fft_signal_i * Inverse_D))
+        corr_signal = ifft(ifftshift(fft_signal))
+
+        vI = np.array(corr_signal.real, dtype=waveform.real.dtype)
+        vQ = np.array(corr_signal.imag, dtype=waveform.real.dtype)
+
+        return vI + 1j * vQ
+
+    def _calculate_inverse_filter(self, fft_vals):
+        """Calculate inverse of the response at the given frequencies.
+
+        Parameters
+        ----------
+        fft_vals : numpy array
+            Frequencies at which to evaluate the inverse filter.
+
+        Returns
+        -------
+        tuple of numpy array
+            Elements (a, b, c, d) of the 2x2 inverse response matrix.
+
+        """
         response_I = ifft(ifftshift(self.vFilteredResponse_FFT_I))
         response_FFT_I_r = fftshift(fft(complex(1, 0) * response_I.real))
         response_FFT_I_i = fftshift(fft(complex(1, 0) * response_I.imag))
@@ -106,23 +198,8 @@ class Predistortion(object):
         Inverse_C = interp1d(self.vResponse_freqs, Zc)
         Inverse_D = interp1d(self.vResponse_freqs, Zd)
 
-        # applies the interpolated inverse function to the AWG signal
-
-        fft_vals, fft_signal_r = self.apply_FFT(
-            self.tvals, complex(1, 0) * waveform.real)
-        fft_vals, fft_signal_i = self.apply_FFT(
-            self.tvals, complex(1, 0) * waveform.imag)
-
-        fft_signal = (fft_signal_r * Inverse_A(fft_vals) + fft_signal_i *
-                      Inverse_B(fft_vals) + 1j *
-                      (fft_signal_r * Inverse_C(fft_vals) +
-                       fft_signal_i * Inverse_D(fft_vals)))
-        corr_signal = ifft(ifftshift(fft_signal))
-
-        vI = np.array(corr_signal.real, dtype='float64')
-        vQ = np.array(corr_signal.imag, dtype='float64')
-
-        return vI + 1j * vQ
+        return (Inverse_A(fft_vals), Inverse_B(fft_vals),
+                Inverse_C(fft_vals), Inverse_D(fft_vals))
 
     def apply_FFT(self, tvals, signal):
         fft_signal = fftshift(fft(signal))
@@ -172,6 +249,8 @@ class ExponentialPredistortion:
         self.tau4 = 0
         self.dt = 1
         self.n = int(waveform_number)
+        # filter responses for the padded waveform lengths
+        self._kernels = OrderedDict()
 
     def set_parameters(self, config={}):
         """Set base parameters using config from from Labber driver.
@@ -211,13 +290,38 @@ class ExponentialPredistortion:
         """
         # pad with zeros at end to make sure response has time to go to zero
         pad_time = 6 * max([self.tau1, self.tau2, self.tau3])
-        padded = np.zeros(len(waveform) + round(pad_time / self.dt))
+        padded = np.zeros(len(waveform) + round(pad_time / self.dt),
+                          dtype=waveform.dtype)
         padded[:len(waveform)] = waveform
 
         Y = np.fft.rfft(padded, norm='ortho')
 
-        omega = 2 * np.pi * np.fft.rfftfreq(len(padded), self.dt)
-        H = (1 +
+        key = (len(padded), self.dt, self.A1, self.tau1, self.A2, self.tau2,
+               self.A3, self.tau3, self.A4, self.tau4)
+        H, = _get_kernel(self._kernels, key,
+                         lambda: (self._calculate_response(len(padded)),))
+
+        Yc = Y / H
+
+        yc = np.fft.irfft(Yc, norm='ortho')
+        return yc[:len(waveform)].astype(waveform.dtype, copy=False)
+
+    def _calculate_response(self, n_pts):
+        """Calculate filter response for a waveform with `n_pts` points.
+
+        Parameters
+        ----------
+        n_pts : int
+            Number of points in the padded waveform.
+
+        Returns
+        -------
+        numpy array
+            Response at the frequencies of the real FFT of the waveform.
+
+        """
+        omega = 2 * np.pi * np.fft.rfftfreq(n_pts, self.dt)
+        return (1 +
              (1j * self.A1 * omega * self.tau1) /
              (1j * omega * self.tau1 + 1) +
              (1j * self.A2 * omega * self.tau2) /
@@ -227,11 +331,6 @@ class ExponentialPredistortion:
              (1j * self.A4 * omega * self.tau4) /
              (1j * omega * self.tau4 + 1))
 
-        Yc = Y / H
-
-        yc = np.fft.irfft(Yc, norm='ortho')
-        return yc[:len(waveform)]
-
 
 if __name__ == '__main__':
     pass
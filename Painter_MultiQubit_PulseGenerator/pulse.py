@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 import logging
+from collections import OrderedDict
 from enum import Enum
 
 import numpy as np
+try:
+    from scipy.integrate import cumulative_trapezoid
+except ImportError:
+    # scipy < 1.6
+    from scipy.integrate import cumtrapz as cumulative_trapezoid
 
 log = logging.getLogger('LabberDriver')
 
@@ -58,6 +64,8 @@ class Pulse(object):
         in units of standard deviations.
     start_at_zero : bool
         If True, forces the pulse to start in 0.
+    envelope_cache : :obj:`EnvelopeCache`
+        If not None, cache used for re-using previously calculated envelopes.
 
     """
 
@@ -90,6 +98,9 @@ class Pulse(object):
         self.iq_ratio = 1.0
         self.iq_skew = 0.0
 
+        # cache for pre-calculated envelopes, shared between pulse copies
+        self.envelope_cache = None
+
     def total_duration(self):
         """Get the total duration for the pulse.
 
@@ -201,20 +212,17 @@ class Pulse(object):
 
             else:
                 # plateau is added as an extra extension of theta_f.
-                theta_t = np.ones(len(t)) * self.theta_i
-                for i in range(len(t)):
-                    if 0 < (t[i] - t0 + self.plateau / 2) < self.plateau:
-                        theta_t[i] = self.theta_f
-                    elif (0 < (t[i] - t0 + self.width / 2 + self.plateau / 2) <
-                            (self.width + self.plateau) / 2):
-                        theta_t[i] = np.interp(
-                            t[i] - t0 + self.width / 2 + self.plateau / 2,
-                            self.t_tau, self.theta_tau)
-                    elif (0 < (t[i] - t0 + self.width / 2 + self.plateau / 2) <
-                        (self.width + self.plateau)):
-                        theta_t[i] = np.interp(
-                            t[i] - t0 + self.width / 2 - self.plateau / 2,
-                            self.t_tau, self.theta_tau)
+                x_rise = t - t0 + self.width / 2 + self.plateau / 2
+                x_fall = t - t0 + self.width / 2 - self.plateau / 2
+                x_plateau = t - t0 + self.plateau / 2
+                theta_t = np.select(
+                    [(0 < x_plateau) & (x_plateau < self.plateau),
+                     (0 < x_rise) & (x_rise < (self.width + self.plateau) / 2),
+                     (0 < x_rise) & (x_rise < (self.width + self.plateau))],
+                    [self.theta_f,
+                     np.interp(x_rise, self.t_tau, self.theta_tau),
+                     np.interp(x_fall, self.t_tau, self.theta_tau)],
+                    default=self.theta_i)
 
             # make sure no angles are smaller than theta_i
             theta_t = np.clip(theta_t, self.theta_i, None)
@@ -252,8 +260,8 @@ class Pulse(object):
         return values
 
 
-    def calculate_waveform(self, t0, t):
-        """Calculate pulse waveform including phase shifts and SSB-mixing.
+    def calculate_drag_envelope(self, t0, t):
+        """Calculate pulse envelope, including DRAG correction.
 
         Parameters
         ----------
@@ -261,12 +269,12 @@ class Pulse(object):
             Pulse position, referenced to center of pulse.
 
         t : numpy array
-            Array with time values for which to calculate the pulse waveform.
+            Array with time values for which to calculate the pulse envelope.
 
         Returns
         -------
         waveform : numpy array
-            Array containing pulse waveform.
+            Array containing pulse envelope, complex if DRAG is used.
 
         """
         y = self.calculate_envelope(t0, t)
@@ -275,6 +283,30 @@ class Pulse(object):
             y = y + 1j * beta * np.gradient(y)
             y = y * np.exp(1j * 2 * np.pi * self.drag_detuning *
                            (t - t0 + self.total_duration() / 2))
+        return y
+
+    def calculate_waveform(self, t0, t):
+        """Calculate pulse waveform including phase shifts and SSB-mixing.
+
+        Parameters
+        ----------
+        t0 : float
+            Pulse position, referenced to center of pulse.
+
+        t : numpy array
+            Array with time values for which to calculate the pulse waveform.
+
+        Returns
+        -------
+        waveform : numpy array
+            Array containing pulse waveform.
+
+        """
+        # get envelope from cache, if available
+        if self.envelope_cache is None:
+            y = self.calculate_drag_envelope(t0, t)
+        else:
+            y = self.envelope_cache.get_envelope(self, t0, t)
 
         if self.pulse_type in (PulseType.XY, ):
             # Apply phase and SSB
@@ -339,12 +371,11 @@ class Pulse(object):
 
         # Calculate pulse width in tau variable - See paper for details
         tau = np.linspace(0, 1, n_points)
-        self.theta_tau = np.zeros(n_points)
         # This corresponds to the sum in Eq. (15) in Martinis & Geller
-        for i in range(n_points):
-            self.theta_tau[i] = (
-                np.sum(Lcoeff * (1 - np.cos(2 * np.pi * n * tau[i]))) +
-                self.theta_i)
+        self.theta_tau = (
+            np.sum(Lcoeff * (1 - np.cos(2 * np.pi * n * tau[:, None])),
+                   axis=1) +
+            self.theta_i)
         # Now calculate t_tau according to Eq. (20)
         t_tau = np.trapz(np.sin(self.theta_tau), x=tau)
         # Find the width in units of tau:
@@ -353,11 +384,139 @@ class Pulse(object):
         # Calculating time as functions of tau
         # we normalize to width_tau (calculated above)
         tau = np.linspace(0, Width_tau, n_points)
-        self.t_tau = np.zeros(n_points)
-        for i in range(n_points):
-            if i > 0:
-                self.t_tau[i] = np.trapz(
-                        np.sin(self.theta_tau[0:i+1]), x=tau[0:i+1])
+        self.t_tau = cumulative_trapezoid(
+            np.sin(self.theta_tau), x=tau, initial=0)
+
+
+class EnvelopeCache(object):
+    """Least-recently-used cache for pulse envelopes.
+
+    Envelopes are keyed on the pulse shape parameters, the number of samples
+    and the sub-sample offset of the pulse center, which means that identical
+    pulses placed at different positions in a sequence are only calculated
+    once. Parameters that are only used for mixing (phase, frequency and IQ
+    corrections) are not part of the key.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum total size of the cached envelopes, in bytes
+        (the default is 64 MB).
+    sample_rate : float
+        Sample rate of the time vectors passed to the cache.
+
+    Attributes
+    ----------
+    hits : int
+        Number of envelopes returned from the cache.
+    misses : int
+        Number of envelopes that had to be calculated.
+    nbytes : int
+        Current total size of the cached envelopes, in bytes.
+
+    """
+
+    # pulse attributes that do not affect the envelope
+    MIXING_ATTRIBUTES = ('phase', 'frequency', 'iq_ratio', 'iq_skew',
+                         'envelope_cache')
+    # attribute types used as key without conversion
+    SCALAR_TYPES = frozenset((int, float, bool, str, type(None), PulseShape,
+                              PulseType))
+
+    def __init__(self, max_bytes=64E6, sample_rate=1.2E9):
+        self.max_bytes = int(max_bytes)
+        self.sample_rate = sample_rate
+        self._envelopes = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_envelope(self, pulse, t0, t):
+        """Get pulse envelope, calculate and store it if not in the cache.
+
+        Parameters
+        ----------
+        pulse : :obj:`Pulse`
+            The pulse for which to get the envelope.
+        t0 : float
+            Pulse position, referenced to center of pulse.
+        t : numpy array
+            Array with time values for which to get the pulse envelope.
+
+        Returns
+        -------
+        waveform : numpy array
+            Read-only array containing the pulse envelope.
+
+        """
+        # sub-sample offset of the pulse center relative to the first sample
+        offset = round(self.sample_rate * (t0 - float(t[0])), 6) if len(t) \
+            else 0.0
+        # samples outside the pulse are set to zero by calculate_envelope,
+        # include them in the key since rounding may differ between positions
+        half_duration = pulse.total_duration() / 2
+        edges = (int(t.searchsorted(t0 - half_duration, side='left')),
+                 int(t.searchsorted(t0 + half_duration, side='right')))
+        key = (self._get_pulse_key(pulse), self.sample_rate, len(t), offset,
+               edges)
+        y = self._envelopes.get(key)
+        if y is not None:
+            self.hits += 1
+            self._envelopes.move_to_end(key)
+            return y
+        # not in cache, calculate envelope
+        self.misses += 1
+        y = pulse.calculate_drag_envelope(t0, t)
+        y.setflags(write=False)
+        if y.nbytes <= self.max_bytes:
+            self._envelopes[key] = y
+            self.nbytes += y.nbytes
+            # remove least recently used envelopes if cache is full
+            while self.nbytes > self.max_bytes:
+                (_, old) = self._envelopes.popitem(last=False)
+                self.nbytes -= old.nbytes
+        return y
+
+    def clear(self):
+        """Remove all envelopes and reset the statistics."""
+        self._envelopes.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_statistics(self):
+        """Get cache statistics.
+
+        Returns
+        -------
+        dict
+            Number of hits, misses and entries, hit rate and size in bytes.
+
+        """
+        n_call = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses,
+                    hit_rate=(self.hits / n_call) if n_call > 0 else 0.0,
+                    entries=len(self._envelopes), nbytes=self.nbytes)
+
+    def _get_pulse_key(self, pulse):
+        """Get hashable key from the envelope parameters of the pulse."""
+        return tuple([(name, value if type(value) in self.SCALAR_TYPES
+                       else self._make_hashable(value))
+                      for (name, value) in pulse.__dict__.items()
+                      if name not in self.MIXING_ATTRIBUTES])
+
+    def _make_hashable(self, value):
+        """Convert attribute value to a hashable object."""
+        if isinstance(value, (int, float, str, Enum, type(None))):
+            return value
+        if isinstance(value, np.ndarray):
+            return (value.dtype.str, value.shape, value.tobytes())
+        if hasattr(value, '__dict__'):
+            # objects like qubits are represented by their content
+            return (type(value).__name__,) + tuple(
+                (name, self._make_hashable(v))
+                for (name, v) in value.__dict__.items())
+        return value
 
 
 if __name__ == '__main__':
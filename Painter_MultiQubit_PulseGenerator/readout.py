@@ -29,6 +29,9 @@ class Readout(object):
         self.demod_length = 1.0E-6
         self.freq_offset = 0.0
         self.use_phase_ref = False
+        # demodulation references for all qubits, updated when needed
+        self._reference_key = None
+        self._reference = None
 
         # self.n_records = 1
 
@@ -202,6 +205,210 @@ class Readout(object):
             values /= (np.cos(dAngleRef) + 1j * np.sin(dAngleRef))
         return values
 
+    def demodulate_all(self, signal, ref=None):
+        """Calculate complex signal from data and reference for all qubits.
+
+        Gives the same result as calling `demodulate` for each qubit, but
+        the data is only reshaped once and all qubits and segments are
+        demodulated with a single matrix product.
+
+        Parameters
+        ----------
+        signal : dict
+            Dictionary with signal data
+
+        ref : dict
+            Dictionary with reference data
+
+        Returns
+        -------
+        values : complex numpy array
+            Array with shape (number of qubits, number of segments)
+
+        """
+        n_segment = int(self.n_records)
+        if signal is None:
+            return np.zeros((self.n_readout, n_segment), dtype=complex)
+        vY = signal['y']
+        n0, length, n_segment, vData = self._get_segments(signal, vY)
+        if length <= 1:
+            return np.zeros((self.n_readout, n_segment), dtype=complex)
+        # real data, cos/sin references are interleaved as real/imag parts
+        mRef = self._get_reference(signal['dt'], n0, length, iq=False)
+        values = self._apply_reference(vData[:, n0:n0 + length], mRef)
+        if self.use_phase_ref and ref is not None:
+            # skip reference if trace length doesn't match
+            if len(ref['y']) != len(vY):
+                return values
+            vRef = np.reshape(ref['y'], vData.shape)
+            values_ref = self._apply_reference(vRef[:, n0:n0 + length], mRef)
+            # subtract the reference angle
+            dAngleRef = np.arctan2(values_ref.imag, values_ref.real)
+            values /= (np.cos(dAngleRef) + 1j * np.sin(dAngleRef))
+        return values
+
+    def demodulate_iq_all(self, signal_i, signal_q, ref=None):
+        """Calculate complex signal from complex data for all qubits.
+
+        Gives the same result as calling `demodulate_iq` for each qubit, but
+        the data is only reshaped once and all qubits and segments are
+        demodulated with a single matrix product.
+
+        Parameters
+        ----------
+        signal_i : dict
+            Dictionary with in-phase signal data
+
+        signal_q : dict
+            Dictionary with qudrature signal data
+
+        ref : dict
+            Dictionary with reference data
+
+        Returns
+        -------
+        values : complex numpy array
+            Array with shape (number of qubits, number of segments)
+
+        """
+        n_segment = int(self.n_records)
+        if signal_i is None or signal_q is None:
+            return np.zeros((self.n_readout, n_segment), dtype=complex)
+        vI = signal_i['y']
+        vQ = signal_q['y']
+        if vI.shape != vQ.shape:
+            raise ValueError('I and Q must have the same shape.')
+        n0, length, n_segment, vData = self._get_segments(
+            signal_i, vI + 1j * vQ)
+        if length <= 1:
+            return np.zeros((self.n_readout, n_segment), dtype=complex)
+        mRef = self._get_reference(signal_i['dt'], n0, length, iq=True)
+        # sign of Q is flipped for our convention of IQ demodulation
+        values = np.conj(self._apply_reference(vData[:, n0:n0 + length],
+                                               mRef))
+        if self.use_phase_ref and ref is not None:
+            # skip reference if trace length doesn't match
+            if len(ref['y']) != len(vI):
+                return values
+            vRef = np.reshape(ref['y'], vData.shape)
+            values_ref = np.conj(self._apply_reference(
+                vRef[:, n0:n0 + length], mRef))
+            # subtract the reference angle
+            dAngleRef = np.arctan2(values_ref.imag, values_ref.real)
+            values /= (np.cos(dAngleRef) + 1j * np.sin(dAngleRef))
+        return values
+
+    def _get_segments(self, signal, vY):
+        """Get demodulation window and data reshaped into segments.
+
+        Parameters
+        ----------
+        signal : dict
+            Dictionary with signal data, used for shape and time step.
+
+        vY : numpy array
+            Signal data.
+
+        Returns
+        -------
+        n0 : int
+            Index of first demodulated point in each segment.
+        length : int
+            Number of demodulated points in each segment.
+        n_segment : int
+            Number of segments.
+        vData : numpy array
+            Data reshaped to (n_segment, points per segment).
+
+        """
+        n_segment = int(self.n_records)
+        # override segment parameter if input data has more than one dimension
+        shape = signal.get('shape', vY.shape)
+        if len(shape) > 1:
+            n_segment = shape[0]
+        dt = signal['dt']
+        # avoid exceptions if no time step is given
+        if dt == 0:
+            dt = 1.0
+        # get indices for data trimming
+        n0 = int(round(self.demod_skip / dt))
+        n_total = vY.size
+        length = 1 + int(round(self.demod_length / dt))
+        length = min(length, int(n_total / n_segment) - n0)
+        if length <= 1:
+            return n0, length, n_segment, None
+        vData = np.reshape(vY, (n_segment, int(n_total / n_segment)))
+        return n0, length, n_segment, vData
+
+    def _get_reference(self, dt, n0, length, iq):
+        """Get demodulation references for all qubits.
+
+        The references include the trapezoidal integration weights, so that
+        demodulation is a matrix product with the data. They are only
+        recalculated if the frequencies or the demodulation window change.
+
+        Parameters
+        ----------
+        dt : float
+            Time step of the data.
+        n0 : int
+            Index of first demodulated point.
+        length : int
+            Number of demodulated points.
+        iq : bool
+            If True, get complex references for IQ data, otherwise get
+            cos/sin references for real data.
+
+        Returns
+        -------
+        numpy array
+            Complex array with shape (length, number of qubits).
+
+        """
+        # avoid exceptions if no time step is given
+        if dt == 0:
+            dt = 1.0
+        frequency = self.frequencies[:self.n_readout] - self.freq_offset
+        key = (tuple(frequency), dt, n0, length, iq)
+        if key == self._reference_key:
+            return self._reference
+        vTime = dt * (n0 + np.arange(length, dtype=float))
+        # trapezoidal integration weights
+        weights = np.ones(length) / float(length - 1)
+        weights[[0, -1]] *= 0.5
+        phase = 2 * np.pi * vTime[:, np.newaxis] * frequency
+        if iq:
+            mRef = weights[:, np.newaxis] * np.exp(-1j * phase)
+        else:
+            mRef = 2 * weights[:, np.newaxis] * (np.cos(phase) +
+                                                  1j * np.sin(phase))
+        self._reference_key = key
+        self._reference = np.ascontiguousarray(mRef)
+        return self._reference
+
+    def _apply_reference(self, vData, mRef):
+        """Demodulate data segments with references for all qubits.
+
+        Parameters
+        ----------
+        vData : numpy array
+            Data with shape (n_segment, length).
+        mRef : numpy array
+            References with shape (length, number of qubits).
+
+        Returns
+        -------
+        values : complex numpy array
+            Array with shape (number of qubits, n_segment)
+
+        """
+        if np.iscomplexobj(vData):
+            return (vData @ mRef).T
+        # for real data, treat real/imag parts as two real references
+        n_qubit = mRef.shape[1]
+        values = vData @ mRef.view(float)
+        return values.view(complex).reshape(-1, n_qubit).T
+
 
 if __name__ == '__main__':
     pass
@@ -1,15 +1,24 @@
 #!/usr/bin/env python3
+import functools
+import json
 import logging
-from copy import copy
+import time
+import weakref
+from copy import copy, deepcopy
 from enum import Enum
 
 import numpy as np
+try:
+    from scipy.signal import oaconvolve
+except ImportError:
+    # scipy < 1.4
+    from scipy.signal import fftconvolve as oaconvolve
 
 from crosstalk import Crosstalk
 from gates import (CompositeGate, CustomGate, Gate, IdentityGate, ReadoutGate,
                    SingleQubitRotation, TwoQubitGate, VirtualZGate, RabiGate)
 from predistortion import ExponentialPredistortion, Predistortion
-from pulse import Pulse, PulseShape, PulseType
+from pulse import EnvelopeCache, Pulse, PulseShape, PulseType
 from qubits import Qubit, Transmon
 from readout import Readout
 from tomography import ProcessTomography, StateTomography
@@ -20,6 +29,105 @@ log = logging.getLogger('LabberDriver')
 # Maximal number of qubits controllable by this class
 MAX_QUBIT = 9
 
+# smallest and largest window size at which filters switch to FFT convolution
+FFT_FILTER_SIZE_RANGE = (32, 512)
+
+
+class ConfigRecorder(dict):
+    """Configuration dict that records which keys are read.
+
+    Reads are recorded for the current `stage`, which is used to find out
+    which compilation stages depend on which configuration values. Iterating
+    over the keys marks the stage as depending on all values.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration as defined by Labber driver configuration window.
+    stage : str or tuple
+        Stage for which reads are recorded (the default is 'generate').
+
+    Attributes
+    ----------
+    keys_read : dict
+        Set of keys read for each stage.
+
+    """
+
+    # key recorded when iterating over the whole configuration
+    ALL = '*'
+    # value of keys missing in the configuration
+    MISSING = object()
+
+    def __init__(self, config, stage='generate'):
+        super().__init__(config)
+        self.stage = stage
+        self.keys_read = dict()
+
+    def _record(self, key):
+        self.keys_read.setdefault(self.stage, set()).add(key)
+
+    def __getitem__(self, key):
+        self._record(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self._record(key)
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self._record(key)
+        return super().get(key, default)
+
+    def __iter__(self):
+        self._record(self.ALL)
+        return super().__iter__()
+
+    def keys(self):
+        self._record(self.ALL)
+        return super().keys()
+
+    def values(self):
+        self._record(self.ALL)
+        return super().values()
+
+    def items(self):
+        self._record(self.ALL)
+        return super().items()
+
+    def copy(self):
+        self._record(self.ALL)
+        return dict(super().items())
+
+
+def _set_config_stage(config, stage):
+    """Set the stage for which config reads are recorded, if recording."""
+    if isinstance(config, ConfigRecorder):
+        config.stage = stage
+
+
+def _profile_stage(name):
+    """Decorate compilation stage to record its time and new waveforms.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage in the profile of :obj:`SequenceToWaveforms`.
+
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            # weak references, to not keep replaced waveforms alive
+            before = [weakref.ref(x) for x in self._get_output_arrays()]
+            t0 = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self._record_stage(name, time.perf_counter() - t0, before)
+        return wrapper
+    return decorator
+
 
 class Step:
     """Represent one step in a sequence.
@@ -481,6 +589,9 @@ class SequenceToWaveforms:
 
     """
 
+    # window size above which filters use FFT convolution, set on first use
+    _fft_filter_size = None
+
     def __init__(self, n_qubit=5):
         self.n_qubit = n_qubit
         self.dt = 10E-9
@@ -493,6 +604,10 @@ class SequenceToWaveforms:
         self.first_delay = 100E-9
         self.trim_to_sequence = True
         self.align_to_end = False
+        # waveform precision
+        self.single_precision = False
+        self.report_precision_error = False
+        self.precision_error = {}
 
         self.sequences = []
         self.qubits = [Qubit() for n in range(MAX_QUBIT)]
@@ -502,6 +617,17 @@ class SequenceToWaveforms:
                          for n in range(MAX_QUBIT)]
         self._wave_z = [np.zeros(0) for n in range(MAX_QUBIT)]
         self._wave_gate = [np.zeros(0) for n in range(MAX_QUBIT)]
+        # index ranges (start, stop) of z waveforms that may be non-zero
+        self._segments_z = [[] for n in range(MAX_QUBIT)]
+        # results of each compilation stage and the config values they used,
+        # for incremental compilation
+        self._stage_results = None
+        self._stage_config = None
+        # time and allocated waveforms of each stage of the last compilation
+        self.profile = dict()
+        self.profile_time = 0.0
+        self.log_profile = False
+        self._profile_start = None
 
         # waveform delays
         self.wave_xy_delays = np.zeros(MAX_QUBIT)
@@ -514,6 +640,10 @@ class SequenceToWaveforms:
         self.pulses_readout = [Pulse(pulse_type=PulseType.READOUT)
                                for n in range(MAX_QUBIT)]
 
+        # cache for re-using envelopes of identical pulses
+        self.cache_envelopes = False
+        self._envelope_cache = EnvelopeCache()
+
         # cross-talk
         self.compensate_crosstalk = False
         self._crosstalk = Crosstalk()
@@ -534,6 +664,7 @@ class SequenceToWaveforms:
         # filters
         self.use_gate_filter = False
         self.use_z_filter = False
+        self.fft_filter = False
 
         # readout trig settings
         self.readout_trig_generate = False
@@ -557,12 +688,500 @@ class SequenceToWaveforms:
             Description of returned object.
 
         """
+        self._reset_profile()
+        if self.single_precision and self.report_precision_error:
+            self.precision_error = self.get_precision_error(sequences)
+            log.info('Single-precision error: {:.3g} LSB (16-bit)'.format(
+                self.precision_error['max_error_lsb']))
+
+        # stored stage results no longer match the waveforms
+        self._stage_results = None
         self.sequences = sequences
         self._seperate_gates()
 
         self._add_timings()
         self._init_waveforms()
+        self._compile_waveforms()
+        self._finish_profile()
+
+        # create and return dictionary with waveforms
+        waveforms = dict()
+        waveforms['xy'] = self._wave_xy
+        waveforms['z'] = self._wave_z
+        waveforms['gate'] = self._wave_gate
+        waveforms['readout_trig'] = self.readout_trig
+        waveforms['readout_iq'] = self.readout_iq
+        return waveforms
+
+    def get_waveforms_incremental(self, sequence, config):
+        """Set parameters and compile sequence, re-using unchanged stages.
+
+        The config keys read by each compilation stage are recorded. When
+        called again, only the stages that read a changed value are
+        re-run, the results of the other stages are taken from the previous
+        call. Predistortion is tracked separately for each waveform. The
+        result is identical to calling `set_parameters` and `get_waveforms`.
+
+        The returned arrays are used as input for later calls and must not
+        be modified.
+
+        Parameters
+        ----------
+        sequence : :obj:`Sequence`
+            Sequence object, `get_sequence` is only called if the sequence
+            or pulse parameters changed.
+        config : dict
+            Configuration as defined by Labber driver configuration window.
+
+        Returns
+        -------
+        dict
+            Waveforms, with the same keys as returned by `get_waveforms`.
+
+        """
+        recorder = ConfigRecorder(config)
+        sequence.set_parameters(recorder)
+        self.set_parameters(recorder)
+        if self.single_precision and self.report_precision_error:
+            # the precision check needs a full compilation
+            return self.get_waveforms(sequence.get_sequence(config))
+        self._reset_profile()
+        stages = self._get_changed_stages(config)
+
+        # pulses of the sequence
+        generate = (stages is None or 'generate' in stages or
+                    'sequence' in stages or
+                    self._stage_results['sequence'] is not sequence)
+        if generate:
+            recorder.stage = 'sequence'
+            self.sequences = sequence.get_sequence(recorder)
+            self._seperate_gates()
+            self._add_timings()
+            self._init_waveforms()
+            self._generate_sequence_waveforms()
+            results = {'generate': self._get_stage_result(),
+                       'n_pts': self.n_pts, 'sequence': sequence}
+        else:
+            # sequence not re-generated, keep keys it depends on
+            results = self._stage_results
+            recorder.keys_read['sequence'] = self._stage_config.get(
+                'sequence', {}).keys()
+            # waveform size is reset by set_parameters if trimming
+            self.n_pts = results['n_pts']
+            self._set_stage_result(results['generate'])
 
+        # crosstalk
+        crosstalk = generate or 'crosstalk' in stages
+        if crosstalk:
+            self._perform_crosstalk_compensation()
+            results['crosstalk'] = self._get_stage_result()
+        else:
+            self._set_stage_result(results['crosstalk'])
+
+        # predistortion, per waveform
+        if generate:
+            indices_xy = None
+        elif 'predistort_xy' in stages:
+            indices_xy = None
+        else:
+            indices_xy = [n for n in range(MAX_QUBIT)
+                          if ('predistort_xy', n) in stages]
+        if crosstalk or 'predistort_z' in stages:
+            indices_z = None
+        else:
+            indices_z = [n for n in range(MAX_QUBIT)
+                         if ('predistort_z', n) in stages]
+        if indices_xy is not None or indices_z is not None:
+            # start from previous result for waveforms that are not updated
+            previous = results['predistort']
+            for n in range(self.n_qubit):
+                if indices_xy is not None and n not in indices_xy:
+                    self._wave_xy[n] = previous['xy'][n]
+                if indices_z is not None and n not in indices_z:
+                    self._wave_z[n] = previous['z'][n]
+                    self._segments_z[n] = list(previous['segments_z'][n])
+        self._predistort_waveforms(indices_xy, indices_z)
+        results['predistort'] = self._get_stage_result()
+
+        # readout trig, gate, filters and offsets are always updated
+        (dtype_complex, dtype_float) = self.get_dtypes()
+        for n in range(self.n_qubit):
+            self._wave_gate[n] = np.zeros(self.n_pts, dtype=dtype_float)
+        self.readout_trig = np.zeros(self.n_pts_readout, dtype=dtype_float)
+        self.readout_iq = self.readout_iq.copy()
+        self._finish_waveforms()
+
+        # store results and the config values they depend on
+        self._stage_results = results
+        self._stage_config = {
+            stage: {key: config.get(key, ConfigRecorder.MISSING)
+                    for key in keys}
+            for stage, keys in recorder.keys_read.items()}
+        self._finish_profile()
+
+        waveforms = dict()
+        waveforms['xy'] = self._wave_xy
+        waveforms['z'] = self._wave_z
+        waveforms['gate'] = self._wave_gate
+        waveforms['readout_trig'] = self.readout_trig
+        waveforms['readout_iq'] = self.readout_iq
+        return waveforms
+
+    def _get_changed_stages(self, config):
+        """Get compilation stages that read config values that changed.
+
+        Parameters
+        ----------
+        config : dict
+            Configuration as defined by Labber driver configuration window.
+
+        Returns
+        -------
+        set
+            Stages with changed config values, or None if there are no
+            results from a previous compilation.
+
+        """
+        if self._stage_results is None or self._stage_config is None:
+            return None
+        stages = set()
+        for stage, values in self._stage_config.items():
+            for key, value in values.items():
+                new = config.get(key, ConfigRecorder.MISSING)
+                if (key == ConfigRecorder.ALL or
+                        self._is_value_changed(new, value)):
+                    stages.add(stage)
+                    break
+        return stages
+
+    def _is_value_changed(self, new, old):
+        """Check if config value changed, values that cannot be compared are
+        considered changed."""
+        try:
+            return bool(new != old)
+        except (TypeError, ValueError):
+            return True
+
+    def _get_stage_result(self):
+        """Get references to the current waveforms of the sequence."""
+        return {'xy': list(self._wave_xy[:self.n_qubit]),
+                'z': list(self._wave_z[:self.n_qubit]),
+                'segments_z': [list(s) for s in
+                               self._segments_z[:self.n_qubit]],
+                'readout_iq': self.readout_iq}
+
+    def _set_stage_result(self, result):
+        """Set the waveforms of the sequence from a stored stage result."""
+        self._wave_xy[:self.n_qubit] = result['xy']
+        self._wave_z[:self.n_qubit] = result['z']
+        self._segments_z[:self.n_qubit] = [list(s) for s in
+                                           result['segments_z']]
+        self.readout_iq = result['readout_iq']
+
+    def get_waveforms_batch(self, sequences_list, align_end=False):
+        """Compile multiple sequences into 2D waveform arrays.
+
+        The waveforms are written directly into preallocated arrays with one
+        row per sequence, padded with zeros to the length of the longest
+        waveform. The results are identical to calling `get_waveforms` for
+        each sequence.
+
+        Parameters
+        ----------
+        sequences_list : list of list of :obj:`Step`
+            The qubit sequences to be compiled.
+        align_end : bool
+            If True, align waveforms to the end of each row instead of the
+            start (the default is False).
+
+        Returns
+        -------
+        dict
+            Waveforms for all sequences, with the same keys as returned by
+            `get_waveforms`. Each waveform is a 2D numpy array with shape
+            (number of sequences, number of points).
+
+        """
+        # first pass, get timing and waveform size for all sequences
+        self._reset_profile()
+        self._stage_results = None
+        compiled = self._prepare_batch(sequences_list)
+        # preallocate output
+        n_call = len(compiled)
+        n_pts = max([c[1] for c in compiled])
+        n_pts_readout = max([c[2] for c in compiled])
+        (dtype_complex, dtype_float) = self.get_dtypes()
+        waveforms = dict()
+        waveforms['xy'] = [np.zeros((n_call, n_pts), dtype=dtype_complex)
+                           for n in range(self.n_qubit)]
+        waveforms['z'] = [np.zeros((n_call, n_pts), dtype=dtype_float)
+                          for n in range(self.n_qubit)]
+        waveforms['gate'] = [np.zeros((n_call, n_pts), dtype=dtype_float)
+                             for n in range(self.n_qubit)]
+        waveforms['readout_trig'] = np.zeros((n_call, n_pts_readout),
+                                             dtype=dtype_float)
+        waveforms['readout_iq'] = np.zeros((n_call, n_pts_readout),
+                                           dtype=dtype_complex)
+        # second pass, compile each sequence into its row of the output
+        self._compile_batch(compiled, waveforms, align_end=align_end)
+        self._finish_profile()
+        return waveforms
+
+    def get_profile(self):
+        """Get time and allocated waveforms of the last compilation.
+
+        Returns
+        -------
+        dict
+            Total time in seconds, number and size in bytes of waveform
+            arrays allocated, size of the compiled waveforms, and for each
+            stage the time, number of calls, and number and size of waveform
+            arrays allocated. Stages are in the order they were first run.
+
+        """
+        stages = {name: dict(stage) for name, stage in self.profile.items()}
+        return dict(time=self.profile_time,
+                    arrays=sum(s['arrays'] for s in stages.values()),
+                    nbytes=sum(s['nbytes'] for s in stages.values()),
+                    waveform_nbytes=sum(
+                        x.nbytes for x in self._get_output_arrays()),
+                    stages=stages)
+
+    def format_profile(self):
+        """Get one-line summary of the profile of the last compilation.
+
+        Returns
+        -------
+        str
+            Total time, followed by the time and allocated waveforms of each
+            stage.
+
+        """
+        items = ['total {:.1f} ms'.format(1E3 * self.profile_time)]
+        for name, stage in self.profile.items():
+            item = '{} {:.1f} ms'.format(name, 1E3 * stage['time'])
+            if stage['arrays'] > 0:
+                item += ' ({:d} arrays, {:.2f} MB)'.format(
+                    stage['arrays'], 1E-6 * stage['nbytes'])
+            items.append(item)
+        return ', '.join(items)
+
+    def _reset_profile(self):
+        """Start profiling a new compilation."""
+        self.profile = dict()
+        self.profile_time = 0.0
+        self._profile_start = time.perf_counter()
+
+    def _finish_profile(self):
+        """Store total compilation time and log profile, if enabled."""
+        if self._profile_start is not None:
+            self.profile_time = time.perf_counter() - self._profile_start
+        self._profile_start = None
+        if self.log_profile:
+            log.info('Compile profile: ' + json.dumps(self.get_profile()))
+
+    def _get_output_arrays(self):
+        """Get waveform arrays of the sequence being compiled."""
+        return (self._wave_xy[:self.n_qubit] + self._wave_z[:self.n_qubit] +
+                self._wave_gate[:self.n_qubit] +
+                [self.readout_trig, self.readout_iq])
+
+    def _record_stage(self, name, t, before):
+        """Add time and waveforms allocated by stage to the profile.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+        t : float
+            Time spent in the stage, in seconds.
+        before : list of weakref
+            References to the waveform arrays before the stage was run.
+
+        """
+        old = set(id(x()) for x in before if x() is not None)
+        new = dict()
+        for x in self._get_output_arrays():
+            if id(x) not in old:
+                new[id(x)] = x.nbytes
+        stage = self.profile.setdefault(
+            name, dict(time=0.0, calls=0, arrays=0, nbytes=0))
+        stage['time'] += t
+        stage['calls'] += 1
+        stage['arrays'] += len(new)
+        stage['nbytes'] += sum(new.values())
+
+    def get_dtypes(self):
+        """Get data types used for the waveforms.
+
+        Returns
+        -------
+        tuple of numpy dtype
+            Data type for complex and real waveforms.
+
+        """
+        if self.single_precision:
+            return (np.complex64, np.float32)
+        return (np.complex128, np.float64)
+
+    def get_precision_error(self, sequences):
+        """Compare single-precision waveforms to the double-precision result.
+
+        The sequence is compiled in both precisions, the compiled sequence
+        and the waveforms stored in the object are not affected.
+
+        Parameters
+        ----------
+        sequences : list of :obj:`Step`
+            The qubit sequence to be compiled.
+
+        Returns
+        -------
+        dict
+            Maximum absolute error of each waveform, with the same keys as
+            returned by `get_waveforms`. The key 'max_error_lsb' contains the
+            largest error in units of the least significant bit of a 16-bit
+            DAC spanning the peak amplitude of each waveform.
+
+        """
+        # keep state, compilation changes both waveforms and sequence
+        state = (self.single_precision, self.sequences, self._wave_xy[:],
+                 self._wave_z[:], self._wave_gate[:], self.readout_trig,
+                 self.readout_iq)
+        results = []
+        try:
+            for single_precision in (False, True):
+                self.single_precision = single_precision
+                self.sequences = deepcopy(sequences)
+                self._seperate_gates()
+                self._add_timings()
+                self._init_waveforms()
+                self._compile_waveforms()
+                results.append(
+                    dict(xy=self._wave_xy[:self.n_qubit],
+                         z=self._wave_z[:self.n_qubit],
+                         gate=self._wave_gate[:self.n_qubit],
+                         readout_trig=[self.readout_trig],
+                         readout_iq=[self.readout_iq]))
+        finally:
+            (self.single_precision, self.sequences, self._wave_xy[:],
+             self._wave_z[:], self._wave_gate[:], self.readout_trig,
+             self.readout_iq) = state
+
+        report = dict()
+        max_error_lsb = 0.0
+        for key, references in results[0].items():
+            errors = []
+            for reference, wave in zip(references, results[1][key]):
+                # compare real and imaginary parts separately
+                reference = reference.view(np.float64)
+                if len(reference) == 0:
+                    errors.append(0.0)
+                    continue
+                error = float(np.max(
+                    np.abs(wave.view(wave.real.dtype) - reference)))
+                peak = float(np.max(np.abs(reference)))
+                if peak > 0:
+                    max_error_lsb = max(max_error_lsb, error / peak * 2**15)
+                errors.append(error)
+            report[key] = errors if key in ('xy', 'z', 'gate') else errors[0]
+        report['max_error_lsb'] = max_error_lsb
+        return report
+
+    def _prepare_batch(self, sequences_list):
+        """Calculate timings and waveform sizes for multiple sequences.
+
+        Parameters
+        ----------
+        sequences_list : list of list of :obj:`Step`
+            The qubit sequences to be compiled.
+
+        Returns
+        -------
+        list of tuple
+            Tuples (sequences, n_pts, n_pts_readout) for each sequence, to be
+            passed to `_compile_batch`.
+
+        """
+        compiled = []
+        for sequences in sequences_list:
+            self.sequences = sequences
+            self._seperate_gates()
+            self._add_timings()
+            self._calculate_waveform_sizes()
+            compiled.append((self.sequences, self.n_pts, self.n_pts_readout))
+        return compiled
+
+    def _compile_batch(self, compiled, waveforms, indices=None,
+                       align_end=False):
+        """Compile prepared sequences into rows of preallocated waveforms.
+
+        Parameters
+        ----------
+        compiled : list of tuple
+            Prepared sequences, as returned by `_prepare_batch`.
+        waveforms : dict
+            Preallocated 2D waveforms, with the same keys as returned by
+            `get_waveforms_batch`. The arrays are updated in place.
+        indices : list of int
+            Output row index for each of the sequences. If None, the
+            sequences are written to consecutive rows (the default is None).
+        align_end : bool
+            If True, align waveforms to the end of each row instead of the
+            start (the default is False).
+
+        """
+        if indices is None:
+            indices = range(len(compiled))
+        wave_xy = waveforms['xy']
+        wave_z = waveforms['z']
+        wave_gate = waveforms['gate']
+        readout_trig = waveforms['readout_trig']
+        readout_iq = waveforms['readout_iq']
+        n_pts = wave_z[0].shape[1]
+        n_pts_readout = readout_trig.shape[1]
+        for m, (sequences, n_seq, n_seq_readout) in zip(indices, compiled):
+            self.sequences = sequences
+            self.n_pts = n_seq
+            self.n_pts_readout = n_seq_readout
+            # get views of the output rows
+            i0 = (n_pts - n_seq) if align_end else 0
+            j0 = (n_pts_readout - n_seq_readout) if align_end else 0
+            rows_xy = [w[m, i0:(i0 + n_seq)] for w in wave_xy]
+            rows_z = [w[m, i0:(i0 + n_seq)] for w in wave_z]
+            rows_gate = [w[m, i0:(i0 + n_seq)] for w in wave_gate]
+            row_trig = readout_trig[m, j0:(j0 + n_seq_readout)]
+            row_iq = readout_iq[m, j0:(j0 + n_seq_readout)]
+            self._wave_xy[:self.n_qubit] = rows_xy
+            self._wave_z[:self.n_qubit] = rows_z
+            self._wave_gate[:self.n_qubit] = rows_gate
+            self.readout_trig = row_trig
+            self.readout_iq = row_iq
+            self.t = np.arange(self.n_pts) / self.sample_rate
+
+            self._compile_waveforms()
+
+            # some steps create new arrays, copy those into the output
+            for rows, waves in ((rows_xy, self._wave_xy),
+                                (rows_z, self._wave_z),
+                                (rows_gate, self._wave_gate)):
+                for row, wave in zip(rows, waves):
+                    if wave is not row:
+                        row[:] = wave
+            if self.readout_trig is not row_trig:
+                row_trig[:] = self.readout_trig
+            if self.readout_iq is not row_iq:
+                row_iq[:] = self.readout_iq
+
+    def _compile_waveforms(self):
+        """Compile waveforms from sequence with timings and waveforms set."""
+        self._generate_sequence_waveforms()
+        self._perform_crosstalk_compensation()
+        self._predistort_waveforms()
+        self._finish_waveforms()
+
+    def _generate_sequence_waveforms(self):
+        """Generate pulses of the sequence, before any corrections."""
         if self.align_to_end:
             shift = self._round((self.n_pts - 2) / self.sample_rate -
                                 self.sequences[-1].t_end)
@@ -579,8 +1198,8 @@ class SequenceToWaveforms:
             for n in range(1, self.n_qubit):
                 self._wave_xy[n][:] = 0.0
 
-        self._perform_crosstalk_compensation()
-        self._predistort_waveforms()
+    def _finish_waveforms(self):
+        """Add readout trig and gate, filter waveforms and apply offsets."""
         self._add_readout_trig()
         self._add_microwave_gate()
         self._filter_output_waveforms()
@@ -588,15 +1207,7 @@ class SequenceToWaveforms:
         # Apply offsets
         self.readout_iq += self.readout_i_offset + 1j * self.readout_q_offset
 
-        # create and return dictionary with waveforms
-        waveforms = dict()
-        waveforms['xy'] = self._wave_xy
-        waveforms['z'] = self._wave_z
-        waveforms['gate'] = self._wave_gate
-        waveforms['readout_trig'] = self.readout_trig
-        waveforms['readout_iq'] = self.readout_iq
-        return waveforms
-
+    @_profile_stage('seperate_gates')
     def _seperate_gates(self):
         if not self.simultaneous_pulses:
             new_sequences = []
@@ -621,6 +1232,7 @@ class SequenceToWaveforms:
                 if gate is None:
                     step.gates[i] = IdentityGate(width=0)
 
+    @_profile_stage('add_timings')
     def _add_timings(self):
         for step in self.sequences:
             if step.dt is None and step.t0 is None:
@@ -694,27 +1306,52 @@ class SequenceToWaveforms:
 
         return pulse
 
-    def _predistort_waveforms(self):
-        """Pre-distort the waveforms."""
+    @_profile_stage('predistort')
+    def _predistort_waveforms(self, indices_xy=None, indices_z=None):
+        """Pre-distort the waveforms.
+
+        Parameters
+        ----------
+        indices_xy : list of int
+            XY waveforms to predistort. If None, all waveforms are
+            predistorted (the default is None).
+        indices_z : list of int
+            Z waveforms to predistort. If None, all waveforms are
+            predistorted (the default is None).
+
+        """
         if self.perform_predistortion:
             # go through and predistort all waveforms
             n_wave = self.n_qubit if self.local_xy else 1
             for n in range(n_wave):
+                if indices_xy is not None and n not in indices_xy:
+                    continue
                 self._wave_xy[n] = self._predistortions[n].predistort(
                     self._wave_xy[n])
 
         if self.perform_predistortion_z:
             # go through and predistort all waveforms
             for n in range(self.n_qubit):
+                if indices_z is not None and n not in indices_z:
+                    continue
                 self._wave_z[n] = self._predistortions_z[n].predistort(
                     self._wave_z[n])
+                # the filter response extends over the full waveform
+                self._segments_z[n] = [(0, len(self._wave_z[n]))]
 
+    @_profile_stage('crosstalk')
     def _perform_crosstalk_compensation(self):
         """Compensate for Z-control crosstalk."""
         if not self.compensate_crosstalk:
             return
-        self._wave_z = self._crosstalk.compensate(self._wave_z)
+        # compensated waveforms can only be non-zero where any input is
+        segments = self._merge_segments(
+            sum(self._segments_z[:self.n_qubit], []))
+        self._wave_z = self._crosstalk.compensate(self._wave_z, segments)
+        for n in range(self.n_qubit):
+            self._segments_z[n] = list(segments)
 
+    @_profile_stage('virtual_z')
     def _perform_virtual_z(self):
         """Shifts the phase of pulses subsequent to virutal z gates."""
         for qubit in range(self.n_qubit):
@@ -727,16 +1364,18 @@ class SequenceToWaveforms:
                 if not isinstance(gate, ReadoutGate):
                     step.gates[qubit] = gate.add_phase(phase)
 
+    @_profile_stage('microwave_gate')
     def _add_microwave_gate(self):
         """Create waveform for gating microwave switch."""
         if not self.generate_gate_switch:
             return
         n_wave = self.n_qubit if self.local_xy else 1
+        dtype = self.get_dtypes()[1]
         # go through all waveforms
         for n, wave in enumerate(self._wave_xy[:n_wave]):
             if self.uniform_gate:
                 # the uniform gate is all ones
-                gate = np.ones_like(wave)
+                gate = np.ones(len(wave), dtype=dtype)
                 # if creating readout trig, turn off gate during readout
                 if self.readout_trig_generate:
                     gate[-int((self.readout_trig_duration -
@@ -744,46 +1383,97 @@ class SequenceToWaveforms:
                                self.gate_delay) * self.sample_rate):] = 0.0
             else:
                 # non-uniform gate, find non-zero elements
-                gate = np.array(np.abs(wave) > 0.0, dtype=float)
+                mask = np.abs(wave) > 0.0
                 # fix gate overlap
                 n_overlap = int(np.round(self.gate_overlap * self.sample_rate))
-                diff_gate = np.diff(gate)
-                indx_up = np.nonzero(diff_gate > 0.0)[0]
-                indx_down = np.nonzero(diff_gate < 0.0)[0]
+                indx_up, indx_down = self._find_gate_edges(mask)
                 # add extra elements to left and right for overlap
-                for indx in indx_up:
-                    gate[max(0, indx - n_overlap):(indx + 1)] = 1.0
-                for indx in indx_down:
-                    gate[indx:(indx + n_overlap + 1)] = 1.0
+                self._fill_gate_intervals(
+                    mask,
+                    np.r_[np.maximum(0, indx_up - n_overlap), indx_down],
+                    np.r_[indx_up + 1, indx_down + n_overlap + 1])
 
                 # fix gaps in gate shorter than min (look for 1>0)
-                diff_gate = np.diff(gate)
-                indx_up = np.nonzero(diff_gate > 0.0)[0]
-                indx_down = np.nonzero(diff_gate < 0.0)[0]
+                indx_up, indx_down = self._find_gate_edges(mask)
                 # ignore first transition if starting in zero
-                if gate[0] == 0:
+                if not mask[0]:
                     indx_up = indx_up[1:]
                 n_down_up = min(len(indx_down), len(indx_up))
                 len_down = indx_up[:n_down_up] - indx_down[:n_down_up]
                 # find short gaps
                 short_gaps = np.nonzero(len_down < (self.minimal_gate_time *
                                                     self.sample_rate))[0]
-                for indx in short_gaps:
-                    gate[indx_down[indx]:(1 + indx_up[indx])] = 1.0
+                self._fill_gate_intervals(mask, indx_down[short_gaps],
+                                          1 + indx_up[short_gaps])
+                gate = np.array(mask, dtype=dtype)
 
                 # shift gate in time
                 n_shift = int(np.round(self.gate_delay * self.sample_rate))
                 if n_shift < 0:
                     n_shift = abs(n_shift)
-                    gate = np.r_[gate[n_shift:], np.zeros((n_shift,))]
+                    gate = np.r_[gate[n_shift:],
+                                 np.zeros((n_shift,), dtype=gate.dtype)]
                 elif n_shift > 0:
-                    gate = np.r_[np.zeros((n_shift,)), gate[:(-n_shift)]]
+                    gate = np.r_[np.zeros((n_shift,), dtype=gate.dtype),
+                                 gate[:(-n_shift)]]
             # make sure gate starts/ends in 0
             gate[0] = 0.0
             gate[-1] = 0.0
             # store results
             self._wave_gate[n] = gate
 
+    def _find_gate_edges(self, mask):
+        """Find rising and falling edges of gate.
+
+        Parameters
+        ----------
+        mask : np.array of bool
+            Gate, True where the gate is open.
+
+        Returns
+        -------
+        np.array
+            Indices of the last closed element before each rising edge.
+        np.array
+            Indices of the last open element before each falling edge.
+
+        """
+        diff_gate = np.diff(mask.view(np.int8))
+        return np.flatnonzero(diff_gate > 0), np.flatnonzero(diff_gate < 0)
+
+    def _fill_gate_intervals(self, mask, starts, stops):
+        """Open gate in intervals, in-place.
+
+        Parameters
+        ----------
+        mask : np.array of bool
+            Gate, True where the gate is open.
+        starts : np.array of int
+            Start index of each interval.
+        stops : np.array of int
+            Stop index of each interval. The intervals are interpreted as
+            slices `mask[start:stop]`, including negative indices.
+
+        """
+        n = len(mask)
+        starts = np.clip(np.where(starts < 0, starts + n, starts), 0, n)
+        stops = np.clip(np.where(stops < 0, stops + n, stops), 0, n)
+        keep = stops > starts
+        if not np.any(keep):
+            return
+        # merge overlapping intervals, sorted by start
+        order = np.argsort(starts[keep], kind='stable')
+        starts = starts[keep][order]
+        stops = np.maximum.accumulate(stops[keep][order])
+        first = np.r_[True, starts[1:] > stops[:-1]]
+        last = np.r_[first[1:], True]
+        # mark start and stop of merged intervals, open gate in between
+        delta = np.zeros(n + 1, dtype=np.int8)
+        delta[starts[first]] = 1
+        delta[stops[last]] = -1
+        mask |= np.cumsum(delta[:n], dtype=np.int8).view(bool)
+
+    @_profile_stage('filter')
     def _filter_output_waveforms(self):
         """Filter output waveforms"""
         # start with gate
@@ -809,7 +1499,7 @@ class SequenceToWaveforms:
             # apply filter to all output waveforms
             for n in range(self.n_qubit):
                 self._wave_z[n] = self._apply_window_filter(
-                    self._wave_z[n], window)
+                    self._wave_z[n], window, self._segments_z[n])
 
     def _get_filter_window(self, size=11, window='Kaiser', kaiser_beta=14.0):
         """Get filter for waveform convolution"""
@@ -833,7 +1523,7 @@ class SequenceToWaveforms:
             raise('Unknown filter windows function %s.' % str(window))
         return w/w.sum()
 
-    def _apply_window_filter(self, x, window):
+    def _apply_window_filter(self, x, window, segments=None):
         """Apply window filter to input waveform
 
         Parameters
@@ -842,6 +1532,11 @@ class SequenceToWaveforms:
             Input waveform.
         window: np.array
             Filter waveform.
+        segments: list of tuple
+            Index ranges (start, stop) outside which the input waveform is
+            zero. If given, the filter is only evaluated close to the
+            segments. If None, the full waveform is filtered (the default is
+            None).
 
         Returns
         -------
@@ -851,10 +1546,127 @@ class SequenceToWaveforms:
         """
         # buffer waveform to avoid wrapping effects at boundaries
         n = len(window)
-        s = np.r_[2*x[0] - x[n-1::-1], x, 2*x[-1] - x[-1:-n:-1]]
-        # apply convolution
-        y = np.convolve(s, window, mode='same')
-        return y[n:-n+1]
+        window = np.asarray(window, dtype=x.dtype)
+        left = 2*x[0] - x[n-1::-1]
+        right = 2*x[-1] - x[-1:-n:-1]
+        if segments is None:
+            s = np.r_[left, x, right]
+            # apply convolution
+            y = self._convolve_window(s, window)
+            return y[n:-n+1]
+
+        # output is zero further than the window size from all segments
+        y = np.zeros_like(x)
+        for start, stop in self._merge_segments(segments, n, len(x)):
+            # same part of the buffered waveform as used above, the output
+            # points are therefore identical to the full convolution
+            s = np.r_[left[start:], x[max(start - n, 0):(stop + n)],
+                      right[:max(stop + n - len(x), 0)]]
+            y[start:stop] = self._convolve_window(s, window)[
+                n:(n + stop - start)]
+        return y
+
+    def _convolve_window(self, s, window):
+        """Convolve waveform with filter window, with output of same size.
+
+        If `fft_filter` is set, long windows use overlap-add FFT convolution,
+        which differs from `np.convolve` by floating-point rounding, of
+        about 1e-15 relative to the waveform amplitude. Otherwise the output
+        is always identical to `np.convolve`.
+
+        Parameters
+        ----------
+        s: np.array
+            Input waveform.
+        window: np.array
+            Filter waveform.
+
+        Returns
+        -------
+        np.array
+            Filtered waveform, centered as for `np.convolve` in 'same' mode.
+
+        """
+        if (self.fft_filter and
+                len(window) >= FFT_FILTER_SIZE_RANGE[0] and
+                len(s) > len(window) and
+                len(window) >= self._get_fft_filter_size()):
+            return oaconvolve(s, window, mode='same')
+        return np.convolve(s, window, mode='same')
+
+    def _get_fft_filter_size(self):
+        """Get the window size above which FFT convolution is faster.
+
+        The crossover depends on the machine. It is measured once per
+        process by timing both methods on a short waveform, and limited to
+        `FFT_FILTER_SIZE_RANGE`.
+
+        Returns
+        -------
+        int
+            Smallest window size for which FFT convolution is used.
+
+        """
+        if SequenceToWaveforms._fft_filter_size is not None:
+            return SequenceToWaveforms._fft_filter_size
+        x = np.zeros(2**15)
+        size = FFT_FILTER_SIZE_RANGE[1]
+        n = FFT_FILTER_SIZE_RANGE[0]
+        while n < size:
+            window = np.ones(n) / n
+            dt_direct = np.inf
+            dt_fft = np.inf
+            for m in range(3):
+                t0 = time.perf_counter()
+                np.convolve(x, window, mode='same')
+                t1 = time.perf_counter()
+                oaconvolve(x, window, mode='same')
+                t2 = time.perf_counter()
+                dt_direct = min(dt_direct, t1 - t0)
+                dt_fft = min(dt_fft, t2 - t1)
+            if dt_fft < dt_direct:
+                size = n
+                break
+            n *= 2
+        SequenceToWaveforms._fft_filter_size = size
+        log.debug('Using FFT convolution for filters with %d or more points'
+                  % size)
+        return size
+
+    def _merge_segments(self, segments, margin=0, n_pts=None):
+        """Merge overlapping index ranges.
+
+        Parameters
+        ----------
+        segments: list of tuple
+            Index ranges (start, stop).
+        margin: int
+            Number of points to extend each range by on both sides (the
+            default is 0).
+        n_pts: int
+            If given, the ranges are clipped to [0, n_pts) (the default is
+            None).
+
+        Returns
+        -------
+        list of tuple
+            Sorted, non-overlapping index ranges (start, stop).
+
+        """
+        merged = []
+        for start, stop in sorted(segments):
+            start = int(start) - margin
+            stop = int(stop) + margin
+            if n_pts is not None:
+                start = max(start, 0)
+                stop = min(stop, n_pts)
+            if stop <= start:
+                continue
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+            else:
+                merged.append((start, stop))
+        return merged
 
     def _round(self, t, acc=1E-12):
         """Round the time `t` with a certain accuarcy `acc`.
@@ -874,11 +1686,12 @@ class SequenceToWaveforms:
         """
         return int(np.round(t / acc)) * acc
 
+    @_profile_stage('readout_trig')
     def _add_readout_trig(self):
         """Create waveform for readout trigger."""
         if not self.readout_trig_generate:
             return
-        trig = np.zeros_like(self.readout_iq)
+        trig = np.zeros(len(self.readout_iq), dtype=self.get_dtypes()[1])
         start = (np.abs(self.readout_iq) > 0.0).nonzero()[0][0]
         end = int(np.min((start +
                           self.readout_trig_duration * self.sample_rate,
@@ -890,8 +1703,25 @@ class SequenceToWaveforms:
         trig[-1] = 0.0
         self.readout_trig = trig
 
+    @_profile_stage('init_waveforms')
     def _init_waveforms(self):
         """Initialize waveforms according to sequence settings."""
+        self._calculate_waveform_sizes()
+        (dtype_complex, dtype_float) = self.get_dtypes()
+        for n in range(self.n_qubit):
+            self._wave_xy[n] = np.zeros(self.n_pts, dtype=dtype_complex)
+            self._wave_z[n] = np.zeros(self.n_pts, dtype=dtype_float)
+            self._wave_gate[n] = np.zeros(self.n_pts, dtype=dtype_float)
+
+        # Waveform time vector
+        self.t = np.arange(self.n_pts) / self.sample_rate
+
+        # readout trig and i/q waveforms
+        self.readout_trig = np.zeros(self.n_pts_readout, dtype=dtype_float)
+        self.readout_iq = np.zeros(self.n_pts_readout, dtype=dtype_complex)
+
+    def _calculate_waveform_sizes(self):
+        """Calculate number of points in main and readout waveforms."""
         # To keep the first pulse delay, use the smallest delay as reference.
         min_delay = np.min([self.wave_xy_delays[:self.n_qubit],
                             self.wave_z_delays[:self.n_qubit]])
@@ -916,13 +1746,6 @@ class SequenceToWaveforms:
             if self.n_pts % 2 == 1:
                 # Odd n_pts give spectral leakage in FFT
                 self.n_pts += 1
-        for n in range(self.n_qubit):
-            self._wave_xy[n] = np.zeros(self.n_pts, dtype=np.complex)
-            self._wave_z[n] = np.zeros(self.n_pts, dtype=float)
-            self._wave_gate[n] = np.zeros(self.n_pts, dtype=float)
-
-        # Waveform time vector
-        self.t = np.arange(self.n_pts) / self.sample_rate
 
         # readout trig and i/q waveforms
         if self.readout_match_main_size:
@@ -937,9 +1760,7 @@ class SequenceToWaveforms:
                 # Odd n_pts give spectral leakage in FFT
                 self.n_pts_readout += 1
 
-        self.readout_trig = np.zeros(self.n_pts_readout, dtype=float)
-        self.readout_iq = np.zeros(self.n_pts_readout, dtype=np.complex)
-
+    @_profile_stage('generate_waveforms')
     def _generate_waveforms(self):
         """Generate the waveforms corresponding to the sequence."""
         # find out if CZ pulses are used, if so pre-calc envelope to save time
@@ -954,8 +1775,18 @@ class SequenceToWaveforms:
         for pulse in pulses_cz:
             pulse.calculate_cz_waveform()
 
+        # share envelope cache between all built-in pulses
+        cache = self._envelope_cache if self.cache_envelopes else None
+        for pulse in (self.pulses_1qb_xy + self.pulses_1qb_z +
+                      self.pulses_2qb + self.pulses_readout):
+            pulse.envelope_cache = cache
+
+        self._segments_z = [[] for n in range(MAX_QUBIT)]
         for step in self.sequences:
             for qubit, gate in enumerate(step.gates):
+                # identity gates have zero amplitude, no need to calculate
+                if isinstance(gate, IdentityGate):
+                    continue
                 pulse = self._get_pulse_for_gate(qubit, gate)
                 if pulse is None:
                     continue
@@ -1002,6 +1833,13 @@ class SequenceToWaveforms:
                     t0 = middle + (max_duration - pulse.total_duration()) / 2
                 # calculate the pulse waveform for the selected indices
                 waveform[indices] += gate.get_waveform(pulse, t0, t)
+                if pulse.pulse_type == PulseType.Z:
+                    self._segments_z[qubit].append(
+                        (indices[0], indices[-1] + 1))
+
+        if self.cache_envelopes:
+            log.debug('Envelope cache: {}'.format(
+                self._envelope_cache.get_statistics()))
 
     def set_parameters(self, config={}):
         """Set base parameters using config from from Labber driver.
@@ -1012,6 +1850,8 @@ class SequenceToWaveforms:
             Configuration as defined by Labber driver configuration window
 
         """
+        # record which compilation stage the parameters are used in
+        _set_config_stage(config, 'generate')
         # sequence parameters
         d = dict(Zero=0, One=1, Two=2, Three=3, Four=4, Five=5, Six=6, Seven=7,
                  Eight=8, Nine=9)
@@ -1029,6 +1869,18 @@ class SequenceToWaveforms:
         self.trim_start = config.get('Trim both start and end')
         self.align_to_end = config.get('Align pulses to end of waveform')
 
+        # waveform precision
+        self.single_precision = config.get('Single-precision waveforms',
+                                           False)
+        self.report_precision_error = config.get(
+            'Report single-precision error', False)
+
+        # envelope cache, size is given in MB
+        self.cache_envelopes = config.get('Cache pulse envelopes', False)
+        self._envelope_cache.max_bytes = int(
+            1E6 * config.get('Envelope cache size', 64))
+        self._envelope_cache.sample_rate = self.sample_rate
+
         # qubit spectra
         for n in range(self.n_qubit):
             m = n + 1  # pulses are indexed from 1 in Labber
@@ -1153,21 +2005,27 @@ class SequenceToWaveforms:
                                      config.get('QB2 Phi 2QB #12'))
 
         # predistortion
+        _set_config_stage(config, 'predistort_xy')
         self.perform_predistortion = config.get('Predistort waveforms', False)
         # update all predistorting objects
-        for p in self._predistortions:
+        for n, p in enumerate(self._predistortions):
+            _set_config_stage(config, ('predistort_xy', n))
             p.set_parameters(config)
 
         # Z predistortion
+        _set_config_stage(config, 'predistort_z')
         self.perform_predistortion_z = config.get('Predistort Z')
-        for p in self._predistortions_z:
+        for n, p in enumerate(self._predistortions_z):
+            _set_config_stage(config, ('predistort_z', n))
             p.set_parameters(config)
 
         # crosstalk
+        _set_config_stage(config, 'crosstalk')
         self.compensate_crosstalk = config.get('Compensate cross-talk', False)
         self._crosstalk.set_parameters(config)
 
         # gate switch waveform
+        _set_config_stage(config, 'output')
         self.generate_gate_switch = config.get('Generate gate')
         self.uniform_gate = config.get('Uniform gate')
         self.gate_delay = config.get('Gate delay')
@@ -1185,19 +2043,26 @@ class SequenceToWaveforms:
         self.z_filter_size = int(config.get('Z - Filter size', 5))
         self.z_filter_kaiser_beta = config.get(
             'Z - Kaiser beta', 14.0)
+        self.fft_filter = config.get('FFT filter convolution', False)
 
         # readout
+        _set_config_stage(config, 'generate')
         self.readout_match_main_size = config.get(
             'Match main sequence waveform size')
+        _set_config_stage(config, 'output')
         self.readout_i_offset = config.get('Readout offset - I')
         self.readout_q_offset = config.get('Readout offset - Q')
         self.readout_trig_generate = config.get('Generate readout trig')
         self.readout_trig_amplitude = config.get('Readout trig amplitude')
         self.readout_trig_duration = config.get('Readout trig duration')
         self.readout_predistort = config.get('Predistort readout waveform')
+        # profiling and demodulation do not affect the waveforms
+        _set_config_stage(config, 'demodulation')
+        self.log_profile = config.get('Log compile profile', False)
         self.readout.set_parameters(config)
 
         # get readout pulse parameters
+        _set_config_stage(config, 'generate')
         phases = 2 * np.pi * np.array([0.8847060, 0.2043214, 0.9426104,
                                        0.6947334, 0.8752361, 0.2246747,
                                        0.6503154, 0.7305004, 0.1309068])
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+import builtins
+import hashlib
+import importlib
+import importlib.machinery
+import importlib.util
+import os
+import sys
+import types
+
+from sequence import Sequence
+
+# prefix of the module names of loaded custom sequence files
+MODULE_PREFIX = '_custom_sequence_'
+
+
+class SequenceLoader:
+    """Load custom sequence classes from Python files.
+
+    Each file is loaded as a separate module, named after the hash of its
+    absolute path, so files with the same name in different folders do not
+    interfere. Loaded modules are cached, a file is only executed again if
+    its content changed.
+
+    The file can import helper modules in the same folder. They are loaded
+    in a package named after the hash of the folder, so helper modules with
+    the same name in different folders do not interfere, and neither
+    `sys.path` nor the top-level names in `sys.modules` are changed. The
+    file is executed again if any of its helper modules changed.
+
+    The file must define a class named `CustomSequence`, which is a subclass
+    of :obj:`Sequence`.
+
+    """
+
+    def __init__(self):
+        # absolute path: (modification time, size, content hash, module,
+        # list of (path, modification time, size) of helper modules)
+        self._modules = dict()
+
+    def get_sequence_class(self, path):
+        """Get the custom sequence class defined in a file.
+
+        Parameters
+        ----------
+        path : str
+            Path to Python file with custom sequence.
+
+        Returns
+        -------
+        type
+            The `CustomSequence` class of the file.
+
+        Raises
+        ------
+        ValueError
+            If the file does not exist or does not define a valid
+            `CustomSequence` class.
+
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise ValueError('Custom sequence file "%s" not found.' % path)
+        cached = self._modules.get(path)
+        helpers_changed = cached is None or self._is_changed(cached[4])
+        if (not helpers_changed and
+                (cached[0], cached[1]) == (stat.st_mtime_ns, stat.st_size)):
+            return cached[3].CustomSequence
+        # file may have changed, compare content
+        with open(path, 'rb') as f:
+            source = f.read()
+        digest = hashlib.sha1(source).hexdigest()
+        if not helpers_changed and cached[2] == digest:
+            (module, helpers) = (cached[3], cached[4])
+        else:
+            (module, helpers) = self._load_module(path, source)
+        self._modules[path] = (stat.st_mtime_ns, stat.st_size, digest,
+                               module, helpers)
+        return module.CustomSequence
+
+    def is_updated(self, path, sequence_class):
+        """Check if a file no longer defines the given sequence class.
+
+        Parameters
+        ----------
+        path : str
+            Path to Python file with custom sequence.
+        sequence_class : type
+            Class previously returned by `get_sequence_class`.
+
+        Returns
+        -------
+        bool
+            True if the file or its helper modules changed and the file has
+            to be loaded again.
+
+        """
+        cached = self._modules.get(os.path.abspath(path))
+        if cached is None or cached[3].CustomSequence is not sequence_class:
+            return True
+        return self._is_changed([(path, cached[0], cached[1])] + cached[4])
+
+    def _is_changed(self, files):
+        """Check if any of a list of (path, mtime, size) changed on disk."""
+        for (path, mtime, size) in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return True
+            if (mtime, size) != (stat.st_mtime_ns, stat.st_size):
+                return True
+        return False
+
+    def _load_module(self, path, source):
+        """Execute source of custom sequence file in a new module.
+
+        Returns
+        -------
+        module
+            The loaded module.
+        list of tuple
+            Path, modification time and size of the helper modules imported
+            by the file.
+
+        """
+        name = MODULE_PREFIX + hashlib.sha1(path.encode()).hexdigest()[:16]
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        importer = _FolderImporter(os.path.dirname(path))
+        module.__builtins__ = importer.builtins
+        code = compile(source, path, 'exec')
+        # register while executing, as needed by for example dataclasses
+        previous = sys.modules.get(name)
+        sys.modules[name] = module
+        try:
+            exec(code, module.__dict__)
+            self._validate(path, module)
+        except BaseException:
+            # keep previously loaded version of the file
+            if previous is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = previous
+            raise
+        return module, importer.get_files()
+
+    def _validate(self, path, module):
+        """Check that module defines a valid custom sequence class."""
+        sequence_class = getattr(module, 'CustomSequence', None)
+        if not (isinstance(sequence_class, type) and
+                issubclass(sequence_class, Sequence)):
+            raise ValueError(
+                'Custom sequence file "%s" must define a class '
+                '"CustomSequence", subclassing Sequence.' % path)
+
+
+class _FolderImporter:
+    """Import function resolving modules in a folder before `sys.path`.
+
+    Used as `__import__` of a custom sequence file and its helper modules.
+    Absolute imports of modules in the folder load them as submodules of a
+    package named after the hash of the folder. All other imports are
+    passed on to the built-in import. Helper modules already loaded from the
+    folder are removed, so that they are executed again.
+
+    Parameters
+    ----------
+    folder : str
+        Absolute path of folder with the custom sequence file.
+
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.package = (MODULE_PREFIX +
+                        hashlib.sha1(folder.encode()).hexdigest()[:16])
+        # builtins of the file and its helper modules, with this import
+        self.builtins = dict(builtins.__dict__, __import__=self)
+        for name in list(sys.modules):
+            if name.startswith(self.package + '.'):
+                del sys.modules[name]
+        package = types.ModuleType(self.package)
+        package.__path__ = [folder]
+        sys.modules[self.package] = package
+
+    def __call__(self, name, globals=None, locals=None, fromlist=(),
+                 level=0):
+        top = name.partition('.')[0]
+        module = self._import_helper(top) if level == 0 else None
+        if module is None:
+            return builtins.__import__(name, globals, locals, fromlist,
+                                       level)
+        if name != top:
+            # submodules of helper packages are found by the import system
+            importlib.import_module(self.package + '.' + name)
+        if not fromlist:
+            return module
+        module = sys.modules[self.package + '.' + name]
+        if hasattr(module, '__path__'):
+            for item in fromlist:
+                if item != '*' and not hasattr(module, item):
+                    try:
+                        importlib.import_module(module.__name__ + '.' + item)
+                    except ModuleNotFoundError:
+                        pass
+        return module
+
+    def _import_helper(self, name):
+        """Load module from the folder, return None if not in folder."""
+        full_name = self.package + '.' + name
+        if full_name in sys.modules:
+            return sys.modules[full_name]
+        spec = importlib.machinery.PathFinder.find_spec(full_name,
+                                                        [self.folder])
+        if spec is None or spec.loader is None:
+            return None
+        # module already imported from the folder, for example the driver
+        # modules if the file is next to them
+        loaded = getattr(sys.modules.get(name), '__file__', None)
+        if loaded is not None and (os.path.abspath(loaded) ==
+                                   os.path.abspath(spec.origin)):
+            return None
+        module = importlib.util.module_from_spec(spec)
+        module.__builtins__ = self.builtins
+        sys.modules[full_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[full_name]
+            raise
+        setattr(sys.modules[self.package], name, module)
+        return module
+
+    def get_files(self):
+        """Get path, modification time and size of loaded helper modules.
+
+        Returns
+        -------
+        list of tuple
+            (path, modification time, size) of all modules loaded in the
+            package of the folder, including submodules of helper packages.
+
+        """
+        files = []
+        for name, module in list(sys.modules.items()):
+            path = getattr(module, '__file__', None)
+            if name.startswith(self.package + '.') and path is not None:
+                stat = os.stat(path)
+                files.append((path, stat.st_mtime_ns, stat.st_size))
+        return files
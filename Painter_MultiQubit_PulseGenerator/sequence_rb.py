@@ -599,6 +599,34 @@ class TwoQubit_RB(Sequence):
 
             multi_gate_seq = []
 
+            # Interleaved gate
+            interleavedSeq1 = []
+            interleavedSeq2 = []
+            if interleave is True:
+                if interleaved_gate == 'CZ':
+                    interleavedSeq1.append(Gate.I)
+                    interleavedSeq2.append(Gate.CZ)
+                elif interleaved_gate == 'CZEcho':
+                    # CZEcho is a composite gate, so get each gate
+                    gate = Gate.CZEcho.value
+                    for g in gate.sequence:
+                        interleavedSeq1.append(g[0])
+                        interleavedSeq2.append(g[1])
+                elif interleaved_gate == 'I':
+                    # TBA: adjust the duration of I gates?
+                    # log.info('Qubits to benchmark: ' + str(qubits_to_benchmark))
+                    # gate = Gate.I(width = self.pulses_2qb[qubit]).value
+                    interleavedSeq1.append(Gate.I)
+                    interleavedSeq2.append(Gate.I)
+
+            # keep track of the total clifford using the clifford table
+            clifford_table = cliffords.get_clifford_table()
+            clifford_index = clifford_table.identity
+            interleaved_index = clifford_table.identity
+            if len(interleavedSeq1) > 0:
+                interleaved_index = clifford_table.index_from_matrix(
+                    self.evaluate_sequence(interleavedSeq1, interleavedSeq2))
+
             # Generate 2QB RB sequence
             cliffordSeq1 = []
             cliffordSeq2 = []
@@ -607,24 +635,14 @@ class TwoQubit_RB(Sequence):
                 rndnum = rnd.randint(0, 11519)
                 # rndnum = rnd.randint(0, 576) #Only applying single qubit gates
                 add_twoQ_clifford(rndnum, cliffordSeq1, cliffordSeq2)
+                clifford_index = clifford_table.compose(rndnum, clifford_index)
                 # If interleave gate,
                 if interleave is True:
                     self.prev_interleaved_gate = interleaved_gate
-                    if interleaved_gate == 'CZ':
-                        cliffordSeq1.append(Gate.I)
-                        cliffordSeq2.append(Gate.CZ)
-                    elif interleaved_gate == 'CZEcho':
-                        # CZEcho is a composite gate, so get each gate
-                        gate = Gate.CZEcho.value
-                        for g in gate.sequence:
-                            cliffordSeq1.append(g[0])
-                            cliffordSeq2.append(g[1])
-                    elif interleaved_gate == 'I':
-                        # TBA: adjust the duration of I gates?
-                        # log.info('Qubits to benchmark: ' + str(qubits_to_benchmark))
-                        # gate = Gate.I(width = self.pulses_2qb[qubit]).value
-                        cliffordSeq1.append(Gate.I)
-                        cliffordSeq2.append(Gate.I)
+                    cliffordSeq1.extend(interleavedSeq1)
+                    cliffordSeq2.extend(interleavedSeq2)
+                    clifford_index = clifford_table.compose(
+                        interleaved_index, clifford_index)
 
 
             # remove redundant Identity gates for cliffordSeq1
@@ -637,7 +655,8 @@ class TwoQubit_RB(Sequence):
 
             # get recovery gate seq
             (recoverySeq1, recoverySeq2) = self.get_recovery_gate(
-                cliffordSeq1, cliffordSeq2, config)
+                cliffordSeq1, cliffordSeq2, config,
+                clifford_index=clifford_index)
 
             # Remove redundant identity gates in recovery gate seq
             index_identity_recovery = [] # find where Identity gates are
@@ -794,7 +813,8 @@ class TwoQubit_RB(Sequence):
         # log.info('two qubit gate: ' + str(twoQ_gate))
         return twoQ_gate
 
-    def get_recovery_gate(self, gate_seq_1, gate_seq_2, config):
+    def get_recovery_gate(self, gate_seq_1, gate_seq_2, config,
+                          clifford_index=None):
         """
         Get the recovery (the inverse) gate
 
@@ -809,6 +829,10 @@ class TwoQubit_RB(Sequence):
         config: dict
             The configuration
 
+        clifford_index: int
+            Index of the two-qubit Clifford equal to the gate sequence, if
+            known. If None, it is calculated from the gate sequence.
+
         Returns
         -------
         (recovery_seq_1, recovery_seq_2): tuple of the lists
@@ -816,14 +840,6 @@ class TwoQubit_RB(Sequence):
         """
 
 
-        qubit_state = np.matrix(
-            '1; 0; 0; 0')  # initial state: ground state |00>
-
-        qubit_state = np.matmul(self.evaluate_sequence(
-            gate_seq_1, gate_seq_2), qubit_state)
-
-        # find recovery gate which makes qubit_state return to initial state
-        total_num_cliffords = 11520
         recovery_seq_1 = []
         recovery_seq_2 = []
 
@@ -834,13 +850,13 @@ class TwoQubit_RB(Sequence):
         cheapest_recovery_seq_2 = []
         log.info('*** get recovery gate *** ')
         if (find_cheapest == True):
-            min_N_2QB_gate = np.inf
-            min_N_1QB_gate = np.inf
-            max_N_I_gate = -np.inf
-            cheapest_index = None
-
             use_lookup_table = config['Use a look-up table']
             if (use_lookup_table == True):
+                # initial state: ground state |00>
+                qubit_state = np.matrix('1; 0; 0; 0')
+                qubit_state = np.matmul(self.evaluate_sequence(
+                    gate_seq_1, gate_seq_2), qubit_state)
+
                 filepath_lookup_table = config['File path of the look-up table']
                 if len(filepath_lookup_table) == 0:
                     filepath_lookup_table = os.path.join(path_currentdir, 'recovery_rb_table.pickle')
@@ -867,132 +883,14 @@ class TwoQubit_RB(Sequence):
             log.info("--- COULDN'T FIND THE RECOVERY GATE IN THE LOOK-UP TABLE... ---")
 
 
-        # Calculate the matrix of the clifford sequence
-        matrix_cliffords = self.evaluate_sequence(gate_seq_1,gate_seq_2)
-
-        for i in range(total_num_cliffords):
-            recovery_seq_1 = []
-            recovery_seq_2 = []
-            add_twoQ_clifford(i, recovery_seq_1, recovery_seq_2)
-
-            # Calculate the matrix of the recovery clifford
-            matrix_recovery = self.evaluate_sequence(recovery_seq_1, recovery_seq_2)
-
-            # Calculate the matrix of the total clifford sequence
-            matrix_total = np.matmul(matrix_recovery,matrix_cliffords)
-            if (CheckIdentity(matrix_total)):
-                if (find_cheapest == True):
-                    # Less 2QB Gates, Less 1QB Gates, and More I Gates = the cheapest gate.
-                    # The priority: less 2QB gates > less 1QB gates > more I gates
-                    N_2QB_gate = 0
-                    N_1QB_gate = 0
-                    N_I_gate = 0
-
-                    # count the numbers of the gates
-                    for j in range(len(recovery_seq_1)):
-                        if (recovery_seq_1[j] == Gate.CZ or recovery_seq_2[j] == Gate.CZ):
-                            N_2QB_gate += 1
-                        else:
-                            N_1QB_gate += 2
-                        if (recovery_seq_1[j] == Gate.I):
-                            N_I_gate += 1
-                        if (recovery_seq_2[j] == Gate.I):
-                            N_I_gate += 1
-
-                    if (N_2QB_gate <= min_N_2QB_gate): # if it has less 2QB gates, always update it
-                        min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-
-                        if (N_1QB_gate <= min_N_1QB_gate): # *only if it has less 2QB gates*, check whether it has less 1QB gates
-                            min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-
-                            if (N_I_gate >= max_N_I_gate): # *only if it has less 2QB gates & only if it has less 1QB gates*, check whether it has more I gates
-                                min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-
-                    # check whether it is the cheapest
-                    # if it has less 2QB gates, always update it.
-                    if (N_2QB_gate < min_N_2QB_gate):
-                        min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-                        log.info('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-                    else:
-                        # if it has equal # of 2QB gates and less 1QB gates, update it.
-                        if (N_2QB_gate == min_N_2QB_gate and
-                            N_1QB_gate < min_N_1QB_gate):
-                            min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-                            log.info('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-                        else:
-                            # if it has equal # of 2QB & 1QB gates, and more 1QB gates, update it.
-                            if (N_2QB_gate == min_N_2QB_gate and
-                                N_1QB_gate == min_N_1QB_gate and
-                                N_I_gate >= max_N_I_gate):
-                                min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-                                log.info('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-
-                else:
-                    return(recovery_seq_1,recovery_seq_2)
-
-        # for i in range(total_num_cliffords):
-        #     recovery_seq_1 = []
-        #     recovery_seq_2 = []
-        #     add_twoQ_clifford(i, recovery_seq_1, recovery_seq_2)
-        #     qubit_final_state = np.matmul(self.evaluate_sequence(
-        #         recovery_seq_1, recovery_seq_2), qubit_state)
-        #     if np.abs(np.abs(qubit_final_state[0]) - 1) < 1e-6:
-        #         if (find_cheapest == True):
-        #             # Less 2QB Gates, Less 1QB Gates, and More I Gates = the cheapest gate.
-        #             # The priority: less 2QB gates > less 1QB gates > more I gates
-        #             N_2QB_gate = 0
-        #             N_1QB_gate = 0
-        #             N_I_gate = 0
-
-        #             # count the numbers of the gates
-        #             for j in range(len(recovery_seq_1)):
-        #                 if (gate_seq_1[j] == Gate.CZ or gate_seq_2[j] == Gate.CZ):
-        #                     N_2QB_gate += 1
-        #                 else:
-        #                     N_1QB_gate += 2
-        #                 if (gate_seq_1[j] == Gate.I):
-        #                     N_I_gate += 1
-        #                 if (gate_seq_2[j] == Gate.I):
-        #                     N_I_gate += 1
-
-        #             if (N_2QB_gate <= min_N_2QB_gate): # if it has less 2QB gates, always update it
-        #                 min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-
-        #                 if (N_1QB_gate <= min_N_1QB_gate): # *only if it has less 2QB gates*, check whether it has less 1QB gates
-        #                     min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-
-        #                     if (N_I_gate >= max_N_I_gate): # *only if it has less 2QB gates & only if it has less 1QB gates*, check whether it has more I gates
-        #                         min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-
-        #             # check whether it is the cheapest
-        #             # if it has less 2QB gates, always update it.
-        #             if (N_2QB_gate < min_N_2QB_gate):
-        #                 min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-        #                 log.info('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-        #             else:
-        #                 # if it has equal # of 2QB gates and less 1QB gates, update it.
-        #                 if (N_2QB_gate == min_N_2QB_gate and
-        #                     N_1QB_gate < min_N_1QB_gate):
-        #                     min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-        #                     log.info('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-        #                 else:
-        #                     # if it has equal # of 2QB & 1QB gates, and more 1QB gates, update it.
-        #                     if (N_2QB_gate == min_N_2QB_gate and
-        #                         N_1QB_gate == min_N_1QB_gate and
-        #                         N_I_gate >= max_N_I_gate):
-        #                         min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-        #                         log.info('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-
-
-        #         else:
-        #             break
-
-        if (find_cheapest == True):
-            recovery_seq_1 = []
-            recovery_seq_2 = []
-            log.info('The index of the cheapest recovery clifford: %d'%(cheapest_index))
-            add_twoQ_clifford(cheapest_index, recovery_seq_1, recovery_seq_2)
-
+        # find the inverse of the sequence in the two-qubit Clifford table
+        clifford_table = cliffords.get_clifford_table()
+        if clifford_index is None:
+            clifford_index = clifford_table.index_from_matrix(
+                self.evaluate_sequence(gate_seq_1, gate_seq_2))
+        recovery_index = clifford_table.get_inverse(clifford_index)
+        log.info('The index of the recovery clifford: %d' % (recovery_index))
+        add_twoQ_clifford(recovery_index, recovery_seq_1, recovery_seq_2)
 
         if (recovery_seq_1 == [] and recovery_seq_2 == []):
             recovery_seq_1 = [None]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the driver modules are imported without a package, as in Labber
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,56 @@
+from copy import deepcopy
+
+import numpy as np
+import pytest
+
+from benchmark import (WORKLOADS, get_randomized_sequences,
+                       get_waveforms_batch_previous, load_default_config)
+from sequence import SequenceToWaveforms
+
+
+def get_compiler(name, **values):
+    (sequence_class, workload_values) = WORKLOADS[name]
+    config = load_default_config()
+    config.update(workload_values)
+    config.update(values)
+    sequence = sequence_class()
+    sequence_to_waveforms = SequenceToWaveforms()
+    sequence.set_parameters(config)
+    sequence_to_waveforms.set_parameters(config)
+    return (sequence, sequence_to_waveforms, config)
+
+
+@pytest.mark.parametrize('align_end', [False, True])
+@pytest.mark.parametrize('name', ['rb_1qb_10', 'rb_2qb_10'])
+def test_batch_identical_to_loop(name, align_end):
+    (sequence, sequence_to_waveforms, config) = get_compiler(name)
+    sequences_list = get_randomized_sequences(sequence, config, 8)
+    reference = get_waveforms_batch_previous(
+        sequence_to_waveforms, deepcopy(sequences_list), align_end)
+    # randomizations differ in length, the shorter ones are padded
+    lengths = [len(sequence_to_waveforms.get_waveforms(deepcopy(x))['xy'][0])
+               for x in sequences_list]
+    assert len(set(lengths)) > 1
+    waveforms = sequence_to_waveforms.get_waveforms_batch(
+        deepcopy(sequences_list), align_end=align_end)
+    assert set(waveforms) == set(reference)
+    for key in ('xy', 'z', 'gate'):
+        assert len(waveforms[key]) == len(reference[key])
+        for n, (x, y) in enumerate(zip(waveforms[key], reference[key])):
+            assert x.dtype == y.dtype, '%s%d' % (key, n)
+            assert np.array_equal(x, y), '%s%d' % (key, n)
+    for key in ('readout_trig', 'readout_iq'):
+        assert waveforms[key].dtype == reference[key].dtype
+        assert np.array_equal(waveforms[key], reference[key]), key
+
+
+def test_batch_single_precision():
+    (sequence, sequence_to_waveforms, config) = get_compiler(
+        'rb_1qb_10', **{'Single-precision waveforms': True})
+    sequences_list = get_randomized_sequences(sequence, config, 4)
+    reference = get_waveforms_batch_previous(
+        sequence_to_waveforms, deepcopy(sequences_list))
+    waveforms = sequence_to_waveforms.get_waveforms_batch(
+        deepcopy(sequences_list))
+    assert waveforms['xy'][0].dtype == np.complex64
+    assert np.array_equal(waveforms['xy'][0], reference['xy'][0])
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import cliffords
+from sequence_rb import TwoQubit_RB, add_twoQ_clifford
+
+N = cliffords.N_2QB_CLIFFORDS
+
+
+def is_identity(matrix):
+    """Check if matrix is the identity, up to global phase"""
+    matrix = np.asarray(matrix)
+    return np.allclose(matrix / matrix[0, 0], np.identity(4), atol=1E-9) and \
+        np.isclose(abs(matrix[0, 0]), 1.0)
+
+
+def get_gates(index):
+    """Get gate sequences of a Clifford"""
+    (seq_1, seq_2) = ([], [])
+    add_twoQ_clifford(index, seq_1, seq_2)
+    return (seq_1, seq_2)
+
+
+@pytest.fixture(scope='module')
+def matrices():
+    """Matrices of all Cliffords, from the products of their gates"""
+    rb = TwoQubit_RB()
+    return [np.asarray(rb.evaluate_sequence(*get_gates(index)))
+            for index in range(N)]
+
+
+@pytest.fixture(scope='module')
+def table():
+    return cliffords.get_clifford_table()
+
+
+def test_table_file_matches_generated():
+    # the stored table is a binary file, check it against its definition
+    table = np.load(cliffords.CLIFFORD_TABLE_PATH)
+    assert table.shape == (2, N)
+    assert np.array_equal(table, cliffords.generate_clifford_table())
+
+
+def test_index_of_every_clifford(table, matrices):
+    for index in range(N):
+        assert table.index_from_matrix(matrices[index]) == index
+
+
+def test_inverse_of_every_clifford(table, matrices):
+    for index in range(N):
+        inverse = table.get_inverse(index)
+        assert is_identity(matrices[inverse].dot(matrices[index]))
+        assert table.compose(inverse, index) == table.identity
+
+
+def test_compose_matches_matrix_product(table, matrices):
+    rng = np.random.default_rng(0)
+    for (index_2, index_1) in rng.integers(0, N, (2000, 2)):
+        product = matrices[index_2].dot(matrices[index_1])
+        assert table.compose(index_2, index_1) == \
+            table.index_from_matrix(product)
+
+
+@pytest.mark.parametrize('n_clifford', [1, 2, 10, 50])
+def test_recovery_gate_gives_identity(n_clifford):
+    rb = TwoQubit_RB()
+    config = {'Find the cheapest recovery Clifford': False}
+    rng = np.random.default_rng(n_clifford)
+    for n in range(20):
+        (seq_1, seq_2) = ([], [])
+        for index in rng.integers(0, N, n_clifford):
+            add_twoQ_clifford(index, seq_1, seq_2)
+        (recovery_1, recovery_2) = rb.get_recovery_gate(seq_1, seq_2, config)
+        if recovery_1 == [None]:
+            (recovery_1, recovery_2) = ([], [])
+        total = rb.evaluate_sequence(seq_1 + recovery_1, seq_2 + recovery_2)
+        assert is_identity(total)
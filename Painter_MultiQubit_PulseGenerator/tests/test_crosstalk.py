@@ -0,0 +1,129 @@
+import logging
+
+import numpy as np
+import pytest
+
+import crosstalk as crosstalk_module
+from benchmark import compensate_crosstalk_previous, get_crosstalk
+from crosstalk import Crosstalk
+
+
+def get_waveforms(n_qubit, n_pts=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    return list(rng.uniform(-1, 1, (n_qubit, n_pts)))
+
+
+def get_config(path, n_qubit=3, elements=None):
+    config = {'Compensate cross-talk': True, 'Cross-talk (CT) matrix': path,
+              'Number of qubits': ('One', 'Two', 'Three', 'Four')[n_qubit - 1],
+              '1-1 QB <--> Crosstalk matrix': elements is None}
+    for n, element in enumerate(elements or []):
+        config['CT-matrix element #%d' % (n + 1)] = element
+    return config
+
+
+@pytest.mark.parametrize('n_qubit', [1, 2, 5, 9])
+def test_identical_to_matrix_version(tmp_path, n_qubit):
+    crosstalk = get_crosstalk(str(tmp_path / 'matrix.txt'), n_qubit)
+    waveforms = get_waveforms(n_qubit)
+    reference = compensate_crosstalk_previous(crosstalk, waveforms)
+    result = crosstalk.compensate(list(waveforms))
+    assert len(result) == n_qubit
+    for x, y in zip(result, reference):
+        assert x.dtype == np.float64
+        # einsum and matmul only differ by the order of summation
+        assert np.allclose(x, y, rtol=1E-14, atol=1E-15)
+
+
+def test_identical_with_selected_elements(tmp_path):
+    path = str(tmp_path / 'matrix.txt')
+    np.savetxt(path, [[1.0, 0.1, 0.02], [-0.05, 1.0, 0.03],
+                      [0.01, -0.02, 1.0]])
+    crosstalk = Crosstalk()
+    crosstalk.set_parameters(get_config(path, 2, ['Three', 'One']))
+    assert np.array_equal(crosstalk.phi0_vs_voltage,
+                          [[1.0, 0.01], [0.02, 1.0]])
+    waveforms = get_waveforms(2)
+    reference = compensate_crosstalk_previous(crosstalk, waveforms)
+    for x, y in zip(crosstalk.compensate(list(waveforms)), reference):
+        assert np.allclose(x, y, rtol=1E-14, atol=1E-15)
+
+
+def test_segments_identical_to_full(tmp_path):
+    crosstalk = get_crosstalk(str(tmp_path / 'matrix.txt'), 3)
+    waveforms = [np.zeros(1000) for n in range(3)]
+    segments = [(10, 50), (400, 420), (990, 1000)]
+    rng = np.random.default_rng(1)
+    for (start, stop) in segments:
+        for x in waveforms:
+            x[start:stop] = rng.uniform(-1, 1, stop - start)
+    reference = crosstalk.compensate(list(waveforms))
+    for x, y in zip(crosstalk.compensate(list(waveforms), segments),
+                    reference):
+        assert np.array_equal(x, y)
+
+
+def test_single_precision(tmp_path):
+    crosstalk = get_crosstalk(str(tmp_path / 'matrix.txt'), 3)
+    waveforms = get_waveforms(3)
+    reference = crosstalk.compensate(list(waveforms))
+    result = crosstalk.compensate([x.astype(np.float32) for x in waveforms])
+    for x, y in zip(result, reference):
+        assert x.dtype == np.float32
+        assert np.allclose(x, y, atol=1E-6)
+
+
+def test_warning_if_ill_conditioned(tmp_path, caplog):
+    path = str(tmp_path / 'matrix.txt')
+    np.savetxt(path, [[1.0, 1.0], [1.0, 1.0 + 1E-8]])
+    with caplog.at_level(logging.WARNING, logger='LabberDriver'):
+        Crosstalk().set_parameters(get_config(path, 2))
+    assert 'close to singular' in caplog.text
+
+
+def test_no_warning_if_well_conditioned(tmp_path, caplog):
+    path = str(tmp_path / 'matrix.txt')
+    # condition number just below the limit
+    np.savetxt(path, [[1.0, 0.0], [0.0, 2E-6]])
+    with caplog.at_level(logging.WARNING, logger='LabberDriver'):
+        Crosstalk().set_parameters(get_config(path, 2))
+    assert caplog.text == ''
+
+
+def test_inverse_only_recomputed_if_matrix_changed(tmp_path, monkeypatch):
+    calls = []
+    inv = crosstalk_module.inv
+
+    def counting_inv(matrix):
+        calls.append(np.array(matrix))
+        return inv(matrix)
+
+    monkeypatch.setattr(crosstalk_module, 'inv', counting_inv)
+    path_a = str(tmp_path / 'a.txt')
+    path_b = str(tmp_path / 'b.txt')
+    path_c = str(tmp_path / 'c.txt')
+    matrix = [[1.0, 0.1, 0.02], [-0.05, 1.0, 0.03], [0.01, -0.02, 1.0]]
+    np.savetxt(path_a, matrix)
+    # same entries in a different file
+    np.savetxt(path_b, matrix)
+    np.savetxt(path_c, np.transpose(matrix))
+
+    crosstalk = Crosstalk()
+    crosstalk.set_parameters(get_config(path_a))
+    assert len(calls) == 1
+    inverse = crosstalk.voltage_vs_phi0
+    assert np.allclose(np.dot(inverse, matrix), np.eye(3))
+    # no change, or a new file with the same entries
+    crosstalk.set_parameters(get_config(path_a))
+    crosstalk.set_parameters(get_config(path_b))
+    assert len(calls) == 1
+    assert crosstalk.voltage_vs_phi0 is inverse
+    # compensation uses the stored inverse
+    crosstalk.compensate(get_waveforms(3))
+    assert len(calls) == 1
+    # different entries, or a different selection of the entries
+    crosstalk.set_parameters(get_config(path_c))
+    assert len(calls) == 2
+    crosstalk.set_parameters(get_config(path_c, 2, ['One', 'Three']))
+    assert len(calls) == 3
+    assert np.array_equal(calls[-1], [[1.0, 0.01], [0.02, 1.0]])
@@ -0,0 +1,39 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from benchmark import (calculate_cz_envelope_previous,
+                       calculate_cz_waveform_previous, get_cz_pulse)
+
+# final coupling angle is set by the amplitude, lambda by the coefficients
+AMPLITUDES = (20E6, 50E6, 200E6)
+LCOEFFS = ((0.3,), (0.1, -0.02), (0.4, 0.0, 0.05, 0.01))
+PLATEAUS = (0.0, 3.3E-9, 100E-9)
+WIDTHS = (40E-9, 500E-9)
+SAMPLE_RATE = 2E9
+
+
+@pytest.mark.parametrize('amplitude,Lcoeff,width', list(
+    itertools.product(AMPLITUDES, LCOEFFS, WIDTHS)))
+def test_trajectory_matches_previous(amplitude, Lcoeff, width):
+    pulse = get_cz_pulse(width, 0.0, amplitude, Lcoeff)
+    reference = get_cz_pulse(width, 0.0, amplitude, Lcoeff)
+    calculate_cz_waveform_previous(reference)
+    assert np.max(np.abs(pulse.theta_tau - reference.theta_tau)) < 1E-12
+    assert np.max(np.abs(pulse.t_tau - reference.t_tau)) < 1E-12 * width
+
+
+@pytest.mark.parametrize('amplitude,Lcoeff,plateau', list(
+    itertools.product(AMPLITUDES, LCOEFFS, PLATEAUS)))
+def test_envelope_matches_previous(amplitude, Lcoeff, plateau):
+    pulse = get_cz_pulse(40E-9, plateau, amplitude, Lcoeff)
+    reference = get_cz_pulse(40E-9, plateau, amplitude, Lcoeff)
+    calculate_cz_waveform_previous(reference)
+    # pulse centered between samples, with samples outside the pulse
+    duration = pulse.total_duration()
+    t = np.arange(int(duration * SAMPLE_RATE) + 20) / SAMPLE_RATE
+    t0 = 10 / SAMPLE_RATE + duration / 2 + 0.3 / SAMPLE_RATE
+    values = pulse.calculate_envelope(t0, t)
+    expected = calculate_cz_envelope_previous(reference, t0, t)
+    assert np.max(np.abs(values - expected)) < 1E-12
@@ -0,0 +1,67 @@
+import numpy as np
+
+from benchmark import compile_workload, load_default_config
+from pulse import EnvelopeCache, Pulse
+from sequence import SequenceToWaveforms
+
+
+def test_cache_is_off_by_default():
+    config = load_default_config()
+    assert not config['Cache pulse envelopes']
+    sequence_to_waveforms = SequenceToWaveforms()
+    sequence_to_waveforms.set_parameters(config)
+    assert not sequence_to_waveforms.cache_envelopes
+
+
+def test_default_output_unchanged():
+    config = load_default_config()
+    off = compile_workload('rb_1qb_100', config)
+    config['Cache pulse envelopes'] = False
+    explicit = compile_workload('rb_1qb_100', config)
+    for a, b in zip(off['xy'], explicit['xy']):
+        assert np.array_equal(a, b)
+
+
+def test_cached_envelopes_match_calculated():
+    config = load_default_config()
+    for name in ('rb_1qb_100', 'cpmg_500'):
+        config['Cache pulse envelopes'] = False
+        reference = compile_workload(name, config)
+        config['Cache pulse envelopes'] = True
+        cached = compile_workload(name, config)
+        # envelopes at different positions differ by rounding errors, which
+        # grow with the time from the start of the sequence
+        for a, b in zip(reference['xy'], cached['xy']):
+            assert np.max(np.abs(a - b), initial=0.0) < 1E-11
+
+
+def test_hits_and_misses():
+    cache = EnvelopeCache(sample_rate=1E9)
+    pulse = Pulse()
+    t = np.arange(200) / 1E9
+    y1 = cache.get_envelope(pulse, 50E-9, t)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert not y1.flags.writeable
+    # same sub-sample offset, shifted by a whole number of samples
+    shift = 300 / 1E9
+    y2 = cache.get_envelope(pulse, 50E-9 + shift, t + shift)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert y2 is y1
+    assert np.allclose(y2, pulse.calculate_drag_envelope(50E-9 + shift,
+                                                         t + shift),
+                       rtol=0, atol=1E-12)
+    # shifted by half a sample, must be calculated
+    y3 = cache.get_envelope(pulse, 50.5E-9 + shift, t + shift)
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert not np.allclose(y3, y1)
+    assert np.array_equal(y3, pulse.calculate_drag_envelope(50.5E-9 + shift,
+                                                            t + shift))
+
+
+def test_size_is_bounded():
+    t = np.arange(1000) / 1E9
+    cache = EnvelopeCache(max_bytes=3 * 8 * len(t), sample_rate=1E9)
+    for n in range(10):
+        cache.get_envelope(Pulse(), 100E-9 + n * 0.1E-9, t)
+        assert cache.nbytes <= cache.max_bytes
+    assert cache.get_statistics()['entries'] == 3
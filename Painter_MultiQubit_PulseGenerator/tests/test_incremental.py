@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+
+from benchmark import load_default_config
+from sequence import SequenceToWaveforms
+from sequence_builtin import CPMG, Rabi
+from sequence_rb import TwoQubit_RB
+
+# sequence class and configuration values differing from the defaults
+BASES = {
+    'rabi_2qb': (Rabi, {'Sequence': 'Rabi', 'Number of qubits': 'Two',
+                        'Readout delay': 1E-7}),
+    'cpmg': (CPMG, {'Sequence': 'CP/CPMG', 'Number of qubits': 'Two',
+                    '# of pi pulses': 5.0, 'Sequence duration': 2E-6}),
+    'rb_2qb': (TwoQubit_RB, {'Sequence': '2-QB Randomized Benchmarking',
+                             'Number of qubits': 'Two',
+                             'Number of Cliffords': 5.0}),
+}
+
+# values tried for each edited setting, covering all compilation stages
+EDITS = {
+    # sequence and pulse generation
+    'Randomize': [0.0, 1.0, 2.0],
+    'Sample rate': [1.2E9, 1E9],
+    'Trim waveform to sequence': [False, True],
+    'Pulse spacing': [0.0, 5E-9],
+    'Pulse type': ['Gaussian', 'Cosine', 'Square'],
+    'Amplitude #1': [0.5, 0.3],
+    'Width #2': [10E-9, 16E-9],
+    'Use DRAG': [False, True],
+    'DRAG scaling #1': [0.0, 0.2E-9],
+    'Qubit 1 Z Delay': [0.0, 3E-9],
+    'Qubit 2 XY Delay': [0.0, -2E-9],
+    'Single-precision waveforms': [False, True],
+    # Z pulses and two-qubit gates
+    'Pulse type, Z': ['Gaussian', 'Square'],
+    'Amplitude #1, Z': [0.0, 0.1],
+    'Width, 2QB': [50E-9, 60E-9],
+    # crosstalk and predistortion
+    'Compensate cross-talk': [False, True],
+    'Predistort Z': [False, True],
+    'Predistort Z1 - A1': [0.0, 0.02],
+    'Predistort Z1 - tau1': [1E-7, 3E-7],
+    'Predistort Z2 - A2': [0.0, -0.01],
+    'Predistort Z2 - tau2': [2E-6, 1E-6],
+    # readout
+    'Readout amplitude #1': [0.1, 0.2],
+    'Readout delay': [1E-7, 2E-7],
+    'Predistort readout waveform': [False, True],
+    'Generate readout trig': [True, False],
+    'Readout trig duration': [2E-8, 5E-8],
+    # gate and output filters
+    'Generate gate': [False, True],
+    'Gate delay': [0.0, -4E-8],
+    'Filter gate waveforms': [False, True],
+    'Filter Z waveforms': [False, True],
+    'Z - Filter size': [5.0, 11.0],
+}
+KEYS = sorted(EDITS)
+
+
+@pytest.fixture(scope='module')
+def default_config(tmp_path_factory):
+    config = load_default_config()
+    # cross-talk matrix file, used when compensation is turned on
+    path = tmp_path_factory.mktemp('crosstalk') / 'matrix.txt'
+    np.savetxt(str(path), [[1.0, 0.1], [-0.05, 1.0]])
+    config['Cross-talk (CT) matrix'] = str(path)
+    config['1-1 QB <--> Crosstalk matrix'] = True
+    return config
+
+
+def compile_full(sequence_class, config):
+    sequence = sequence_class()
+    sequence_to_waveforms = SequenceToWaveforms()
+    sequence.set_parameters(config)
+    sequence_to_waveforms.set_parameters(config)
+    return sequence_to_waveforms.get_waveforms(sequence.get_sequence(config))
+
+
+def copy_waveforms(waveforms):
+    return {key: ([np.array(x) for x in value] if isinstance(value, list)
+                  else np.array(value))
+            for key, value in waveforms.items()}
+
+
+def assert_same_waveforms(waveforms, reference, message):
+    assert set(waveforms) == set(reference)
+    for key in ('xy', 'z', 'gate'):
+        assert len(waveforms[key]) == len(reference[key]), message
+        for n, (x, y) in enumerate(zip(waveforms[key], reference[key])):
+            assert x.dtype == y.dtype, '%s, %s%d' % (message, key, n)
+            assert np.array_equal(x, y), '%s, %s%d' % (message, key, n)
+    for key in ('readout_trig', 'readout_iq'):
+        assert waveforms[key].dtype == reference[key].dtype, message
+        assert np.array_equal(waveforms[key], reference[key]), \
+            '%s, %s' % (message, key)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('base', sorted(BASES))
+def test_random_edits_identical_to_full_compile(default_config, base, seed):
+    (sequence_class, values) = BASES[base]
+    config = dict(default_config, **values)
+    sequence = sequence_class()
+    sequence_to_waveforms = SequenceToWaveforms()
+    rng = np.random.default_rng(seed)
+    edits = []
+    previous = None
+    for step in range(25):
+        if step > 0 and rng.random() < 0.1:
+            # same settings again, all stages are re-used
+            edits.append(('no change', None))
+        elif step > 0:
+            # change one to three settings at once
+            for n in range(rng.integers(1, 4)):
+                key = KEYS[rng.integers(len(KEYS))]
+                choices = [x for x in EDITS[key] if x != config.get(key)]
+                config[key] = choices[rng.integers(len(choices))]
+                edits.append((key, config[key]))
+        message = '%s, seed %d, edits %s' % (base, seed, edits)
+        waveforms = sequence_to_waveforms.get_waveforms_incremental(
+            sequence, dict(config))
+        assert_same_waveforms(waveforms, compile_full(sequence_class, config),
+                              message)
+        if previous is not None:
+            # results of earlier calls are not modified
+            assert_same_waveforms(previous[1], previous[0], message)
+        # the lists of waveforms are re-used, keep the arrays
+        previous = (copy_waveforms(waveforms),
+                    {key: list(value) if isinstance(value, list) else value
+                     for key, value in waveforms.items()})
+
+
+def test_off_by_default():
+    assert not load_default_config()['Incremental compilation']
+
+
+def test_parameters_set_once(default_config, monkeypatch):
+    (sequence_class, values) = BASES['cpmg']
+    config = dict(default_config, **values)
+    sequence = sequence_class()
+    sequence_to_waveforms = SequenceToWaveforms()
+    calls = []
+
+    def count_calls(obj):
+        set_parameters = obj.set_parameters
+
+        def wrapper(config):
+            calls.append(type(obj).__name__)
+            return set_parameters(config)
+        monkeypatch.setattr(obj, 'set_parameters', wrapper)
+
+    count_calls(sequence)
+    count_calls(sequence_to_waveforms)
+    for amplitude in (0.5, 0.3):
+        config['Amplitude #1'] = amplitude
+        calls.clear()
+        sequence_to_waveforms.get_waveforms_incremental(sequence,
+                                                        dict(config))
+        # the driver does not set the parameters before the call
+        assert sorted(calls) == ['CPMG', 'SequenceToWaveforms']
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from benchmark import add_microwave_gate_previous
+from sequence import SequenceToWaveforms
+
+SAMPLE_RATE = 1E9
+
+
+def get_compiler(waveforms, overlap=20, min_gap=20, delay=0, uniform=False):
+    """Compiler with gate settings in samples and the given XY waveforms"""
+    sequence_to_waveforms = SequenceToWaveforms(len(waveforms))
+    sequence_to_waveforms.n_qubit = len(waveforms)
+    sequence_to_waveforms.sample_rate = SAMPLE_RATE
+    sequence_to_waveforms.local_xy = True
+    sequence_to_waveforms.generate_gate_switch = True
+    sequence_to_waveforms.uniform_gate = uniform
+    sequence_to_waveforms.gate_overlap = overlap / SAMPLE_RATE
+    sequence_to_waveforms.minimal_gate_time = min_gap / SAMPLE_RATE
+    sequence_to_waveforms.gate_delay = delay / SAMPLE_RATE
+    for n, x in enumerate(waveforms):
+        sequence_to_waveforms._wave_xy[n] = np.asarray(x, dtype=complex)
+    return sequence_to_waveforms
+
+
+def get_pulses(n_pts, pulses):
+    """Waveform that is non-zero in the intervals (start, stop)"""
+    x = np.zeros(n_pts, dtype=complex)
+    for (start, stop) in pulses:
+        x[start:stop] = 0.5 + 0.1j
+    return x
+
+
+def assert_same_gate(sequence_to_waveforms):
+    reference = add_microwave_gate_previous(sequence_to_waveforms)
+    sequence_to_waveforms._add_microwave_gate()
+    for n, y in enumerate(reference):
+        x = sequence_to_waveforms._wave_gate[n]
+        # the previous uniform gate had the complex type of the XY waveform
+        assert x.dtype == np.float64
+        assert np.array_equal(x, y), n
+    return reference
+
+
+@pytest.mark.parametrize('pulses', [
+    # pulses at the first and last sample
+    [(0, 5)], [(95, 100)], [(0, 5), (95, 100)], [(0, 100)],
+    # single-sample pulses and gaps
+    [(0, 1)], [(99, 100)], [(10, 11), (12, 13)], [(0, 49), (50, 100)],
+    # overlap buffers reaching past the edges or into each other
+    [(3, 10), (30, 40), (88, 97)], [(20, 25), (45, 50), (70, 75)],
+    # no pulses
+    [],
+])
+@pytest.mark.parametrize('delay', [-30, -1, 0, 1, 30])
+@pytest.mark.parametrize('overlap,min_gap', [(0, 0), (5, 0), (0, 30),
+                                             (20, 20), (200, 0)])
+def test_edges_identical_to_loop(pulses, delay, overlap, min_gap):
+    assert_same_gate(get_compiler([get_pulses(100, pulses)], overlap,
+                                  min_gap, delay))
+
+
+def test_random_identical_to_loop():
+    rng = np.random.default_rng(0)
+    for case in range(2000):
+        n_pts = int(rng.integers(2, 300))
+        n_pulse = int(rng.integers(0, 8))
+        starts = rng.integers(0, n_pts, n_pulse)
+        stops = np.minimum(starts + rng.integers(1, 20, n_pulse), n_pts)
+        waveforms = [get_pulses(n_pts, zip(starts, stops))]
+        # second qubit with independent pulses, zeros only in some cases
+        waveforms.append(rng.choice([0.0, 1.0], n_pts, p=[0.9, 0.1]))
+        assert_same_gate(get_compiler(
+            waveforms, overlap=int(rng.integers(0, 30)),
+            min_gap=int(rng.integers(0, 40)),
+            delay=int(rng.integers(-20, 21))))
+
+
+def test_gap_filled_and_overlap_added():
+    sequence_to_waveforms = get_compiler(
+        [get_pulses(100, [(20, 30), (40, 50), (80, 90)])], overlap=2,
+        min_gap=10)
+    gate = assert_same_gate(sequence_to_waveforms)[0]
+    # the 10-sample gap shrinks to 5 samples with the overlap and is closed,
+    # the 30-sample gap is kept
+    assert np.array_equal(np.flatnonzero(gate),
+                          np.r_[np.arange(17, 52), np.arange(77, 92)])
+
+
+@pytest.mark.parametrize('readout_trig', [False, True])
+def test_uniform_identical_to_loop(readout_trig):
+    sequence_to_waveforms = get_compiler(
+        [get_pulses(100, [(20, 30)]), get_pulses(100, [])], uniform=True)
+    sequence_to_waveforms.readout_trig_generate = readout_trig
+    sequence_to_waveforms.readout_trig_duration = 40 / SAMPLE_RATE
+    gate = assert_same_gate(sequence_to_waveforms)[0]
+    assert gate[1] == 1.0
+    assert gate[-2] == (0.0 if readout_trig else 1.0)
+
+
+def test_single_precision():
+    sequence_to_waveforms = get_compiler([get_pulses(100, [(20, 30)])])
+    reference = add_microwave_gate_previous(sequence_to_waveforms)
+    sequence_to_waveforms.single_precision = True
+    sequence_to_waveforms._add_microwave_gate()
+    gate = sequence_to_waveforms._wave_gate[0]
+    assert gate.dtype == np.float32
+    assert np.array_equal(gate, reference[0])
@@ -0,0 +1,132 @@
+from copy import deepcopy
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+import parallel
+from benchmark import (WORKLOADS, get_randomized_sequences,
+                       get_waveforms_batch_previous, load_default_config)
+from parallel import WorkerPool, get_waveforms_parallel
+from sequence import SequenceToWaveforms
+
+N_CALL = 7
+
+# custom sequence that fails in the workers after the sizes are reported,
+# when the waveforms are compiled into shared memory
+SOURCE_FAILING = '''import sequence
+from sequence_rb import SingleQubit_RB
+
+
+class CustomSequence(SingleQubit_RB):
+    pass
+
+
+def _compile_waveforms(self):
+    raise RuntimeError('compilation failed in worker')
+
+
+sequence.SequenceToWaveforms._compile_waveforms = _compile_waveforms
+'''
+
+
+@pytest.fixture(scope='module')
+def rb_config():
+    config = load_default_config()
+    config.update(WORKLOADS['rb_1qb_10'][1])
+    config['Randomize'] = 3.0
+    return config
+
+
+@pytest.fixture(scope='module')
+def serial(rb_config):
+    """Waveforms of sequences compiled one by one with seeds Randomize+n+1"""
+    sequence = WORKLOADS['rb_1qb_10'][0]()
+    sequence_to_waveforms = SequenceToWaveforms()
+    sequence.set_parameters(rb_config)
+    sequence_to_waveforms.set_parameters(rb_config)
+    return get_waveforms_batch_previous(
+        sequence_to_waveforms,
+        get_randomized_sequences(sequence, rb_config, N_CALL))
+
+
+def assert_same_waveforms(waveforms, reference):
+    assert set(waveforms) == set(reference)
+    for key in ('xy', 'z', 'gate'):
+        assert len(waveforms[key]) == len(reference[key])
+        for n, (x, y) in enumerate(zip(waveforms[key], reference[key])):
+            assert x.dtype == y.dtype, '%s%d' % (key, n)
+            assert np.array_equal(x, y), '%s%d' % (key, n)
+    for key in ('readout_trig', 'readout_iq'):
+        assert waveforms[key].dtype == reference[key].dtype
+        assert np.array_equal(waveforms[key], reference[key]), key
+
+
+@pytest.fixture
+def shared_memory_names(monkeypatch):
+    """Names of the shared memory blocks created by the pool"""
+    names = []
+
+    class RecordingSharedMemory(SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            names.append(self.name)
+
+    monkeypatch.setattr(parallel, 'SharedMemory', RecordingSharedMemory)
+    return names
+
+
+def assert_unlinked(names):
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=name)
+
+
+@pytest.mark.parametrize('n_workers', [1, 2, 4])
+def test_identical_for_any_number_of_workers(rb_config, serial, n_workers,
+                                             shared_memory_names):
+    with WorkerPool(n_workers) as pool:
+        waveforms = pool.get_waveforms(WORKLOADS['rb_1qb_10'][0],
+                                       rb_config, N_CALL)
+        assert_same_waveforms(waveforms, serial)
+        # processes are kept for the next call
+        pids = [process.pid for (process, conn) in pool._workers]
+        assert len(pids) == n_workers
+        waveforms = pool.get_waveforms(WORKLOADS['rb_1qb_10'][0],
+                                       deepcopy(rb_config), N_CALL)
+        assert [process.pid for (process, conn) in pool._workers] == pids
+        assert_same_waveforms(waveforms, serial)
+    assert pool._workers == []
+    assert len(shared_memory_names) == 2
+    assert_unlinked(shared_memory_names)
+
+
+def test_single_call(rb_config, serial):
+    waveforms = get_waveforms_parallel(WORKLOADS['rb_1qb_10'][0], rb_config,
+                                       N_CALL, n_workers=2)
+    assert_same_waveforms(waveforms, serial)
+
+
+def test_shared_memory_unlinked_if_worker_fails(tmp_path, rb_config,
+                                                shared_memory_names):
+    path = tmp_path / 'failing_seq.py'
+    path.write_text(SOURCE_FAILING)
+    with WorkerPool(2) as pool:
+        with pytest.raises(RuntimeError, match='compilation failed'):
+            pool.get_waveforms(str(path), rb_config, N_CALL)
+        # the block was created, and removed after the error
+        assert len(shared_memory_names) == 1
+        assert_unlinked(shared_memory_names)
+        # the workers are kept
+        assert all(process.is_alive() for (process, conn) in pool._workers)
+
+
+def test_pool_usable_after_error(tmp_path, rb_config, serial):
+    with WorkerPool(2) as pool:
+        # fails before the sizes are reported
+        with pytest.raises(RuntimeError, match='not found'):
+            pool.get_waveforms(str(tmp_path / 'missing.py'), rb_config,
+                               N_CALL)
+        waveforms = pool.get_waveforms(WORKLOADS['rb_1qb_10'][0], rb_config,
+                                       N_CALL)
+    assert_same_waveforms(waveforms, serial)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from benchmark import (exponential_predistort_previous,
+                       get_exponential_predistortion,
+                       get_transfer_predistortion, predistort_previous)
+
+SAMPLE_RATE = 1.2E9
+
+
+def get_waveform(n_pts, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=n_pts) + 1j * rng.normal(size=n_pts)
+
+
+@pytest.mark.parametrize('n_pts', [1000, 4096, 10001])
+def test_transfer_function_identical(n_pts):
+    predistortion = get_transfer_predistortion(SAMPLE_RATE)
+    for seed in range(3):
+        # the first call fills the cache, the others use it
+        waveform = get_waveform(n_pts, seed)
+        assert np.array_equal(predistortion.predistort(waveform),
+                              predistort_previous(predistortion, waveform))
+    assert len(predistortion._kernels) == 1
+
+
+def test_transfer_function_kernel_per_length():
+    predistortion = get_transfer_predistortion(SAMPLE_RATE)
+    for n_pts in (1000, 2000, 1000):
+        waveform = get_waveform(n_pts)
+        assert np.array_equal(predistortion.predistort(waveform),
+                              predistort_previous(predistortion, waveform))
+    assert len(predistortion._kernels) == 2
+
+
+def test_transfer_function_cleared_on_new_file():
+    predistortion = get_transfer_predistortion(SAMPLE_RATE)
+    predistortion.predistort(get_waveform(1000))
+    # no file, predistortion is not in use
+    predistortion.import_transfer_function('')
+    assert len(predistortion._kernels) == 0
+
+
+@pytest.mark.parametrize('n_pts', [1000, 50001])
+def test_exponential_identical(n_pts):
+    predistortion = get_exponential_predistortion(SAMPLE_RATE)
+    for seed in range(3):
+        waveform = get_waveform(n_pts, seed).real
+        assert np.array_equal(
+            predistortion.predistort(waveform),
+            exponential_predistort_previous(predistortion, waveform))
+    assert len(predistortion._kernels) == 1
+
+
+def test_exponential_new_poles():
+    predistortion = get_exponential_predistortion(SAMPLE_RATE)
+    waveform = get_waveform(2000).real
+    first = predistortion.predistort(waveform)
+    # changing a pole must not reuse the old kernel
+    predistortion.A1 *= 2
+    second = predistortion.predistort(waveform)
+    assert not np.array_equal(first, second)
+    assert np.array_equal(
+        second, exponential_predistort_previous(predistortion, waveform))
+    assert len(predistortion._kernels) == 2
+
+
+def test_kernels_are_read_only():
+    predistortion = get_exponential_predistortion(SAMPLE_RATE)
+    predistortion.predistort(get_waveform(1000).real)
+    for kernel in predistortion._kernels.values():
+        assert not any(x.flags.writeable for x in kernel)
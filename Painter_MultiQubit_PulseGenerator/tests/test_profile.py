@@ -0,0 +1,148 @@
+import gc
+import json
+import logging
+import re
+import weakref
+
+import numpy as np
+import pytest
+
+from benchmark import (STAGES, WORKLOADS, get_randomized_sequences,
+                       load_default_config)
+from sequence import SequenceToWaveforms
+
+# all stages of the compiler, in the order they are run
+COMPILE_STAGES = [stage for stage in STAGES if stage != 'sequence']
+
+
+def get_compiler(name='rb_2qb_10', **values):
+    (sequence_class, workload_values) = WORKLOADS[name]
+    config = load_default_config()
+    config.update(workload_values)
+    config.update(values)
+    sequence = sequence_class()
+    sequence_to_waveforms = SequenceToWaveforms()
+    sequence.set_parameters(config)
+    sequence_to_waveforms.set_parameters(config)
+    return (sequence, sequence_to_waveforms, config)
+
+
+def test_stage_names_and_order():
+    (sequence, sequence_to_waveforms, config) = get_compiler()
+    waveforms = sequence_to_waveforms.get_waveforms(
+        sequence.get_sequence(config))
+    profile = sequence_to_waveforms.get_profile()
+    assert list(profile['stages']) == COMPILE_STAGES
+    for name, stage in profile['stages'].items():
+        assert stage['calls'] == 1, name
+        assert stage['time'] >= 0, name
+    assert 0 < sum(s['time'] for s in profile['stages'].values()) <= \
+        profile['time']
+    assert sequence_to_waveforms.profile_time == profile['time']
+    # all output arrays are allocated when initializing the waveforms
+    n_qubit = sequence_to_waveforms.n_qubit
+    init = profile['stages']['init_waveforms']
+    assert init['arrays'] == 3 * n_qubit + 2
+    assert profile['waveform_nbytes'] == sum(
+        x.nbytes for key in ('xy', 'z', 'gate')
+        for x in waveforms[key][:n_qubit]) + \
+        waveforms['readout_trig'].nbytes + waveforms['readout_iq'].nbytes
+    assert profile['nbytes'] >= init['nbytes']
+    # summary has the same stages
+    summary = sequence_to_waveforms.format_profile()
+    assert summary.startswith('total ')
+    assert re.findall(r'(\w+) [0-9.]+ ms', summary) == ['total'] + \
+        COMPILE_STAGES
+
+
+def test_allocations_of_stages():
+    (sequence, sequence_to_waveforms, config) = get_compiler(
+        **{'Generate gate': True, 'Filter gate waveforms': True})
+    sequence_to_waveforms.get_waveforms(sequence.get_sequence(config))
+    stages = sequence_to_waveforms.get_profile()['stages']
+    # stages that only write into existing waveforms
+    for name in ('seperate_gates', 'add_timings', 'virtual_z',
+                 'generate_waveforms'):
+        assert stages[name]['arrays'] == 0, name
+        assert stages[name]['nbytes'] == 0, name
+    # new gate waveforms, filtered into new arrays
+    n_qubit = sequence_to_waveforms.n_qubit
+    assert stages['microwave_gate']['arrays'] == n_qubit
+    assert stages['filter']['arrays'] == n_qubit
+    assert stages['filter']['nbytes'] == sum(
+        x.nbytes for x in sequence_to_waveforms._wave_gate[:n_qubit])
+
+
+def test_timings_reset_between_calls():
+    (sequence, sequence_to_waveforms, config) = get_compiler()
+    sequence_to_waveforms.get_waveforms(sequence.get_sequence(config))
+    first = sequence_to_waveforms.get_profile()
+    sequence_to_waveforms.get_waveforms(sequence.get_sequence(config))
+    second = sequence_to_waveforms.get_profile()
+    assert list(second['stages']) == COMPILE_STAGES
+    for name, stage in second['stages'].items():
+        assert stage['calls'] == 1, name
+    assert second['arrays'] == first['arrays']
+    assert second['nbytes'] == first['nbytes']
+    # earlier profile is a copy, not changed by later compilations
+    assert first is not second
+    assert all(stage['calls'] == 1 for stage in first['stages'].values())
+
+
+def test_batch_profile():
+    (sequence, sequence_to_waveforms, config) = get_compiler()
+    sequence_to_waveforms.get_waveforms(sequence.get_sequence(config))
+    sequences_list = get_randomized_sequences(sequence, config, 3)
+    sequence_to_waveforms.get_waveforms_batch(sequences_list)
+    stages = sequence_to_waveforms.get_profile()['stages']
+    # each stage is run once per sequence, counts of single call are reset,
+    # waveforms are preallocated instead of initialized
+    assert set(stages) == set(COMPILE_STAGES) - {'init_waveforms'}
+    for name, stage in stages.items():
+        assert stage['calls'] == 3, name
+
+
+@pytest.mark.parametrize('log_profile', [False, True])
+def test_log_line(caplog, log_profile):
+    (sequence, sequence_to_waveforms, config) = get_compiler(
+        **{'Log compile profile': log_profile})
+    with caplog.at_level(logging.INFO, logger='LabberDriver'):
+        for n in range(2):
+            sequence_to_waveforms.get_waveforms(
+                sequence.get_sequence(config))
+    lines = [r.getMessage() for r in caplog.records
+             if r.getMessage().startswith('Compile profile: ')]
+    if not log_profile:
+        # nothing is logged by the compiler
+        assert [r for r in caplog.records if r.module == 'sequence'] == []
+        return
+    # one structured line per compilation
+    assert len(lines) == 2
+    profile = json.loads(lines[-1][len('Compile profile: '):])
+    assert list(profile['stages']) == COMPILE_STAGES
+    assert profile['time'] == sequence_to_waveforms.profile_time
+
+
+def test_logging_does_not_change_waveforms():
+    results = []
+    for log_profile in (False, True):
+        (sequence, sequence_to_waveforms, config) = get_compiler(
+            **{'Log compile profile': log_profile})
+        results.append(sequence_to_waveforms.get_waveforms(
+            sequence.get_sequence(config)))
+    for key in ('xy', 'z', 'gate'):
+        for x, y in zip(results[0][key], results[1][key]):
+            assert np.array_equal(x, y)
+
+
+def test_profile_keeps_no_waveforms():
+    (sequence, sequence_to_waveforms, config) = get_compiler()
+    waveforms = sequence_to_waveforms.get_waveforms(
+        sequence.get_sequence(config))
+    references = [weakref.ref(x) for x in waveforms['xy'][:2]]
+    del waveforms
+    sequence_to_waveforms.get_waveforms(sequence.get_sequence(config))
+    gc.collect()
+    # replaced waveforms are freed, the profile only holds sizes
+    assert all(ref() is None for ref in references)
+    assert json.dumps(sequence_to_waveforms.get_profile())
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from benchmark import get_readout, get_readout_signal
+
+N_RECORDS = 50
+
+
+def demodulate_loop(readout, signal, signal_q=None, ref=None):
+    """Demodulate qubits one by one, as done before demodulate_all"""
+    if signal_q is None:
+        return np.array([readout.demodulate(n, signal, ref)
+                         for n in range(readout.n_readout)])
+    return np.array([readout.demodulate_iq(n, signal, signal_q, ref)
+                     for n in range(readout.n_readout)])
+
+
+def demodulate_all(readout, signal, signal_q=None, ref=None):
+    if signal_q is None:
+        return readout.demodulate_all(signal, ref)
+    return readout.demodulate_iq_all(signal, signal_q, ref)
+
+
+def assert_same_values(readout, signal, signal_q=None, ref=None):
+    values = demodulate_all(readout, signal, signal_q, ref)
+    reference = demodulate_loop(readout, signal, signal_q, ref)
+    assert values.shape == (readout.n_readout, N_RECORDS)
+    # matrix product and trapz only differ by the order of summation
+    assert np.allclose(values, reference, rtol=1E-12, atol=1E-14)
+
+
+@pytest.mark.parametrize('iq', [False, True])
+@pytest.mark.parametrize('use_phase_ref', [False, True])
+@pytest.mark.parametrize('n_qubit', [1, 4, 9])
+def test_identical_to_loop(n_qubit, use_phase_ref, iq):
+    readout = get_readout(n_qubit, N_RECORDS)
+    readout.use_phase_ref = use_phase_ref
+    # mixed positive and negative frequencies, and one at zero
+    readout.frequencies[0] = 0.0
+    signal = get_readout_signal(N_RECORDS)
+    signal_q = get_readout_signal(N_RECORDS, seed=1) if iq else None
+    ref = get_readout_signal(N_RECORDS, seed=2)
+    assert_same_values(readout, signal, signal_q, ref)
+
+
+@pytest.mark.parametrize('iq', [False, True])
+@pytest.mark.parametrize('skip,length', [(0.0, 1E-6), (100E-9, 10E-6),
+                                         (2E-6, 1E-6)])
+def test_window_identical_to_loop(skip, length, iq):
+    readout = get_readout(3, N_RECORDS)
+    readout.demod_skip = skip
+    readout.demod_length = length
+    signal = get_readout_signal(N_RECORDS)
+    signal_q = get_readout_signal(N_RECORDS, seed=1) if iq else None
+    values = demodulate_all(readout, signal, signal_q)
+    reference = demodulate_loop(readout, signal, signal_q)
+    assert values.shape == reference.shape
+    assert np.allclose(values, reference, rtol=1E-12, atol=1E-14)
+
+
+def test_reference_reused():
+    readout = get_readout(9, N_RECORDS)
+    signal = get_readout_signal(N_RECORDS)
+    readout.demodulate_all(signal)
+    reference = readout._reference
+    readout.demodulate_all(get_readout_signal(N_RECORDS, seed=1))
+    assert readout._reference is reference
+    # other data type needs other references
+    readout.demodulate_iq_all(signal, signal)
+    assert readout._reference is not reference
+
+
+@pytest.mark.parametrize('iq', [False, True])
+@pytest.mark.parametrize('change', ['frequency', 'offset', 'skip', 'length',
+                                    'dt', 'n_readout'])
+def test_reference_updated_on_change(change, iq):
+    readout = get_readout(9, N_RECORDS)
+    signal = get_readout_signal(N_RECORDS)
+    signal_q = get_readout_signal(N_RECORDS, seed=1) if iq else None
+    demodulate_all(readout, signal, signal_q)
+    reference = readout._reference
+    if change == 'frequency':
+        # changed in-place, as done by set_parameters
+        readout.frequencies[4] += 1E6
+    elif change == 'offset':
+        readout.freq_offset = 3E6
+    elif change == 'skip':
+        # starts at a different phase of the reference
+        readout.demod_skip += 2E-9
+    elif change == 'length':
+        readout.demod_length -= 100E-9
+    elif change == 'dt':
+        signal = dict(signal, dt=1E-9)
+        if iq:
+            signal_q = dict(signal_q, dt=1E-9)
+    elif change == 'n_readout':
+        readout.n_readout = 5
+    values = demodulate_all(readout, signal, signal_q)
+    assert readout._reference is not reference
+    reference = demodulate_loop(readout, signal, signal_q)
+    assert np.allclose(values, reference, rtol=1E-12, atol=1E-14)
+
+
+def test_no_signal():
+    readout = get_readout(3, N_RECORDS)
+    assert np.array_equal(readout.demodulate_all(None),
+                          np.zeros((3, N_RECORDS)))
+    assert np.array_equal(readout.demodulate_iq_all(None, None),
+                          np.zeros((3, N_RECORDS)))
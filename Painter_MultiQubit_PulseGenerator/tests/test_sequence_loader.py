@@ -0,0 +1,243 @@
+import importlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from benchmark import load_default_config
+from sequence import SequenceToWaveforms
+from sequence_loader import MODULE_PREFIX, SequenceLoader
+
+SOURCE = '''from gates import Gate
+from sequence import Sequence
+
+
+class CustomSequence(Sequence):
+
+    def generate_sequence(self, config):
+        for n in range({n_pulse}):
+            self.add_gate_to_all(Gate.{gate})
+'''
+
+SOURCE_HELPER = '''from gates import Gate
+from sequence import Sequence
+
+from {helper} import N_PULSE
+
+
+class CustomSequence(Sequence):
+
+    def generate_sequence(self, config):
+        for n in range(N_PULSE):
+            self.add_gate_to_all(Gate.Xp)
+'''
+
+
+def write_sequence(path, n_pulse=1, gate='Xp', source=SOURCE, **kwargs):
+    with open(str(path), 'w') as f:
+        f.write(source.format(n_pulse=n_pulse, gate=gate, **kwargs))
+    # make sure the modification time changes, also on coarse file systems
+    stat = os.stat(str(path))
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def compile_class(sequence_class):
+    config = load_default_config()
+    config.update({'Sequence': 'Custom', 'Number of qubits': 'One'})
+    sequence = sequence_class()
+    sequence_to_waveforms = SequenceToWaveforms()
+    sequence.set_parameters(config)
+    sequence_to_waveforms.set_parameters(config)
+    waveforms = sequence_to_waveforms.get_waveforms(
+        sequence.get_sequence(config))
+    return waveforms['xy'][0]
+
+
+def test_unchanged_file_is_cached(tmp_path):
+    path = tmp_path / 'my_seq.py'
+    write_sequence(path)
+    loader = SequenceLoader()
+    sequence_class = loader.get_sequence_class(str(path))
+    assert not loader.is_updated(str(path), sequence_class)
+    assert loader.get_sequence_class(str(path)) is sequence_class
+    # touched without changing the content
+    write_sequence(path)
+    assert loader.is_updated(str(path), sequence_class)
+    assert loader.get_sequence_class(str(path)) is sequence_class
+
+
+def test_edited_file_is_reloaded(tmp_path):
+    path = tmp_path / 'my_seq.py'
+    write_sequence(path, n_pulse=1)
+    loader = SequenceLoader()
+    old_class = loader.get_sequence_class(str(path))
+    old_wave = compile_class(old_class)
+    write_sequence(path, n_pulse=3)
+    assert loader.is_updated(str(path), old_class)
+    new_class = loader.get_sequence_class(str(path))
+    assert new_class is not old_class
+    new_wave = compile_class(new_class)
+    # three pulses instead of one
+    assert np.sum(np.abs(new_wave)) == pytest.approx(
+        3 * np.sum(np.abs(old_wave)))
+
+
+def test_same_name_in_different_folders(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    path_a = tmp_path / 'a' / 'my_seq.py'
+    path_b = tmp_path / 'b' / 'my_seq.py'
+    write_sequence(path_a, gate='Xp')
+    write_sequence(path_b, gate='Yp')
+    loader = SequenceLoader()
+    class_a = loader.get_sequence_class(str(path_a))
+    class_b = loader.get_sequence_class(str(path_b))
+    assert class_a is not class_b
+    assert class_a.__module__ != class_b.__module__
+    # X and Y pulses differ in phase
+    wave_a = compile_class(class_a)
+    wave_b = compile_class(class_b)
+    assert np.allclose(np.abs(wave_b), np.abs(wave_a))
+    assert not np.allclose(wave_b, wave_a)
+    assert loader.get_sequence_class(str(path_a)) is class_a
+
+
+def write_helper(path, source):
+    with open(str(path), 'w') as f:
+        f.write(source)
+    stat = os.stat(str(path))
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_helper_module_in_same_folder(tmp_path):
+    helper = '_loader_test_helper'
+    write_helper(tmp_path / (helper + '.py'), 'N_PULSE = 2\n')
+    path = tmp_path / 'my_seq.py'
+    write_sequence(path, source=SOURCE_HELPER, helper=helper)
+    old_path = list(sys.path)
+    old_modules = set(sys.modules)
+    sequence_class = SequenceLoader().get_sequence_class(str(path))
+    # neither the path nor the top-level module names are changed
+    assert sys.path == old_path
+    assert helper not in sys.modules
+    assert all(name.startswith(MODULE_PREFIX)
+               for name in set(sys.modules) - old_modules)
+    assert np.any(compile_class(sequence_class))
+
+
+def test_same_helper_name_in_different_folders(tmp_path):
+    classes = []
+    loader = SequenceLoader()
+    for (folder, n_pulse) in (('a', 1), ('b', 3)):
+        (tmp_path / folder).mkdir()
+        write_helper(tmp_path / folder / 'helpers.py',
+                     'N_PULSE = %d\n' % n_pulse)
+        path = tmp_path / folder / 'my_seq.py'
+        write_sequence(path, source=SOURCE_HELPER, helper='helpers')
+        classes.append(loader.get_sequence_class(str(path)))
+    assert 'helpers' not in sys.modules
+    # each file gets the helper module of its own folder
+    wave_a = compile_class(classes[0])
+    wave_b = compile_class(classes[1])
+    assert np.sum(np.abs(wave_b)) == pytest.approx(
+        3 * np.sum(np.abs(wave_a)))
+    # also when loaded again
+    path_a = tmp_path / 'a' / 'my_seq.py'
+    write_sequence(path_a, source=SOURCE_HELPER + '\n', helper='helpers')
+    assert np.array_equal(
+        compile_class(loader.get_sequence_class(str(path_a))), wave_a)
+
+
+def test_edited_helper_is_reloaded(tmp_path):
+    write_helper(tmp_path / 'helpers.py', 'N_PULSE = 1\n')
+    path = tmp_path / 'my_seq.py'
+    write_sequence(path, source=SOURCE_HELPER, helper='helpers')
+    loader = SequenceLoader()
+    old_class = loader.get_sequence_class(str(path))
+    old_wave = compile_class(old_class)
+    assert not loader.is_updated(str(path), old_class)
+    # only the helper changes
+    write_helper(tmp_path / 'helpers.py', 'N_PULSE = 2\n')
+    assert loader.is_updated(str(path), old_class)
+    new_class = loader.get_sequence_class(str(path))
+    assert new_class is not old_class
+    assert not loader.is_updated(str(path), new_class)
+    assert loader.get_sequence_class(str(path)) is new_class
+    assert np.sum(np.abs(compile_class(new_class))) == pytest.approx(
+        2 * np.sum(np.abs(old_wave)))
+
+
+def test_nested_helpers_and_packages(tmp_path):
+    # helper importing another helper, and a package with a submodule
+    write_helper(tmp_path / 'base_helper.py', 'N = 2\n')
+    write_helper(tmp_path / 'helpers.py',
+                 'import base_helper\n'
+                 'from helper_pkg.sub import EXTRA\n'
+                 'N_PULSE = base_helper.N + EXTRA\n')
+    (tmp_path / 'helper_pkg').mkdir()
+    write_helper(tmp_path / 'helper_pkg' / '__init__.py', '')
+    write_helper(tmp_path / 'helper_pkg' / 'sub.py', 'EXTRA = 1\n')
+    path = tmp_path / 'my_seq.py'
+    write_sequence(path, source=SOURCE_HELPER, helper='helpers')
+    loader = SequenceLoader()
+    sequence_class = loader.get_sequence_class(str(path))
+    for name in ('helpers', 'base_helper', 'helper_pkg', 'helper_pkg.sub'):
+        assert name not in sys.modules
+    wave = compile_class(sequence_class)
+    # submodule of helper package is also tracked
+    write_helper(tmp_path / 'helper_pkg' / 'sub.py', 'EXTRA = 0\n')
+    assert loader.is_updated(str(path), sequence_class)
+    new_wave = compile_class(loader.get_sequence_class(str(path)))
+    assert np.sum(np.abs(wave)) == pytest.approx(
+        1.5 * np.sum(np.abs(new_wave)))
+
+
+def test_module_already_imported_from_folder(tmp_path, monkeypatch):
+    # for example the driver modules, if the file is next to them
+    helper = tmp_path / '_loader_test_loaded.py'
+    write_helper(helper, 'N_PULSE = 2\n')
+    spec = importlib.util.spec_from_file_location('_loader_test_loaded',
+                                                  str(helper))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.setitem(sys.modules, '_loader_test_loaded', module)
+    path = tmp_path / 'my_seq.py'
+    write_sequence(path, source=SOURCE_HELPER + 'import _loader_test_loaded\n'
+                   'LOADED = _loader_test_loaded\n',
+                   helper='_loader_test_loaded')
+    sequence_class = SequenceLoader().get_sequence_class(str(path))
+    assert sys.modules[sequence_class.__module__].LOADED is module
+
+
+def test_global_module_not_shadowed_without_helper(tmp_path):
+    path = tmp_path / 'my_seq.py'
+    write_sequence(path, source=SOURCE + 'import json\nJSON = json\n')
+    sequence_class = SequenceLoader().get_sequence_class(str(path))
+    assert sys.modules[sequence_class.__module__].JSON is \
+        importlib.import_module('json')
+
+
+def test_invalid_file(tmp_path):
+    loader = SequenceLoader()
+    with pytest.raises(ValueError):
+        loader.get_sequence_class(str(tmp_path / 'missing.py'))
+    path = tmp_path / 'no_class.py'
+    with open(str(path), 'w') as f:
+        f.write('x = 1\n')
+    old_path = list(sys.path)
+    with pytest.raises(ValueError):
+        loader.get_sequence_class(str(path))
+    assert sys.path == old_path
+
+
+def test_failed_edit_keeps_previous_class(tmp_path):
+    path = tmp_path / 'my_seq.py'
+    write_sequence(path)
+    loader = SequenceLoader()
+    sequence_class = loader.get_sequence_class(str(path))
+    write_sequence(path, source='raise RuntimeError()\n')
+    with pytest.raises(RuntimeError):
+        loader.get_sequence_class(str(path))
+    assert sys.modules[sequence_class.__module__].CustomSequence is \
+        sequence_class
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from benchmark import WORKLOADS, compile_workload, load_default_config
+from sequence import SequenceToWaveforms
+
+# resolution of the AWG, the full scale is the peak of each waveform
+N_BIT = 16
+
+
+def get_parts(x):
+    """Real and imaginary parts, as sent to the AWG channels"""
+    if np.iscomplexobj(x):
+        x = np.concatenate([x.real, x.imag])
+    return np.asarray(x, dtype=np.float64)
+
+
+def quantize(x, full_scale):
+    """Convert waveform to AWG codes"""
+    return np.rint(get_parts(x) / full_scale * (2**(N_BIT - 1) - 1))
+
+
+def get_pairs(waveforms):
+    for key in ('xy', 'z', 'gate'):
+        for n, x in enumerate(waveforms[key]):
+            yield ('%s%d' % (key, n), x)
+    for key in ('readout_trig', 'readout_iq'):
+        yield (key, waveforms[key])
+
+
+@pytest.fixture(scope='module')
+def compiled():
+    return (compile_workload('cpmg_9qb_100us'),
+            compile_workload('cpmg_9qb_100us_single'))
+
+
+def test_data_types(compiled):
+    (double, single) = compiled
+    assert len(single['xy']) == 9
+    for key, dtype in (('xy', np.complex64), ('z', np.float32)):
+        for x in single[key]:
+            assert x.dtype == dtype
+    assert all(x.dtype == np.complex128 for x in double['xy'])
+
+
+def test_single_within_one_lsb(compiled):
+    (double, single) = compiled
+    n_checked = 0
+    for (name, x), (_, y) in zip(get_pairs(double), get_pairs(single)):
+        assert len(x) == len(y), name
+        full_scale = np.max(np.abs(get_parts(x)), initial=0.0)
+        if full_scale == 0:
+            assert not np.any(y), name
+            continue
+        difference = np.abs(quantize(y, full_scale) - quantize(x, full_scale))
+        assert np.max(difference) <= 1, name
+        n_checked += 1
+    # all nine qubits have pulses
+    assert n_checked >= 9
+
+
+def test_precision_error_report():
+    config = load_default_config()
+    (sequence_class, values) = WORKLOADS['cpmg_9qb_100us_single']
+    config.update(values)
+    sequence = sequence_class()
+    sequence_to_waveforms = SequenceToWaveforms()
+    sequence.set_parameters(config)
+    sequence_to_waveforms.set_parameters(config)
+    report = sequence_to_waveforms.get_precision_error(
+        sequence.get_sequence(config))
+    assert 0 < report['max_error_lsb'] <= 1
+    assert len(report['xy']) == 9
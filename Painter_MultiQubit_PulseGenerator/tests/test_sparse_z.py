@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from benchmark import (DenseSequenceToWaveforms, get_crosstalk_config,
+                       load_default_config)
+from gates import Gate
+from sequence import SequenceToWaveforms
+from sequence_builtin import CPMG
+
+# number of pi pulses for T1, Ramsey and CPMG
+N_PULSES = {'t1': -1.0, 'ramsey': 0.0, 'cpmg': 4.0}
+
+
+class DetunedCPMG(CPMG):
+    """CPMG with Z pulses on the first qubit before, in and after the gaps"""
+
+    def generate_sequence(self, config):
+        self.add_gate(0, Gate.Zp, t0=0)
+        super().generate_sequence(config)
+        self.add_gate(0, Gate.Zp, t0=config['Sequence duration'] / 3)
+        self.add_gate(0, Gate.Zp)
+
+
+@pytest.fixture(scope='module')
+def default_config(tmp_path_factory):
+    config = load_default_config()
+    path = tmp_path_factory.mktemp('crosstalk') / 'matrix.txt'
+    config.update(get_crosstalk_config(str(path), 3))
+    config.update({
+        'Sequence': 'CP/CPMG', 'Number of qubits': 'Three',
+        'Sequence duration': 20E-6, 'Generate gate': True,
+        'Filter gate waveforms': True, 'Filter Z waveforms': True,
+        'Predistort Z1 - A1': 0.02, 'Predistort Z1 - tau1': 1E-7,
+        'Predistort Z2 - A1': -0.01, 'Predistort Z2 - tau1': 2E-6,
+        'Predistort Z3 - A1': 0.01, 'Predistort Z3 - tau1': 5E-7})
+    return config
+
+
+def compile_both(sequence_class, config):
+    waveforms = []
+    for compiler_class in (DenseSequenceToWaveforms, SequenceToWaveforms):
+        sequence = sequence_class()
+        sequence_to_waveforms = compiler_class()
+        sequence.set_parameters(config)
+        sequence_to_waveforms.set_parameters(config)
+        waveforms.append(sequence_to_waveforms.get_waveforms(
+            sequence.get_sequence(config)))
+    return waveforms
+
+
+def assert_same_waveforms(waveforms, reference):
+    for key in ('xy', 'z', 'gate'):
+        for n, (x, y) in enumerate(zip(waveforms[key], reference[key])):
+            assert x.dtype == y.dtype, '%s%d' % (key, n)
+            assert np.array_equal(x, y), '%s%d' % (key, n)
+    for key in ('readout_trig', 'readout_iq'):
+        assert np.array_equal(waveforms[key], reference[key]), key
+
+
+@pytest.mark.parametrize('align_to_end', [False, True])
+@pytest.mark.parametrize('predistort', [False, True])
+@pytest.mark.parametrize('sequence_class', [CPMG, DetunedCPMG])
+@pytest.mark.parametrize('name', sorted(N_PULSES))
+def test_identical_to_dense(default_config, name, sequence_class, predistort,
+                            align_to_end):
+    config = dict(default_config, **{
+        '# of pi pulses': N_PULSES[name], 'Predistort Z': predistort,
+        'Trim waveform to sequence': not align_to_end,
+        'Number of points': 30E3,
+        'Align pulses to end of waveform': align_to_end})
+    (reference, waveforms) = compile_both(sequence_class, config)
+    assert_same_waveforms(waveforms, reference)
+    if sequence_class is DetunedCPMG:
+        # crosstalk compensation spreads the z pulses to all qubits
+        assert all(np.any(x) for x in waveforms['z'][:3])
+
+
+@pytest.mark.parametrize('z_filter,size', [('Kaiser', 5.0),
+                                           ('Rectangular', 51.0),
+                                           ('Rectangular', 400.0)])
+def test_filters_identical_to_dense(default_config, z_filter, size):
+    config = dict(default_config, **{
+        '# of pi pulses': 0.0, 'Z filter': z_filter, 'Z - Filter size': size})
+    (reference, waveforms) = compile_both(DetunedCPMG, config)
+    assert_same_waveforms(waveforms, reference)
+
+
+def test_z_segments(default_config):
+    config = dict(default_config, **{'# of pi pulses': -1.0,
+                                     'Compensate cross-talk': False})
+    sequence = DetunedCPMG()
+    sequence_to_waveforms = SequenceToWaveforms()
+    sequence.set_parameters(config)
+    sequence_to_waveforms.set_parameters(config)
+    waveforms = sequence_to_waveforms.get_waveforms(
+        sequence.get_sequence(config))
+    segments = sequence_to_waveforms._segments_z
+    # only the three pulses of the first qubit are tracked, the gap is not
+    assert len(segments[0]) == 3
+    n_pts = len(waveforms['z'][0])
+    assert sum(stop - start for (start, stop) in segments[0]) < n_pts / 100
+    assert segments[1] == segments[2] == []
+    # the waveform is zero outside the segments, before filtering
+    mask = np.zeros(n_pts, dtype=bool)
+    for (start, stop) in sequence_to_waveforms._merge_segments(
+            segments[0], 5, n_pts):
+        mask[start:stop] = True
+    assert not np.any(waveforms['z'][0][~mask])
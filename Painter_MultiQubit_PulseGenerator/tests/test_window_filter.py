@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from benchmark import load_default_config
+from sequence import FFT_FILTER_SIZE_RANGE, SequenceToWaveforms
+
+# last size is above the largest crossover, always FFT if enabled
+SIZES = [5, 101, 2 * FFT_FILTER_SIZE_RANGE[1] + 1]
+
+
+def get_sequence_to_waveforms(fft_filter=None):
+    config = load_default_config()
+    if fft_filter is not None:
+        config['FFT filter convolution'] = fft_filter
+    sequence_to_waveforms = SequenceToWaveforms()
+    sequence_to_waveforms.set_parameters(config)
+    return sequence_to_waveforms
+
+
+def apply_filter_reference(x, window):
+    """Filter with the buffered direct convolution"""
+    n = len(window)
+    s = np.r_[2 * x[0] - x[n - 1::-1], x, 2 * x[-1] - x[-1:-n:-1]]
+    return np.convolve(s, window, mode='same')[n:-n + 1]
+
+
+def get_waveform(n_pts, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.zeros(n_pts)
+    # two pulses, with zeros in between
+    x[1000:1500] = rng.uniform(-1, 1, 500)
+    x[6000:6200] = rng.uniform(-1, 1, 200)
+    return x
+
+
+def test_default_is_direct_convolution():
+    assert not get_sequence_to_waveforms().fft_filter
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_default_identical_to_convolve(size):
+    sequence_to_waveforms = get_sequence_to_waveforms()
+    window = sequence_to_waveforms._get_filter_window(size, 'Kaiser', 14.0)
+    x = get_waveform(10000)
+    reference = apply_filter_reference(x, window)
+    assert np.array_equal(
+        sequence_to_waveforms._apply_window_filter(x, window), reference)
+    assert np.array_equal(sequence_to_waveforms._apply_window_filter(
+        x, window, [(1000, 1500), (6000, 6200)]), reference)
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_fft_within_rounding(size):
+    sequence_to_waveforms = get_sequence_to_waveforms(fft_filter=True)
+    window = sequence_to_waveforms._get_filter_window(size, 'Kaiser', 14.0)
+    x = get_waveform(10000)
+    reference = apply_filter_reference(x, window)
+    y = sequence_to_waveforms._apply_window_filter(x, window)
+    assert len(y) == len(x)
+    assert np.max(np.abs(y - reference)) < 1E-12
+    # output is aligned with the input
+    assert np.argmax(y) == np.argmax(reference)
+
+
+@pytest.mark.parametrize('size', [4, 5, 2 * FFT_FILTER_SIZE_RANGE[1]])
+def test_fft_same_alignment(size):
+    # odd and even windows are centered as by np.convolve
+    sequence_to_waveforms = get_sequence_to_waveforms(fft_filter=True)
+    window = np.random.default_rng(1).uniform(0, 1, size)
+    s = np.random.default_rng(2).uniform(-1, 1, 5000)
+    assert np.allclose(sequence_to_waveforms._convolve_window(s, window),
+                       np.convolve(s, window, mode='same'),
+                       rtol=0, atol=1E-12)